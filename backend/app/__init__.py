@@ -34,6 +34,10 @@ def create_app():
     app.register_blueprint(video_recreation_bp, url_prefix='/api')
     # app.register_blueprint(agent_bp)
     
+    # 按配置启用远程调用的录制或回放
+    from app.services.cassette import install_cassette
+    install_cassette()
+    
     # 创建数据库表
     with app.app_context():
         try:
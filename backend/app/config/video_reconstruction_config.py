@@ -31,9 +31,62 @@ class VideoReconstructionConfig:
                 "ffmpeg_path": "",  # 自动查找
                 "timeout": 600,
                 "default_slice_duration": 8,  # 默认切片时长8秒
+                "slice_mode": "segment",  # segment 一次调用切出全部切片，legacy 每个切片单独调用ffmpeg
+                "slice_stream_copy": True,  # 关键帧与切片边界对齐时直接流复制
+                "slice_keyframe_tolerance": 0.5,  # 关键帧与切片边界允许的偏差(秒)
+                "slice_strategy": "fixed",  # fixed 按固定时长切片，shots 按本地镜头检测的切换点切片
+                "shot_max_slice_duration": 15,  # 按镜头切片时过长的镜头再均分(秒)
+                "frame_sampling": "single_pass",  # single_pass 源视频解码一次提取所有切片的帧，per_slice 逐片提取
+                "keyframes_per_slice": 3,
                 "video_quality": "high",
                 "audio_quality": "high"
             },
+            "render": {
+                "single_pass": True,  # 拼接、配音混流和时长适配在一次渲染中完成
+                "fit_mode": "pad",  # pad 画面短于配音时定格最后一帧、长于配音时保留完整画面；stretch 按比例变速；none 取较短者
+                "max_stretch_ratio": 1.25,  # stretch 模式允许的最大变速比例，超出时改用 pad
+                "duration_tolerance": 0.1,  # 画面与配音时长差在此范围内视为一致(秒)
+                "preset": "veryfast",
+                "crf": 20,
+                "audio_bitrate": "192k",
+                "width": 0,  # 0表示取片段中最常见的分辨率
+                "height": 0,
+                "fps": 0  # 0表示取片段中最常见的帧率
+            },
+            "analysis_proxy": {
+                "enabled": True,  # 分析阶段读取低分辨率代理，切片关键帧(生成参考图)和最终合成读取原视频
+                "height": 360,  # 代理高度，原视频更低时不放大
+                "max_fps": 30,  # 代理为恒定帧率，取原帧率与该值中的较小者
+                "gop_seconds": 0.5,  # 关键帧间隔(秒)，0表示全帧内编码
+                "preset": "veryfast",
+                "crf": 28,
+                "audio_bitrate": "64k",  # 保留低码率音轨，切片送入多模态模型时仍带声音
+                "cache_dir": os.path.join(os.getcwd(), "cache", "proxy")  # 源视频目录不可写时使用
+            },
+            "ffmpeg_executor": {
+                "max_concurrency": 0,  # 0表示按CPU核数自动计算
+                "threads_per_job": 0,  # 0表示按核数和并发数平均分配
+                "default_timeout": 600  # 单个任务超时(秒)
+            },
+            "shot_detection": {
+                "sample_fps": 6,  # 采样帧率
+                "width": 96,  # 采样帧尺寸
+                "height": 54,
+                "batch_size": 256,  # 每批向量化计算的帧数
+                "hist_weight": 0.7,  # 直方图差异权重，其余为边缘变化率
+                "edge_threshold": 32,  # 灰度梯度超过该值视为边缘
+                "min_threshold": 0.25,  # 切点分数下限
+                "hard_threshold": 0.6,  # 超过该分数直接视为切点
+                "adaptive_window": 2.0,  # 自适应阈值的单侧窗口(秒)
+                "adaptive_k": 3.0,  # 阈值 = 窗口中位数 + k * MAD
+                "min_shot_duration": 2.0  # 短于该时长的镜头与相邻镜头合并(秒)
+            },
+            "media_probe": {
+                "enabled": True,
+                "max_entries": 1024,  # 内存中保留的文件数
+                "disk_cache": True,  # 落盘供其他工作进程和重跑复用
+                "cache_dir": os.path.join(os.getcwd(), "cache", "probe")
+            },
             "comfyui": {
                 "base_url": "http://localhost:8188",
                 "timeout": 600,
@@ -96,6 +149,110 @@ class VideoReconstructionConfig:
                     "system_prompt": "你是一个专业的故事创作大师，能够根据视频内容分析结果，生成吸引人的故事线，包括详细的场景描述、角色设定、情节发展等。请确保故事逻辑连贯、情感丰富、富有创意。"
                 }
             },
+            "scene_scheduler": {
+                "max_concurrency": 3  # 同时进行远程调用的场景数上限
+            },
+            "dashscope_client": {
+                "base_url": "https://dashscope.aliyuncs.com/api/v1",
+                "pool_size": 32,  # 进程内连接池总连接数
+                "pool_size_per_host": 16,
+                "keepalive_timeout": 60,  # 空闲连接保持时间(秒)
+                "connect_timeout": 10,
+                "request_timeout": 120  # 单次调用默认截止时间(秒)
+            },
+            "response_cache": {
+                "enabled": True,
+                "cache_dir": os.path.join(os.getcwd(), "cache", "responses"),
+                "max_bytes": 256 * 1024 * 1024,  # 磁盘占用上限，超出时按最近使用时间淘汰
+                "ttl_seconds": 30 * 24 * 3600,  # 条目有效期(秒)，0表示不过期
+                "max_temperature": 0.1  # 温度不高于该值的调用视为确定性调用，默认缓存
+            },
+            "video_analysis": {
+                "max_concurrency": 4,  # 同时分析的切片数上限，实际并发还受provider_scheduler限制
+                "slice_timeout": 120,  # 单个切片单次HTTP请求超时(秒)，不含在服务调度器中排队的时间
+                "slice_retries": 2,  # 单个切片失败后的重试次数
+                "retry_delay": 2  # 重试间隔(秒)，按次数递增
+            },
+            "image_payload": {
+                "enabled": True,
+                "format": "jpeg",  # jpeg或webp
+                "cache_dir": os.path.join(os.getcwd(), "cache", "images"),
+                "memory_items": 256,  # 内存中缓存的base64编码数量
+                "profiles": {}  # 按模型名前缀覆盖默认的{"max_side": 最长边像素, "quality": 编码质量}
+            },
+            "slice_dedup": {
+                "enabled": True,
+                "hash_size": 8,  # dHash/pHash边长，哈希共hash_size*hash_size位
+                "max_dhash_distance": 10,  # 关键帧dHash汉明距离不超过该值视为近似
+                "max_phash_distance": 10,  # 关键帧pHash汉明距离不超过该值视为近似
+                "max_color_distance": 0.05,  # 颜色矩(0~1)最大差值不超过该值视为近似
+                "max_run": 6  # 连续复用同一分析结果的切片数上限，0表示不限
+            },
+            "scene_prompts": {
+                "mode": "parallel",  # parallel: 先提取全片风格与人物设定再并发生成；sequential: 逐个场景参考上一场景生成
+                "max_concurrency": 6,  # 并发生成提示词的场景数，实际并发还受provider_scheduler限制
+                "polish": False  # 并发生成后是否再用一次调用统一润色所有场景的提示词
+            },
+            "structured_output": {
+                "json_mode": True,  # 支持的模型使用response_format={"type": "json_object"}，只返回合法JSON
+                "json_mode_models": ["qwen-plus", "qwen-max", "qwen-turbo", "qwen-flash", "qwen3"]  # 按模型名前缀匹配
+            },
+            "summarization": {
+                "slice_tokens": 600,  # 单个切片分析参与摘要的token上限
+                "window_seconds": 24,  # 每个时间段摘要覆盖的最长时间(秒)
+                "map_input_tokens": 3000,  # 生成时间段摘要时单次调用的输入上限
+                "digest_tokens": 300,  # 每个时间段摘要的token上限
+                "reduce_input_tokens": 3000,  # 生成全局摘要时单次调用的输入上限，超出时逐层合并
+                "summary_tokens": 800,  # 全局摘要的token上限
+                "scene_context_tokens": 1200,  # 每个场景提示词中视频理解上下文的token上限
+                "max_concurrency": 4  # 同时进行的摘要调用数
+            },
+            "step_cache": {
+                "enabled": True,
+                "cache_dir": os.path.join(os.getcwd(), "cache", "steps")
+            },
+            "job_queue": {
+                "db_path": os.path.join(os.getcwd(), "recreation_jobs.db"),
+                "workers": 2,  # 工作进程数量
+                "poll_interval": 2,  # 空闲时轮询间隔(秒)
+                "heartbeat_interval": 30,  # 心跳间隔(秒)
+                "lease_timeout": 300,  # 心跳超时后任务重新入队(秒)
+                "max_attempts": 2,
+                "autostart_workers": True  # 随Web服务启动工作进程
+            },
+            "progress_stream": {
+                "db_path": "",  # 为空时与任务队列共用数据库
+                "poll_interval": 1,  # SSE轮询事件表的间隔(秒)
+                "max_poll_interval": 5,  # 无新事件时轮询间隔逐次翻倍，最长不超过该值(秒)
+                "keepalive_interval": 15,  # 无事件时发送保活注释的间隔(秒)
+                "max_stream_duration": 300  # 单个SSE连接的最长时长(秒)，到时断开由客户端续传重连，避免长期占用请求线程
+            },
+            "tracing": {
+                "enabled": True,
+                "trace_file_name": "trace.json"  # 与recreation_result.json放在同一任务目录
+            },
+            "provider_scheduler": {
+                "enabled": True,
+                # 每个服务的并发上限和每分钟请求数(rpm为0表示不限速)，按账号配额调整
+                "providers": {
+                    "dashscope_text": {"max_concurrency": 4, "rpm": 60},
+                    "dashscope_vl": {"max_concurrency": 4, "rpm": 60},
+                    "dashscope_image_edit": {"max_concurrency": 2, "rpm": 30},
+                    "dashscope_video_synthesis": {"max_concurrency": 2, "rpm": 0},
+                    "comfyui": {"max_concurrency": 1, "rpm": 0}
+                }
+            },
+            "cassette": {
+                "mode": "off",  # off / record / replay，可用环境变量CASSETTE_MODE覆盖
+                "path": os.path.join(os.getcwd(), "cassettes", "default"),  # 可用环境变量CASSETTE_PATH覆盖
+                "replay_latency": "none",  # none 立即返回，recorded 按录制耗时等待
+                "latency_scale": 1.0,
+                "ignore_keys": ["seed", "filename_prefix"]
+            },
+            "batch": {
+                "max_active_jobs": 8,  # 同时处理的视频数，需足以让各服务排满
+                "skip_completed": True  # 跳过已有完成记录的视频
+            },
             "hotspot": {
                 "enabled": True,
                 "keywords": ["AI", "科技", "创意", "生活"],
@@ -198,6 +355,26 @@ class VideoReconstructionConfig:
         """获取FFmpeg配置"""
         return self.config["ffmpeg"]
     
+    def get_render_config(self) -> Dict[str, Any]:
+        """获取最终渲染配置"""
+        return self.config["render"]
+    
+    def get_analysis_proxy_config(self) -> Dict[str, Any]:
+        """获取分析代理配置"""
+        return self.config["analysis_proxy"]
+    
+    def get_ffmpeg_executor_config(self) -> Dict[str, Any]:
+        """获取FFmpeg执行器配置"""
+        return self.config["ffmpeg_executor"]
+    
+    def get_shot_detection_config(self) -> Dict[str, Any]:
+        """获取镜头检测配置"""
+        return self.config["shot_detection"]
+    
+    def get_media_probe_config(self) -> Dict[str, Any]:
+        """获取媒体探测缓存配置"""
+        return self.config["media_probe"]
+    
     def get_comfyui_config(self) -> Dict[str, Any]:
         """获取ComfyUI配置"""
         return self.config["comfyui"]
@@ -214,6 +391,70 @@ class VideoReconstructionConfig:
         """获取热点配置"""
         return self.config["hotspot"]
     
+    def get_scene_scheduler_config(self) -> Dict[str, Any]:
+        """获取场景调度配置"""
+        return self.config["scene_scheduler"]
+    
+    def get_dashscope_client_config(self) -> Dict[str, Any]:
+        """获取DashScope客户端配置"""
+        return self.config["dashscope_client"]
+    
+    def get_response_cache_config(self) -> Dict[str, Any]:
+        """获取模型响应缓存配置"""
+        return self.config["response_cache"]
+    
+    def get_video_analysis_config(self) -> Dict[str, Any]:
+        """获取视频切片分析配置"""
+        return self.config["video_analysis"]
+    
+    def get_image_payload_config(self) -> Dict[str, Any]:
+        """获取多模态请求图片预处理配置"""
+        return self.config["image_payload"]
+    
+    def get_slice_dedup_config(self) -> Dict[str, Any]:
+        """获取切片近重复检测配置"""
+        return self.config["slice_dedup"]
+    
+    def get_scene_prompts_config(self) -> Dict[str, Any]:
+        """获取场景提示词生成配置"""
+        return self.config["scene_prompts"]
+    
+    def get_structured_output_config(self) -> Dict[str, Any]:
+        """获取模型结构化输出配置"""
+        return self.config["structured_output"]
+    
+    def get_summarization_config(self) -> Dict[str, Any]:
+        """获取视频理解分层摘要配置"""
+        return self.config["summarization"]
+    
+    def get_step_cache_config(self) -> Dict[str, Any]:
+        """获取步骤缓存配置"""
+        return self.config["step_cache"]
+    
+    def get_job_queue_config(self) -> Dict[str, Any]:
+        """获取任务队列配置"""
+        return self.config["job_queue"]
+    
+    def get_progress_stream_config(self) -> Dict[str, Any]:
+        """获取进度推送配置"""
+        return self.config["progress_stream"]
+    
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """获取耗时追踪配置"""
+        return self.config["tracing"]
+    
+    def get_provider_scheduler_config(self) -> Dict[str, Any]:
+        """获取服务调度配置"""
+        return self.config["provider_scheduler"]
+    
+    def get_cassette_config(self) -> Dict[str, Any]:
+        """获取录制回放配置"""
+        return self.config["cassette"]
+    
+    def get_batch_config(self) -> Dict[str, Any]:
+        """获取批量处理配置"""
+        return self.config["batch"]
+    
     def get_system_config(self) -> Dict[str, Any]:
         """获取系统配置"""
         return self.config["system"]
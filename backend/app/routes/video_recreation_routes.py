@@ -1,9 +1,13 @@
-from flask import Blueprint, request, jsonify, current_app
-from app.services.video_recreation_service import VideoRecreationService
+from flask import Blueprint, Response, request, jsonify, current_app
+from app.services.job_queue import get_job_queue
+from app.services.progress_events import get_event_store, emit_progress
+from app.config.video_reconstruction_config import get_config
 from app.services.video_service import VideoService
 from app.models import db, VideoRecreation, RecreationScene, RecreationLog, DouyinVideo
 from datetime import datetime
 import os
+import json
+import time
 import traceback
 import uuid
 
@@ -21,10 +25,10 @@ def recreate_video(video_id):
         if not video_path or not os.path.exists(video_path):
             return jsonify({'error': '视频文件不存在或路径无效'}), 400
         
-        # 检查是否已经在处理中
-        existing_recreation = VideoRecreation.query.filter_by(
-            original_video_id=video_id,
-            status='processing'
+        # 检查是否已经在排队或处理中
+        existing_recreation = VideoRecreation.query.filter(
+            VideoRecreation.original_video_id == video_id,
+            VideoRecreation.status.in_(['pending', 'processing'])
         ).first()
         
         if existing_recreation:
@@ -33,68 +37,46 @@ def recreate_video(video_id):
                 'recreation_id': existing_recreation.id
             }), 409
         
-        # 创建二创记录
+        # 处理参数
+        data = request.get_json(silent=True) or {}
+        raw_slice_limit = data.get('slice_limit', 0)
+        try:
+            slice_limit = int(raw_slice_limit)
+            if isinstance(raw_slice_limit, float) and raw_slice_limit != slice_limit:
+                raise ValueError(raw_slice_limit)
+        except (TypeError, ValueError, OverflowError):
+            slice_limit = -1
+        if isinstance(raw_slice_limit, bool) or slice_limit < 0:
+            return jsonify({'success': False, 'error': 'slice_limit必须是非负整数'}), 400
+        options = {
+            'use_qwen': bool(data.get('use_qwen', False)),
+            'use_nano_banana': bool(data.get('use_nano_banana', False)),
+            'slice_limit': slice_limit
+        }
+        
+        # 创建二创记录，等待工作进程领取
         recreation = VideoRecreation(
             original_video_id=video_id,
-            status='processing',
+            original_video_path=video_path,
+            status='pending',
             created_at=datetime.now()
         )
         db.session.add(recreation)
         db.session.commit()
         
-        # 记录开始日志
-        log = RecreationLog(
-            recreation_id=recreation.id,
-            step_name='start',
-            log_level='info',
-            message='开始视频二创处理',
-            created_at=datetime.now()
-        )
-        db.session.add(log)
-        db.session.commit()
-        
-        # 初始化二创服务
-        print(f"[二创进度] 初始化二创服务，任务ID: {recreation.id}")
-        recreation_service = VideoRecreationService()
+        # 提交到任务队列，由工作进程异步执行
+        job_id = get_job_queue().enqueue(recreation.id, video_path, options)
+        emit_progress('job_queued', {'job_id': job_id, 'options': options}, recreation_id=recreation.id)
+        log_step(recreation.id, 'start', 'processing', f'二创任务已入队，任务ID: {job_id}')
+        print(f"[二创进度] 任务已入队，任务ID: {recreation.id}，队列任务ID: {job_id}")
         
-        try:
-            # 调用完整的视频二创处理流程
-            result = recreation_service.process_video_for_recreation(video_path, recreation.id)
-            
-            if result.get('success'):
-                print(f"[二创进度] 视频二创处理完成")
-                recreation.status = 'completed'
-                recreation.completed_at = datetime.utcnow()
-                db.session.commit()
-                
-                return jsonify({
-                    'success': True,
-                    'message': '视频二创处理完成',
-                    'recreation_id': recreation.id,
-                    'result': result
-                })
-            else:
-                print(f"[二创进度] 视频二创处理失败: {result.get('error', '未知错误')}")
-                recreation.status = 'failed'
-                db.session.commit()
-                
-                return jsonify({
-                    'success': False,
-                    'message': f"视频二创处理失败: {result.get('error', '未知错误')}",
-                    'recreation_id': recreation.id
-                }), 500
-        
-        except Exception as e:
-            # 更新状态为失败
-            recreation.status = 'failed'
-            log_step(recreation.id, 'error', 'failed', f'处理失败: {str(e)}')
-            db.session.commit()
-            
-            return jsonify({
-                'success': False,
-                'recreation_id': recreation.id,
-                'error': str(e)
-            }), 500
+        return jsonify({
+            'success': True,
+            'message': '二创任务已提交',
+            'recreation_id': recreation.id,
+            'job_id': job_id,
+            'status': 'queued'
+        }), 202
             
     except Exception as e:
         return jsonify({
@@ -116,8 +98,12 @@ def get_recreation_status(recreation_id):
         # 获取日志信息
         logs = RecreationLog.query.filter_by(recreation_id=recreation_id).order_by(RecreationLog.created_at).all()
         
+        # 获取队列任务状态
+        job = get_job_queue().get_job_by_recreation(recreation_id)
+        
         return jsonify({
             'recreation': recreation.to_dict(),
+            'job': job,
             'scenes': [scene.to_dict() for scene in scenes],
             'logs': [log.to_dict() for log in logs]
         })
@@ -125,6 +111,73 @@ def get_recreation_status(recreation_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@video_recreation_bp.route('/recreations/<int:recreation_id>/events', methods=['GET'])
+def stream_recreation_events(recreation_id):
+    # SSE进度推送：步骤切换、场景进度、远程任务状态；支持Last-Event-ID断点续传
+    recreation = VideoRecreation.query.get(recreation_id)
+    if not recreation:
+        return jsonify({'error': '二创记录不存在'}), 404
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_event_id = 0
+    
+    stream_config = get_config().get_progress_stream_config()
+    poll_interval = stream_config.get('poll_interval', 1)
+    max_poll_interval = max(poll_interval, stream_config.get('max_poll_interval', 5))
+    keepalive_interval = stream_config.get('keepalive_interval', 15)
+    max_stream_duration = stream_config.get('max_stream_duration', 300)
+    event_store = get_event_store()
+    job_queue = get_job_queue()
+    
+    def generate():
+        cursor = last_event_id
+        started = last_sent = time.time()
+        interval = poll_interval
+        # 告诉客户端断线后的重连间隔
+        yield f"retry: {int(poll_interval * 1000)}\n\n"
+        
+        while True:
+            events = event_store.fetch_after(recreation_id, cursor)
+            for event in events:
+                cursor = event['id']
+                payload = json.dumps({
+                    'recreation_id': recreation_id,
+                    'created_at': event['created_at'],
+                    **event['data']
+                }, ensure_ascii=False, default=str)
+                yield f"id: {event['id']}\nevent: {event['event_type']}\ndata: {payload}\n\n"
+                last_sent = time.time()
+                if event['event_type'] in event_store.TERMINAL_EVENTS:
+                    return
+            
+            if events:
+                interval = poll_interval
+                continue
+            
+            if time.time() - started >= max_stream_duration:
+                # 每个连接占用一个请求线程，超过最长时长后主动断开，客户端按retry间隔带Last-Event-ID重连续传
+                return
+            
+            if time.time() - last_sent >= keepalive_interval:
+                # 保活注释，同时检查任务是否已经在没有终止事件的情况下结束（例如心跳超时）
+                job = job_queue.get_job_by_recreation(recreation_id)
+                if job and job['status'] in (job_queue.STATUS_SUCCEEDED, job_queue.STATUS_FAILED):
+                    return
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            
+            # 没有新事件时逐步拉长轮询间隔，减少空闲连接对事件表的查询
+            time.sleep(interval)
+            interval = min(max_poll_interval, interval * 2)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @video_recreation_bp.route('/videos/upload', methods=['POST'])
 def upload_video():
     try:
@@ -0,0 +1,225 @@
+# 分析代理视频
+# 每个源视频转码一次低分辨率、恒定帧率、短GOP的代理文件，缓存在源视频旁边；
+# 探测、镜头检测和切片等分析环节读取代理；切片关键帧同时作为视频生成的参考图，仍从原视频提取
+
+import os
+import glob
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Tuple
+
+from app.services.tracing import span
+from app.services.ffmpeg_executor import get_ffmpeg_executor, PRIORITY_BATCH
+from app.services.media_probe import get_media_probe, summarize_video_info
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisProxyCache:
+    """分析代理缓存，线程安全，同一源视频的并发请求只转码一次"""
+
+    # 代理编码参数变化时递增，使旧代理失效
+    PROXY_VERSION = 1
+    PROXY_MARKER = ".proxy_"
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        proxy_config = dict(get_config().get_analysis_proxy_config())
+        if config:
+            proxy_config.update(config)
+
+        self.enabled = proxy_config.get("enabled", True)
+        self.height = proxy_config.get("height", 360)
+        self.max_fps = proxy_config.get("max_fps", 30)
+        self.gop_seconds = proxy_config.get("gop_seconds", 0.5)
+        self.preset = proxy_config.get("preset", "veryfast")
+        self.crf = proxy_config.get("crf", 28)
+        self.audio_bitrate = proxy_config.get("audio_bitrate", "64k")
+        self.cache_dir = proxy_config.get("cache_dir", os.path.join(os.getcwd(), "cache", "proxy"))
+        self.ffmpeg_path = (get_config().get("ffmpeg.ffmpeg_path", "") or shutil.which("ffmpeg") or "ffmpeg")
+
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        logger.info(f"[分析代理] 初始化完成，启用: {self.enabled}, 高度: {self.height}p, GOP: {self.gop_seconds}秒")
+
+    def params(self) -> Dict[str, Any]:
+        """影响代理内容的编码参数，供依赖分析结果的缓存计算键"""
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'version': self.PROXY_VERSION,
+            'height': self.height,
+            'max_fps': self.max_fps,
+            'gop_seconds': self.gop_seconds,
+            'preset': self.preset,
+            'crf': self.crf,
+            'audio_bitrate': self.audio_bitrate
+        }
+
+    def is_proxy(self, video_path: str) -> bool:
+        return self.PROXY_MARKER in os.path.basename(video_path)
+
+    def _plan(self, video_path: str) -> Optional[Tuple[str, float]]:
+        # 返回(代理路径, 代理帧率)；代理文件名包含源文件大小、修改时间和编码参数的摘要，源文件变化后自动失效
+        info = get_media_probe().probe(video_path)
+        if not info:
+            return None
+        summary = summarize_video_info(info)
+        if not summary['width'] or not summary['height']:
+            return None
+
+        fps = round(min(summary['fps'] or self.max_fps, self.max_fps), 3)
+        real_path = os.path.realpath(video_path)
+        stat = os.stat(real_path)
+        digest = hashlib.sha256(repr((
+            self.PROXY_VERSION, stat.st_size, stat.st_mtime_ns,
+            self.height, fps, self.gop_seconds, self.crf, self.audio_bitrate
+        )).encode("utf-8")).hexdigest()[:12]
+
+        video_dir = os.path.dirname(real_path)
+        stem = os.path.splitext(os.path.basename(real_path))[0]
+        if not os.access(video_dir, os.W_OK):
+            # 源目录不可写时放到缓存目录，用源路径摘要区分同名文件
+            video_dir = os.path.join(self.cache_dir, hashlib.sha256(real_path.encode("utf-8")).hexdigest()[:16])
+            os.makedirs(video_dir, exist_ok=True)
+        return os.path.join(video_dir, f"{stem}{self.PROXY_MARKER}{self.height}p_{digest}.mp4"), fps
+
+    def _command(self, video_path: str, output_path: str, fps: float):
+        gop = max(1, int(round(fps * self.gop_seconds)))
+        return [
+            self.ffmpeg_path,
+            '-y',
+            '-i', video_path,
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            '-vf', f"fps={fps},scale=-2:'min({self.height},ih)',format=yuv420p",
+            '-c:v', 'libx264',
+            '-preset', self.preset,
+            '-crf', str(self.crf),
+            '-tune', 'fastdecode',
+            '-g', str(gop),
+            '-keyint_min', str(gop),
+            '-sc_threshold', '0',
+            '-c:a', 'aac',
+            '-b:a', self.audio_bitrate,
+            '-movflags', '+faststart',
+            '-f', 'mp4',
+            output_path
+        ]
+
+    def _remove_stale(self, proxy_path: str):
+        # 同一源视频的旧代理(源文件被覆盖或参数变化)直接删除
+        prefix = proxy_path.split(self.PROXY_MARKER)[0]
+        for stale in glob.glob(f"{glob.escape(prefix)}{self.PROXY_MARKER}*.mp4"):
+            if stale != proxy_path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def _claim(self, proxy_path: str) -> Tuple[Future, bool]:
+        # 返回(future, 是否由当前调用者负责转码)
+        with self._lock:
+            future = self._inflight.get(proxy_path)
+            if future is not None:
+                return future, False
+            future = self._inflight[proxy_path] = Future()
+            return future, True
+
+    def _finish(self, video_path: str, proxy_path: str, tmp_path: str, future: Future, result: Dict[str, Any]) -> str:
+        output = video_path
+        try:
+            if result.get('success') and os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                os.replace(tmp_path, proxy_path)
+                self._remove_stale(proxy_path)
+                output = proxy_path
+                logger.info(f"[分析代理] 已生成代理: {proxy_path} ({os.path.getsize(proxy_path) / 1024 / 1024:.1f}MB)")
+            else:
+                logger.warning(f"[分析代理] 转码失败，分析环节使用原视频: {video_path}")
+        except Exception as e:
+            logger.warning(f"[分析代理] 保存代理失败，分析环节使用原视频 {video_path}: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._inflight.pop(proxy_path, None)
+            future.set_result(output)
+        return output
+
+    def _prepare(self, video_path: str):
+        # 返回(已有结果, 代理路径, 临时路径, 帧率)；已有结果不为None时无需转码
+        if not self.enabled or not os.path.exists(video_path) or self.is_proxy(video_path):
+            return video_path, None, None, None
+        try:
+            plan = self._plan(video_path)
+        except Exception as e:
+            logger.warning(f"[分析代理] 计算代理参数失败 {video_path}: {e}")
+            plan = None
+        if plan is None:
+            return video_path, None, None, None
+        proxy_path, fps = plan
+        if os.path.exists(proxy_path):
+            return proxy_path, None, None, None
+        return None, proxy_path, f"{proxy_path}.{os.getpid()}.{threading.get_ident()}.tmp", fps
+
+    def get(self, video_path: str) -> str:
+        """同步获取分析代理路径，代理不可用时返回原视频路径"""
+        ready, proxy_path, tmp_path, fps = self._prepare(video_path)
+        if ready is not None:
+            return ready
+
+        future, owner = self._claim(proxy_path)
+        if not owner:
+            return future.result()
+        with span('analysis_proxy', 'ffmpeg', video=os.path.basename(video_path)):
+            try:
+                result = get_ffmpeg_executor().run(self._command(video_path, tmp_path, fps), priority=PRIORITY_BATCH)
+            except Exception as e:
+                logger.warning(f"[分析代理] 执行转码失败: {e}")
+                result = {}
+        return self._finish(video_path, proxy_path, tmp_path, future, result)
+
+    async def get_async(self, video_path: str) -> str:
+        """异步获取分析代理路径，不阻塞事件循环"""
+        ready, proxy_path, tmp_path, fps = await asyncio.to_thread(self._prepare, video_path)
+        if ready is not None:
+            return ready
+
+        future, owner = self._claim(proxy_path)
+        if not owner:
+            return await asyncio.wrap_future(future)
+        with span('analysis_proxy', 'ffmpeg', video=os.path.basename(video_path)):
+            try:
+                result = await get_ffmpeg_executor().run_async(self._command(video_path, tmp_path, fps), priority=PRIORITY_BATCH)
+            except asyncio.CancelledError:
+                self._finish(video_path, proxy_path, tmp_path, future, {})
+                raise
+            except Exception as e:
+                logger.warning(f"[分析代理] 执行转码失败: {e}")
+                result = {}
+        return self._finish(video_path, proxy_path, tmp_path, future, result)
+
+
+_analysis_proxy = None
+_analysis_proxy_lock = threading.Lock()
+
+
+def get_analysis_proxy_cache() -> AnalysisProxyCache:
+    """获取全局分析代理缓存实例"""
+    global _analysis_proxy
+    if _analysis_proxy is None:
+        with _analysis_proxy_lock:
+            if _analysis_proxy is None:
+                _analysis_proxy = AnalysisProxyCache()
+    return _analysis_proxy
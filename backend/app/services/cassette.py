@@ -0,0 +1,394 @@
+# 远程调用录制回放
+# record模式下把DashScope SDK调用和SiliconFlow、ComfyUI、Qwen视频服务的HTTP请求连同耗时写入磁带目录；
+# replay模式下按请求内容匹配录制结果，确定性地返回并可模拟原始耗时，无网络也能对整条流水线做基准测试
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import importlib
+import threading
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = 'off'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+# 不参与请求匹配的参数：密钥和超时设置每次运行都可能不同
+_IGNORED_KEYS = {'api_key', 'timeout', 'authorization', 'Authorization'}
+
+
+class CassetteMissError(Exception):
+    """回放模式下找不到匹配的录制结果"""
+    pass
+
+
+class _AttrDict(dict):
+    """回放的SDK响应，同时支持字典访问和属性访问（与DashScope响应对象一致）"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _to_attr(value):
+    if isinstance(value, dict):
+        return _AttrDict({k: _to_attr(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_to_attr(v) for v in value]
+    return value
+
+
+class _ReplayedResponse:
+    """回放的requests响应"""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes, url: str, elapsed: float):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.elapsed = elapsed
+        self.ok = status_code < 400
+        self.encoding = 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self, **kwargs):
+        return json.loads(self.content.decode('utf-8'), **kwargs)
+
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False):
+        chunk_size = chunk_size or len(self.content) or 1
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if not self.ok:
+            import requests
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+
+class Cassette:
+    """一个磁带目录：interactions.jsonl 逐条追加交互记录，大的响应体按内容哈希存放在 blobs/"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置，环境变量优先，便于临时切换到回放模式
+        cassette_config = dict(get_config().get_cassette_config())
+        if config:
+            cassette_config.update(config)
+
+        self.mode = os.environ.get('CASSETTE_MODE', cassette_config.get("mode", MODE_OFF))
+        self.path = os.environ.get('CASSETTE_PATH', cassette_config.get("path", os.path.join(os.getcwd(), "cassettes", "default")))
+        # 回放延迟：none 不等待，recorded 按录制耗时等待；latency_scale 用于按比例放大或缩小
+        self.replay_latency = cassette_config.get("replay_latency", "none")
+        self.latency_scale = float(cassette_config.get("latency_scale", 1.0))
+        # 每次运行都会变化的字段（随机种子、带时间戳的文件名前缀等）不参与匹配
+        self.ignore_keys = _IGNORED_KEYS | set(cassette_config.get("ignore_keys", []))
+
+        self.interactions_file = os.path.join(self.path, "interactions.jsonl")
+        self.blobs_dir = os.path.join(self.path, "blobs")
+        self._lock = threading.Lock()
+        self._recorded: Dict[str, List[Dict[str, Any]]] = {}
+        self._replay_positions: Dict[str, int] = {}
+
+        if self.mode == MODE_RECORD:
+            os.makedirs(self.blobs_dir, exist_ok=True)
+        elif self.mode == MODE_REPLAY:
+            self._load()
+
+        logger.info(f"[录制回放] 模式: {self.mode}, 磁带目录: {self.path}")
+
+    @property
+    def active(self) -> bool:
+        return self.mode in (MODE_RECORD, MODE_REPLAY)
+
+    def _load(self):
+        if not os.path.exists(self.interactions_file):
+            logger.warning(f"[录制回放] 磁带不存在: {self.interactions_file}")
+            return
+        with open(self.interactions_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    interaction = json.loads(line)
+                except json.JSONDecodeError:
+                    # 录制进程中途被杀时最后一行可能不完整
+                    continue
+                self._recorded.setdefault(interaction['key'], []).append(interaction)
+        print(f"[录制回放] 已加载 {sum(len(v) for v in self._recorded.values())} 条录制记录")
+
+    # ---------- 请求归一化 ----------
+
+    def _normalize(self, value):
+        # 本地文件按内容哈希匹配，任务目录、临时文件名不同也能命中同一条录制
+        if isinstance(value, dict):
+            return {k: self._normalize(v) for k, v in sorted(value.items()) if k not in self.ignore_keys}
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        if isinstance(value, str):
+            path = value[len('file://'):] if value.startswith('file://') else value
+            if len(path) < 1024 and os.path.isfile(path):
+                return f"file-sha256:{self._file_digest(path)}"
+            return value
+        if hasattr(value, 'read') and hasattr(value, 'name') and isinstance(value.name, str) and os.path.isfile(value.name):
+            return f"file-sha256:{self._file_digest(value.name)}"
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return str(type(value).__name__)
+
+    @staticmethod
+    def _file_digest(path: str) -> str:
+        sha256_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256_hash.update(chunk)
+        return sha256_hash.hexdigest()
+
+    def make_key(self, operation: str, request: Dict[str, Any]) -> str:
+        payload = json.dumps({'op': operation, 'request': self._normalize(request)}, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # ---------- 大响应体存储 ----------
+
+    def _put_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = os.path.join(self.blobs_dir, digest[:2], digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, blob_path)
+        return digest
+
+    def _get_blob(self, digest: str) -> bytes:
+        with open(os.path.join(self.blobs_dir, digest[:2], digest), 'rb') as f:
+            return f.read()
+
+    # ---------- 录制与回放 ----------
+
+    def _append(self, interaction: Dict[str, Any]):
+        line = json.dumps(interaction, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.interactions_file, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def _next_recorded(self, operation: str, key: str) -> Dict[str, Any]:
+        # 同一请求录到多条时按顺序回放（如轮询任务状态），用完后一直返回最后一条
+        with self._lock:
+            interactions = self._recorded.get(key)
+            if not interactions:
+                raise CassetteMissError(f"[录制回放] 没有匹配的录制: {operation} ({key[:12]})")
+            position = self._replay_positions.get(key, 0)
+            self._replay_positions[key] = position + 1
+            return interactions[min(position, len(interactions) - 1)]
+
+    def _simulate_latency(self, interaction: Dict[str, Any]):
+        if self.replay_latency == 'recorded':
+            delay = interaction.get('duration', 0) * self.latency_scale
+            if delay > 0:
+                time.sleep(delay)
+
+    @staticmethod
+    def _error_record(e: Exception) -> Dict[str, str]:
+        return {'type': type(e).__name__, 'module': type(e).__module__, 'message': str(e)}
+
+    @staticmethod
+    def _raise_recorded_error(error: Dict[str, str]):
+        try:
+            error_class = getattr(importlib.import_module(error['module']), error['type'])
+            exception = error_class(error['message'])
+        except Exception:
+            exception = RuntimeError(f"{error['type']}: {error['message']}")
+        raise exception
+
+    def call_sdk(self, operation: str, func, *args, **kwargs):
+        """录制或回放一次DashScope SDK调用"""
+        request = {'args': list(args), 'kwargs': kwargs}
+        key = self.make_key(operation, request)
+
+        if self.mode == MODE_REPLAY:
+            interaction = self._next_recorded(operation, key)
+            self._simulate_latency(interaction)
+            if interaction.get('error'):
+                self._raise_recorded_error(interaction['error'])
+            if interaction.get('stream'):
+                return iter([_to_attr(chunk) for chunk in interaction['response']])
+            return _to_attr(interaction['response'])
+
+        start = time.perf_counter()
+        interaction = {'key': key, 'op': operation, 'recorded_at': time.time()}
+        try:
+            response = func(*args, **kwargs)
+        except Exception as e:
+            interaction.update(duration=time.perf_counter() - start, error=self._error_record(e))
+            self._append(interaction)
+            raise
+
+        if kwargs.get('stream') and not isinstance(response, dict):
+            # 流式响应先完整读出再录制，调用方拿到的是等价的迭代器
+            chunks = list(response)
+            interaction.update(duration=time.perf_counter() - start, stream=True,
+                               response=[json.loads(json.dumps(c, default=str)) for c in chunks])
+            self._append(interaction)
+            return iter(chunks)
+
+        interaction.update(duration=time.perf_counter() - start, response=json.loads(json.dumps(response, default=str)))
+        self._append(interaction)
+        return response
+
+    def call_http(self, operation: str, func, url: str, **kwargs):
+        """录制或回放一次requests调用"""
+        request = {'url': url, 'params': kwargs.get('params'), 'json': kwargs.get('json'),
+                   'data': kwargs.get('data'), 'files': kwargs.get('files')}
+        key = self.make_key(operation, request)
+
+        if self.mode == MODE_REPLAY:
+            interaction = self._next_recorded(operation, key)
+            self._simulate_latency(interaction)
+            if interaction.get('error'):
+                self._raise_recorded_error(interaction['error'])
+            response = interaction['response']
+            if 'blob' in response:
+                content = self._get_blob(response['blob'])
+            else:
+                content = base64.b64decode(response.get('body_base64', ''))
+            return _ReplayedResponse(response['status_code'], response.get('headers', {}), content, url, interaction.get('duration', 0))
+
+        start = time.perf_counter()
+        interaction = {'key': key, 'op': operation, 'url': url, 'recorded_at': time.time()}
+        try:
+            response = func(url, **kwargs)
+            content = response.content
+        except Exception as e:
+            interaction.update(duration=time.perf_counter() - start, error=self._error_record(e))
+            self._append(interaction)
+            raise
+
+        recorded_response = {'status_code': response.status_code, 'headers': dict(response.headers)}
+        # 视频等大文件单独存放，避免交互记录文件膨胀
+        if len(content) > 64 * 1024:
+            recorded_response['blob'] = self._put_blob(content)
+        else:
+            recorded_response['body_base64'] = base64.b64encode(content).decode('ascii')
+        interaction.update(duration=time.perf_counter() - start, response=recorded_response)
+        self._append(interaction)
+        # 已读出的响应体仍可通过iter_content/json访问
+        return response
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """按调用类型统计录制耗时分布（秒）"""
+        durations: Dict[str, List[float]] = {}
+        if self.mode == MODE_REPLAY:
+            interactions = [i for items in self._recorded.values() for i in items]
+        else:
+            interactions = []
+            if os.path.exists(self.interactions_file):
+                with open(self.interactions_file, 'r', encoding='utf-8') as f:
+                    interactions = [json.loads(line) for line in f if line.strip()]
+
+        for interaction in interactions:
+            durations.setdefault(interaction['op'], []).append(interaction.get('duration', 0))
+
+        stats = {}
+        for operation, values in durations.items():
+            values.sort()
+            percentile = lambda p: values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+            stats[operation] = {
+                'count': len(values),
+                'mean': round(sum(values) / len(values), 3),
+                'p50': round(percentile(0.5), 3),
+                'p90': round(percentile(0.9), 3),
+                'p99': round(percentile(0.99), 3),
+                'max': round(values[-1], 3)
+            }
+        return stats
+
+
+class _CassetteRequests:
+    """替换服务模块中的requests，get/post经过磁带，其余属性（exceptions等）原样转发"""
+
+    def __init__(self, cassette: Cassette, requests_module, service_name: str):
+        self._cassette = cassette
+        self._requests = requests_module
+        self._service_name = service_name
+
+    def get(self, url, **kwargs):
+        return self._cassette.call_http(f"{self._service_name}.GET", self._requests.get, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._cassette.call_http(f"{self._service_name}.POST", self._requests.post, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._requests, name)
+
+
+def _wrap_sdk_method(cassette: Cassette, owner, method_name: str, operation: str):
+    original = getattr(owner, method_name)
+    if getattr(original, '_cassette_wrapped', False):
+        return
+
+    def wrapper(*args, **kwargs):
+        return cassette.call_sdk(operation, original, *args, **kwargs)
+
+    wrapper._cassette_wrapped = True
+    setattr(owner, method_name, staticmethod(wrapper))
+
+
+_cassette = None
+
+
+def get_cassette() -> Cassette:
+    """获取全局磁带实例"""
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette()
+    return _cassette
+
+
+def install_cassette() -> Optional[Cassette]:
+    """按配置启用录制或回放；模式为off时不做任何替换"""
+    cassette = get_cassette()
+    if not cassette.active:
+        return None
+
+    # DashScope SDK：服务里既有模块级导入也有函数内导入，替换类属性才能全部覆盖
+    try:
+        import dashscope
+        _wrap_sdk_method(cassette, dashscope.MultiModalConversation, 'call', 'dashscope.MultiModalConversation.call')
+        _wrap_sdk_method(cassette, dashscope.Generation, 'call', 'dashscope.Generation.call')
+        _wrap_sdk_method(cassette, dashscope.VideoSynthesis, 'async_call', 'dashscope.VideoSynthesis.async_call')
+        _wrap_sdk_method(cassette, dashscope.VideoSynthesis, 'wait', 'dashscope.VideoSynthesis.wait')
+    except ImportError as e:
+        logger.warning(f"[录制回放] 未安装dashscope，跳过SDK录制: {e}")
+
+    # HTTP调用只替换指定服务模块里的requests，不影响进程内其他请求
+    import requests
+    for module_name, service_name in [
+        ('app.services.qwen_video_service', 'qwen_video'),
+        ('app.services.speech_recognition_service', 'siliconflow'),
+        ('app.services.comfyui_service', 'comfyui'),
+    ]:
+        try:
+            module = importlib.import_module(module_name)
+            if not isinstance(module.requests, _CassetteRequests):
+                module.requests = _CassetteRequests(cassette, requests, service_name)
+        except Exception as e:
+            logger.warning(f"[录制回放] 替换 {module_name} 的HTTP调用失败: {e}")
+
+    print(f"[录制回放] 已启用{'录制' if cassette.mode == MODE_RECORD else '回放'}模式，磁带目录: {cassette.path}")
+    return cassette
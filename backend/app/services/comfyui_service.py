@@ -7,6 +7,10 @@ import time
 from typing import Dict, List, Any, Optional
 import logging
 
+from app.services.progress_events import emit_progress
+from app.services.tracing import span, traced
+from app.services.provider_scheduler import ProviderScheduler, provider_limited
+
 logger = logging.getLogger(__name__)
 
 
@@ -86,6 +90,7 @@ class ComfyUIService:
                 "error": error_msg
             }
     
+    @provider_limited(ProviderScheduler.COMFYUI)
     def generate_keyframes(self, prompt: Dict[str, Any], num_keyframes: int = 5) -> Dict[str, Any]:
         try:
             logger.info(f"=== 开始生成关键帧流程 ===")
@@ -188,6 +193,7 @@ class ComfyUIService:
                 "exception_type": type(e).__name__
             }
     
+    @provider_limited(ProviderScheduler.COMFYUI)
     def generate_video_from_keyframes(self, keyframe_urls: List[str], prompt: Dict[str, Any]) -> Dict[str, Any]:
         try:
             logger.info(f"=== 开始从关键帧生成视频流程 ===")
@@ -587,6 +593,12 @@ class ComfyUIService:
                 }
             }
     
+    def _poll_sleep(self):
+        # 轮询间隔单独记为span，时间线上可以区分真正的等待和请求耗时
+        with span('poll.sleep', 'sleep'):
+            time.sleep(self.poll_interval)
+    
+    @traced('comfyui.poll_result', 'comfyui')
     def _poll_comfyui_result(self, prompt_id: str, max_wait_time: int = 300) -> Dict[str, Any]:
         start_time = time.time()
         elapsed_time = 0
@@ -594,6 +606,8 @@ class ComfyUIService:
         
         logger.info(f"=== 开始轮询ComfyUI结果 ===")
         logger.info(f"轮询参数: prompt_id={prompt_id}, max_wait_time={max_wait_time}s, poll_interval={self.poll_interval}s")
+        emit_progress('remote_task', {'service': 'comfyui', 'task_id': prompt_id, 'status': 'queued'})
+        last_status = 'queued'
         
         while elapsed_time < max_wait_time:
             attempt_count += 1
@@ -611,7 +625,7 @@ class ComfyUIService:
                 
                 if response.status_code != 200:
                     logger.warning(f"轮询响应状态异常: {response.status_code}，内容: {response.text[:500]}...")
-                    time.sleep(self.poll_interval)
+                    self._poll_sleep()
                     continue
                 
                 # 解析响应内容
@@ -620,13 +634,13 @@ class ComfyUIService:
                     logger.debug(f"轮询响应JSON解析成功")
                 except json.JSONDecodeError as e:
                     logger.error(f"轮询响应JSON解析失败: {str(e)}，响应内容: {response.text[:1000]}...")
-                    time.sleep(self.poll_interval)
+                    self._poll_sleep()
                     continue
                 
                 # 检查prompt_id是否在历史记录中
                 if prompt_id not in history:
                     logger.info(f"轮询: prompt_id {prompt_id} 尚未生成完成，继续等待...")
-                    time.sleep(self.poll_interval)
+                    self._poll_sleep()
                     continue
                 
                 item = history[prompt_id]
@@ -635,6 +649,9 @@ class ComfyUIService:
                 # 检查生成状态
                 if "status" in item:
                     logger.info(f"轮询: 当前状态 - {item['status']}")
+                    if str(item['status']) != last_status:
+                        last_status = str(item['status'])
+                        emit_progress('remote_task', {'service': 'comfyui', 'task_id': prompt_id, 'status': item['status']})
                     if item['status'] == "error":
                         error_msg = item.get("error", "未知错误")
                         logger.error(f"轮询: 生成失败 - {error_msg}")
@@ -690,6 +707,7 @@ class ComfyUIService:
                     
                     logger.info(f"轮询: 成功提取 {len(generated_files)} 个生成文件")
                     result["generated_files"] = generated_files
+                    emit_progress('remote_task', {'service': 'comfyui', 'task_id': prompt_id, 'status': 'completed'})
                     
                     logger.info(f"=== 轮询完成 ===")
                     logger.info(f"轮询结果: 成功={result['success']}, 总耗时={elapsed_time:.2f}s, 尝试次数={attempt_count}, 生成文件数={len(generated_files)}")
@@ -699,20 +717,20 @@ class ComfyUIService:
                 # 继续等待
                 remaining_time = max_wait_time - elapsed_time
                 logger.info(f"轮询: 输出尚未生成，继续等待... 剩余时间: {remaining_time:.2f}s")
-                time.sleep(self.poll_interval)
+                self._poll_sleep()
                 
             except requests.exceptions.RequestException as e:
                 error_msg = f"轮询网络异常: {str(e)}"
                 logger.error(error_msg)
-                time.sleep(self.poll_interval)
+                self._poll_sleep()
             except json.JSONDecodeError as e:
                 error_msg = f"轮询JSON解析异常: {str(e)}"
                 logger.error(error_msg)
-                time.sleep(self.poll_interval)
+                self._poll_sleep()
             except Exception as e:
                 error_msg = f"轮询异常: {str(e)}"
                 logger.error(error_msg, exc_info=True)
-                time.sleep(self.poll_interval)
+                self._poll_sleep()
         
         error_msg = f"生成超时，超过 {max_wait_time} 秒，尝试次数: {attempt_count}"
         logger.error(f"=== 轮询失败 ===")
@@ -0,0 +1,289 @@
+# DashScope HTTP客户端
+# 进程内共享的DashScope REST客户端：在后台事件循环中维护一个aiohttp连接池(keep-alive)，
+# 任意线程、任意事件循环的调用都复用同一个连接池；每次调用有独立的截止时间，错误按类型抛出
+
+import json
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, List, Optional, AsyncIterator, Callable
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class DashScopeError(Exception):
+    """DashScope调用失败"""
+
+    # 是否值得重试：限流、服务端错误、超时和连接错误可以重试，请求本身错误不行
+    retryable = False
+
+    def __init__(self, message: str, status: int = None, code: str = None, request_id: str = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.request_id = request_id
+
+
+class DashScopeRequestError(DashScopeError):
+    """请求参数、鉴权或内容审核错误(4xx)"""
+    pass
+
+
+class DashScopeRateLimitError(DashScopeError):
+    """触发限流(429 / Throttling)"""
+    retryable = True
+
+
+class DashScopeServerError(DashScopeError):
+    """服务端错误(5xx)"""
+    retryable = True
+
+
+class DashScopeTimeoutError(DashScopeError):
+    """超过本次调用的截止时间"""
+    retryable = True
+
+
+class DashScopeConnectionError(DashScopeError):
+    """网络连接错误"""
+    retryable = True
+
+
+class DashScopeResponseError(DashScopeError):
+    """响应格式无法解析"""
+    pass
+
+
+def _error_from_response(status: int, body: Dict[str, Any]) -> DashScopeError:
+    code = body.get('code') or ''
+    message = f"DashScope调用失败，状态码: {status}, 错误码: {code}, 错误信息: {body.get('message', '')}"
+    kwargs = {'status': status, 'code': code, 'request_id': body.get('request_id')}
+    if status == 429 or code.startswith('Throttling'):
+        return DashScopeRateLimitError(message, **kwargs)
+    if status >= 500:
+        return DashScopeServerError(message, **kwargs)
+    return DashScopeRequestError(message, **kwargs)
+
+
+def _chunk_text(payload: Dict[str, Any]) -> str:
+    # 多模态接口的content是[{'text': ...}]列表，文本接口是字符串
+    choices = (payload.get('output') or {}).get('choices') or []
+    if not choices:
+        return (payload.get('output') or {}).get('text') or ''
+    content = (choices[0].get('message') or {}).get('content')
+    if isinstance(content, list):
+        return ''.join(item.get('text', '') for item in content if isinstance(item, dict))
+    return content or ''
+
+
+def inline_local_media(messages: List[Dict[str, Any]], model: str = None) -> List[Dict[str, Any]]:
+    """把消息中file://开头的本地图片按模型缩放重编码后转成base64 data URL；SDK会自动上传本地文件，REST接口需要调用方处理"""
+    from app.services.image_payload import get_image_payload_optimizer
+    optimizer = get_image_payload_optimizer()
+
+    converted = []
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, list):
+            converted.append(message)
+            continue
+        items = []
+        for item in content:
+            image = item.get('image') if isinstance(item, dict) else None
+            if isinstance(image, str) and image.startswith('file://'):
+                item = {**item, 'image': optimizer.data_url(image, model)}
+            items.append(item)
+        converted.append({**message, 'content': items})
+    return converted
+
+
+class DashScopeClient:
+    """共享连接池的DashScope客户端，线程安全"""
+
+    MULTIMODAL_PATH = "/services/aigc/multimodal-generation/generation"
+    TEXT_PATH = "/services/aigc/text-generation/generation"
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        client_config = dict(get_config().get_dashscope_client_config())
+        if config:
+            client_config.update(config)
+
+        self.base_url = client_config.get("base_url", "https://dashscope.aliyuncs.com/api/v1").rstrip('/')
+        self.pool_size = client_config.get("pool_size", 32)
+        self.pool_size_per_host = client_config.get("pool_size_per_host", 16)
+        self.keepalive_timeout = client_config.get("keepalive_timeout", 60)
+        self.connect_timeout = client_config.get("connect_timeout", 10)
+        self.request_timeout = client_config.get("request_timeout", 120)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+        logger.info(f"[DashScope客户端] 初始化完成，连接池: {self.pool_size}, 默认超时: {self.request_timeout}秒")
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # 连接池绑定在后台线程的事件循环上，调用方的事件循环只等待结果
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="dashscope-client", daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout)
+            )
+        return self._session
+
+    def _payload(self, path: str, model: str, messages: List[Dict[str, Any]], parameters: Dict[str, Any] = None) -> Dict[str, Any]:
+        # 统一使用SSE增量输出：全模态模型只支持流式调用，非流式调用方在客户端拼接
+        params = {'incremental_output': True}
+        if path == self.TEXT_PATH:
+            params['result_format'] = 'message'
+        params.update(parameters or {})
+        return {'model': model, 'input': {'messages': messages}, 'parameters': params}
+
+    async def _pump(self, path: str, payload: Dict[str, Any], api_key: str, timeout: float,
+                    emit: Callable[[Dict[str, Any]], None]):
+        # 在后台事件循环中执行：发出请求并把每个增量块交给emit
+        headers = {
+            'Authorization': f"Bearer {api_key}",
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'X-DashScope-SSE': 'enable'
+        }
+        session = await self._get_session()
+
+        async def run():
+            async with session.post(f"{self.base_url}{path}", json=payload, headers=headers) as response:
+                if response.status != 200:
+                    try:
+                        body = json.loads(await response.text())
+                    except ValueError:
+                        body = {}
+                    raise _error_from_response(response.status, body)
+
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8', errors='ignore').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    try:
+                        chunk = json.loads(line[5:])
+                    except ValueError:
+                        raise DashScopeResponseError(f"无法解析的响应块: {line[:200]}")
+                    if chunk.get('code') and not chunk.get('output'):
+                        raise _error_from_response(int(chunk.get('status_code') or 500), chunk)
+                    choices = (chunk.get('output') or {}).get('choices') or [{}]
+                    # 中间块的finish_reason是字符串"null"
+                    finish_reason = choices[0].get('finish_reason') or (chunk.get('output') or {}).get('finish_reason')
+                    emit({
+                        'text': _chunk_text(chunk),
+                        'finish_reason': finish_reason if finish_reason != 'null' else None,
+                        'usage': chunk.get('usage'),
+                        'request_id': chunk.get('request_id')
+                    })
+
+        deadline = timeout or self.request_timeout
+        try:
+            await asyncio.wait_for(run(), timeout=deadline)
+        except asyncio.TimeoutError:
+            raise DashScopeTimeoutError(f"DashScope调用超时({deadline}秒)")
+        except aiohttp.ClientError as e:
+            raise DashScopeConnectionError(f"DashScope连接失败: {type(e).__name__}: {e}")
+
+    async def _collect(self, path: str, payload: Dict[str, Any], api_key: str, timeout: float) -> Dict[str, Any]:
+        chunks: List[Dict[str, Any]] = []
+        await self._pump(path, payload, api_key, timeout, chunks.append)
+        if not chunks:
+            raise DashScopeResponseError("DashScope响应为空")
+        return {
+            'text': ''.join(c['text'] for c in chunks),
+            'finish_reason': next((c['finish_reason'] for c in reversed(chunks) if c['finish_reason']), None),
+            'usage': next((c['usage'] for c in reversed(chunks) if c['usage']), None),
+            'request_id': chunks[-1]['request_id']
+        }
+
+    async def call(self, model: str, messages: List[Dict[str, Any]], api_key: str, parameters: Dict[str, Any] = None,
+                   timeout: float = None, path: str = None) -> Dict[str, Any]:
+        """异步调用，返回完整文本；调用方协程被取消时请求同时取消"""
+        path = path or self.MULTIMODAL_PATH
+        future = asyncio.run_coroutine_threadsafe(
+            self._collect(path, self._payload(path, model, messages, parameters), api_key, timeout),
+            self._ensure_loop()
+        )
+        return await asyncio.wrap_future(future)
+
+    def call_sync(self, model: str, messages: List[Dict[str, Any]], api_key: str, parameters: Dict[str, Any] = None,
+                  timeout: float = None, path: str = None) -> Dict[str, Any]:
+        """同步调用，供旧的同步代码使用，与异步调用共用连接池"""
+        path = path or self.MULTIMODAL_PATH
+        future = asyncio.run_coroutine_threadsafe(
+            self._collect(path, self._payload(path, model, messages, parameters), api_key, timeout),
+            self._ensure_loop()
+        )
+        return future.result()
+
+    async def stream(self, model: str, messages: List[Dict[str, Any]], api_key: str, parameters: Dict[str, Any] = None,
+                     timeout: float = None, path: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """异步流式调用，逐块返回增量文本"""
+        path = path or self.MULTIMODAL_PATH
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def put(item):
+            # 调用方的事件循环可能已经关闭
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass
+
+        async def pump():
+            try:
+                await self._pump(path, self._payload(path, model, messages, parameters), api_key, timeout, put)
+                put(done)
+            except BaseException as e:
+                put(e)
+                raise
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # 调用方提前结束迭代或被取消时中断请求
+            future.cancel()
+
+
+_dashscope_client = None
+_dashscope_client_lock = threading.Lock()
+
+
+def get_dashscope_client() -> DashScopeClient:
+    """获取全局DashScope客户端实例"""
+    global _dashscope_client
+    if _dashscope_client is None:
+        with _dashscope_client_lock:
+            if _dashscope_client is None:
+                _dashscope_client = DashScopeClient()
+    return _dashscope_client
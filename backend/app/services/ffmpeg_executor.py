@@ -0,0 +1,343 @@
+# FFmpeg任务执行器
+# 进程内所有FFmpeg/FFprobe调用共用的有界执行器：按CPU核数限制并发，预览类任务优先于批量编码，
+# 支持单任务超时、取消，并解析 -progress pipe:1 输出的实时进度；解码到管道的任务可在名额内把stdout交给调用方流式读取
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future
+from queue import PriorityQueue
+from typing import Dict, Any, List, Optional, Callable, Iterator, BinaryIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class FFmpegJob:
+    """一次FFmpeg调用"""
+
+    def __init__(self, cmd: List[str], priority: int, timeout: Optional[float], capture_output: bool,
+                 on_progress: Optional[Callable[[Dict[str, Any]], None]], label: str, stream: bool = False):
+        self.cmd = cmd
+        self.priority = priority
+        self.timeout = timeout
+        self.capture_output = capture_output
+        self.on_progress = on_progress
+        self.label = label
+        # stream为True时进程启动后通过stdout_ready把stdout交给调用方读取，执行器只等待进程结束
+        self.stream = stream
+        self.stdout_ready: Future = Future()
+        self.future: Future = Future()
+        self.progress: Dict[str, Any] = {}
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self._process: Optional[subprocess.Popen] = None
+        self._cancelled = False
+        self._timed_out = False
+        self._lock = threading.Lock()
+
+    def cancel(self) -> bool:
+        """取消任务：排队中直接丢弃，运行中结束ffmpeg进程"""
+        with self._lock:
+            self._cancelled = True
+            process = self._process
+        if process is None:
+            return self.future.cancel()
+        if process.poll() is None:
+            process.kill()
+        return True
+
+    def _kill_on_timeout(self):
+        with self._lock:
+            self._timed_out = True
+            process = self._process
+        if process is not None and process.poll() is None:
+            logger.warning(f"[FFmpeg执行器] 任务超时({self.timeout}秒)，结束进程: {self.label}")
+            process.kill()
+
+
+class FFmpegExecutor:
+    """有界优先级FFmpeg执行器，线程安全，可被多个事件循环和线程共用"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        executor_config = dict(get_config().get_ffmpeg_executor_config())
+        if config:
+            executor_config.update(config)
+
+        cpu_count = os.cpu_count() or 2
+        # 默认并发：每个编码任务大约占用4个核心，至少保留2个并发给预览类小任务
+        self.max_concurrency = executor_config.get("max_concurrency") or max(2, cpu_count // 4)
+        # 限制每个任务的编码线程，避免并发任务各自按全部核心开线程互相抢占
+        self.threads_per_job = executor_config.get("threads_per_job") or max(1, cpu_count // self.max_concurrency)
+        self.default_timeout = executor_config.get("default_timeout", 600)
+
+        self._queue: PriorityQueue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self._active = 0
+        self._stats_lock = threading.Lock()
+        for i in range(self.max_concurrency):
+            worker = threading.Thread(target=self._worker_loop, name=f"ffmpeg-executor-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"[FFmpeg执行器] 并发上限: {self.max_concurrency}, 每任务线程数: {self.threads_per_job}")
+
+    def _prepare_command(self, job: FFmpegJob) -> List[str]:
+        cmd = list(job.cmd)
+        if os.path.splitext(os.path.basename(cmd[0]))[0].lower() != 'ffmpeg':
+            return cmd
+        # 进度输出写到stdout；需要捕获stdout的命令不加进度参数
+        if not job.capture_output and not job.stream and '-progress' not in cmd:
+            cmd[1:1] = ['-progress', 'pipe:1', '-nostats']
+        # -threads作为输出选项放在输出文件之前
+        if '-threads' not in cmd and len(cmd) > 2:
+            cmd[-1:-1] = ['-threads', str(self.threads_per_job)]
+        return cmd
+
+    def submit(self, cmd: List[str], priority: int = PRIORITY_BATCH, timeout: float = None, capture_output: bool = False,
+               on_progress: Callable[[Dict[str, Any]], None] = None, label: str = None, stream: bool = False) -> FFmpegJob:
+        """提交任务，立即返回FFmpegJob，通过job.future获取结果"""
+        job = FFmpegJob(
+            cmd,
+            priority,
+            timeout if timeout is not None else self.default_timeout,
+            capture_output,
+            on_progress,
+            label or (os.path.basename(cmd[-1]) if cmd else 'ffmpeg'),
+            stream
+        )
+        self._queue.put((priority, next(self._sequence), job))
+        return job
+
+    def run(self, cmd: List[str], **kwargs) -> Dict[str, Any]:
+        """同步执行，阻塞直到任务结束"""
+        return self.submit(cmd, **kwargs).future.result()
+
+    async def run_async(self, cmd: List[str], **kwargs) -> Dict[str, Any]:
+        """在事件循环中等待任务结束，协程被取消时同时取消ffmpeg任务"""
+        job = self.submit(cmd, **kwargs)
+        try:
+            return await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    @contextmanager
+    def open_stdout(self, cmd: List[str], priority: int = PRIORITY_BATCH, timeout: float = None,
+                    label: str = None) -> Iterator[BinaryIO]:
+        """
+        在执行器名额内启动ffmpeg，把stdout管道交给调用方读取，读取期间一直占用名额
+
+        调用方正常退出时应已读到EOF，此时进程失败(非零退出、超时)抛出RuntimeError；
+        提前退出(异常或生成器关闭)时结束进程，不再检查结果
+        """
+        job = self.submit(cmd, priority=priority, timeout=timeout, label=label, stream=True)
+        try:
+            stdout = job.stdout_ready.result()
+        except BaseException:
+            job.cancel()
+            raise
+
+        completed = False
+        try:
+            yield stdout
+            completed = True
+        finally:
+            if not completed:
+                job.cancel()
+            result = job.future.result()
+        if not result['success']:
+            reason = f"超时({job.timeout}秒)" if result['timed_out'] else f"返回码 {result['returncode']}"
+            raise RuntimeError(f"FFmpeg执行失败({reason}): {job.label}: {result['stderr'][-500:]}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            active = self._active
+        return {
+            'max_concurrency': self.max_concurrency,
+            'threads_per_job': self.threads_per_job,
+            'active': active,
+            'queued': self._queue.qsize()
+        }
+
+    def _worker_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job.future.cancelled() or not job.future.set_running_or_notify_cancel():
+                self._release_stream(job)
+                continue
+            with self._stats_lock:
+                self._active += 1
+            try:
+                job.future.set_result(self._execute(job))
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                self._release_stream(job)
+                with self._stats_lock:
+                    self._active -= 1
+
+    @staticmethod
+    def _release_stream(job: FFmpegJob):
+        # 流式任务未能启动进程时通知等待stdout的调用方，避免一直阻塞
+        if job.stream and not job.stdout_ready.done():
+            job.stdout_ready.set_exception(RuntimeError(f"FFmpeg任务未启动: {job.label}"))
+
+    def _execute(self, job: FFmpegJob) -> Dict[str, Any]:
+        cmd = self._prepare_command(job)
+        job.started_at = time.monotonic()
+        stderr_tail = deque(maxlen=50)
+
+        with job._lock:
+            if job._cancelled:
+                return self._result(job, -1, None, '', cancelled=True)
+            job._process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL
+            )
+        process = job._process
+        if job.stream:
+            job.stdout_ready.set_result(process.stdout)
+
+        # stderr单独线程读取，避免管道写满阻塞ffmpeg
+        def drain_stderr():
+            for line in iter(process.stderr.readline, b''):
+                stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+
+        stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+        stderr_thread.start()
+
+        timer = None
+        if job.timeout:
+            timer = threading.Timer(job.timeout, job._kill_on_timeout)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            if job.stream:
+                # stdout由调用方读取
+                stdout = None
+            elif job.capture_output:
+                stdout = process.stdout.read()
+            else:
+                stdout = None
+                self._read_progress(job, process)
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            stderr_thread.join(timeout=5)
+
+        returncode = process.returncode
+        if returncode != 0 and not job._cancelled:
+            logger.error(f"FFmpeg命令失败: {' '.join(cmd)}")
+            logger.error(f"错误输出: {chr(10).join(list(stderr_tail)[-10:])}")
+
+        return self._result(
+            job, returncode,
+            stdout.decode('utf-8', errors='ignore') if stdout is not None else None,
+            '\n'.join(stderr_tail),
+            cancelled=job._cancelled,
+            timed_out=job._timed_out
+        )
+
+    def _read_progress(self, job: FFmpegJob, process: subprocess.Popen):
+        # -progress 输出若干 key=value 行，以 progress=continue/end 结束一组
+        block = {}
+        for raw_line in iter(process.stdout.readline, b''):
+            line = raw_line.decode('utf-8', errors='ignore').strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            block[key] = value
+            if key != 'progress':
+                continue
+
+            out_time_us = block.get('out_time_us') or block.get('out_time_ms')
+            progress = {
+                'frame': int(block['frame']) if block.get('frame', '').isdigit() else None,
+                'fps': block.get('fps'),
+                'speed': block.get('speed'),
+                'out_time_seconds': int(out_time_us) / 1_000_000 if out_time_us and out_time_us.lstrip('-').isdigit() else None,
+                'status': value
+            }
+            job.progress = progress
+            if job.on_progress:
+                try:
+                    job.on_progress(progress)
+                except Exception as e:
+                    logger.debug(f"[FFmpeg执行器] 进度回调失败: {e}")
+            block = {}
+
+    @staticmethod
+    def _result(job: FFmpegJob, returncode: int, stdout: Optional[str], stderr: str,
+                cancelled: bool = False, timed_out: bool = False) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'success': returncode == 0 and not cancelled and not timed_out,
+            'returncode': returncode,
+            'stdout': stdout,
+            'stderr': stderr,
+            'cancelled': cancelled,
+            'timed_out': timed_out,
+            'queue_seconds': (job.started_at or now) - job.submitted_at,
+            'run_seconds': now - (job.started_at or now)
+        }
+
+
+def read_rawvideo_batches(cmd: List[str], width: int, height: int, batch_size: int, priority: int = PRIORITY_BATCH,
+                          timeout: float = None, label: str = None) -> Iterator[np.ndarray]:
+    """
+    经过执行器运行输出bgr24 rawvideo到pipe:1的ffmpeg命令，按批把帧读成NumPy数组，不写临时文件
+
+    每批读入同一块预分配缓冲区并返回其视图，调用方需要保留帧时自行复制；ffmpeg失败或超时时抛出RuntimeError
+    """
+    frame_size = width * height * 3
+    buffer = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+    raw = memoryview(buffer.reshape(-1))
+    target = batch_size * frame_size
+
+    with get_ffmpeg_executor().open_stdout(cmd, priority=priority, timeout=timeout, label=label) as stdout:
+        while True:
+            filled = 0
+            while filled < target:
+                count = stdout.readinto(raw[filled:target])
+                if not count:
+                    break
+                filled += count
+            frames = filled // frame_size
+            if frames:
+                yield buffer[:frames]
+            if filled < target:
+                break
+
+
+_ffmpeg_executor = None
+_ffmpeg_executor_lock = threading.Lock()
+
+
+def get_ffmpeg_executor() -> FFmpegExecutor:
+    """获取全局FFmpeg执行器实例"""
+    global _ffmpeg_executor
+    if _ffmpeg_executor is None:
+        with _ffmpeg_executor_lock:
+            if _ffmpeg_executor is None:
+                _ffmpeg_executor = FFmpegExecutor()
+    return _ffmpeg_executor
@@ -3,10 +3,17 @@
 import os
 import subprocess
 import asyncio
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Callable
 import logging
+import shutil
 import uuid
 
+from app.services.tracing import span
+from app.services.progress_events import emit_progress
+from app.services.ffmpeg_executor import get_ffmpeg_executor, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from app.services.media_probe import get_media_probe, summarize_video_info
+from app.services.analysis_proxy import get_analysis_proxy_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -42,6 +49,28 @@ class FFmpegService:
         self.video_quality = ffmpeg_config.get("video_quality", "high")
         self.audio_quality = ffmpeg_config.get("audio_quality", "high")
         self.timeout = ffmpeg_config.get("timeout", 600)
+        # 切片方式：segment 单次调用分段复用器，legacy 逐片切片
+        self.slice_mode = ffmpeg_config.get("slice_mode", "segment")
+        self.slice_stream_copy = ffmpeg_config.get("slice_stream_copy", True)
+        self.slice_keyframe_tolerance = ffmpeg_config.get("slice_keyframe_tolerance", 0.5)
+        # 切片帧提取：single_pass 对源视频解码一次提取全部切片的帧，per_slice 逐片提取
+        self.frame_sampling = ffmpeg_config.get("frame_sampling", "single_pass")
+        # 切片边界：fixed 固定时长，shots 按镜头切换点
+        self.slice_strategy = ffmpeg_config.get("slice_strategy", "fixed")
+        self.shot_max_slice_duration = ffmpeg_config.get("shot_max_slice_duration", 15)
+        self.keyframes_per_slice = ffmpeg_config.get("keyframes_per_slice", 3)
+        
+        # 最终渲染：流参数一致时流复制拼接，否则单次滤镜图编码
+        render_config = self.system_config.get_render_config()
+        self.render_fit_mode = render_config.get("fit_mode", "pad")
+        self.render_max_stretch_ratio = render_config.get("max_stretch_ratio", 1.25)
+        self.render_duration_tolerance = render_config.get("duration_tolerance", 0.1)
+        self.render_preset = render_config.get("preset", "veryfast")
+        self.render_crf = render_config.get("crf", 20)
+        self.render_audio_bitrate = render_config.get("audio_bitrate", "192k")
+        self.render_width = render_config.get("width", 0)
+        self.render_height = render_config.get("height", 0)
+        self.render_fps = render_config.get("fps", 0)
         
         logger.info(f"FFmpeg路径: {self.ffmpeg_path}")
         logger.info(f"FFprobe路径: {self.ffprobe_path}")
@@ -117,7 +146,28 @@ class FFmpegService:
             logger.error(f"查找FFprobe失败: {str(e)}")
             return None
     
-    async def slice_video(self, video_path: str, slice_duration: int = None, slice_limit: int = 0) -> Dict[str, Any]:
+    def slicing_params(self, use_proxy: bool = True) -> Dict[str, Any]:
+        """影响切片边界、切片内容和切片帧的参数，供依赖切片分析结果的缓存计算键"""
+        params = {
+            'default_slice_duration': self.default_slice_duration,
+            'slice_mode': self.slice_mode,
+            'slice_stream_copy': self.slice_stream_copy,
+            'slice_keyframe_tolerance': self.slice_keyframe_tolerance,
+            'slice_strategy': self.slice_strategy,
+            'frame_sampling': self.frame_sampling,
+            'keyframes_per_slice': self.keyframes_per_slice,
+            'analysis_proxy': get_analysis_proxy_cache().params() if use_proxy else {'enabled': False}
+        }
+        if self.slice_strategy == "shots":
+            params['shot_max_slice_duration'] = self.shot_max_slice_duration
+            params['shot_detection'] = self.system_config.get_shot_detection_config()
+        return params
+    
+    async def get_analysis_proxy(self, video_path: str) -> str:
+        """获取源视频的低分辨率分析代理，代理不可用时返回原视频路径"""
+        return await get_analysis_proxy_cache().get_async(video_path)
+    
+    async def slice_video(self, video_path: str, slice_duration: int = None, slice_limit: int = 0, use_proxy: bool = True) -> Dict[str, Any]:
         #将视频切片为指定时长的片段
         
         
@@ -127,6 +177,11 @@ class FFmpegService:
                 slice_duration = self.default_slice_duration
             logger.info(f"开始切片视频: {video_path}, 切片时长: {slice_duration}秒, 切片限制: {slice_limit}")
             
+            # 探测、镜头检测和切片读取分析代理，输出目录仍在原视频旁边
+            source_path = video_path
+            if use_proxy:
+                video_path = await self.get_analysis_proxy(source_path)
+            
             # 获取视频信息
             video_info = await self._get_video_info(video_path)
             if not video_info:
@@ -139,78 +194,48 @@ class FFmpegService:
                 return None
             
             # 创建输出目录
-            output_dir = os.path.join(os.path.dirname(video_path), f"slices_{uuid.uuid4().hex[:8]}")
+            output_dir = os.path.join(os.path.dirname(source_path), f"slices_{uuid.uuid4().hex[:8]}")
             os.makedirs(output_dir, exist_ok=True)
             
-            # 计算切片数量
-            slice_count = max(1, int(total_duration / slice_duration) + 1)
+            # 计算切片起点：按镜头切换点或固定时长
+            boundaries = None
+            if self.slice_strategy == "shots":
+                boundaries = await self._shot_boundaries(video_path, total_duration)
+            if boundaries is None:
+                boundaries = [i * slice_duration for i in range(max(1, int(total_duration / slice_duration) + 1))
+                              if i * slice_duration < total_duration] + [total_duration]
+            starts = boundaries[:-1]
             
             # 应用切片限制
-            if slice_limit > 0:
-                slice_count = min(slice_count, slice_limit)
-                logger.info(f"应用切片限制，只生成 {slice_count} 个切片")
+            if slice_limit > 0 and len(starts) > slice_limit:
+                starts = starts[:slice_limit]
+                logger.info(f"应用切片限制，只生成 {len(starts)} 个切片")
+            end_time = boundaries[len(starts)]
             
+            # 分段复用器一次调用生成全部切片；失败时回退到逐片切片
             slices = []
-            
-            for i in range(slice_count):
-                start_time = i * slice_duration
-                if start_time >= total_duration:
-                    break
-                
-                # 生成切片文件名
-                slice_filename = f"slice_{i:03d}.mp4"
-                slice_path = os.path.join(output_dir, slice_filename)
-                
-                # 构建优化的FFmpeg命令，使用更兼容的CPU编码
-                cmd = [
-                    self.ffmpeg_path,
-                    '-i', video_path,
-                    '-ss', str(start_time),
-                    '-t', str(slice_duration),
-                    '-c:v', 'libx264',  # 使用CPU编码，提高兼容性
-                    '-preset', 'fast',  # 更快的编码速度
-                    '-crf', '28',  # 更低的视频质量，加快生成速度
-                    '-g', '60',  # 减少关键帧数量
-                    '-c:a', 'aac',
-                    '-b:a', '64k',  # 降低音频比特率
-                    '-y',
-                    slice_path
-                ]
-                
-                # 执行FFmpeg命令
-                await self._run_ffmpeg_command(cmd)
-                
-                # 检查切片是否生成成功
-                if os.path.exists(slice_path) and os.path.getsize(slice_path) > 0:
-                    # 提取切片的关键帧
-                    preview_path = await self._extract_keyframe(slice_path)
-                    keyframes = await self._extract_keyframes(slice_path, num_keyframes=3)
-                    
-                    slice_info = {
-                        "slice_id": f"slice_{i}",
-                        "input_file": video_path,
-                        "output_file": slice_path,
-                        "preview_file": preview_path,
-                        "keyframes": keyframes,
-                        "start_time": start_time,
-                        "duration": slice_duration,
-                        "index": i
-                    }
-                    slices.append(slice_info)
-                    logger.info(f"切片成功: {slice_path}，提取了 {len(keyframes)} 个关键帧")
-                else:
-                    logger.warning(f"切片失败: {slice_path}")
+            if self.slice_mode == "segment":
+                slices = await self._slice_with_segment_muxer(video_path, output_dir, starts, end_time)
+                if not slices:
+                    logger.warning("分段复用器切片失败，回退到逐片切片")
+            if not slices:
+                slices = await self._slice_per_segment(video_path, output_dir, starts, end_time)
             
             if not slices:
                 logger.error("所有切片都失败了")
                 return None
             
+            # 提取每个切片的预览图和关键帧；关键帧还会作为视频生成的参考图，从原视频提取，保持原始画质
+            await self._attach_slice_frames(source_path, slices, from_slices=source_path == video_path)
+            
             return {
                 "slices": slices,
                 "slice_info": {
                     "total_slices": len(slices),
                     "slice_duration": slice_duration,
-                    "input_video": video_path,
+                    "slice_strategy": self.slice_strategy,
+                    "input_video": source_path,
+                    "analysis_video": video_path,
                     "output_dir": output_dir
                 }
             }
@@ -218,6 +243,305 @@ class FFmpegService:
             logger.error(f"视频切片失败: {str(e)}")
             return None
     
+    async def _shot_boundaries(self, video_path: str, total_duration: float) -> Optional[List[float]]:
+        """按本地镜头检测的切换点计算切片边界，过长的镜头再均分；检测失败返回None"""
+        try:
+            from app.services.shot_detection import ShotDetector
+            
+            detector = ShotDetector(ffmpeg_path=self.ffmpeg_path)
+            cuts = await asyncio.to_thread(detector.detect_cuts, video_path, total_duration)
+        except Exception as e:
+            logger.warning(f"镜头检测失败，按固定时长切片: {str(e)}")
+            return None
+        
+        boundaries = [0.0]
+        for end in cuts + [total_duration]:
+            start = boundaries[-1]
+            pieces = max(1, int(-(-(end - start) // self.shot_max_slice_duration)))
+            boundaries.extend(start + (end - start) * k / pieces for k in range(1, pieces + 1))
+        logger.info(f"按镜头切片: 检测到 {len(cuts) + 1} 个镜头，生成 {len(boundaries) - 1} 个切片")
+        return boundaries
+    
+    async def _slice_per_segment(self, video_path: str, output_dir: str, starts: List[float], end_time: float) -> List[Dict[str, Any]]:
+        # 逐片切片：每个切片单独启动一个ffmpeg进程并重新编码
+        slices = []
+        
+        for i, start_time in enumerate(starts):
+            slice_duration = (starts[i + 1] if i + 1 < len(starts) else end_time) - start_time
+            
+            # 生成切片文件名
+            slice_filename = f"slice_{i:03d}.mp4"
+            slice_path = os.path.join(output_dir, slice_filename)
+            
+            # 构建优化的FFmpeg命令，使用更兼容的CPU编码
+            cmd = [
+                self.ffmpeg_path,
+                '-i', video_path,
+                '-ss', str(start_time),
+                '-t', str(slice_duration),
+                '-c:v', 'libx264',  # 使用CPU编码，提高兼容性
+                '-preset', 'fast',  # 更快的编码速度
+                '-crf', '28',  # 更低的视频质量，加快生成速度
+                '-g', '60',  # 减少关键帧数量
+                '-c:a', 'aac',
+                '-b:a', '64k',  # 降低音频比特率
+                '-y',
+                slice_path
+            ]
+            
+            # 执行FFmpeg命令
+            await self._run_ffmpeg_command(cmd)
+            
+            # 检查切片是否生成成功
+            if os.path.exists(slice_path) and os.path.getsize(slice_path) > 0:
+                slice_info = {
+                    "slice_id": f"slice_{i}",
+                    "input_file": video_path,
+                    "output_file": slice_path,
+                    "preview_file": None,
+                    "keyframes": [],
+                    "start_time": start_time,
+                    "duration": slice_duration,
+                    "index": i
+                }
+                slices.append(slice_info)
+                logger.info(f"切片成功: {slice_path}")
+            else:
+                logger.warning(f"切片失败: {slice_path}")
+        
+        return slices
+    
+    async def _probe_keyframe_times(self, video_path: str, end_time: float) -> List[float]:
+        """读取视频流关键帧时间点，只解析数据包不解码"""
+        cmd = [
+            self.ffprobe_path,
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-read_intervals', f'%+{end_time + 1}',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            video_path
+        ]
+        output = await self._run_ffmpeg_command(cmd, capture_output=True, priority=PRIORITY_INTERACTIVE)
+        if not output:
+            return []
+        
+        keyframe_times = []
+        for line in output.splitlines():
+            parts = line.strip().split(',')
+            if len(parts) >= 2 and 'K' in parts[1] and parts[0] not in ('', 'N/A'):
+                keyframe_times.append(float(parts[0]))
+        return sorted(keyframe_times)
+    
+    def _align_boundaries_to_keyframes(self, keyframe_times: List[float], boundaries: List[float]) -> Optional[List[float]]:
+        """为每个切片边界找到容差内最近的关键帧，任一边界找不到时返回None"""
+        aligned = []
+        for boundary in boundaries:
+            nearest = min(keyframe_times, key=lambda t: abs(t - boundary), default=None)
+            if nearest is None or abs(nearest - boundary) > self.slice_keyframe_tolerance:
+                return None
+            if aligned and nearest <= aligned[-1]:
+                return None
+            aligned.append(nearest)
+        return aligned
+    
+    async def _slice_with_segment_muxer(self, video_path: str, output_dir: str, starts: List[float], end_time: float) -> List[Dict[str, Any]]:
+        # 单次ffmpeg调用切出所有切片：源视频GOP与切片边界对齐时直接流复制，否则整段只编码一次并在边界强制关键帧
+        boundaries = starts[1:]
+        output_pattern = os.path.join(output_dir, 'slice_%03d.mp4')
+        
+        aligned = None
+        if self.slice_stream_copy:
+            keyframe_times = await self._probe_keyframe_times(video_path, end_time)
+            if keyframe_times:
+                # 流复制时输出时间戳从第一个关键帧开始计
+                origin = keyframe_times[0]
+                aligned = self._align_boundaries_to_keyframes([t - origin for t in keyframe_times], boundaries)
+        
+        if aligned is not None:
+            logger.info(f"源视频关键帧与切片边界对齐，使用流复制切片")
+            starts = [0.0] + aligned
+            cmd = [
+                self.ffmpeg_path,
+                '-i', video_path,
+                '-t', str(end_time),
+                '-map', '0:v:0',
+                '-map', '0:a:0?',
+                '-c', 'copy',
+                '-f', 'segment',
+                # 略早于关键帧时间，避免时间戳舍入导致切点跳到下一个关键帧
+                '-segment_times', ','.join(f"{max(t - 0.001, 0):.3f}" for t in aligned),
+                '-reset_timestamps', '1',
+                '-y',
+                output_pattern
+            ]
+        else:
+            logger.info(f"源视频关键帧无法对齐切片边界，单次重新编码并在边界强制关键帧")
+            starts = [0.0] + boundaries
+            cmd = [
+                self.ffmpeg_path,
+                '-i', video_path,
+                '-t', str(end_time),
+                '-map', '0:v:0',
+                '-map', '0:a:0?',
+                '-c:v', 'libx264',
+                '-preset', 'fast',
+                '-crf', '28',
+                '-force_key_frames', ','.join(f"{t:.3f}" for t in boundaries) or '0',
+                '-c:a', 'aac',
+                '-b:a', '64k',
+                '-f', 'segment',
+                '-segment_times', ','.join(f"{t:.3f}" for t in boundaries) or str(end_time),
+                '-reset_timestamps', '1',
+                '-y',
+                output_pattern
+            ]
+        
+        if not await self._run_ffmpeg_command(cmd, on_progress=self._progress_reporter('视频切片', end_time)):
+            return []
+        
+        slice_paths = sorted(
+            os.path.join(output_dir, name) for name in os.listdir(output_dir)
+            if name.startswith('slice_') and name.endswith('.mp4')
+        )
+        if len(slice_paths) != len(starts):
+            logger.warning(f"分段复用器生成 {len(slice_paths)} 个切片，预期 {len(starts)} 个")
+        
+        slices = []
+        for i, slice_path in enumerate(slice_paths[:len(starts)]):
+            if os.path.getsize(slice_path) == 0:
+                logger.warning(f"切片失败: {slice_path}")
+                continue
+            start_time = starts[i]
+            end = starts[i + 1] if i + 1 < len(starts) else end_time
+            
+            slices.append({
+                "slice_id": f"slice_{i}",
+                "input_file": video_path,
+                "output_file": slice_path,
+                "preview_file": None,
+                "keyframes": [],
+                "start_time": start_time,
+                "duration": end - start_time,
+                "index": i
+            })
+            logger.info(f"切片成功: {slice_path}")
+        
+        return slices
+    
+    def _slice_frame_targets(self, slice_info: Dict[str, Any]) -> Dict[str, float]:
+        # 预览图取切片中点，关键帧在切片内均匀分布（避开首尾）
+        start = slice_info['start_time']
+        duration = slice_info['duration']
+        targets = {'preview': start + duration / 2}
+        for k in range(self.keyframes_per_slice):
+            targets[f'keyframe_{k + 1}'] = start + (k + 1) * duration / (self.keyframes_per_slice + 1)
+        return targets
+    
+    def _slice_frame_path(self, slice_info: Dict[str, Any], role: str) -> str:
+        # 与逐片提取保持相同的目录结构：切片旁的 keyframes_<切片名>/
+        base_name = os.path.splitext(os.path.basename(slice_info['output_file']))[0]
+        keyframes_dir = os.path.join(os.path.dirname(slice_info['output_file']), f"keyframes_{base_name}")
+        return os.path.join(keyframes_dir, f"{role}.jpg")
+    
+    async def _sample_frames_single_pass(self, video_path: str, slices: List[Dict[str, Any]]) -> bool:
+        """对源视频只解码一次，按时间点一次性输出所有切片的预览图和关键帧"""
+        # 多个角色落在同一时间点时只取一帧，之后复制
+        wanted = []
+        for slice_info in slices:
+            for role, timestamp in self._slice_frame_targets(slice_info).items():
+                wanted.append((round(timestamp, 3), slice_info, role))
+        timestamps = sorted({t for t, _, _ in wanted})
+        if not timestamps:
+            return False
+        
+        # 每个时间点选中时间戳首次越过它的那一帧：t >= T 且上一帧 < T
+        select_expr = '+'.join(f"gte(t,{t})*lt(prev_pts*TB,{t})" for t in timestamps)
+        frames_dir = os.path.join(os.path.dirname(slices[0]['output_file']), f"frames_{uuid.uuid4().hex[:8]}")
+        os.makedirs(frames_dir, exist_ok=True)
+        
+        cmd = [
+            self.ffmpeg_path,
+            '-t', str(timestamps[-1] + 1),
+            '-i', video_path,
+            '-an', '-sn',
+            '-vf', f"setpts=PTS-STARTPTS,select='{select_expr}'",
+            '-vsync', '0',
+            '-q:v', '2',
+            '-y',
+            os.path.join(frames_dir, 'frame_%05d.jpg')
+        ]
+        
+        try:
+            if not await self._run_ffmpeg_command(cmd, priority=PRIORITY_INTERACTIVE):
+                return False
+            
+            frame_files = sorted(name for name in os.listdir(frames_dir) if name.endswith('.jpg'))
+            if len(frame_files) != len(timestamps):
+                # 帧率过低时两个时间点可能落在同一帧间隔内，无法一一对应
+                logger.warning(f"单次解码得到 {len(frame_files)} 帧，预期 {len(timestamps)} 帧，回退到逐片提取")
+                return False
+            
+            frame_by_time = {t: os.path.join(frames_dir, name) for t, name in zip(timestamps, frame_files)}
+            for timestamp, slice_info, role in wanted:
+                target_path = self._slice_frame_path(slice_info, role)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copyfile(frame_by_time[timestamp], target_path)
+                if role == 'preview':
+                    slice_info['preview_file'] = target_path
+                else:
+                    slice_info['keyframes'].append(target_path)
+            return True
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+    
+    async def _seek_slice_frames(self, video_path: str, slice_info: Dict[str, Any]):
+        # 按切片的时间点逐帧定位提取，切片文件来自分析代理时用于回退，帧仍取自原视频
+        slice_info['preview_file'] = None
+        slice_info['keyframes'] = []
+        for role, timestamp in self._slice_frame_targets(slice_info).items():
+            target_path = self._slice_frame_path(slice_info, role)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            cmd = [
+                self.ffmpeg_path,
+                '-ss', f"{timestamp:.3f}",
+                '-i', video_path,
+                '-frames:v', '1',
+                '-q:v', '2',
+                '-y',
+                target_path
+            ]
+            await self._run_ffmpeg_command(cmd, priority=PRIORITY_INTERACTIVE)
+            if not (os.path.exists(target_path) and os.path.getsize(target_path) > 0):
+                logger.warning(f"关键帧提取失败: {target_path}")
+                continue
+            if role == 'preview':
+                slice_info['preview_file'] = target_path
+            else:
+                slice_info['keyframes'].append(target_path)
+    
+    async def _attach_slice_frames(self, video_path: str, slices: List[Dict[str, Any]], from_slices: bool = True):
+        # 优先单次解码提取全部切片的帧，失败时逐片提取；from_slices为False时切片文件不是从video_path切出的，回退时按时间点从video_path提取
+        if self.frame_sampling == "single_pass":
+            for slice_info in slices:
+                slice_info['preview_file'] = None
+                slice_info['keyframes'] = []
+            if await self._sample_frames_single_pass(video_path, slices):
+                logger.info(f"单次解码完成 {len(slices)} 个切片的预览图和关键帧提取")
+                return
+        
+        if not from_slices:
+            for slice_info in slices:
+                await self._seek_slice_frames(video_path, slice_info)
+                logger.info(f"切片 {slice_info['output_file']} 从原视频提取了 {len(slice_info['keyframes'])} 个关键帧")
+            return
+        
+        for slice_info in slices:
+            slice_path = slice_info['output_file']
+            slice_info['preview_file'] = await self._extract_keyframe(slice_path)
+            slice_info['keyframes'] = await self._extract_keyframes(slice_path, num_keyframes=self.keyframes_per_slice)
+            logger.info(f"切片 {slice_path} 提取了 {len(slice_info['keyframes'])} 个关键帧")
+    
     async def extract_audio(self, video_path: str) -> Dict[str, Any]:
         """从视频中提取音频"""
         try:
@@ -262,75 +586,267 @@ class FFmpegService:
                 logger.error("没有视频片段可以合成")
                 return None
             
-            # 创建临时目录
-            temp_dir = os.path.join(os.path.dirname(video_segments[0]['output_file']), f"temp_{uuid.uuid4().hex[:8]}")
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # 1. 生成视频片段列表文件
-            segment_list_path = os.path.join(temp_dir, "segments.txt")
-            with open(segment_list_path, 'w') as f:
-                for segment in video_segments:
-                    f.write(f"file '{segment['output_file']}'\n")
-            
-            # 2. 生成最终视频文件名
             output_video_path = os.path.join(
                 os.path.dirname(video_segments[0]['output_file']),
                 f"final_{uuid.uuid4().hex[:8]}.mp4"
             )
             
-            # 3. 构建FFmpeg命令
-            cmd = [
-                self.ffmpeg_path,
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', segment_list_path,
-                '-c', 'copy',
-                '-y',
-                output_video_path
-            ]
-            
-            # 执行FFmpeg命令合并视频片段
-            await self._run_ffmpeg_command(cmd)
-            
-            # 4. 如果有音频，合并音频到视频
-            if audio_path and os.path.exists(audio_path):
-                final_with_audio_path = os.path.join(
-                    os.path.dirname(video_segments[0]['output_file']),
-                    f"final_with_audio_{uuid.uuid4().hex[:8]}.mp4"
-                )
-                
-                cmd = [
-                    self.ffmpeg_path,
-                    '-i', output_video_path,
-                    '-i', audio_path,
-                    '-c:v', 'copy',
-                    '-c:a', 'aac',
-                    '-strict', 'experimental',
-                    '-shortest',
-                    '-y',
-                    final_with_audio_path
-                ]
-                
-                await self._run_ffmpeg_command(cmd)
-                
-                # 替换原视频文件
-                os.replace(final_with_audio_path, output_video_path)
-                logger.info(f"音频合并成功: {output_video_path}")
-            
-            # 5. 清理临时文件
-            os.remove(segment_list_path)
-            os.rmdir(temp_dir)
+            # 拼接和音频混流在一次渲染中完成
+            result = await self.render_final_video(
+                [segment['output_file'] for segment in video_segments],
+                output_video_path,
+                audio_path if audio_path and os.path.exists(audio_path) else None
+            )
             
-            if os.path.exists(output_video_path) and os.path.getsize(output_video_path) > 0:
+            if result.get('success'):
                 logger.info(f"最终视频合成成功: {output_video_path}")
                 return output_video_path
             else:
-                logger.error(f"最终视频合成失败: {output_video_path}")
+                logger.error(f"最终视频合成失败: {result.get('error')}")
                 return None
         except Exception as e:
             logger.error(f"最终视频合成失败: {str(e)}")
             return None
     
+    async def _probe_render_input(self, media_path: str) -> Optional[Dict[str, Any]]:
+        """读取渲染输入的流参数（使用缓存的探测结果）"""
+        info = await get_media_probe().probe_async(media_path, self.ffprobe_path)
+        if not info:
+            return None
+        
+        video = next((s for s in info.get('streams', []) if s.get('codec_type') == 'video'), None)
+        audio = next((s for s in info.get('streams', []) if s.get('codec_type') == 'audio'), None)
+        summary = summarize_video_info(info)
+        return {
+            'path': media_path,
+            'duration': summary['duration'],
+            'video': {
+                'codec_name': video.get('codec_name'),
+                'profile': video.get('profile'),
+                'width': video.get('width'),
+                'height': video.get('height'),
+                'pix_fmt': video.get('pix_fmt'),
+                'r_frame_rate': video.get('r_frame_rate'),
+                'time_base': video.get('time_base'),
+                'fps': summary['fps']
+            } if video else None,
+            'audio': {
+                'codec_name': audio.get('codec_name'),
+                'sample_rate': audio.get('sample_rate'),
+                'channels': audio.get('channels')
+            } if audio else None
+        }
+    
+    async def plan_render(self, video_paths: List[str], audio_path: str = None) -> Dict[str, Any]:
+        """
+        规划最终渲染：所有片段流参数一致且无需延长画面时直接流复制拼接，
+        否则用一个滤镜图统一分辨率/帧率、拼接、适配配音时长并混流，只编码一次。
+        无法探测视频流的片段不参与渲染，实际使用的片段在返回值的video_paths中
+        """
+        probed = [(path, await self._probe_render_input(path)) for path in video_paths]
+        audio = await self._probe_render_input(audio_path) if audio_path else None
+        
+        skipped = [path for path, s in probed if s is None or s['video'] is None]
+        if skipped:
+            logger.warning(f"[最终渲染] {len(skipped)} 个片段无法探测视频流，已跳过: {skipped}")
+        segments = [s for path, s in probed if s is not None and s['video'] is not None]
+        
+        plan = {
+            'mode': 'filter',
+            'reason': '',
+            'video_paths': [s['path'] for s in segments],
+            'skipped_segments': skipped,
+            'segments': segments,
+            'video_duration': sum(s['duration'] for s in segments),
+            'audio_duration': audio['duration'] if audio else None,
+            'use_segment_audio': False,
+            'stretch': False
+        }
+        if not segments:
+            return plan
+        
+        # 目标时长：stretch模式在允许的变速范围内按配音时长变速；pad模式画面短于配音时定格最后一帧，
+        # 长于配音时保留完整画面，不截断
+        video_duration = plan['video_duration']
+        if audio and self.render_fit_mode == 'stretch' and video_duration > 0 \
+                and 1 / self.render_max_stretch_ratio <= audio['duration'] / video_duration <= self.render_max_stretch_ratio:
+            plan['stretch'] = True
+            plan['target_duration'] = audio['duration']
+        elif audio and self.render_fit_mode != 'none':
+            plan['target_duration'] = max(audio['duration'], video_duration)
+        else:
+            plan['target_duration'] = video_duration
+        
+        plan.update(self._render_target(segments))
+        
+        # 没有配音时保留片段自带的音频：全部片段都有音频时才拼接音轨
+        if not audio_path:
+            plan['use_segment_audio'] = all(s['audio'] for s in segments)
+        
+        video_signatures = {tuple(sorted(s['video'].items())) for s in segments}
+        audio_signatures = {tuple(sorted(s['audio'].items())) if s['audio'] else None for s in segments}
+        shortfall = plan['target_duration'] - plan['video_duration']
+        
+        if len(video_signatures) > 1:
+            plan['reason'] = '片段编码参数不一致'
+        elif not audio_path and len(audio_signatures) > 1:
+            plan['reason'] = '片段音频参数不一致'
+        elif plan['stretch'] and abs(audio['duration'] - video_duration) > self.render_duration_tolerance:
+            plan['reason'] = '需要按配音时长调整画面速度'
+        elif audio and self.render_fit_mode != 'none' and shortfall > self.render_duration_tolerance:
+            plan['reason'] = '画面短于配音，需要延长最后一帧'
+        else:
+            plan['mode'] = 'copy'
+        
+        logger.info(f"[最终渲染] 渲染方式: {plan['mode']}" + (f"，原因: {plan['reason']}" if plan['reason'] else ''))
+        return plan
+    
+    def _render_target(self, segments: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 输出分辨率和帧率取片段中最常见的值，配置中指定时以配置为准
+        def most_common(values, default):
+            values = [v for v in values if v]
+            return max(set(values), key=values.count) if values else default
+        
+        width, height = most_common([(s['video']['width'], s['video']['height']) for s in segments], (1280, 720))
+        fps = most_common([round(s['video']['fps'], 3) for s in segments], 25)
+        return {
+            'width': self.render_width or width,
+            'height': self.render_height or height,
+            'fps': self.render_fps or fps
+        }
+    
+    async def render_final_video(self, video_paths: List[str], output_path: str, audio_path: str = None) -> Dict[str, Any]:
+        """拼接片段、适配配音时长并混流，一次ffmpeg调用生成最终视频"""
+        try:
+            if not video_paths:
+                return {'success': False, 'error': '没有视频片段可以合成'}
+            
+            with span('render.plan', 'ffmpeg', segments=len(video_paths)):
+                plan = await self.plan_render(video_paths, audio_path)
+            # 两种渲染方式都只使用能探测到视频流的片段，保证输入序号和拼接列表一致
+            video_paths = plan['video_paths']
+            if not video_paths:
+                return {'success': False, 'error': f"所有片段都无法探测视频流: {plan['skipped_segments']}"}
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            
+            list_path = None
+            if plan['mode'] == 'copy':
+                list_path = f"{output_path}.{uuid.uuid4().hex[:8]}.txt"
+                with open(list_path, 'w', encoding='utf-8') as f:
+                    for path in video_paths:
+                        f.write(f"file '{os.path.abspath(path)}'\n")
+                cmd = self._build_copy_render_command(list_path, output_path, plan, audio_path)
+            else:
+                cmd = self._build_filter_render_command(video_paths, output_path, plan, audio_path)
+            
+            try:
+                success = await self._run_ffmpeg_command(
+                    cmd, on_progress=self._progress_reporter('最终渲染', plan['target_duration'])
+                )
+                # 流复制失败（如时间基不兼容）时退回到滤镜图重新编码
+                if not success and plan['mode'] == 'copy':
+                    logger.warning("[最终渲染] 流复制拼接失败，改为重新编码")
+                    plan['mode'] = 'filter'
+                    cmd = self._build_filter_render_command(video_paths, output_path, plan, audio_path)
+                    success = await self._run_ffmpeg_command(
+                        cmd, on_progress=self._progress_reporter('最终渲染', plan['target_duration'])
+                    )
+            finally:
+                if list_path and os.path.exists(list_path):
+                    os.remove(list_path)
+            
+            if not success or not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                return {'success': False, 'error': f"最终渲染失败: {output_path}", 'render_mode': plan['mode'],
+                        'skipped_segments': plan['skipped_segments']}
+            
+            return {
+                'success': True,
+                'output_path': output_path,
+                'duration': plan['target_duration'],
+                'file_size': os.path.getsize(output_path),
+                'resolution': f"{plan['width']}x{plan['height']}",
+                'fps': plan['fps'],
+                'render_mode': plan['mode'],
+                'audio_muxed': bool(audio_path),
+                'skipped_segments': plan['skipped_segments']
+            }
+        except Exception as e:
+            logger.error(f"最终渲染失败: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
+    def _build_copy_render_command(self, list_path: str, output_path: str, plan: Dict[str, Any], audio_path: str = None) -> List[str]:
+        # 流复制拼接画面，只对配音做AAC编码
+        cmd = [self.ffmpeg_path, '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            cmd += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy', '-c:a', 'aac', '-b:a', self.render_audio_bitrate]
+            if self.render_fit_mode == 'none':
+                cmd += ['-shortest']
+            else:
+                cmd += ['-t', f"{plan['target_duration']:.3f}"]
+        else:
+            cmd += ['-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy']
+        cmd += ['-movflags', '+faststart', '-y', output_path]
+        return cmd
+    
+    def _build_filter_render_command(self, video_paths: List[str], output_path: str, plan: Dict[str, Any], audio_path: str = None) -> List[str]:
+        # 各片段统一分辨率、帧率和像素格式后拼接，按配音时长延长或变速画面，最后一次编码输出
+        width, height, fps = plan['width'], plan['height'], plan['fps']
+        use_segment_audio = plan['use_segment_audio'] and not audio_path
+        
+        cmd = [self.ffmpeg_path]
+        for path in video_paths:
+            cmd += ['-i', path]
+        if audio_path:
+            cmd += ['-i', audio_path]
+        
+        filters = []
+        concat_inputs = ''
+        for i in range(len(video_paths)):
+            filters.append(
+                f"[{i}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p,setpts=PTS-STARTPTS[v{i}]"
+            )
+            concat_inputs += f"[v{i}]"
+            if use_segment_audio:
+                filters.append(f"[{i}:a:0]aformat=sample_rates=48000:channel_layouts=stereo,asetpts=PTS-STARTPTS[a{i}]")
+                concat_inputs += f"[a{i}]"
+        filters.append(
+            f"{concat_inputs}concat=n={len(video_paths)}:v=1:a={1 if use_segment_audio else 0}[vcat]"
+            + ("[acat]" if use_segment_audio else "")
+        )
+        
+        video_duration = plan['video_duration']
+        target_duration = plan['target_duration']
+        shortfall = target_duration - video_duration
+        if audio_path and plan['stretch']:
+            filters.append(f"[vcat]setpts=PTS*{target_duration / video_duration:.6f},fps={fps}[vout]")
+        elif audio_path and self.render_fit_mode != 'none' and shortfall > 0:
+            filters.append(f"[vcat]tpad=stop_mode=clone:stop_duration={shortfall:.3f}[vout]")
+        else:
+            filters.append("[vcat]null[vout]")
+        
+        cmd += ['-filter_complex', ';'.join(filters), '-map', '[vout]']
+        if audio_path:
+            cmd += ['-map', f"{len(video_paths)}:a:0"]
+        elif use_segment_audio:
+            cmd += ['-map', '[acat]']
+        
+        cmd += [
+            '-c:v', 'libx264',
+            '-preset', self.render_preset,
+            '-crf', str(self.render_crf),
+            '-pix_fmt', 'yuv420p'
+        ]
+        if audio_path or use_segment_audio:
+            cmd += ['-c:a', 'aac', '-b:a', self.render_audio_bitrate]
+        if audio_path and self.render_fit_mode == 'none':
+            cmd += ['-shortest']
+        else:
+            # pad模式的目标时长不短于画面，只限定配音较长时的输出时长，不截断画面
+            cmd += ['-t', f"{target_duration:.3f}"]
+        cmd += ['-movflags', '+faststart', '-y', output_path]
+        return cmd
+    
     async def _extract_keyframes(self, video_path: str, num_keyframes: int = 3) -> List[str]:
         """从视频中提取多个关键帧，优化版"""
         try:
@@ -370,7 +886,7 @@ class FFmpegService:
             ]
             
             # 执行批量提取命令
-            await self._run_ffmpeg_command(cmd)
+            await self._run_ffmpeg_command(cmd, priority=PRIORITY_INTERACTIVE)
             
             # 检查生成的关键帧
             for i in range(num_keyframes):
@@ -391,7 +907,7 @@ class FFmpegService:
                         '-y',
                         keyframe_path
                     ]
-                    await self._run_ffmpeg_command(cmd_single)
+                    await self._run_ffmpeg_command(cmd_single, priority=PRIORITY_INTERACTIVE)
                     
                     if os.path.exists(keyframe_path) and os.path.getsize(keyframe_path) > 0:
                         keyframes.append(keyframe_path)
@@ -410,40 +926,11 @@ class FFmpegService:
     async def _get_video_info(self, video_path: str) -> Dict[str, Any]:
         """获取视频信息"""
         try:
-            # 使用ffprobe获取视频信息
-            ffprobe_cmd = [
-                self.ffprobe_path,
-                '-i', video_path,
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams'
-            ]
-            
-            # 执行ffprobe命令
-            result = await self._run_ffmpeg_command(ffprobe_cmd, capture_output=True)
+            # ffprobe结果按(路径, 大小, 修改时间)缓存，同一文件只探测一次
+            info = await get_media_probe().probe_async(video_path, self.ffprobe_path)
             
-            if result:
-                import json
-                info = json.loads(result)
-                
-                # 提取基本信息
-                duration = float(info['format']['duration'])
-                width = height = 0
-                
-                for stream in info['streams']:
-                    if stream['codec_type'] == 'video':
-                        width = int(stream['width'])
-                        height = int(stream['height'])
-                        break
-                
-                return {
-                    'duration': duration,
-                    'width': width,
-                    'height': height,
-                    'bitrate': info['format'].get('bit_rate', 0),
-                    'format_name': info['format']['format_name']
-                }
+            if info:
+                return summarize_video_info(info)
             # 如果ffprobe失败，尝试使用ffmpeg命令获取基本信息
             logger.warning("ffprobe获取视频信息失败，尝试使用ffmpeg命令获取基本信息")
             return {
@@ -464,48 +951,57 @@ class FFmpegService:
                 'format_name': 'mp4'
             }
     
-    async def _run_ffmpeg_command(self, cmd: List[str], capture_output: bool = False) -> str:
+    async def _run_ffmpeg_command(self, cmd: List[str], capture_output: bool = False, priority: int = PRIORITY_BATCH,
+                                  on_progress: Callable[[Dict[str, Any]], None] = None) -> str:
         """执行FFmpeg命令"""
+        # 每个子进程一个span，参数里记录可执行文件和输出文件，方便在时间线上定位
+        with span(f"ffmpeg.{os.path.basename(cmd[0]) if cmd else 'ffmpeg'}", 'ffmpeg', output=cmd[-1] if cmd else None) as span_args:
+            result = await self._execute_ffmpeg_command(cmd, capture_output, priority, on_progress)
+            span_args['success'] = result is not None
+            return result
+    
+    async def _execute_ffmpeg_command(self, cmd: List[str], capture_output: bool = False, priority: int = PRIORITY_BATCH,
+                                      on_progress: Callable[[Dict[str, Any]], None] = None) -> str:
         try:
             logger.debug(f"执行FFmpeg命令: {' '.join(cmd)}")
             
-            if capture_output:
-                # 捕获输出
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    shell=False
-                )
-                
-                stdout, stderr = await process.communicate()
-                
-                if process.returncode != 0:
-                    logger.error(f"FFmpeg命令失败: {' '.join(cmd)}")
-                    logger.error(f"错误输出: {stderr.decode('utf-8', errors='ignore')}")
-                    return None
-                
-                return stdout.decode('utf-8', errors='ignore')
-            else:
-                # 不捕获输出，直接执行
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.DEVNULL,
-                    stderr=asyncio.subprocess.DEVNULL,
-                    shell=False
-                )
-                
-                await process.wait()
-                
-                if process.returncode != 0:
-                    logger.error(f"FFmpeg命令失败: {' '.join(cmd)}")
-                    return None
-                
-                return "success"
+            # 所有调用经过进程级执行器排队，并发按CPU核数限制，预览类任务优先
+            result = await get_ffmpeg_executor().run_async(
+                cmd,
+                priority=priority,
+                timeout=self.timeout,
+                capture_output=capture_output,
+                on_progress=on_progress
+            )
+            
+            if not result.get('success'):
+                if result.get('timed_out'):
+                    logger.error(f"FFmpeg命令超时: {' '.join(cmd)}")
+                return None
+            
+            return result.get('stdout') if capture_output else "success"
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"执行FFmpeg命令失败: {str(e)}")
             return None
     
+    def _progress_reporter(self, label: str, total_seconds: float) -> Callable[[Dict[str, Any]], None]:
+        # 长时间编码按10%步进上报进度
+        last_reported = [-1]
+        
+        def report(progress: Dict[str, Any]):
+            out_time = progress.get('out_time_seconds')
+            if not out_time or total_seconds <= 0:
+                return
+            percent = min(100, int(out_time / total_seconds * 100))
+            if percent // 10 > last_reported[0]:
+                last_reported[0] = percent // 10
+                logger.info(f"[FFmpeg] {label} 进度: {percent}%")
+                emit_progress('ffmpeg', {'label': label, 'percent': percent, 'speed': progress.get('speed')})
+        
+        return report
+    
     async def resize_video(self, video_path: str, width: int, height: int) -> str:
         """调整视频大小"""
         try:
@@ -562,7 +1058,7 @@ class FFmpegService:
             ]
             
             # 执行FFmpeg命令
-            await self._run_ffmpeg_command(cmd)
+            await self._run_ffmpeg_command(cmd, priority=PRIORITY_INTERACTIVE)
             
             if os.path.exists(thumbnail_path) and os.path.getsize(thumbnail_path) > 0:
                 logger.info(f"视频缩略图生成成功: {thumbnail_path}")
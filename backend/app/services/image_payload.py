@@ -0,0 +1,206 @@
+# 多模态请求图片预处理
+# 发送给视觉模型的本地图片统一缩放到该模型的有效输入分辨率、按调优后的质量重新编码并去掉元数据；
+# 处理结果按源图片内容哈希缓存在磁盘，base64编码缓存在内存，同一帧多次发送只处理一次
+
+import os
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# 超过模型有效分辨率的像素在服务端会被缩小，上传它们只增加传输时间
+_DEFAULT_PROFILES = {
+    "qwen-omni": {"max_side": 1024, "quality": 80},
+    "qwen3-vl": {"max_side": 1280, "quality": 82},
+    "qwen-vl": {"max_side": 1280, "quality": 82},
+    "qwen-image-edit": {"max_side": 1536, "quality": 90},
+    "default": {"max_side": 1280, "quality": 82}
+}
+
+
+class ImagePayloadOptimizer:
+    """按模型缩放、重编码并缓存请求中的图片，线程安全"""
+
+    # 编码方式变化时递增，使旧缓存失效
+    CACHE_VERSION = 1
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        payload_config = dict(get_config().get_image_payload_config())
+        if config:
+            payload_config.update(config)
+
+        self.enabled = payload_config.get("enabled", True)
+        self.format = payload_config.get("format", "jpeg")
+        self.cache_dir = os.path.realpath(payload_config.get("cache_dir", os.path.join(os.getcwd(), "cache", "images")))
+        self.memory_items = payload_config.get("memory_items", 256)
+        self.profiles = {**_DEFAULT_PROFILES, **payload_config.get("profiles", {})}
+
+        self._lock = threading.Lock()
+        self._digests: Dict[Tuple, str] = {}
+        # 处理后文件路径 -> base64 data URL，按最近使用顺序排列
+        self._data_urls: "OrderedDict[str, str]" = OrderedDict()
+        self.original_bytes = 0
+        self.prepared_bytes = 0
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        logger.info(f"[图片预处理] 初始化完成，启用: {self.enabled}, 格式: {self.format}, 缓存目录: {self.cache_dir}")
+
+    def profile(self, model: Optional[str]) -> Dict[str, Any]:
+        """按模型名前缀匹配最长的配置"""
+        if model:
+            matches = [name for name in self.profiles if name != "default" and model.startswith(name)]
+            if matches:
+                return self.profiles[max(matches, key=len)]
+        return self.profiles["default"]
+
+    def _local_path(self, image: str) -> Optional[str]:
+        # 只处理本地文件，远程URL和data URL原样发送
+        if not isinstance(image, str) or image.startswith(('http://', 'https://', 'oss://', 'data:')):
+            return None
+        path = image[len('file://'):] if image.startswith('file://') else image
+        return path if os.path.isfile(path) else None
+
+    def _is_prepared(self, path: str) -> bool:
+        return os.path.realpath(path).startswith(self.cache_dir + os.sep)
+
+    def _content_digest(self, path: str) -> str:
+        stat = os.stat(path)
+        memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            sha256_hash = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256_hash.update(chunk)
+            digest = self._digests[memo_key] = sha256_hash.hexdigest()
+        return digest
+
+    def _encode(self, path: str, output_path: str, max_side: int, quality: int):
+        # cv2读取时应用EXIF方向，编码结果不包含EXIF、ICC等元数据
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"无法读取图片: {path}")
+        height, width = image.shape[:2]
+        scale = max_side / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+        if self.format == "webp":
+            ok, encoded = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        else:
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+        if not ok:
+            raise ValueError(f"图片编码失败: {path}")
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, output_path)
+
+    def prepare(self, image: str, model: str = None) -> str:
+        """返回处理后图片的本地路径；非本地图片、已处理过的图片或处理失败时返回原路径"""
+        path = self._local_path(image)
+        if not self.enabled or path is None or self._is_prepared(path):
+            return path or image
+
+        profile = self.profile(model)
+        try:
+            digest = self._content_digest(path)
+            key = hashlib.sha256(repr((
+                self.CACHE_VERSION, digest, self.format, profile["max_side"], profile["quality"]
+            )).encode('utf-8')).hexdigest()
+            extension = 'webp' if self.format == 'webp' else 'jpg'
+            output_path = os.path.join(self.cache_dir, key[:2], f"{key}.{extension}")
+            if not os.path.exists(output_path):
+                self._encode(path, output_path, profile["max_side"], profile["quality"])
+                original_size, prepared_size = os.path.getsize(path), os.path.getsize(output_path)
+                with self._lock:
+                    self.original_bytes += original_size
+                    self.prepared_bytes += prepared_size
+                logger.debug(f"[图片预处理] {os.path.basename(path)}: {original_size / 1024:.0f}KB -> {prepared_size / 1024:.0f}KB")
+            return output_path
+        except Exception as e:
+            logger.warning(f"[图片预处理] 处理图片失败，发送原图 {path}: {e}")
+            return path
+
+    def file_url(self, image: str, model: str = None) -> str:
+        """DashScope SDK使用的file://地址，SDK会自动上传；非本地图片原样返回"""
+        prepared = self.prepare(image, model)
+        return f"file://{os.path.abspath(prepared)}" if self._local_path(prepared) else prepared
+
+    def data_url(self, image: str, model: str = None) -> str:
+        """REST接口使用的base64 data URL；非本地图片原样返回"""
+        prepared = self.prepare(image, model)
+        if not self._local_path(prepared):
+            return prepared
+        cache_key = os.path.realpath(prepared)
+        with self._lock:
+            cached = self._data_urls.get(cache_key)
+            if cached is not None:
+                self._data_urls.move_to_end(cache_key)
+                return cached
+
+        extension = os.path.splitext(prepared)[1].lower()
+        mime_type = {'.webp': 'image/webp', '.png': 'image/png'}.get(extension, 'image/jpeg')
+        with open(prepared, 'rb') as f:
+            encoded = f"data:{mime_type};base64,{base64.b64encode(f.read()).decode('ascii')}"
+        # 只缓存处理后的小图，原图不占内存
+        if self._is_prepared(prepared):
+            with self._lock:
+                self._data_urls[cache_key] = encoded
+                while len(self._data_urls) > self.memory_items:
+                    self._data_urls.popitem(last=False)
+        return encoded
+
+    def prepare_messages(self, messages: List[Dict[str, Any]], model: str = None, inline: bool = False) -> List[Dict[str, Any]]:
+        """处理DashScope格式({'image': ...})和OpenAI格式({'image_url': {'url': ...}})消息中的图片"""
+        convert = self.data_url if inline else self.file_url
+        prepared_messages = []
+        for message in messages:
+            content = message.get('content')
+            if not isinstance(content, list):
+                prepared_messages.append(message)
+                continue
+            items = []
+            for item in content:
+                if isinstance(item, dict) and isinstance(item.get('image'), str):
+                    item = {**item, 'image': convert(item['image'], model)}
+                elif isinstance(item, dict) and isinstance(item.get('image_url'), dict) and item['image_url'].get('url'):
+                    item = {**item, 'image_url': {**item['image_url'], 'url': self.data_url(item['image_url']['url'], model)}}
+                items.append(item)
+            prepared_messages.append({**message, 'content': items})
+        return prepared_messages
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'original_bytes': self.original_bytes,
+                'prepared_bytes': self.prepared_bytes,
+                'ratio': round(self.original_bytes / self.prepared_bytes, 2) if self.prepared_bytes else None
+            }
+
+
+_image_payload_optimizer = None
+_image_payload_optimizer_lock = threading.Lock()
+
+
+def get_image_payload_optimizer() -> ImagePayloadOptimizer:
+    """获取全局图片预处理实例"""
+    global _image_payload_optimizer
+    if _image_payload_optimizer is None:
+        with _image_payload_optimizer_lock:
+            if _image_payload_optimizer is None:
+                _image_payload_optimizer = ImagePayloadOptimizer()
+    return _image_payload_optimizer
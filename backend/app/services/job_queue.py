@@ -0,0 +1,204 @@
+# 视频二创任务队列
+# 基于SQLite的持久化任务队列，Web进程只负责入队，由独立的工作进程领取并执行
+
+import os
+import json
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RecreationJobQueue:
+    """SQLite持久化任务队列，支持多进程并发领取"""
+
+    # 任务状态：queued -> running -> succeeded / failed
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        queue_config = dict(get_config().get_job_queue_config())
+        if config:
+            queue_config.update(config)
+
+        self.db_path = queue_config.get("db_path", os.path.join(os.getcwd(), "recreation_jobs.db"))
+        self.lease_timeout = queue_config.get("lease_timeout", 300)
+        self.max_attempts = queue_config.get("max_attempts", 2)
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用独立连接，连接不跨进程、跨线程共享
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            # WAL模式允许Web进程读取状态的同时工作进程写入
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS recreation_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recreation_id INTEGER NOT NULL,
+                    video_path TEXT NOT NULL,
+                    options TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    heartbeat_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_recreation_jobs_status ON recreation_jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_recreation_jobs_recreation ON recreation_jobs (recreation_id)")
+        finally:
+            conn.close()
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['options'] = json.loads(job['options']) if job.get('options') else {}
+        return job
+
+    def enqueue(self, recreation_id: int, video_path: str, options: Dict[str, Any] = None) -> int:
+        """提交任务，返回任务ID"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO recreation_jobs (recreation_id, video_path, options, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (recreation_id, video_path, json.dumps(options or {}, ensure_ascii=False), self.STATUS_QUEUED, datetime.now().isoformat())
+            )
+            job_id = cursor.lastrowid
+            logger.info(f"[任务队列] 任务已入队: job_id={job_id}, recreation_id={recreation_id}")
+            return job_id
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """领取下一个待执行任务，没有任务时返回None"""
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 获取写锁，保证同一任务只被一个工作进程领取
+            conn.execute("BEGIN IMMEDIATE")
+            now = datetime.now()
+
+            # 心跳超时的运行中任务视为工作进程已崩溃，重新入队或标记失败
+            stale_before = (now - timedelta(seconds=self.lease_timeout)).isoformat()
+            conn.execute(
+                "UPDATE recreation_jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (self.STATUS_FAILED, '工作进程心跳超时', now.isoformat(), self.STATUS_RUNNING, stale_before, self.max_attempts)
+            )
+            conn.execute(
+                "UPDATE recreation_jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                (self.STATUS_QUEUED, self.STATUS_RUNNING, stale_before)
+            )
+
+            row = conn.execute(
+                "SELECT * FROM recreation_jobs WHERE status = ? ORDER BY id LIMIT 1",
+                (self.STATUS_QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                "UPDATE recreation_jobs SET status = ?, worker_id = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (self.STATUS_RUNNING, worker_id, now.isoformat(), now.isoformat(), row['id'])
+            )
+            conn.execute("COMMIT")
+
+            job = self._row_to_dict(row)
+            job['status'] = self.STATUS_RUNNING
+            job['worker_id'] = worker_id
+            job['attempts'] += 1
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: int):
+        """刷新运行中任务的心跳"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE recreation_jobs SET heartbeat_at = ? WHERE id = ? AND status = ?",
+                (datetime.now().isoformat(), job_id, self.STATUS_RUNNING)
+            )
+        finally:
+            conn.close()
+
+    def complete(self, job_id: int):
+        """标记任务成功"""
+        self._finish(job_id, self.STATUS_SUCCEEDED, None)
+
+    def fail(self, job_id: int, error: str):
+        """标记任务失败"""
+        self._finish(job_id, self.STATUS_FAILED, error)
+
+    def _finish(self, job_id: int, status: str, error: Optional[str]):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE recreation_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, datetime.now().isoformat(), job_id)
+            )
+            logger.info(f"[任务队列] 任务结束: job_id={job_id}, status={status}")
+        finally:
+            conn.close()
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """按任务ID查询任务"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM recreation_jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._row_to_dict(row)
+        finally:
+            conn.close()
+
+    def get_job_by_recreation(self, recreation_id: int) -> Optional[Dict[str, Any]]:
+        """查询二创记录对应的最新任务，附带排队位置"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM recreation_jobs WHERE recreation_id = ? ORDER BY id DESC LIMIT 1",
+                (recreation_id,)
+            ).fetchone()
+            job = self._row_to_dict(row)
+            if job and job['status'] == self.STATUS_QUEUED:
+                job['queue_position'] = conn.execute(
+                    "SELECT COUNT(*) FROM recreation_jobs WHERE status = ? AND id < ?",
+                    (self.STATUS_QUEUED, job['id'])
+                ).fetchone()[0] + 1
+            return job
+        finally:
+            conn.close()
+
+
+_job_queue = None
+
+
+def get_job_queue() -> RecreationJobQueue:
+    """获取全局任务队列实例"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = RecreationJobQueue()
+    return _job_queue
@@ -0,0 +1,240 @@
+# 媒体元数据缓存
+# 进程内共享的ffprobe结果缓存，以(真实路径, 文件大小, 修改时间)为键保存完整的stream/format信息，
+# 同一文件被切片、关键帧提取、一致性检查反复探测时只启动一次ffprobe；可选落盘供其他进程和重跑复用
+
+import os
+import json
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Tuple
+
+from app.services.ffmpeg_executor import get_ffmpeg_executor, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+
+class MediaProbeCache:
+    """ffprobe结果缓存，线程安全，同一文件的并发探测合并为一次"""
+
+    # 缓存格式版本，ffprobe参数变化时递增，使旧的磁盘缓存失效
+    CACHE_VERSION = 1
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        probe_config = dict(get_config().get_media_probe_config())
+        if config:
+            probe_config.update(config)
+
+        self.enabled = probe_config.get("enabled", True)
+        self.max_entries = probe_config.get("max_entries", 1024)
+        self.disk_cache = probe_config.get("disk_cache", True)
+        self.cache_dir = probe_config.get("cache_dir", os.path.join(os.getcwd(), "cache", "probe"))
+        self.ffprobe_path = (get_config().get("ffmpeg.ffprobe_path", "") or shutil.which("ffprobe") or "ffprobe")
+
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled and self.disk_cache:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        logger.info(f"[媒体探测缓存] 初始化完成，启用: {self.enabled}, 落盘: {self.disk_cache}")
+
+    @staticmethod
+    def make_key(media_path: str) -> Optional[Tuple]:
+        """缓存键：真实路径、大小和纳秒级修改时间，文件被覆盖后自动失效"""
+        try:
+            real_path = os.path.realpath(media_path)
+            stat = os.stat(real_path)
+        except OSError:
+            return None
+        return (real_path, stat.st_size, stat.st_mtime_ns)
+
+    def _disk_path(self, key: Tuple) -> str:
+        digest = hashlib.sha256(json.dumps([self.CACHE_VERSION, *key]).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def _lookup(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            info = self._entries.get(key)
+            if info is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return info
+
+        if self.disk_cache:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                self._remember(key, info, persist=False)
+                with self._lock:
+                    self.hits += 1
+                return info
+            except (OSError, ValueError):
+                pass
+        return None
+
+    def _remember(self, key: Tuple, info: Dict[str, Any], persist: bool = True):
+        with self._lock:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if persist and self.disk_cache:
+            try:
+                disk_path = self._disk_path(key)
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(info, f, ensure_ascii=False)
+                os.replace(tmp_path, disk_path)
+            except Exception as e:
+                logger.warning(f"[媒体探测缓存] 写入磁盘缓存失败: {e}")
+
+    def _claim(self, key: Tuple) -> Tuple[Future, bool]:
+        # 返回(future, 是否由当前调用者负责执行探测)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            self.misses += 1
+            return future, True
+
+    def _command(self, media_path: str, ffprobe_path: str = None):
+        return [
+            ffprobe_path or self.ffprobe_path,
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format',
+            '-show_streams',
+            '-i', media_path
+        ]
+
+    def _finish(self, key: Tuple, future: Future, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        info = None
+        try:
+            if result.get('success') and result.get('stdout'):
+                info = json.loads(result['stdout'])
+                if 'format' not in info:
+                    info = None
+            if info is not None:
+                self._remember(key, info)
+            else:
+                logger.warning(f"[媒体探测缓存] ffprobe探测失败: {key[0]}")
+        except Exception as e:
+            logger.warning(f"[媒体探测缓存] 解析ffprobe输出失败 {key[0]}: {e}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(info)
+        return info
+
+    def probe(self, media_path: str, ffprobe_path: str = None) -> Optional[Dict[str, Any]]:
+        """同步获取完整的ffprobe信息(format + streams)，失败返回None"""
+        key = self.make_key(media_path)
+        if key is None:
+            return None
+        if not self.enabled:
+            result = get_ffmpeg_executor().run(self._command(key[0], ffprobe_path), capture_output=True, priority=PRIORITY_INTERACTIVE)
+            return json.loads(result['stdout']) if result.get('success') and result.get('stdout') else None
+
+        info = self._lookup(key)
+        if info is not None:
+            return info
+
+        future, owner = self._claim(key)
+        if not owner:
+            return future.result()
+        try:
+            result = get_ffmpeg_executor().run(self._command(key[0], ffprobe_path), capture_output=True, priority=PRIORITY_INTERACTIVE)
+        except Exception as e:
+            logger.warning(f"[媒体探测缓存] 执行ffprobe失败: {e}")
+            result = {}
+        return self._finish(key, future, result)
+
+    async def probe_async(self, media_path: str, ffprobe_path: str = None) -> Optional[Dict[str, Any]]:
+        """异步获取完整的ffprobe信息，不阻塞事件循环"""
+        key = self.make_key(media_path)
+        if key is None:
+            return None
+        if not self.enabled:
+            result = await get_ffmpeg_executor().run_async(self._command(key[0], ffprobe_path), capture_output=True, priority=PRIORITY_INTERACTIVE)
+            return json.loads(result['stdout']) if result.get('success') and result.get('stdout') else None
+
+        info = self._lookup(key)
+        if info is not None:
+            return info
+
+        future, owner = self._claim(key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await get_ffmpeg_executor().run_async(self._command(key[0], ffprobe_path), capture_output=True, priority=PRIORITY_INTERACTIVE)
+        except asyncio.CancelledError:
+            self._finish(key, future, {})
+            raise
+        except Exception as e:
+            logger.warning(f"[媒体探测缓存] 执行ffprobe失败: {e}")
+            result = {}
+        return self._finish(key, future, result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def summarize_video_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """从完整的ffprobe信息中提取常用字段"""
+    fmt = info.get('format', {})
+    video_stream = next((s for s in info.get('streams', []) if s.get('codec_type') == 'video'), {})
+    has_audio = any(s.get('codec_type') == 'audio' for s in info.get('streams', []))
+
+    fps = 0.0
+    for rate_key in ('avg_frame_rate', 'r_frame_rate'):
+        num, _, den = str(video_stream.get(rate_key, '0/0')).partition('/')
+        try:
+            if float(den or 1) > 0 and float(num) > 0:
+                fps = float(num) / float(den or 1)
+                break
+        except ValueError:
+            continue
+
+    duration = float(fmt.get('duration') or video_stream.get('duration') or 0)
+    frame_count = int(video_stream['nb_frames']) if str(video_stream.get('nb_frames', '')).isdigit() else int(round(duration * fps))
+
+    return {
+        'duration': duration,
+        'width': int(video_stream.get('width') or 0),
+        'height': int(video_stream.get('height') or 0),
+        'fps': fps,
+        'frame_count': frame_count,
+        'bitrate': fmt.get('bit_rate', 0),
+        'format_name': fmt.get('format_name', ''),
+        'codec_name': video_stream.get('codec_name', ''),
+        'has_audio': has_audio
+    }
+
+
+_media_probe = None
+_media_probe_lock = threading.Lock()
+
+
+def get_media_probe() -> MediaProbeCache:
+    """获取全局媒体探测缓存实例"""
+    global _media_probe
+    if _media_probe is None:
+        with _media_probe_lock:
+            if _media_probe is None:
+                _media_probe = MediaProbeCache()
+    return _media_probe
@@ -0,0 +1,119 @@
+# 二创任务进度事件
+# 工作进程把步骤切换、场景进度和远程任务状态写入事件表，Web进程通过SSE按事件ID增量推送
+
+import os
+import json
+import sqlite3
+import logging
+import contextvars
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 当前协程/线程正在处理的二创任务ID，深层服务（ComfyUI、Qwen等）据此上报进度，无需层层传参
+_current_recreation_id = contextvars.ContextVar('current_recreation_id', default=None)
+
+
+class ProgressEventStore:
+    """基于SQLite的进度事件存储，事件ID全局单调递增，可用于断点续传"""
+
+    # 出现这些事件后任务不会再有新进度
+    TERMINAL_EVENTS = ('job_succeeded', 'job_failed')
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 事件与任务队列共用同一个数据库文件
+        system_config = get_config()
+        stream_config = dict(system_config.get_progress_stream_config())
+        if config:
+            stream_config.update(config)
+
+        self.db_path = stream_config.get("db_path") or system_config.get_job_queue_config().get(
+            "db_path", os.path.join(os.getcwd(), "recreation_jobs.db")
+        )
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS recreation_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recreation_id INTEGER NOT NULL,
+                    event_type TEXT NOT NULL,
+                    data TEXT,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_recreation_events_recreation ON recreation_events (recreation_id, id)")
+        finally:
+            conn.close()
+
+    def append(self, recreation_id: int, event_type: str, data: Dict[str, Any] = None) -> int:
+        """写入一条事件，返回事件ID"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO recreation_events (recreation_id, event_type, data, created_at) VALUES (?, ?, ?, ?)",
+                (recreation_id, event_type, json.dumps(data or {}, ensure_ascii=False, default=str), datetime.now().isoformat())
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def fetch_after(self, recreation_id: int, last_event_id: int = 0, limit: int = 200) -> List[Dict[str, Any]]:
+        """读取指定事件ID之后的事件"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM recreation_events WHERE recreation_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (recreation_id, last_event_id, limit)
+            ).fetchall()
+            events = []
+            for row in rows:
+                event = dict(row)
+                event['data'] = json.loads(event['data']) if event.get('data') else {}
+                events.append(event)
+            return events
+        finally:
+            conn.close()
+
+
+_event_store = None
+
+
+def get_event_store() -> ProgressEventStore:
+    """获取全局进度事件存储实例"""
+    global _event_store
+    if _event_store is None:
+        _event_store = ProgressEventStore()
+    return _event_store
+
+
+def bind_recreation(recreation_id: Optional[int]):
+    """把当前上下文绑定到二创任务，之后创建的协程和to_thread线程都会继承"""
+    return _current_recreation_id.set(recreation_id)
+
+
+def emit_progress(event_type: str, data: Dict[str, Any] = None, recreation_id: int = None):
+    """上报进度事件；没有绑定任务时忽略。上报失败不影响主流程"""
+    recreation_id = recreation_id if recreation_id is not None else _current_recreation_id.get()
+    if recreation_id is None:
+        return
+    try:
+        get_event_store().append(recreation_id, event_type, data)
+    except Exception as e:
+        logger.warning(f"[进度事件] 写入事件失败: {e}")
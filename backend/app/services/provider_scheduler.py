@@ -0,0 +1,214 @@
+# 模型服务调度器
+# 进程内所有二创任务共享的全局调度器，按服务提供方（DashScope文本、VL、图像编辑、视频合成、ComfyUI）
+# 限制并发数和请求速率，批量处理时吞吐量由各服务的配额决定，而不是由单个视频的串行流程决定
+
+import time
+import asyncio
+import logging
+import threading
+import functools
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any
+
+from app.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class _ProviderLimiter:
+    """单个服务提供方的并发和速率限制"""
+
+    def __init__(self, name: str, max_concurrency: int, rpm: int):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        # rpm为0表示不限速；请求按固定间隔均匀发出，避免瞬时突发触发限流
+        self.interval = 60.0 / rpm if rpm else 0
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def _reserve_rate_slot(self) -> float:
+        # 预约下一个可发请求的时间点，返回需要等待的秒数
+        if not self.interval:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    @contextmanager
+    def acquire(self):
+        wait_start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            with span(f"scheduler.wait.{self.name}", 'scheduler'):
+                self._semaphore.acquire()
+                delay = self._reserve_rate_slot()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        start = time.monotonic()
+        with self._lock:
+            self.active += 1
+            self.wait_seconds += start - wait_start
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.busy_seconds += time.monotonic() - start
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def acquire_async(self):
+        # 与同步调用共用同一个信号量；非阻塞轮询等待名额，协程被取消时不会遗留占用
+        wait_start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            with span(f"scheduler.wait.{self.name}", 'scheduler'):
+                while not self._semaphore.acquire(blocking=False):
+                    await asyncio.sleep(0.05)
+                try:
+                    delay = self._reserve_rate_slot()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        start = time.monotonic()
+        with self._lock:
+            self.active += 1
+            self.wait_seconds += start - wait_start
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.busy_seconds += time.monotonic() - start
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'waiting': self.waiting,
+                'completed': self.completed,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'busy_seconds': round(self.busy_seconds, 3)
+            }
+
+
+class ProviderScheduler:
+    """按服务提供方限流的全局调度器，线程安全，可被多个任务的事件循环和线程同时使用"""
+
+    DASHSCOPE_TEXT = 'dashscope_text'
+    DASHSCOPE_VL = 'dashscope_vl'
+    DASHSCOPE_IMAGE_EDIT = 'dashscope_image_edit'
+    DASHSCOPE_VIDEO_SYNTHESIS = 'dashscope_video_synthesis'
+    COMFYUI = 'comfyui'
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        scheduler_config = dict(get_config().get_provider_scheduler_config())
+        if config:
+            scheduler_config.update(config)
+
+        self.enabled = scheduler_config.get("enabled", True)
+        self.limiters: Dict[str, _ProviderLimiter] = {}
+        for name, provider_config in scheduler_config.get("providers", {}).items():
+            self.limiters[name] = _ProviderLimiter(
+                name,
+                provider_config.get("max_concurrency", 2),
+                provider_config.get("rpm", 0)
+            )
+
+        # 同一线程内嵌套调用同一服务（如装饰过的方法互相调用）时不重复占用名额，避免自锁
+        self._held = threading.local()
+
+        logger.info(f"[服务调度] 初始化完成，启用: {self.enabled}, 服务: {list(self.limiters.keys())}")
+
+    @contextmanager
+    def limit(self, provider: str):
+        """在服务的并发和速率配额内执行一段调用"""
+        limiter = self.limiters.get(provider)
+        held = getattr(self._held, 'providers', None)
+        if held is None:
+            held = self._held.providers = set()
+
+        if not self.enabled or limiter is None or provider in held:
+            yield
+            return
+
+        with limiter.acquire():
+            held.add(provider)
+            try:
+                yield
+            finally:
+                held.discard(provider)
+
+    @asynccontextmanager
+    async def limit_async(self, provider: str):
+        """在事件循环中等待服务配额，等待期间不占用线程"""
+        limiter = self.limiters.get(provider)
+        if not self.enabled or limiter is None:
+            yield
+            return
+
+        async with limiter.acquire_async():
+            yield
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各服务当前的占用情况和累计耗时"""
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+_provider_scheduler = None
+_provider_scheduler_lock = threading.Lock()
+
+
+def get_provider_scheduler() -> ProviderScheduler:
+    """获取全局服务调度器实例"""
+    global _provider_scheduler
+    if _provider_scheduler is None:
+        with _provider_scheduler_lock:
+            if _provider_scheduler is None:
+                _provider_scheduler = ProviderScheduler()
+    return _provider_scheduler
+
+
+def provider_limited(provider: str):
+    """把远程调用限制在指定服务的配额内，同时支持同步函数和协程函数"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                async with get_provider_scheduler().limit_async(provider):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_provider_scheduler().limit(provider):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -9,6 +9,12 @@ import traceback
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 
+from app.services.progress_events import emit_progress
+from app.services.tracing import traced
+from app.services.provider_scheduler import ProviderScheduler, provider_limited
+from app.services.response_cache import get_response_cache
+from app.services.image_payload import get_image_payload_optimizer
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # 设置日志级别为DEBUG，确保能看到详细日志
 
@@ -67,6 +73,8 @@ class QwenVideoService:
         logger.info(f"已切换到API密钥 {self.api_key[:10]}...")
         return self.api_key
     
+    @traced('qwen.analyze_keyframes_with_qwen3vl_plus', 'dashscope')
+    @provider_limited(ProviderScheduler.DASHSCOPE_VL)
     def analyze_keyframes_with_qwen3vl_plus(self, keyframes: List[str], prompt: Dict[str, Any]) -> Dict[str, Any]:
         try:
             logger.info(f"开始使用qwen3-vl-plus分析关键帧")
@@ -98,12 +106,28 @@ class QwenVideoService:
                 }
             ]
             
-            # 添加关键帧到消息
+            # 添加关键帧到消息，关键帧按模型有效分辨率缩放重编码后上传
             for frame_path in keyframes[:3]:  # 只使用前3个关键帧
                 messages[1]['content'].append({
-                    "image": f"file://{os.path.abspath(frame_path)}"
+                    "image": get_image_payload_optimizer().file_url(os.path.abspath(frame_path), "qwen3-vl-plus")
                 })
             
+            # 同一组关键帧和提示词的分析结果可以复用，任务重试时不再重复调用
+            response_cache = get_response_cache()
+            cache_key, cached_content = response_cache.lookup(
+                'qwen3vl_keyframes', "qwen3-vl-plus", messages, {'result_format': 'json'}, cacheable=True
+            )
+            if cached_content is not None:
+                try:
+                    logger.info("qwen3-vl-plus关键帧分析命中响应缓存")
+                    return {
+                        "success": True,
+                        "analysis_result": json.loads(cached_content),
+                        "prompt": cached_content
+                    }
+                except json.JSONDecodeError:
+                    logger.warning("缓存的关键帧分析结果无法解析，重新调用模型")
+            
             # 遍历所有API密钥，尝试分析关键帧
             analysis_result = None
             
@@ -138,6 +162,9 @@ class QwenVideoService:
                                 try:
                                     analysis_result = json.loads(json_content)
                                     logger.info("qwen3-vl-plus关键帧分析成功")
+                                    # 只缓存能解析的结果，解析失败的响应重试时仍会重新调用
+                                    if cache_key:
+                                        response_cache.put(cache_key, json_content, 'qwen3vl_keyframes', "qwen3-vl-plus")
                                     return {
                                         "success": True,
                                         "analysis_result": analysis_result,
@@ -191,6 +218,8 @@ class QwenVideoService:
                 "error": error_msg
             }
     
+    @traced('qwen.generate_keyframes_with_qwen_image_edit', 'dashscope')
+    @provider_limited(ProviderScheduler.DASHSCOPE_IMAGE_EDIT)
     def generate_keyframes_with_qwen_image_edit(self, prompt: Dict[str, Any], reference_images: List[str], num_keyframes: int = 3) -> Dict[str, Any]:
         try:
             logger.info(f"开始使用qwen-image-edit生成关键帧，数量: {num_keyframes}")
@@ -258,7 +287,8 @@ class QwenVideoService:
                             {
                                 "role": "user",
                                 "content": [
-                                    {"image": reference_image},
+                                    # 本地参考图缩放重编码后上传，网络URL原样传递
+                                    {"image": get_image_payload_optimizer().file_url(reference_image, "qwen-image-edit")},
                                     {"text": final_prompt}
                                 ]
                             }
@@ -467,6 +497,8 @@ class QwenVideoService:
             }
     
 
+    @traced('qwen.generate_video_from_keyframes', 'dashscope')
+    @provider_limited(ProviderScheduler.DASHSCOPE_VIDEO_SYNTHESIS)
     def generate_video_from_keyframes(self, keyframes: List[str], prompt: Dict[str, Any]) -> Dict[str, Any]:
         try:
             logger.info(f"开始使用wan2.5-i2v-preview生成视频")
@@ -530,6 +562,7 @@ class QwenVideoService:
                     
                     task_id = rsp.output.task_id
                     logger.info(f"wan2.5-i2v-preview视频生成任务创建成功，task_id: {task_id}")
+                    emit_progress('remote_task', {'service': 'wan2.5-i2v-preview', 'task_id': task_id, 'status': 'PENDING'})
                     
                     # 8. 等待任务完成
                     logger.info(f"开始等待视频生成任务完成...")
@@ -540,6 +573,7 @@ class QwenVideoService:
                     if wait_rsp.status_code != HTTPStatus.OK:
                         error_msg = f"wan2.5-i2v-preview视频生成失败: HTTP {wait_rsp.status_code}, code: {wait_rsp.code}, message: {wait_rsp.message}"
                         logger.error(error_msg)
+                        emit_progress('remote_task', {'service': 'wan2.5-i2v-preview', 'task_id': task_id, 'status': 'FAILED', 'error': error_msg})
                         return {
                             "success": False,
                             "error": error_msg
@@ -556,6 +590,7 @@ class QwenVideoService:
                         }
                     
                     logger.info(f"视频生成成功，视频URL: {video_url}")
+                    emit_progress('remote_task', {'service': 'wan2.5-i2v-preview', 'task_id': task_id, 'status': 'SUCCEEDED'})
                     
                     return {
                         "success": True,
@@ -598,6 +633,7 @@ class QwenVideoService:
             }
     
 
+    @traced('qwen.download_video', 'download')
     def download_video(self, video_url: str, local_path: str) -> Dict[str, Any]:
         try:
             logger.info(f"开始下载视频: {video_url}")
@@ -6,11 +6,12 @@ from typing import Dict, Any, List, Optional
 import httpx
 import json
 import uuid
-import base64
 import os
 from datetime import datetime
 import uuid
 
+from app.services.image_payload import get_image_payload_optimizer
+
 logger = logging.getLogger(__name__)
 
 
@@ -79,15 +80,10 @@ class QwenVLService:
                     logger.warning(f"切片预览图不存在: {preview_file}")
                     continue
                 
-                # 读取并编码预览图
-                with open(preview_file, "rb") as f:
-                    image_data = f.read()
-                
-                image_base64 = base64.b64encode(image_data).decode("utf-8")
-                
+                # 预览图按模型有效分辨率缩放重编码后内联为data URL
                 valid_slices.append({
                     "slice_info": slice_info,
-                    "image_base64": image_base64
+                    "image_url": get_image_payload_optimizer().data_url(preview_file, self.model)
                 })
             
             if not valid_slices:
@@ -117,7 +113,7 @@ class QwenVLService:
                     message_content.append({
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{slice_data['image_base64']}"
+                            "url": slice_data["image_url"]
                         }
                     })
                 
@@ -223,11 +219,8 @@ class QwenVLService:
                 logger.warning(f"切片预览图不存在: {preview_file}")
                 return None
             
-            # 读取并编码预览图
-            with open(preview_file, "rb") as f:
-                image_data = f.read()
-            
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
+            # 预览图按模型有效分辨率缩放重编码后内联为data URL
+            image_url = get_image_payload_optimizer().data_url(preview_file, self.model)
             
             # 构建分析请求
             prompt = "请详细分析这张图片的内容，包括：\n1. 场景描述（时间、地点、环境）\n2. 物体识别（主要物体及其位置）\n3. 人物分析（数量、动作、表情、穿着）\n4. 情感和氛围\n5. 关键信息和主题\n\n请以结构化的JSON格式输出结果，确保信息全面、准确。"
@@ -250,7 +243,7 @@ class QwenVLService:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
+                                    "url": image_url
                                 }
                             }
                         ]
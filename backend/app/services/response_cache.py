@@ -0,0 +1,263 @@
+# 模型响应缓存
+# 以(命名空间, 模型, 规范化后的提示词, 附带图片的SHA-256, 生成参数)为键持久化保存VLM/LLM的响应文本，
+# 重跑任务、失败重试、一致性检查重复比较同一组帧时直接返回缓存；磁盘占用按LRU淘汰，条目超过TTL失效
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 不影响生成结果的参数不参与键计算
+_IGNORED_PARAMS = {'api_key', 'timeout', 'stream', 'incremental_output', 'headers'}
+_MEDIA_KEYS = {'image', 'video', 'audio'}
+
+
+class ResponseCache:
+    """内容寻址的模型响应缓存，线程安全"""
+
+    # 缓存格式版本，键的计算方式变化时递增，使旧缓存失效
+    CACHE_VERSION = 1
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        cache_config = dict(get_config().get_response_cache_config())
+        if config:
+            cache_config.update(config)
+
+        self.enabled = cache_config.get("enabled", True)
+        self.cache_dir = cache_config.get("cache_dir", os.path.join(os.getcwd(), "cache", "responses"))
+        self.max_bytes = cache_config.get("max_bytes", 256 * 1024 * 1024)
+        self.ttl_seconds = cache_config.get("ttl_seconds", 30 * 24 * 3600)
+        self.max_temperature = cache_config.get("max_temperature", 0.1)
+
+        self._lock = threading.Lock()
+        # 键 -> 条目文件大小，按最近使用顺序排列
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._digests: Dict[Tuple, str] = {}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+        self.expired = 0
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+        logger.info(f"[响应缓存] 初始化完成，启用: {self.enabled}, 条目: {len(self._index)}, "
+                    f"占用: {self._total_bytes / 1024 / 1024:.1f}MB / {self.max_bytes / 1024 / 1024:.0f}MB")
+
+    def _load_index(self):
+        # 按修改时间(即最近使用时间)重建LRU顺序
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _count(self, namespace: str, name: str):
+        with self._lock:
+            metrics = self._metrics.setdefault(namespace, {'hits': 0, 'misses': 0, 'stores': 0})
+            metrics[name] += 1
+
+    # ---------- 键计算 ----------
+
+    def _media_digest(self, reference: str) -> str:
+        # 本地文件按内容哈希，同一帧换了路径也能命中；data URL直接哈希；远程URL原样参与计算
+        if reference.startswith('data:'):
+            return f"sha256:{hashlib.sha256(reference.encode('utf-8')).hexdigest()}"
+        path = reference[len('file://'):] if reference.startswith('file://') else reference
+        try:
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return reference
+        memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(memo_key)
+        if digest is None:
+            sha256_hash = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256_hash.update(chunk)
+            digest = self._digests[memo_key] = f"sha256:{sha256_hash.hexdigest()}"
+        return digest
+
+    def _normalize(self, value, key: str = None):
+        if isinstance(value, dict):
+            return {k: self._normalize(v, k) for k, v in sorted(value.items()) if k not in _IGNORED_PARAMS}
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        if isinstance(value, str):
+            if key in _MEDIA_KEYS:
+                return self._media_digest(value)
+            # 提示词只做空白规范化，缩进和换行差异不影响命中
+            return ' '.join(value.split())
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return str(value)
+
+    def is_cacheable(self, temperature: Optional[float] = None, cacheable: Optional[bool] = None) -> bool:
+        """显式指定时按指定值；否则温度不高于max_temperature的确定性调用才缓存，未指定温度视为非确定性"""
+        if not self.enabled:
+            return False
+        from app.services.cassette import get_cassette
+        if get_cassette().active:
+            # 录制回放时每次调用都要经过磁带
+            return False
+        if cacheable is not None:
+            return cacheable
+        return temperature is not None and temperature <= self.max_temperature
+
+    def make_key(self, namespace: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any] = None) -> str:
+        payload = json.dumps({
+            'version': self.CACHE_VERSION,
+            'namespace': namespace,
+            'model': model,
+            'messages': self._normalize(messages),
+            'params': self._normalize(params or {})
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # ---------- 读写 ----------
+
+    def get(self, key: str, namespace: str = 'default') -> Optional[Any]:
+        """读取缓存的响应，未命中或已过期返回None"""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count(namespace, 'misses')
+            return None
+
+        if self.ttl_seconds and time.time() - entry.get('created_at', 0) > self.ttl_seconds:
+            self._remove(key)
+            with self._lock:
+                self.expired += 1
+            self._count(namespace, 'misses')
+            return None
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        self._count(namespace, 'hits')
+        return entry.get('response')
+
+    def put(self, key: str, response: Any, namespace: str = 'default', model: str = None):
+        """写入响应，超出容量时淘汰最久未使用的条目"""
+        entry_path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'namespace': namespace,
+                    'model': model,
+                    'created_at': time.time(),
+                    'response': response
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, entry_path)
+            size = os.path.getsize(entry_path)
+        except Exception as e:
+            logger.warning(f"[响应缓存] 写入缓存失败: {e}")
+            return
+
+        self._count(namespace, 'stores')
+        evicted = []
+        with self._lock:
+            self._total_bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self._total_bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._entry_path(old_key))
+            except OSError:
+                pass
+
+    def _remove(self, key: str):
+        with self._lock:
+            self._total_bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def lookup(self, namespace: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any] = None,
+               temperature: Optional[float] = None, cacheable: Optional[bool] = None) -> Tuple[Optional[str], Optional[Any]]:
+        """返回(缓存键, 缓存的响应)；不可缓存时键为None"""
+        if not self.is_cacheable(temperature, cacheable):
+            return None, None
+        key = self.make_key(namespace, model, messages, params)
+        return key, self.get(key, namespace)
+
+    def call_sdk(self, namespace: str, func, cacheable: Optional[bool] = None, **kwargs):
+        """经过缓存调用DashScope SDK(Generation/MultiModalConversation.call)，命中时返回与SDK响应同形的对象"""
+        params = {k: v for k, v in kwargs.items() if k not in ('model', 'messages')}
+        key, cached = self.lookup(namespace, kwargs.get('model'), kwargs.get('messages', []), params,
+                                  kwargs.get('temperature'), cacheable)
+        if cached is not None:
+            from app.services.cassette import _to_attr
+            return _to_attr({
+                'status_code': 200,
+                'request_id': f"cache-{key[:12]}",
+                'output': {'choices': [{'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': cached}}]},
+                'usage': {}
+            })
+
+        response = func(**kwargs)
+        if key is not None and getattr(response, 'status_code', None) == 200:
+            try:
+                content = response.output.choices[0].message.content
+                self.put(key, json.loads(json.dumps(content, default=str)), namespace, kwargs.get('model'))
+            except Exception as e:
+                logger.debug(f"[响应缓存] 响应不含可缓存的内容: {e}")
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'namespaces': {name: dict(metrics) for name, metrics in self._metrics.items()}
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """获取全局响应缓存实例"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
@@ -1,15 +1,30 @@
 import cv2
 import numpy as np
 import os
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Callable
 from datetime import datetime
 import json
+import queue
+import contextvars
 import dashscope
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from config import config
+from app.config.video_reconstruction_config import get_config
+from app.services.provider_scheduler import ProviderScheduler, provider_limited
+from app.services.media_probe import get_media_probe, summarize_video_info
+from app.services.shot_detection import ShotDetector
+from app.services.analysis_proxy import get_analysis_proxy_cache
+from app.services.response_cache import get_response_cache
+from app.services.understanding_summarizer import build_scene_context, truncate_to_tokens
+from app.services.streaming_json import IncrementalJSONArrayParser
+from app.services.structured_output import (
+    SCENE_PROMPT_SCHEMA, SCENE_SCHEMA, SEGMENTATION_SCHEMA, STYLE_SHEET_SCHEMA, POLISHED_PROMPTS_SCHEMA,
+    SchemaError, get_structured_output_metrics, json_mode_params, parse_structured, validate
+)
 
 class SceneSegmentationService:
     
@@ -60,13 +75,15 @@ class SceneSegmentationService:
         self.set_current_api_key()
         return self.current_api_key
     
-    def segment_video_scenes(self, video_path: str, method: str = "intelligent") -> List[Dict[str, Any]]:
+    def segment_video_scenes(self, video_path: str, method: str = "intelligent",
+                             on_scene: Callable[[Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
         """
         对视频进行场景分割
         
         Args:
             video_path: 视频文件路径
-            method: 分割方法，"intelligent" 或 "traditional"
+            method: 分割方法，"intelligent"、"shots"（本地镜头检测）或 "traditional"
+            on_scene: 智能分割时每生成一个场景就回调一次
         
         Returns:
             场景分割结果列表
@@ -78,18 +95,23 @@ class SceneSegmentationService:
             
             if method == "intelligent":
                 # 调用智能场景分割
-                result = self.intelligent_scene_segmentation(video_path, video_understanding, audio_text)
+                result = self.intelligent_scene_segmentation(video_path, video_understanding, audio_text, on_scene=on_scene)
                 if result.get('success', False):
+                    if result.get('partial'):
+                        print(f"智能场景分割中途失败，使用已生成的 {len(result['scenes'])} 个场景: {result.get('error')}")
                     return result['scenes']
                 else:
                     print(f"智能场景分割失败，回退到传统分割: {result.get('error', '未知错误')}")
                     return self.traditional_scene_segmentation(video_path)
+            elif method == "shots":
+                return self.shot_scene_segmentation(video_path)
             else:
                 return self.traditional_scene_segmentation(video_path)
         except Exception as e:
             print(f"场景分割失败，回退到传统分割: {e}")
             return self.traditional_scene_segmentation(video_path)
     
+    @provider_limited(ProviderScheduler.DASHSCOPE_TEXT)
     def optimize_json_prompt(self, json_prompt: Dict[str, Any]) -> Dict[str, Any]:
         """
         使用qwen-plus模型优化JSON格式的提示词
@@ -113,7 +135,8 @@ class SceneSegmentationService:
             """
             
             # 调用qwen-plus-latest模型
-            response = dashscope.Generation.call(
+            response = get_response_cache().call_sdk(
+                'scene_segmentation', dashscope.Generation.call,
                 model="qwen-plus-latest",
                 messages=[
                     {"role": "system", "content": "你是一个专业的视频内容优化专家，擅长优化视频场景提示词，使其更适合生成高质量视频。"},
@@ -293,18 +316,58 @@ class SceneSegmentationService:
             # 发生异常时，返回原始JSON的字符串表示，确保不丢失任何信息
             return json.dumps(json_prompt, ensure_ascii=False, indent=2)
     
-    def intelligent_scene_segmentation(self, video_path: str, video_understanding: str = "", audio_text: str = "") -> Dict[str, Any]:
+    def intelligent_scene_segmentation(self, video_path: str, video_understanding="", audio_text: str = "",
+                                       on_scene: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
         """
         基于大模型的智能场景分割
         
         
             video_path: 视频文件路径（用于获取视频时长等基本信息）
-            video_understanding: 视频理解内容
+            video_understanding: 视频理解内容，可以是理解结果字典（使用全局摘要和各时间段摘要）或文本
             audio_text: 音频转录文本
+            on_scene: 每解析出一个场景就调用一次，下游可以在模型生成后续场景时开始处理
         
-       
+        流式调用在已交出场景后中途失败时，返回已交出的场景作为部分结果(success=True, partial=True,
+        error为失败原因)，调用方不会回退到传统分割，最终场景列表与回调收到的场景保持一致
         """
+        if on_scene is None:
+            return self._stream_scene_segmentation(video_path, video_understanding, audio_text)
+        
+        # 流式调用在工作线程中占用文本模型槽位，场景经队列交给当前线程回调；
+        # 回调不在受限区内执行，回调中发起的文本模型调用不会与本次流式调用争用同一个槽位
+        scene_queue = queue.Queue()
+        finished = object()
+        
+        def stream():
+            try:
+                return self._stream_scene_segmentation(video_path, video_understanding, audio_text, scene_queue.put)
+            finally:
+                scene_queue.put(finished)
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='scene-stream') as executor:
+            future = executor.submit(contextvars.copy_context().run, stream)
+            while True:
+                scene = scene_queue.get()
+                if scene is finished:
+                    break
+                try:
+                    on_scene(scene)
+                except Exception as e:
+                    print(f"[场景分割] 场景 {scene.get('scene_id')} 回调处理失败: {e}")
+            return future.result()
+    
+    @provider_limited(ProviderScheduler.DASHSCOPE_TEXT)
+    def _stream_scene_segmentation(self, video_path: str, video_understanding="", audio_text: str = "",
+                                   on_scene: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+        # 流式调用模型进行智能场景分割，on_scene在持有文本模型槽位的线程中调用，只应做入队等轻量操作
+        emitted = []
         try:
+            # 视频理解内容按token预算压缩，不随视频长度增长
+            if isinstance(video_understanding, dict):
+                video_understanding = build_scene_context(video_understanding)
+            else:
+                video_understanding = build_scene_context({'content': video_understanding or ''})
+            
             # 获取视频基本信息
             video_info = self._get_video_info(video_path)
             
@@ -315,57 +378,85 @@ class SceneSegmentationService:
             
             print("正在调用qwen-plus-latest模型进行智能场景分割...")
             
-            # 使用 dashscope 库调用 qwen-plus-latest 模型
-            response = dashscope.Generation.call(
-                model="qwen-plus-latest",
+            # 流式生成，scenes数组中的每个场景对象一闭合就解析并交给调用方，不等待完整响应
+            model = "qwen-plus-latest"
+            parser = IncrementalJSONArrayParser('scenes')
+            scenes = []
+            responses = dashscope.Generation.call(
+                model=model,
                 messages=[
                     {"role": "system", "content": "你是一个专业的视频内容分析师，擅长根据视频理解内容和音频文本进行智能场景分割，并生成高质量的英文文生视频提示词。"},
                     {"role": "user", "content": prompt}
                 ],
                 result_format='message',
                 temperature=0.7,
-                max_tokens=8000
+                max_tokens=8000,
+                stream=True,
+                incremental_output=True,
+                **json_mode_params(model)
             )
-            
-            if response.status_code == 200 and response.output and response.output.choices:
-                result_text = response.output.choices[0].message.content
-                
-                # 提取纯JSON部分
-                import re
-                # 找到JSON的开始和结束位置
-                json_start = result_text.find('{')
-                json_end = result_text.rfind('}')
-                
-                if json_start != -1 and json_end != -1:
-                    # 提取纯JSON
-                    pure_json_text = result_text[json_start:json_end + 1]
-                    print(f"[DEBUG] 提取到纯JSON，长度: {len(pure_json_text)}")
+            for response in responses:
+                if response.status_code != 200:
+                    error_msg = response.message if hasattr(response, 'message') else '未知错误'
+                    raise Exception(f"大模型响应错误: {error_msg}")
+                if not (response.output and response.output.choices):
+                    continue
+                for raw_scene in parser.feed(response.output.choices[0].message.content or ''):
+                    scene = self._standardize_scene(raw_scene, len(scenes))
+                    if scene is None:
+                        continue
+                    scenes.append(scene)
+                    print(f"[场景分割] 场景 {len(scenes)} 已生成: {scene['start_time']:.1f}s - {scene['end_time']:.1f}s")
+                    if on_scene:
+                        emitted.append(scene)
+                        on_scene(scene)
+            
+            result_text = parser.text()
+            if scenes:
+                # 有对象因无法解析被丢弃时计为失败，不计入修复成功
+                if parser.errors:
+                    outcome = 'failed'
+                elif parser.repaired:
+                    outcome = 'repaired'
                 else:
-                    pure_json_text = result_text
-                    print(f"[DEBUG] 未找到明确的JSON边界，使用完整文本")
-                
-                scenes = self._parse_intelligent_segmentation_result(pure_json_text)
-                
-                print(f"[DEBUG] 解析出 {len(scenes)} 个场景")
-                
-                # 保存生成的场景和prompt到文件
-                self._save_prompts_to_file(video_path, scenes, pure_json_text, "intelligent_segmentation")
-                
-                return {
-                    'success': True,
-                    'scenes': scenes,
-                    'method': 'intelligent',
-                    'processing_time': 0,
-                    'model_response': result_text
-                }
+                    outcome = 'direct'
+                get_structured_output_metrics().record(model, outcome)
             else:
-                error_msg = response.message if hasattr(response, 'message') else '未知错误'
-                raise Exception(f"大模型响应错误: {error_msg}")
+                # 流中没有解析出完整的场景对象时，对完整文本做一次修复解析
+                scenes = self._parse_intelligent_segmentation_result(result_text, model)
+                if on_scene:
+                    for scene in scenes:
+                        emitted.append(scene)
+                        on_scene(scene)
+            
+            print(f"[DEBUG] 解析出 {len(scenes)} 个场景")
+            
+            # 保存生成的场景和prompt到文件
+            self._save_prompts_to_file(video_path, scenes, result_text, "intelligent_segmentation")
+            
+            return {
+                'success': True,
+                'scenes': scenes,
+                'method': 'intelligent',
+                'processing_time': 0,
+                'model_response': result_text
+            }
                 
         except Exception as e:
             print(f"智能场景分割失败: {e}")
             import traceback
             traceback.print_exc()
+            if emitted:
+                # 已交出的场景可能已被下游使用，不再回退到传统分割，以这些场景作为部分结果
+                print(f"[场景分割] 流式分割中途失败，返回已交出的 {len(emitted)} 个场景")
+                return {
+                    'success': True,
+                    'partial': True,
+                    'error': str(e),
+                    'scenes': emitted,
+                    'method': 'intelligent_partial',
+                    'processing_time': 0
+                }
             return {
                 'success': False,
                 'error': str(e),
@@ -537,9 +628,11 @@ class SceneSegmentationService:
                 "prompt": qwen_omni_prompt
             }
     
+    @provider_limited(ProviderScheduler.DASHSCOPE_TEXT)
     def generate_video_prompt_for_scene(self, scene: Dict[str, Any], video_understanding: str, 
                                        audio_text: str, scene_index: int, output_format: str = "json",
-                                       previous_scene_info: Dict[str, Any] = None) -> Dict[str, Any]:
+                                       previous_scene_info: Dict[str, Any] = None,
+                                       style_sheet: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         为单个场景生成视频提示词
         
@@ -550,14 +643,19 @@ class SceneSegmentationService:
             scene_index: 场景索引
             output_format: 输出格式，可选值："text"（纯文本）、"json"（JSON格式，默认）
             previous_scene_info: 上一个场景的信息，包含关键帧和风格等
+            style_sheet: 全片共用的风格与人物设定，给出时不依赖上一个场景即可保持连贯
         
         Returns:
             包含视频提示词的字典
         """
         try:
+            # 调用方应传入场景对应时间段的上下文，这里再按预算兜底截断
+            video_understanding = truncate_to_tokens(video_understanding or '', get_config().get("summarization.scene_context_tokens", 1200))
+            
             # 提取原始视频的风格信息（如动画风格）
             style_info = ""
-            if "动画" in video_understanding or "cartoon" in video_understanding.lower():
+            if ("动画" in video_understanding or "cartoon" in video_understanding.lower()
+                    or (style_sheet or {}).get('is_animation')):
                 style_info = "\n非常重要：视频必须是动画风格，保持与原始视频一致的卡通风格。"
             
             # 添加统一的字幕生成指令
@@ -568,6 +666,9 @@ class SceneSegmentationService:
             if previous_scene_info:
                 previous_info = f"\n\n上一个场景的信息：\n- 上一场景风格：{previous_scene_info.get('style_elements', {}).get('visual_style', '')}\n- 上一场景人物：{previous_scene_info.get('style_elements', {}).get('characters', '')}\n- 上一场景环境：{previous_scene_info.get('style_elements', {}).get('environment', '')}\n\n非常重要：当前场景必须与上一个场景保持视觉连贯性，包括风格、人物和环境的一致性。"            
             
+            # 添加全片共用的风格与人物设定（如果有）
+            style_sheet_info = f"\n\n{self._format_style_sheet(style_sheet)}" if style_sheet else ""
+            
             # 根据输出格式构建不同的提示词
             if output_format == "json":
                 prompt = f"""
@@ -584,7 +685,7 @@ class SceneSegmentationService:
 
 音频转录文本：
 {audio_text}
-{previous_info}
+{previous_info}{style_sheet_info}
 
 请生成一个详细的英文文生视频提示词，包含：
 1. 人物描述（外观、服装、表情、动作）
@@ -639,7 +740,7 @@ class SceneSegmentationService:
 
 音频转录文本：
 {audio_text}
-{previous_info}
+{previous_info}{style_sheet_info}
 
 请生成一个详细的英文文生视频提示词，包含：
 1. 人物描述（外观、服装、表情、动作）
@@ -658,16 +759,19 @@ class SceneSegmentationService:
 请直接返回英文提示词，不需要其他解释。
 """
             
-            # 使用 dashscope 库调用 qwen-plus-latest 模型
-            response = dashscope.Generation.call(
-                model="qwen-plus-latest",
+            # 使用 dashscope 库调用 qwen-plus-latest 模型，JSON格式输出时使用模型的JSON模式
+            model = "qwen-plus-latest"
+            response = get_response_cache().call_sdk(
+                'scene_segmentation', dashscope.Generation.call,
+                model=model,
                 messages=[
                     {"role": "system", "content": "你是一个专业的视频制作专家，擅长生成高质量的英文文生视频提示词。必须严格按照要求的格式返回结果，不要添加任何额外的解释或格式。"},
                     {"role": "user", "content": prompt}
                 ],
                 result_format='message',
                 temperature=0.7,  # 降低温度，减少随机性
-                max_tokens=800  # 增加最大token数，确保完整生成
+                max_tokens=800,  # 增加最大token数，确保完整生成
+                **(json_mode_params(model) if output_format == "json" else {})
             )
             
             if response.status_code == 200 and response.output and response.output.choices:
@@ -675,155 +779,36 @@ class SceneSegmentationService:
                 
                 if output_format == "json":
                     try:
-                        # 增强的JSON提取逻辑
-                        import json
-                        import re
-                        
-                        # 1. 清理和预处理模型响应
-                        # 去除各种可能的代码块标记
-                        cleaned_response = re.sub(r'^```(json|text|)\n|\n```$', '', model_response).strip()
-                        # 处理特殊字符
-                        cleaned_response = re.sub(r'[\x00-\x1F\x7F]', '', cleaned_response)
-                        # 替换中文引号和标点为英文格式
-                        cleaned_response = re.sub(r'“|”', '"', cleaned_response)
-                        cleaned_response = re.sub(r'，', ',', cleaned_response)
-                        cleaned_response = re.sub(r'：', ':', cleaned_response)
-                        # 移除多余空格
-                        cleaned_response = re.sub(r'\s+', ' ', cleaned_response)
-                        
-                        # 2. 尝试多种JSON解析方式
-                        prompt_json = None
-                        
-                        # 方式1: 直接解析
-                        try:
-                            prompt_json = json.loads(cleaned_response)
-                            print(f"[DEBUG] 直接解析JSON成功")
-                        except json.JSONDecodeError:
-                            # 方式2: 提取最外层JSON
-                            print(f"[DEBUG] 直接解析失败，尝试提取最外层JSON")
-                            json_start = cleaned_response.find('{')
-                            json_end = cleaned_response.rfind('}')
-                            if json_start != -1 and json_end != -1:
-                                json_str = cleaned_response[json_start:json_end+1]
-                                try:
-                                    prompt_json = json.loads(json_str)
-                                    print(f"[DEBUG] 提取最外层JSON成功")
-                                except json.JSONDecodeError:
-                                    # 方式3: 更宽松的解析，移除可能的错误字符
-                                    print(f"[DEBUG] 提取最外层JSON失败，尝试宽松解析")
-                                    # 移除所有非JSON字符，只保留基本的JSON结构字符
-                                    relaxed_str = re.sub(r'[^\x00-\x7F]', '', json_str)
-                                    relaxed_str = re.sub(r'[^\{\}\[\],:".\w\s\d-]', '', relaxed_str)
-                                    try:
-                                        prompt_json = json.loads(relaxed_str)
-                                        print(f"[DEBUG] 宽松解析成功")
-                                    except json.JSONDecodeError:
-                                        # 所有解析方法都失败
-                                        raise json.JSONDecodeError("无法提取有效的JSON", cleaned_response, 0)
-                        
-                        # 3. JSON结构验证
-                        if not isinstance(prompt_json, dict):
-                            raise ValueError("JSON不是字典格式")
-                        
-                        # 4. 关键字段验证和补全
-                        # 确保所有必要字段存在
-                        required_fields = ['video_prompt', 'scene_info', 'style_elements', 'technical_params']
-                        for field in required_fields:
-                            if field not in prompt_json:
-                                # 补全缺失的字段
-                                if field == 'video_prompt':
-                                    prompt_json['video_prompt'] = prompt_json.get('description', '') or prompt_json.get('content', '') or f"Scene {scene_index + 1} video prompt"
-                                elif field == 'scene_info':
-                                    prompt_json['scene_info'] = {
-                                        'scene_id': scene_index + 1,
-                                        'start_time': scene['start_time'],
-                                        'end_time': scene['end_time'],
-                                        'duration': scene['duration']
-                                    }
-                                elif field == 'style_elements':
-                                    prompt_json['style_elements'] = {
-                                        'characters': prompt_json.get('characters', ''),
-                                        'environment': prompt_json.get('environment', ''),
-                                        'visual_style': prompt_json.get('visual_style', ''),
-                                        'camera_movement': prompt_json.get('camera_movement', '')
-                                    }
-                                elif field == 'technical_params':
-                                    prompt_json['technical_params'] = {
-                                        'aspect_ratio': '16:9',
-                                        'fps': 24,
-                                        'quality': 'high'
-                                    }
-                        
-                        # 5. 子字段验证和补全
-                        # 验证scene_info字段
-                        if isinstance(prompt_json['scene_info'], dict):
-                            scene_info = prompt_json['scene_info']
-                            if 'scene_id' not in scene_info:
-                                scene_info['scene_id'] = scene_index + 1
-                            if 'start_time' not in scene_info:
-                                scene_info['start_time'] = scene['start_time']
-                            if 'end_time' not in scene_info:
-                                scene_info['end_time'] = scene['end_time']
-                            if 'duration' not in scene_info:
-                                scene_info['duration'] = scene['duration']
-                        
-                        # 验证style_elements字段
-                        if isinstance(prompt_json['style_elements'], dict):
-                            style_elements = prompt_json['style_elements']
-                            if 'characters' not in style_elements:
-                                style_elements['characters'] = ''
-                            if 'environment' not in style_elements:
-                                style_elements['environment'] = ''
-                            if 'visual_style' not in style_elements:
-                                style_elements['visual_style'] = ''
-                            if 'camera_movement' not in style_elements:
-                                style_elements['camera_movement'] = ''
-                        
-                        # 验证technical_params字段
-                        if isinstance(prompt_json['technical_params'], dict):
-                            technical_params = prompt_json['technical_params']
-                            if 'aspect_ratio' not in technical_params:
-                                technical_params['aspect_ratio'] = '16:9'
-                            if 'fps' not in technical_params:
-                                technical_params['fps'] = 24
-                            if 'quality' not in technical_params:
-                                technical_params['quality'] = 'high'
+                        # 按提示词schema解析和校验，缺失的场景信息用当前场景补全
+                        prompt_json = parse_structured(model_response, SCENE_PROMPT_SCHEMA, model, defaults={
+                            'scene_info': {
+                                'scene_id': scene_index + 1,
+                                'start_time': scene['start_time'],
+                                'end_time': scene['end_time'],
+                                'duration': scene['duration']
+                            }
+                        })['data']
                         
-                        print(f"[DEBUG] JSON验证和补全完成")
-                        
-                        # 6. 构建场景提示词数据
+                        # 构建场景提示词数据
                         scene_prompt_data = {
                             'success': True,
-                            'video_prompt': prompt_json.get('video_prompt', ''),
-                            'scene_info': prompt_json.get('scene_info', {}),
-                            'style_elements': prompt_json.get('style_elements', {}),
-                            'technical_params': prompt_json.get('technical_params', {}),
+                            'video_prompt': prompt_json['video_prompt'],
+                            'scene_info': prompt_json['scene_info'],
+                            'style_elements': prompt_json['style_elements'],
+                            'technical_params': prompt_json['technical_params'],
                             'duration': scene['duration'],
                             'raw_response': model_response
                         }
                         
                         return scene_prompt_data
-                    except Exception as e:
-                        # 如果JSON解析失败，降级处理，但保留更多信息
-                        self.logger.warning(f"JSON解析失败，使用增强的纯文本格式: {e}")
+                    except ValueError as e:
+                        # 无法解析或缺少提示词时，把模型响应作为纯文本提示词使用
+                        self.logger.warning(f"JSON解析失败，使用纯文本格式: {e}")
                         self.logger.debug(f"原始响应: {model_response}")
                         
-                        # 从原始响应中提取关键信息
-                        video_prompt = model_response
-                        
-                        # 尝试从响应中提取可能的视频提示词
-                        if ':' in model_response:
-                            # 简单的键值对提取
-                            for line in model_response.split('\n'):
-                                if 'video_prompt' in line.lower() or 'prompt' in line.lower():
-                                    parts = line.split(':', 1)
-                                    if len(parts) > 1:
-                                        video_prompt = parts[1].strip().strip('"').strip("'")
-                                        break
-                        
                         scene_prompt_data = {
                             'success': True,
-                            'video_prompt': video_prompt,
+                            'video_prompt': model_response,
                             'duration': scene['duration'],
                             'technical_params': {
                                 'aspect_ratio': '16:9',
@@ -831,7 +816,7 @@ class SceneSegmentationService:
                                 'quality': 'high',
                                 'style': 'cinematic'
                             },
-                            'warning': f'JSON解析失败，使用增强的纯文本格式: {str(e)}',
+                            'warning': f'JSON解析失败，使用纯文本格式: {str(e)}',
                             'raw_response': model_response
                         }
                         return scene_prompt_data
@@ -861,11 +846,149 @@ class SceneSegmentationService:
                 'video_prompt': f"Scene {scene_index + 1}: {scene.get('description', 'Video scene')}"
             }
     
+    @provider_limited(ProviderScheduler.DASHSCOPE_TEXT)
+    def extract_style_sheet(self, video_understanding: str, audio_text: str = "") -> Dict[str, Any]:
+        """
+        从视频理解内容中一次性提取全片共用的风格与人物设定，各场景提示词据此保持一致，可以并行生成
+        
+        Args:
+            video_understanding: 视频理解内容（全局摘要和各时间段摘要）
+            audio_text: 音频转录文本
+        
+        Returns:
+            包含style_sheet的字典
+        """
+        try:
+            budget = get_config().get("summarization.scene_context_tokens", 1200)
+            prompt = f"""
+请根据以下视频理解内容，提取全片统一的风格与人物设定，供后续逐个场景生成视频提示词时共同遵循。
+
+视频理解内容：
+{truncate_to_tokens(video_understanding or '', budget)}
+
+音频转录文本：
+{truncate_to_tokens(audio_text or '', budget // 2)}
+
+请严格按照以下JSON格式返回结果，人物外观要具体到发型、服装、体型等可见特征，使用英文描述，不要添加任何其他解释或markdown格式：
+{{
+  "visual_style": "整体视觉风格",
+  "color_palette": "主色调",
+  "lighting": "光线特点",
+  "camera_style": "镜头语言和运镜习惯",
+  "is_animation": false,
+  "characters": [
+    {{"name": "人物称呼", "appearance": "外观描述"}}
+  ],
+  "environments": ["主要场景环境"]
+}}
+"""
+            model = "qwen-plus-latest"
+            response = get_response_cache().call_sdk(
+                'scene_segmentation', dashscope.Generation.call,
+                model=model,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的影视美术指导，擅长从视频内容中提炼统一的视觉风格和人物设定。必须严格按照要求的JSON格式返回结果。"},
+                    {"role": "user", "content": prompt}
+                ],
+                result_format='message',
+                temperature=0.1,
+                max_tokens=1200,
+                **json_mode_params(model)
+            )
+            
+            if response.status_code == 200 and response.output and response.output.choices:
+                style_sheet = parse_structured(response.output.choices[0].message.content, STYLE_SHEET_SCHEMA, model)['data']
+                print(f"风格与人物设定提取成功，人物 {len(style_sheet.get('characters') or [])} 个")
+                return {'success': True, 'style_sheet': style_sheet}
+            error_msg = response.message if hasattr(response, 'message') else '未知错误'
+            raise Exception(f"提取风格与人物设定失败: {error_msg}")
+        except Exception as e:
+            print(f"提取风格与人物设定失败: {e}")
+            return {'success': False, 'error': str(e), 'style_sheet': {}}
+    
+    def _format_style_sheet(self, style_sheet: Dict[str, Any]) -> str:
+        # 风格与人物设定转成提示词中的文本段落
+        lines = ["全片统一的风格与人物设定（所有场景必须严格遵循，人物外观和画面风格不得变化）："]
+        for key, label in [('visual_style', '视觉风格'), ('color_palette', '色彩'), ('lighting', '光线'), ('camera_style', '镜头语言')]:
+            value = style_sheet.get(key)
+            if value:
+                lines.append(f"- {label}：{', '.join(map(str, value)) if isinstance(value, list) else value}")
+        for character in style_sheet.get('characters') or []:
+            if isinstance(character, dict):
+                lines.append(f"- 人物「{character.get('name', '')}」：{character.get('appearance', '')}")
+            else:
+                lines.append(f"- 人物：{character}")
+        environments = style_sheet.get('environments')
+        if environments:
+            lines.append(f"- 场景环境：{'; '.join(map(str, environments)) if isinstance(environments, list) else environments}")
+        return "\n".join(lines)
+    
+    @provider_limited(ProviderScheduler.DASHSCOPE_TEXT)
+    def polish_scene_prompts(self, video_prompts: List[str], style_sheet: Dict[str, Any] = None) -> Optional[List[str]]:
+        """
+        一次调用统一润色所有场景的提示词，使人物称呼、外观描述和风格用词前后一致
+        
+        Returns:
+            与输入等长的提示词列表，失败时返回None
+        """
+        try:
+            numbered = "\n".join(f"{i + 1}. {prompt}" for i, prompt in enumerate(video_prompts))
+            prompt = f"""
+以下是同一个视频按时间顺序的 {len(video_prompts)} 个场景的英文视频提示词。请只做统一性润色：
+人物称呼和外观描述前后一致、风格和色彩用词一致、相邻场景之间过渡自然。不要改变每个场景的内容，不要合并或删减场景。
+
+{self._format_style_sheet(style_sheet) if style_sheet else ''}
+
+场景提示词：
+{numbered}
+
+请严格按照以下JSON格式返回，prompts数组长度必须为 {len(video_prompts)}，不要添加任何其他解释：
+{{"prompts": ["场景1的提示词", "场景2的提示词"]}}
+"""
+            model = "qwen-plus-latest"
+            response = get_response_cache().call_sdk(
+                'scene_segmentation', dashscope.Generation.call,
+                model=model,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的视频制作专家，负责统一多个场景提示词的用词和风格。必须严格按照要求的JSON格式返回结果。"},
+                    {"role": "user", "content": prompt}
+                ],
+                result_format='message',
+                temperature=0.3,
+                max_tokens=8000,
+                **json_mode_params(model)
+            )
+            
+            if response.status_code == 200 and response.output and response.output.choices:
+                polished = parse_structured(response.output.choices[0].message.content, POLISHED_PROMPTS_SCHEMA, model)['data']['prompts']
+                if len(polished) != len(video_prompts) or not all(p.strip() for p in polished):
+                    raise ValueError("润色结果的场景数量与输入不一致")
+                return polished
+            error_msg = response.message if hasattr(response, 'message') else '未知错误'
+            raise Exception(f"润色场景提示词失败: {error_msg}")
+        except Exception as e:
+            print(f"润色场景提示词失败，保留原提示词: {e}")
+            return None
+    
     def _get_video_info(self, video_path: str) -> Dict[str, Any]:
         """
         获取视频基本信息
         """
         try:
+            # 优先使用共享的ffprobe缓存，避免重复打开同一个视频
+            info = get_media_probe().probe(video_path)
+            if info:
+                summary = summarize_video_info(info)
+                if summary['width'] and summary['height']:
+                    return {
+                        'duration': summary['duration'],
+                        'fps': summary['fps'],
+                        'total_frames': summary['frame_count'],
+                        'width': summary['width'],
+                        'height': summary['height'],
+                        'aspect_ratio': f"{summary['width']}:{summary['height']}"
+                    }
+            
             cap = cv2.VideoCapture(video_path)
             if not cap.isOpened():
                 raise Exception(f"无法打开视频文件: {video_path}")
@@ -986,128 +1109,36 @@ class SceneSegmentationService:
         except Exception as e:
             print(f"保存prompt到文件失败: {e}")
     
-    def _parse_intelligent_segmentation_result(self, result_text: str) -> List[Dict[str, Any]]:
+    def _standardize_scene(self, scene: Dict[str, Any], index: int) -> Optional[Dict[str, Any]]:
+        # 按场景schema统一字段和类型，缺少起止时间等无法修正的场景返回None
+        try:
+            standardized, _ = validate(scene, SCENE_SCHEMA, {'scene_id': index + 1, 'description': f'场景 {index + 1}'})
+        except SchemaError as e:
+            print(f"[DEBUG] 场景 {index + 1} 不符合格式要求，已跳过: {e}")
+            return None
+        if standardized['duration'] <= 0:
+            standardized['duration'] = max(0.0, standardized['end_time'] - standardized['start_time'])
+        return {key: standardized[key] for key in SCENE_SCHEMA['properties']}
+    
+    def _parse_intelligent_segmentation_result(self, result_text: str, model: str = "qwen-plus-latest") -> List[Dict[str, Any]]:
         """
-        解析智能分割结果，增强版JSON解析逻辑
+        解析智能分割结果：按分割结果schema解析，整体无法解析时逐个提取已闭合的场景对象
         """
-        print("[DEBUG] 开始解析智能分割结果...")
         scenes = []
-        
         try:
-            # 清理和提取JSON部分
-            import re
-            
-            # 移除可能的前后空格和换行
-            cleaned_text = result_text.strip()
-            print(f"[DEBUG] 清理后的文本长度: {len(cleaned_text)}")
-            
-            # 1. 处理各种可能的代码块标记
-            # 移除 ```json, ```, ```text 等标记
-            json_text = re.sub(r'^```(json|text|)\n|\n```$', '', cleaned_text).strip()
-            print(f"[DEBUG] 移除代码块标记后长度: {len(json_text)}")
-            
-            # 2. 最小化处理特殊字符，只处理影响解析的关键字符
-            # 仅替换中文引号和标点，不移除控制字符（可能破坏转义序列）
-            # 不统一替换空格（可能破坏JSON结构）
-            json_text = re.sub(r'“|”', '"', json_text)  # 替换中文引号为英文引号
-            json_text = re.sub(r'，', ',', json_text)   # 替换中文逗号为英文逗号
-            json_text = re.sub(r'：', ':', json_text)   # 替换中文冒号为英文冒号
-            
-            # 3. 尝试直接解析JSON
-            print("[DEBUG] 尝试直接解析JSON...")
-            try:
-                result_data = json.loads(json_text)
-                scenes = result_data.get('scenes', [])
-                print(f"[DEBUG] 直接解析成功，获取到 {len(scenes)} 个场景")
-            except json.JSONDecodeError:
-                # 4. 尝试修复JSON格式
-                print("[DEBUG] 尝试修复JSON格式...")
-                
-                # 查找最外层的JSON结构
-                json_start = json_text.find('{')
-                json_end = json_text.rfind('}')
-                
-                if json_start != -1 and json_end != -1:
-                    # 提取最外层JSON
-                    outer_json = json_text[json_start:json_end+1]
-                    print(f"[DEBUG] 提取最外层JSON，长度: {len(outer_json)}")
-                    
-                    try:
-                        result_data = json.loads(outer_json)
-                        scenes = result_data.get('scenes', [])
-                        print(f"[DEBUG] 外层JSON解析成功，获取到 {len(scenes)} 个场景")
-                    except json.JSONDecodeError as e:
-                        print(f"[DEBUG] 外层JSON解析失败: {e}")
-                        
-                        # 5. 尝试提取scenes数组
-                        print("[DEBUG] 尝试提取scenes数组...")
-                        scenes_pattern = r'"scenes"\s*:\s*\[(.*?)\]' 
-                        match = re.search(scenes_pattern, outer_json, re.DOTALL)
-                        
-                        if match:
-                            scenes_content = match.group(1)
-                            print(f"[DEBUG] 提取到scenes内容，长度: {len(scenes_content)}")
-                            
-                            # 尝试修复scenes数组的格式
-                            # 确保数组元素之间有正确的逗号
-                            scenes_content = re.sub(r'\}\s*\{', '}, {', scenes_content)
-                            
-                            # 尝试解析修复后的scenes数组
-                            full_scenes_json = f"[{scenes_content}]"
-                            print(f"[DEBUG] 修复后的scenes JSON: {full_scenes_json[:100]}...")
-                            
-                            try:
-                                scenes = json.loads(full_scenes_json)
-                                print(f"[DEBUG] scenes数组解析成功，获取到 {len(scenes)} 个场景")
-                            except json.JSONDecodeError as inner_e:
-                                print(f"[DEBUG] scenes数组解析失败: {inner_e}")
-                                
-                                # 6. 最后尝试：直接查找所有场景对象
-                                print("[DEBUG] 尝试直接提取场景对象...")
-                                scene_pattern = r'\{[^}]*"scene_id"[^}]*\}'
-                                scene_matches = re.findall(scene_pattern, outer_json, re.DOTALL)
-                                print(f"[DEBUG] 找到 {len(scene_matches)} 个场景对象")
-                                
-                                scenes = []
-                                for scene_str in scene_matches:
-                                    try:
-                                        scene = json.loads(scene_str)
-                                        scenes.append(scene)
-                                    except json.JSONDecodeError:
-                                        # 尝试修复单个场景对象的JSON格式
-                                        try:
-                                            # 移除多余的逗号
-                                            fixed_scene_str = re.sub(r',\s*}', '}', scene_str)
-                                            fixed_scene_str = re.sub(r',\s*]', ']', fixed_scene_str)
-                                            scene = json.loads(fixed_scene_str)
-                                            scenes.append(scene)
-                                        except:
-                                            continue
-                                
-                                print(f"[DEBUG] 成功解析 {len(scenes)} 个场景对象")
-        
-        except Exception as general_error:
-            print(f"[DEBUG] 发生通用错误: {general_error}")
-            import traceback
-            traceback.print_exc()
+            scenes = parse_structured(result_text, SEGMENTATION_SCHEMA, model)['data']['scenes']
+        except ValueError as e:
+            print(f"[DEBUG] 整体JSON解析失败，逐个提取场景对象: {e}")
+            parser = IncrementalJSONArrayParser('scenes')
+            parser.feed(result_text)
+            scenes = parser.items
         
         # 验证和标准化场景数据
         standardized_scenes = []
         for i, scene in enumerate(scenes):
-            try:
-                standardized_scene = {
-                    'scene_id': scene.get('scene_id', i + 1),
-                    'start_time': float(scene.get('start_time', 0)),
-                    'end_time': float(scene.get('end_time', 0)),
-                    'duration': float(scene.get('duration', 0)),
-                    'description': scene.get('description', f'场景 {i + 1}'),
-                    'video_prompt': scene.get('video_prompt', ''),
-                    'style_elements': scene.get('style_elements', {})
-                }
+            standardized_scene = self._standardize_scene(scene, i) if isinstance(scene, dict) else None
+            if standardized_scene is not None:
                 standardized_scenes.append(standardized_scene)
-            except Exception as scene_error:
-                print(f"[DEBUG] 标准化场景 {i+1} 失败: {scene_error}")
-                continue
         
         # 确保至少返回一个场景，避免空列表
         if not standardized_scenes:
@@ -1126,6 +1157,29 @@ class SceneSegmentationService:
         print(f"[DEBUG] 最终标准化场景数量: {len(standardized_scenes)}")
         return standardized_scenes
     
+    def shot_scene_segmentation(self, video_path: str) -> List[Dict[str, Any]]:
+        """
+        基于本地镜头检测的场景分割，只用CPU，不调用大模型
+        
+        Args:
+            video_path: 视频文件路径
+        
+        Returns:
+            镜头列表，结构与传统分割的场景列表相同
+        """
+        video_info = self._get_video_info(video_path)
+        detector = ShotDetector({"min_shot_duration": self.min_scene_duration})
+        # 镜头检测读取低分辨率分析代理，时间轴与原视频一致
+        scenes = detector.detect(get_analysis_proxy_cache().get(video_path), video_info['duration'])
+        print(f"镜头检测场景分割完成，共分割出 {len(scenes)} 个场景")
+        return scenes
+    
+    def traditional_scene_segmentation(self, video_path: str) -> List[Dict[str, Any]]:
+        """
+        传统场景分割，由本地镜头检测实现
+        """
+        return self.shot_scene_segmentation(video_path)
+    
     # def traditional_scene_segmentation(self, video_path: str) -> List[Dict[str, Any]]:
     #     """
     #     基于视觉特征的传统场景分割
@@ -0,0 +1,194 @@
+# 本地镜头检测服务
+# 通过rawvideo管道读取降采样后的小尺寸帧，用NumPy批量计算颜色直方图差和边缘变化率，
+# 按局部自适应阈值找出镜头切换点并合并过短镜头，只用CPU，不调用任何远程模型
+
+import os
+import shutil
+import logging
+from typing import Dict, Any, List, Optional, Iterator
+
+import numpy as np
+
+from app.services.tracing import span
+from app.services.ffmpeg_executor import read_rawvideo_batches, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+class ShotDetector:
+    """基于直方图和边缘变化的镜头边界检测"""
+
+    # 颜色直方图每个通道量化为8级，共512个桶
+    HIST_LEVELS = 8
+
+    def __init__(self, config: Dict[str, Any] = None, ffmpeg_path: str = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        shot_config = dict(get_config().get_shot_detection_config())
+        if config:
+            shot_config.update(config)
+
+        self.sample_fps = shot_config.get("sample_fps", 6)
+        self.width = shot_config.get("width", 96)
+        self.height = shot_config.get("height", 54)
+        self.batch_size = shot_config.get("batch_size", 256)
+        self.hist_weight = shot_config.get("hist_weight", 0.7)
+        self.edge_threshold = shot_config.get("edge_threshold", 32)
+        self.min_threshold = shot_config.get("min_threshold", 0.25)
+        self.hard_threshold = shot_config.get("hard_threshold", 0.6)
+        self.adaptive_window = shot_config.get("adaptive_window", 2.0)
+        self.adaptive_k = shot_config.get("adaptive_k", 3.0)
+        self.min_shot_duration = shot_config.get("min_shot_duration", 2.0)
+        self.ffmpeg_path = (ffmpeg_path or get_config().get("ffmpeg.ffmpeg_path", "")
+                            or shutil.which("ffmpeg") or "ffmpeg")
+
+    def _iter_frame_batches(self, video_path: str) -> Iterator[np.ndarray]:
+        # 帧以BGR24原始数据从管道读出，不落盘；经过共享的FFmpeg执行器运行，受并发上限和超时约束，每批复用同一块缓冲区
+        cmd = [
+            self.ffmpeg_path,
+            '-v', 'error',
+            '-i', video_path,
+            '-an', '-sn',
+            '-vf', f"fps={self.sample_fps},scale={self.width}:{self.height}",
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            'pipe:1'
+        ]
+        return read_rawvideo_batches(cmd, self.width, self.height, self.batch_size, priority=PRIORITY_BATCH,
+                                     label=f"shot_detection:{os.path.basename(video_path)}")
+
+    def _histograms(self, frames: np.ndarray) -> np.ndarray:
+        # 所有帧的联合颜色直方图一次bincount得到
+        count = frames.shape[0]
+        bins = self.HIST_LEVELS ** 3
+        shift = 8 - int(np.log2(self.HIST_LEVELS))
+        q = (frames >> shift).astype(np.int32)
+        index = (q[..., 0] * self.HIST_LEVELS + q[..., 1]) * self.HIST_LEVELS + q[..., 2]
+        index = index.reshape(count, -1) + (np.arange(count, dtype=np.int32) * bins)[:, None]
+        hist = np.bincount(index.ravel(), minlength=count * bins).reshape(count, bins)
+        return hist.astype(np.float32) / index.shape[1]
+
+    def _edges(self, frames: np.ndarray):
+        # 灰度梯度幅值超过阈值视为边缘；膨胀一个像素容忍镜头内的小幅运动
+        gray = frames.astype(np.float32) @ np.array([0.114, 0.587, 0.299], dtype=np.float32)
+        gx = np.abs(np.diff(gray, axis=2))[:, :-1, :]
+        gy = np.abs(np.diff(gray, axis=1))[:, :, :-1]
+        edges = (gx + gy) > self.edge_threshold
+        dilated = edges.copy()
+        dilated[:, 1:, :] |= edges[:, :-1, :]
+        dilated[:, :-1, :] |= edges[:, 1:, :]
+        dilated[:, :, 1:] |= edges[:, :, :-1]
+        dilated[:, :, :-1] |= edges[:, :, 1:]
+        return edges, dilated
+
+    def frame_scores(self, video_path: str) -> np.ndarray:
+        """逐帧计算与前一采样帧的差异分数，范围0~1"""
+        scores = []
+        prev_hist = prev_edges = prev_dilated = None
+        for frames in self._iter_frame_batches(video_path):
+            hist = self._histograms(frames)
+            edges, dilated = self._edges(frames)
+            if prev_hist is not None:
+                hist = np.concatenate([prev_hist, hist])
+                edges = np.concatenate([prev_edges, edges])
+                dilated = np.concatenate([prev_dilated, dilated])
+            elif len(frames):
+                scores.append(np.zeros(1, dtype=np.float32))
+
+            if len(hist) > 1:
+                hist_delta = 0.5 * np.abs(hist[1:] - hist[:-1]).sum(axis=1)
+                # 边缘变化率：新出现的边缘和消失的边缘所占比例取较大者
+                edge_count = edges.reshape(len(edges), -1).sum(axis=1).astype(np.float32)
+                entering = (edges[1:] & ~dilated[:-1]).reshape(len(edges) - 1, -1).sum(axis=1)
+                exiting = (edges[:-1] & ~dilated[1:]).reshape(len(edges) - 1, -1).sum(axis=1)
+                edge_delta = np.maximum(
+                    entering / np.maximum(edge_count[1:], 1),
+                    exiting / np.maximum(edge_count[:-1], 1)
+                )
+                scores.append(self.hist_weight * hist_delta + (1 - self.hist_weight) * edge_delta)
+
+            prev_hist, prev_edges, prev_dilated = hist[-1:].copy(), edges[-1:].copy(), dilated[-1:].copy()
+
+        return np.concatenate(scores).astype(np.float32) if scores else np.zeros(0, dtype=np.float32)
+
+    def _pick_cuts(self, scores: np.ndarray) -> List[int]:
+        # 局部自适应阈值：窗口中位数 + k倍MAD，且必须是邻域内的峰值
+        if len(scores) < 2:
+            return []
+        window = max(1, int(self.adaptive_window * self.sample_fps))
+        padded = np.pad(scores, window, mode='edge')
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * window + 1)
+        median = np.median(windows, axis=1)
+        mad = np.median(np.abs(windows - median[:, None]), axis=1)
+        threshold = np.maximum(self.min_threshold, median + self.adaptive_k * 1.4826 * mad)
+
+        peak_radius = int(max(1, self.sample_fps // 2))
+        peak_windows = np.lib.stride_tricks.sliding_window_view(np.pad(scores, peak_radius, mode='constant'), 2 * peak_radius + 1)
+        is_peak = scores >= peak_windows.max(axis=1)
+
+        candidates = (((scores >= threshold) | (scores >= self.hard_threshold)) & is_peak)
+        candidates[0] = False
+        return [int(i) for i in np.flatnonzero(candidates)]
+
+    def _merge_short(self, cuts: List[float], strengths: List[float], duration: float) -> List[float]:
+        # 相邻切点间隔小于最短镜头时长时保留分数更高的切点
+        kept: List[float] = []
+        kept_strength: List[float] = []
+        for cut, strength in zip(cuts, strengths):
+            if cut < self.min_shot_duration or duration - cut < self.min_shot_duration:
+                continue
+            if kept and cut - kept[-1] < self.min_shot_duration:
+                if strength > kept_strength[-1] and (len(kept) < 2 or cut - kept[-2] >= self.min_shot_duration):
+                    kept[-1], kept_strength[-1] = cut, strength
+                continue
+            kept.append(cut)
+            kept_strength.append(strength)
+        return kept
+
+    def detect(self, video_path: str, duration: float = None) -> List[Dict[str, Any]]:
+        """检测镜头，返回与场景分割相同结构的镜头列表"""
+        with span('shot_detection', 'analysis', video=os.path.basename(video_path)) as span_args:
+            scores = self.frame_scores(video_path)
+            if duration is None:
+                duration = len(scores) / self.sample_fps
+            cut_indices = self._pick_cuts(scores)
+            cuts = self._merge_short(
+                [i / self.sample_fps for i in cut_indices],
+                [float(scores[i]) for i in cut_indices],
+                duration
+            )
+            span_args['frames'] = int(len(scores))
+            span_args['shots'] = len(cuts) + 1
+
+        boundaries = [0.0] + cuts + [duration]
+        score_by_time = {i / self.sample_fps: float(scores[i]) for i in cut_indices}
+        shots = []
+        for i in range(len(boundaries) - 1):
+            start, end = boundaries[i], boundaries[i + 1]
+            shots.append({
+                'scene_id': i + 1,
+                'start_time': start,
+                'end_time': end,
+                'duration': end - start,
+                'description': f"场景 {i + 1}",
+                'key_frame_time': (start + end) / 2,
+                'boundary_score': score_by_time.get(start, 0.0)
+            })
+        logger.info(f"[镜头检测] {video_path}: 采样 {len(scores)} 帧，检测到 {len(shots)} 个镜头")
+        return shots
+
+    def detect_cuts(self, video_path: str, duration: float = None) -> List[float]:
+        """只返回镜头切换时间点(秒)"""
+        return [shot['start_time'] for shot in self.detect(video_path, duration)[1:]]
+
+
+_shot_detector: Optional[ShotDetector] = None
+
+
+def get_shot_detector() -> ShotDetector:
+    """获取全局镜头检测器实例"""
+    global _shot_detector
+    if _shot_detector is None:
+        _shot_detector = ShotDetector()
+    return _shot_detector
@@ -0,0 +1,130 @@
+# 切片指纹与近重复检测
+# 对每个切片的关键帧计算dHash、pHash和颜色矩，全部在本地用NumPy完成；
+# 与前面已分析的相邻切片足够接近的切片直接复用其分析结果，不再单独调用视觉模型
+
+import os
+import logging
+from typing import Dict, Any, List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    # 正交DCT-II矩阵，二维DCT = D @ X @ D.T
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+class SliceFingerprinter:
+    """切片关键帧指纹，判断相邻切片是否近似重复"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        dedup_config = dict(get_config().get_slice_dedup_config())
+        if config:
+            dedup_config.update(config)
+
+        self.enabled = dedup_config.get("enabled", True)
+        self.hash_size = dedup_config.get("hash_size", 8)
+        self.max_dhash_distance = dedup_config.get("max_dhash_distance", 10)
+        self.max_phash_distance = dedup_config.get("max_phash_distance", 10)
+        self.max_color_distance = dedup_config.get("max_color_distance", 0.05)
+        self.max_run = dedup_config.get("max_run", 6)
+
+        self._dct = _dct_matrix(self.hash_size * 4)
+
+    def _frame_fingerprint(self, image_path: str) -> Optional[Dict[str, np.ndarray]]:
+        # 以1/4分辨率解码，关键帧只用于计算指纹
+        image = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4)
+        if image is None:
+            return None
+        size = self.hash_size
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+        # dHash：水平相邻像素的亮度梯度方向
+        small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+        dhash = (small[:, 1:] > small[:, :-1]).ravel()
+
+        # pHash：低频DCT系数与中位数比较，去掉直流分量
+        dct = self._dct @ cv2.resize(gray, (size * 4, size * 4), interpolation=cv2.INTER_AREA) @ self._dct.T
+        low = dct[:size, :size].ravel()[1:]
+        phash = low > np.median(low)
+
+        # 颜色矩：每个通道的均值、标准差和偏度，归一化到0~1附近
+        pixels = image.reshape(-1, 3).astype(np.float32) / 255.0
+        mean = pixels.mean(axis=0)
+        std = pixels.std(axis=0)
+        skew = np.cbrt(((pixels - mean) ** 3).mean(axis=0))
+        return {'dhash': dhash, 'phash': phash, 'color': np.concatenate([mean, std, skew])}
+
+    def fingerprint(self, keyframes: List[str]) -> Optional[List[Dict[str, np.ndarray]]]:
+        """计算切片所有关键帧的指纹，任一关键帧不可读时返回None(该切片不参与去重)"""
+        if not keyframes:
+            return None
+        frames = []
+        for image_path in keyframes:
+            if not image_path or not os.path.exists(image_path):
+                return None
+            frame = self._frame_fingerprint(image_path)
+            if frame is None:
+                return None
+            frames.append(frame)
+        return frames
+
+    def distance(self, a: List[Dict[str, np.ndarray]], b: List[Dict[str, np.ndarray]]) -> Dict[str, float]:
+        """按关键帧顺序逐帧比较，取最大距离"""
+        pairs = list(zip(a, b))
+        return {
+            'dhash': max(int(np.count_nonzero(x['dhash'] != y['dhash'])) for x, y in pairs),
+            'phash': max(int(np.count_nonzero(x['phash'] != y['phash'])) for x, y in pairs),
+            'color': max(float(np.abs(x['color'] - y['color']).max()) for x, y in pairs)
+        }
+
+    def is_duplicate(self, a: Optional[List[Dict[str, np.ndarray]]], b: Optional[List[Dict[str, np.ndarray]]]) -> bool:
+        if not a or not b or len(a) != len(b):
+            return False
+        distance = self.distance(a, b)
+        return (distance['dhash'] <= self.max_dhash_distance
+                and distance['phash'] <= self.max_phash_distance
+                and distance['color'] <= self.max_color_distance)
+
+    def plan(self, slices: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """
+        为每个切片确定复用来源
+
+        Returns:
+            与切片等长的列表：None表示需要分析，整数表示复用该索引切片的分析结果
+        """
+        sources: List[Optional[int]] = [None] * len(slices)
+        if not self.enabled or len(slices) < 2:
+            return sources
+
+        fingerprints = []
+        for slice_info in slices:
+            try:
+                fingerprints.append(self.fingerprint(slice_info.get('keyframes', [])))
+            except Exception as e:
+                logger.warning(f"[切片去重] 计算指纹失败 {slice_info.get('output_file')}: {e}")
+                fingerprints.append(None)
+
+        # 只和当前连续段的代表切片比较，避免缓慢变化的画面逐段漂移后仍被判为重复
+        anchor, run = 0, 0
+        for i in range(1, len(slices)):
+            if (fingerprints[anchor] is not None and (not self.max_run or run < self.max_run)
+                    and self.is_duplicate(fingerprints[anchor], fingerprints[i])):
+                sources[i] = anchor
+                run += 1
+            else:
+                anchor, run = i, 0
+
+        reused = sum(1 for source in sources if source is not None)
+        if reused:
+            logger.info(f"[切片去重] {len(slices)} 个切片中 {reused} 个与相邻切片近似重复，复用已有分析")
+        return sources
@@ -0,0 +1,187 @@
+# 流水线步骤缓存服务
+# 以步骤输入的哈希作为键，持久化保存步骤结果和产物文件，重跑或断点续跑时只重新计算输入发生变化的步骤；
+# 产物按相对步骤输出目录的路径保存，其他任务命中缓存时恢复到自己的输出目录
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StepCache:
+    """内容寻址的步骤结果缓存"""
+
+    # 缓存格式版本，步骤实现发生不兼容变化时递增，使旧缓存失效
+    CACHE_VERSION = 3
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # 获取配置
+        cache_config = dict(get_config().get_step_cache_config())
+        if config:
+            cache_config.update(config)
+
+        self.enabled = cache_config.get("enabled", True)
+        self.cache_dir = cache_config.get("cache_dir", os.path.join(os.getcwd(), "cache", "steps"))
+        self.entries_dir = os.path.join(self.cache_dir, "entries")
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.entries_dir, exist_ok=True)
+            os.makedirs(self.objects_dir, exist_ok=True)
+
+        logger.info(f"步骤缓存初始化，启用: {self.enabled}, 目录: {self.cache_dir}")
+
+    @staticmethod
+    def file_digest(file_path: str) -> Optional[str]:
+        """计算文件内容的SHA-256"""
+        if not file_path or not os.path.isfile(file_path):
+            return None
+        sha256_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256_hash.update(chunk)
+        return sha256_hash.hexdigest()
+
+    def make_key(self, step_name: str, inputs: Dict[str, Any]) -> str:
+        """根据步骤名和输入参数生成缓存键"""
+        payload = json.dumps(
+            {"version": self.CACHE_VERSION, "step": step_name, "inputs": inputs},
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, step_name: str, key: str) -> str:
+        return os.path.join(self.entries_dir, step_name, key[:2], f"{key}.json")
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    @classmethod
+    def _rebase(cls, value: Any, old_dir: str, new_dir: str) -> Any:
+        # 把结果中位于原输出目录下的路径改写到当前输出目录
+        if isinstance(value, dict):
+            return {k: cls._rebase(v, old_dir, new_dir) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls._rebase(v, old_dir, new_dir) for v in value]
+        if isinstance(value, str) and (value == old_dir or value.startswith(old_dir + os.sep)):
+            return new_dir + value[len(old_dir):]
+        return value
+
+    def get(self, step_name: str, key: str, base_dir: str = None) -> Optional[Any]:
+        """
+        读取缓存结果，产物文件缺失时从缓存中恢复；无法恢复视为未命中
+
+        Args:
+            base_dir: 当前任务的步骤输出目录；写入时位于输出目录下的产物恢复到该目录，
+                      结果中指向原输出目录的路径同时改写到该目录
+        """
+        if not self.enabled:
+            return None
+
+        entry_path = self._entry_path(step_name, key)
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+
+            old_dir = entry.get("base_dir")
+            new_dir = os.path.normpath(base_dir) if base_dir else old_dir
+
+            # 恢复产物文件，相对路径的产物恢复到当前输出目录
+            for file_path, digest in entry.get("artifacts", {}).items():
+                if not os.path.isabs(file_path):
+                    file_path = os.path.join(new_dir, file_path)
+                if os.path.exists(file_path):
+                    continue
+                object_path = self._object_path(digest)
+                if not os.path.exists(object_path):
+                    logger.warning(f"[步骤缓存] {step_name} 产物已丢失，缓存失效: {file_path}")
+                    return None
+                os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+                shutil.copy2(object_path, file_path)
+                logger.info(f"[步骤缓存] {step_name} 从缓存恢复产物: {file_path}")
+
+            result = entry.get("result")
+            if old_dir and new_dir != old_dir:
+                result = self._rebase(result, old_dir, new_dir)
+            return result
+        except Exception as e:
+            logger.warning(f"[步骤缓存] 读取缓存失败 {step_name}/{key[:12]}: {e}")
+            return None
+
+    def put(self, step_name: str, key: str, result: Any, artifacts: List[str] = None, base_dir: str = None) -> bool:
+        """
+        保存步骤结果和产物文件
+
+        Args:
+            base_dir: 步骤输出目录，位于其下的产物按相对路径保存，读取时可恢复到其他任务的输出目录
+        """
+        if not self.enabled:
+            return False
+
+        try:
+            # 保留调用方传入的路径形式，结果中的路径由同一目录拼接而成，读取时按前缀改写
+            base_dir = os.path.normpath(base_dir) if base_dir else None
+            # 产物文件按内容哈希存储，相同内容只保存一份
+            artifact_digests = {}
+            for file_path in artifacts or []:
+                digest = self.file_digest(file_path)
+                if not digest:
+                    continue
+                object_path = self._object_path(digest)
+                if not os.path.exists(object_path):
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    # 多个进程或线程可能同时写入同一内容，临时文件按进程和线程区分
+                    tmp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    shutil.copy2(file_path, tmp_path)
+                    os.replace(tmp_path, object_path)
+                file_path = os.path.abspath(file_path)
+                if base_dir and file_path.startswith(os.path.abspath(base_dir) + os.sep):
+                    file_path = os.path.relpath(file_path, os.path.abspath(base_dir))
+                artifact_digests[file_path] = digest
+
+            entry = {
+                "step": step_name,
+                "key": key,
+                "created_at": datetime.now().isoformat(),
+                "result": result,
+                "base_dir": base_dir,
+                "artifacts": artifact_digests
+            }
+
+            # 先写临时文件再替换，避免进程崩溃时留下半个缓存条目
+            entry_path = self._entry_path(step_name, key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with self._lock:
+                tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False, default=str)
+                os.replace(tmp_path, entry_path)
+
+            logger.info(f"[步骤缓存] 已缓存 {step_name}/{key[:12]}，产物 {len(artifact_digests)} 个")
+            return True
+        except Exception as e:
+            logger.warning(f"[步骤缓存] 写入缓存失败 {step_name}/{key[:12]}: {e}")
+            return False
+
+
+_step_cache = None
+
+
+def get_step_cache() -> StepCache:
+    """获取全局步骤缓存实例"""
+    global _step_cache
+    if _step_cache is None:
+        _step_cache = StepCache()
+    return _step_cache
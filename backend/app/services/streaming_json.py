@@ -0,0 +1,223 @@
+# 模型输出JSON的增量解析与单遍修复
+# 流式生成时逐块喂入文本，目标数组中的每个对象一闭合就解析并交给调用方，不必等待完整响应；
+# 修复只扫描一遍：跳过代码块和前后说明文字、字符串外的中文标点视为JSON标点、补全缺失的逗号、
+# 去掉多余的逗号、转义字符串内的换行，并在文本被截断时补齐未闭合的字符串和括号
+
+import json
+import logging
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 字符串外出现的中文标点按对应的JSON标点处理
+_PUNCTUATION = {'，': ',', '：': ':'}
+_QUOTE_CLOSE = {'"': '"', '“': '”'}
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def repair_json_text(text: str) -> str:
+    """单遍修复模型输出的JSON文本，返回可交给json.loads的字符串"""
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return text.strip()
+
+    out: List[str] = []
+    stack: List[str] = []
+    quote = None
+    escape = False
+    is_key = False
+    after_value = False
+
+    def last_significant() -> str:
+        for ch in reversed(out):
+            if not ch.isspace():
+                return ch
+        return ''
+
+    def drop_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ',':
+            out.pop()
+
+    for ch in text[min(starts):]:
+        if quote:
+            if escape:
+                out.append(ch)
+                escape = False
+            elif ch == '\\':
+                out.append(ch)
+                escape = True
+            elif ch == _QUOTE_CLOSE[quote]:
+                out.append('"')
+                quote = None
+                after_value = not is_key
+            elif ch == '"':
+                # 中文引号包裹的字符串内出现的英文引号
+                out.append('\\"')
+            elif ch in _CONTROL_ESCAPES:
+                out.append(_CONTROL_ESCAPES[ch])
+            elif ord(ch) >= 0x20:
+                out.append(ch)
+            continue
+
+        ch = _PUNCTUATION.get(ch, ch)
+        if ch in _QUOTE_CLOSE or ch in _CLOSERS:
+            # 两个值之间缺少逗号
+            if after_value:
+                out.append(',')
+            if ch in _QUOTE_CLOSE:
+                is_key = bool(stack) and stack[-1] == '{' and last_significant() in ('{', ',')
+                quote = ch
+                out.append('"')
+            else:
+                stack.append(ch)
+                out.append(ch)
+            after_value = False
+        elif ch in ('}', ']'):
+            drop_trailing_comma()
+            if stack:
+                out.append(_CLOSERS[stack.pop()])
+            after_value = True
+            if not stack:
+                # 最外层结构闭合后的内容(代码块结束标记、说明文字)全部忽略
+                break
+        elif ch in (',', ':'):
+            out.append(ch)
+            after_value = False
+        elif ch == '`':
+            continue
+        else:
+            # 数字或true/false/null开始时前一个值已结束，同样补上逗号
+            if after_value and (ch.isalnum() or ch == '-') and not (out and (out[-1].isalnum() or out[-1] in '-+.')):
+                out.append(',')
+            out.append(ch)
+            if ch.isalnum():
+                after_value = True
+
+    # 文本被截断时补齐未闭合的字符串和括号
+    if quote:
+        if escape:
+            out.pop()
+        out.append('"')
+    if stack:
+        if last_significant() == ':':
+            out.append('null')
+        drop_trailing_comma()
+        while stack:
+            out.append(_CLOSERS[stack.pop()])
+    return ''.join(out)
+
+
+def load_json(text: str) -> Tuple[Any, bool]:
+    """先按标准JSON解析，失败时单遍修复后再解析一次；返回(解析结果, 是否经过修复)"""
+    stripped = text.strip()
+    try:
+        return json.loads(stripped), False
+    except ValueError:
+        return json.loads(repair_json_text(stripped)), True
+
+
+def parse_json_document(text: str) -> Any:
+    """先按标准JSON解析，失败时单遍修复后再解析一次"""
+    return load_json(text)[0]
+
+
+class IncrementalJSONArrayParser:
+    """
+    增量解析目标数组中的对象：逐块feed文本，每当数组中的一个对象闭合就返回解析结果
+
+    target_key为None时目标是最外层数组，否则是键名为target_key的数组
+    """
+
+    def __init__(self, target_key: Optional[str] = 'scenes', on_item: Callable[[Dict[str, Any]], None] = None):
+        self.target_key = target_key
+        self.on_item = on_item
+        self.items: List[Any] = []
+        self.errors = 0
+        self.repaired = 0
+
+        self._buffer: List[str] = []
+        self._stack: List[str] = []
+        self._quote = None
+        self._escape = False
+        self._string_start = -1
+        self._last_string = None
+        self._last_significant = ''
+        self._pending_key = None
+        self._array_depth = None
+        self._array_closed = False
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[Any]:
+        """喂入一段文本，返回这段文本中闭合的对象"""
+        completed = []
+        base = len(self._buffer)
+        self._buffer.extend(chunk)
+        for offset, ch in enumerate(chunk):
+            position = base + offset
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == _QUOTE_CLOSE[self._quote]:
+                    self._quote = None
+                    self._last_string = ''.join(self._buffer[self._string_start + 1:position])
+                    self._last_significant = '"'
+                continue
+
+            ch = _PUNCTUATION.get(ch, ch)
+            if ch in _QUOTE_CLOSE:
+                self._quote = ch
+                self._string_start = position
+            elif ch in _CLOSERS:
+                opens_target = (
+                    ch == '[' and self._array_depth is None
+                    and (self._pending_key == self.target_key if self.target_key else not self._stack)
+                )
+                self._stack.append(ch)
+                if opens_target:
+                    self._array_depth = len(self._stack)
+                elif ch == '{' and self._in_array() and len(self._stack) == self._array_depth + 1:
+                    self._item_start = position
+            elif ch in ('}', ']'):
+                depth = len(self._stack)
+                if self._stack:
+                    self._stack.pop()
+                if ch == '}' and self._item_start != -1 and self._in_array() and depth == self._array_depth + 1:
+                    item = self._parse_item(''.join(self._buffer[self._item_start:position + 1]))
+                    self._item_start = -1
+                    if item is not None:
+                        completed.append(item)
+                elif self._in_array() and depth == self._array_depth:
+                    # 目标数组结束，之后的内容不再解析
+                    self._array_closed = True
+            elif ch == ':':
+                self._pending_key = self._last_string if self._last_significant == '"' else None
+            elif ch == ',':
+                self._pending_key = None
+            if not ch.isspace():
+                self._last_significant = ch if ch not in _QUOTE_CLOSE else '"'
+        return completed
+
+    def _in_array(self) -> bool:
+        return self._array_depth is not None and not self._array_closed
+
+    def _parse_item(self, text: str) -> Optional[Any]:
+        try:
+            item, repaired = load_json(text)
+        except ValueError as e:
+            self.errors += 1
+            logger.warning(f"[增量JSON] 跳过无法解析的对象: {e}; {text[:100]}")
+            return None
+        self.repaired += repaired
+        self.items.append(item)
+        if self.on_item:
+            self.on_item(item)
+        return item
+
+    def text(self) -> str:
+        """目前为止喂入的完整文本"""
+        return ''.join(self._buffer)
@@ -0,0 +1,324 @@
+# 模型结构化输出
+# 场景与提示词对象的schema定义、JSON模式请求参数和统一的校验解析器：
+# 标准JSON直接解析(零修复快速路径)，失败时才做一次单遍修复；解析结果按schema转换类型、补全默认值，
+# 出错时指明字段路径；每个模型的直接成功、修复后成功和失败次数分别计数
+
+import contextvars
+import copy
+import json
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple
+
+from app.services.streaming_json import load_json
+
+logger = logging.getLogger(__name__)
+
+_STYLE_ELEMENTS_SCHEMA = {
+    'type': 'object',
+    'default': {},
+    'properties': {
+        'characters': {'type': 'string', 'default': ''},
+        'environment': {'type': 'string', 'default': ''},
+        'visual_style': {'type': 'string', 'default': ''},
+        'camera_movement': {'type': 'string', 'default': ''}
+    }
+}
+
+# 单个场景的视频提示词(generate_video_prompt_for_scene)
+SCENE_PROMPT_SCHEMA = {
+    'type': 'object',
+    'required': ['video_prompt'],
+    'properties': {
+        'video_prompt': {'type': 'string', 'aliases': ['prompt', 'description', 'content']},
+        'scene_info': {
+            'type': 'object',
+            'default': {},
+            'properties': {
+                'scene_id': {'type': 'integer'},
+                'start_time': {'type': 'number'},
+                'end_time': {'type': 'number'},
+                'duration': {'type': 'number'}
+            }
+        },
+        'style_elements': _STYLE_ELEMENTS_SCHEMA,
+        'technical_params': {
+            'type': 'object',
+            'default': {},
+            'properties': {
+                'aspect_ratio': {'type': 'string', 'default': '16:9'},
+                'fps': {'type': 'integer', 'default': 24},
+                'quality': {'type': 'string', 'default': 'high'}
+            }
+        }
+    }
+}
+
+# 智能场景分割结果中的单个场景
+SCENE_SCHEMA = {
+    'type': 'object',
+    'required': ['start_time', 'end_time'],
+    'properties': {
+        'scene_id': {'type': 'integer'},
+        'start_time': {'type': 'number'},
+        'end_time': {'type': 'number'},
+        'duration': {'type': 'number', 'default': 0.0},
+        'description': {'type': 'string'},
+        'video_prompt': {'type': 'string', 'default': '', 'aliases': ['prompt']},
+        'style_elements': _STYLE_ELEMENTS_SCHEMA
+    }
+}
+
+SEGMENTATION_SCHEMA = {
+    'type': 'object',
+    'required': ['scenes'],
+    'properties': {
+        'scenes': {'type': 'array', 'items': SCENE_SCHEMA}
+    }
+}
+
+STYLE_SHEET_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'visual_style': {'type': 'string', 'default': ''},
+        'color_palette': {'type': 'string', 'default': ''},
+        'lighting': {'type': 'string', 'default': ''},
+        'camera_style': {'type': 'string', 'default': ''},
+        'is_animation': {'type': 'boolean', 'default': False},
+        'characters': {'type': 'array', 'default': []},
+        'environments': {'type': 'array', 'default': []}
+    }
+}
+
+POLISHED_PROMPTS_SCHEMA = {
+    'type': 'object',
+    'required': ['prompts'],
+    'properties': {
+        'prompts': {'type': 'array', 'items': {'type': 'string'}}
+    }
+}
+
+
+class SchemaError(ValueError):
+    """输出不符合schema，path指出出错的字段"""
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f"{path or '$'}: {message}")
+        self.path = path
+
+
+def _missing(value) -> bool:
+    return value is None or value == ''
+
+
+def _coerce(value, schema: Dict[str, Any], path: str, defaults, fixes: List[str]):
+    expected = schema.get('type')
+
+    if expected == 'object':
+        if not isinstance(value, dict):
+            raise SchemaError(path, f"应为对象，实际为{type(value).__name__}")
+        result = dict(value)
+        defaults = defaults if isinstance(defaults, dict) else {}
+        required = schema.get('required', [])
+        for name, prop in schema.get('properties', {}).items():
+            child = f"{path}.{name}" if path else name
+            if _missing(result.get(name)):
+                alias = next((a for a in prop.get('aliases', []) if not _missing(result.get(a))), None)
+                if alias is not None:
+                    result[name] = result[alias]
+                    fixes.append(f"{child}: 使用{alias}字段")
+                elif name in defaults:
+                    result[name] = copy.deepcopy(defaults[name])
+                elif 'default' in prop:
+                    result[name] = copy.deepcopy(prop['default'])
+                elif name in required:
+                    raise SchemaError(child, "缺少必填字段")
+                else:
+                    continue
+            try:
+                result[name] = _coerce(result[name], prop, child, defaults.get(name), fixes)
+            except SchemaError as e:
+                if name in required:
+                    raise
+                # 可选字段类型错误时依次回退到调用方默认值、schema默认值，都没有则丢弃该字段，不影响整个对象
+                if name in defaults:
+                    result[name] = _coerce(copy.deepcopy(defaults[name]), prop, child, None, fixes)
+                    fixes.append(f"{e}，使用调用方默认值")
+                elif 'default' in prop:
+                    result[name] = _coerce(copy.deepcopy(prop['default']), prop, child, defaults.get(name), fixes)
+                    fixes.append(f"{e}，使用默认值")
+                else:
+                    result.pop(name, None)
+                    fixes.append(f"{e}，已丢弃该字段")
+        return result
+
+    if expected == 'array':
+        if not isinstance(value, list):
+            raise SchemaError(path, f"应为数组，实际为{type(value).__name__}")
+        item_schema = schema.get('items')
+        if not item_schema:
+            return value
+        items = []
+        for i, item in enumerate(value):
+            try:
+                items.append(_coerce(item, item_schema, f"{path}[{i}]", None, fixes))
+            except SchemaError as e:
+                # 数组中个别元素不合法时跳过该元素
+                fixes.append(f"{e}，已跳过")
+        return items
+
+    if expected == 'string':
+        if isinstance(value, str):
+            return value
+        fixes.append(f"{path}: {type(value).__name__}转换为字符串")
+        if isinstance(value, list):
+            return ', '.join(str(v) for v in value)
+        if isinstance(value, dict):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+
+    if expected in ('number', 'integer'):
+        number = value
+        if isinstance(value, str):
+            # 模型常把时间写成"12.5s"或"12.5秒"
+            try:
+                number = float(value.strip().rstrip('s秒').strip())
+            except ValueError:
+                raise SchemaError(path, f"无法转换为数字: {value[:50]}")
+            fixes.append(f"{path}: 字符串转换为数字")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise SchemaError(path, f"应为数字，实际为{type(value).__name__}")
+        if isinstance(number, float) and not math.isfinite(number):
+            # float()接受"NaN"/"inf"，非有限值按类型错误处理，由上层回退到默认值
+            raise SchemaError(path, f"应为有限数字，实际为{number}")
+        if expected == 'integer':
+            if float(number) != int(number):
+                raise SchemaError(path, f"应为整数，实际为{number}")
+            return int(number)
+        return float(number)
+
+    if expected == 'boolean':
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+            fixes.append(f"{path}: 字符串转换为布尔值")
+            return value.strip().lower() == 'true'
+        raise SchemaError(path, f"应为布尔值，实际为{type(value).__name__}")
+
+    return value
+
+
+def validate(value, schema: Dict[str, Any], defaults: Dict[str, Any] = None) -> Tuple[Any, List[str]]:
+    """
+    按schema校验并规范化已解析的JSON
+
+    Args:
+        value: json.loads的结果
+        schema: 本模块定义的schema(type/properties/required/default/aliases/items)
+        defaults: 与schema结构相同的调用方默认值，优先于schema中的default
+
+    Returns:
+        (规范化后的值, 修正记录)；必填字段缺失或类型无法转换时抛出SchemaError
+    """
+    fixes: List[str] = []
+    return _coerce(value, schema, '', defaults, fixes), fixes
+
+
+class StructuredOutputMetrics:
+    """按模型统计结构化输出的解析结果，线程安全"""
+
+    OUTCOMES = ('direct', 'repaired', 'failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, int]] = {}
+
+    def _add(self, model: str, outcome: str, fixes: int):
+        with self._lock:
+            metrics = self._metrics.setdefault(model or 'unknown', {**{name: 0 for name in self.OUTCOMES}, 'schema_fixes': 0})
+            metrics[outcome] += 1
+            metrics['schema_fixes'] += fixes
+
+    def record(self, model: str, outcome: str, fixes: int = 0):
+        self._add(model, outcome, fixes)
+        job_metrics = _job_metrics.get()
+        if job_metrics is not None:
+            job_metrics._add(model, outcome, fixes)
+
+    @contextmanager
+    def track(self):
+        """
+        单独统计当前上下文内的解析结果(全局统计照常累加)
+
+        上下文经asyncio.to_thread和contextvars.copy_context()传递到工作线程，
+        因此可按任务统计，不受同一进程内其他任务的影响
+        """
+        job_metrics = StructuredOutputMetrics()
+        token = _job_metrics.set(job_metrics)
+        try:
+            yield job_metrics
+        finally:
+            _job_metrics.reset(token)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: dict(metrics) for model, metrics in self._metrics.items()}
+
+    def summary(self) -> str:
+        """各模型解析结果的一行说明，用于任务日志"""
+        return '; '.join(
+            f"{model}: 直接解析 {m['direct']} 次, 修复后解析 {m['repaired']} 次, 失败 {m['failed']} 次"
+            for model, m in self.stats().items()
+        )
+
+
+_job_metrics: contextvars.ContextVar = contextvars.ContextVar('structured_output_job_metrics', default=None)
+_structured_output_metrics = None
+_structured_output_metrics_lock = threading.Lock()
+
+
+def get_structured_output_metrics() -> StructuredOutputMetrics:
+    """获取全局结构化输出统计实例"""
+    global _structured_output_metrics
+    if _structured_output_metrics is None:
+        with _structured_output_metrics_lock:
+            if _structured_output_metrics is None:
+                _structured_output_metrics = StructuredOutputMetrics()
+    return _structured_output_metrics
+
+
+def json_mode_params(model: str) -> Dict[str, Any]:
+    """模型支持JSON模式时返回对应的请求参数，否则返回空字典；提示词中需包含"JSON"字样"""
+    from app.config.video_reconstruction_config import get_config
+
+    output_config = get_config().get_structured_output_config()
+    if output_config.get("json_mode", True) and any(model.startswith(prefix) for prefix in output_config.get("json_mode_models", [])):
+        return {'response_format': {'type': 'json_object'}}
+    return {}
+
+
+def parse_structured(text: str, schema: Dict[str, Any], model: str = '', defaults: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    解析并校验模型输出的JSON，结果计入该模型的统计
+
+    Returns:
+        包含data(规范化后的对象)、repaired(是否经过文本修复)和fixes(字段修正记录)的字典；
+        无法解析或不符合schema时抛出ValueError
+    """
+    metrics = get_structured_output_metrics()
+    try:
+        value, repaired = load_json(text or '')
+        if schema.get('type') == 'object' and isinstance(value, list) and len(schema.get('required', [])) == 1:
+            # 模型省略了外层对象、只返回数组时包回唯一的必填字段
+            value = {schema['required'][0]: value}
+        data, fixes = validate(value, schema, defaults)
+    except ValueError as e:
+        metrics.record(model, 'failed')
+        logger.warning(f"[结构化输出] {model} 输出解析失败: {e}")
+        raise
+    metrics.record(model, 'repaired' if repaired else 'direct', len(fixes))
+    if repaired or fixes:
+        logger.info(f"[结构化输出] {model} 输出{'经过修复，' if repaired else ''}字段修正 {len(fixes)} 处: {'; '.join(fixes[:5])}")
+    return {'data': data, 'repaired': repaired, 'fixes': fixes}
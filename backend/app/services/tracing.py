@@ -0,0 +1,196 @@
+# 流水线耗时追踪
+# 用嵌套的span记录每个步骤、FFmpeg子进程、DashScope/ComfyUI调用、轮询等待和数据库提交的耗时，
+# 任务结束后导出为Chrome trace JSON（chrome://tracing 或 Perfetto 可直接打开）
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 当前任务的追踪对象和当前所在的span，协程和to_thread线程都会继承
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """单个二创任务的耗时时间线"""
+
+    def __init__(self, name: str, **metadata):
+        self.name = name
+        self.metadata = metadata
+        self.started_at = datetime.now().isoformat()
+        self._origin = time.perf_counter()
+        self._events: List[Dict[str, Any]] = []
+        self._lanes: Dict[Any, Dict[str, Any]] = {}
+        self._next_span_id = 0
+        self._lock = threading.Lock()
+
+    def _lane(self) -> int:
+        # 并发的协程在同一线程上交错执行，按协程划分泳道才能保证每条泳道上的span严格嵌套
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        if task is not None:
+            lane_key, lane_name = ('task', id(task)), task.get_name()
+        else:
+            thread = threading.current_thread()
+            lane_key, lane_name = ('thread', thread.ident), thread.name
+
+        with self._lock:
+            lane = self._lanes.get(lane_key)
+            if lane is None:
+                lane = {'tid': len(self._lanes) + 1, 'name': lane_name}
+                self._lanes[lane_key] = lane
+            return lane['tid']
+
+    def _new_span_id(self) -> int:
+        with self._lock:
+            self._next_span_id += 1
+            return self._next_span_id
+
+    def now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1_000_000
+
+    def add_span(self, name: str, category: str, start_us: float, end_us: float, tid: int, args: Dict[str, Any]):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round(start_us, 3),
+            'dur': round(max(end_us - start_us, 0), 3),
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': args
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """按分类汇总耗时（秒）和次数，嵌套span会重复计入各自分类"""
+        totals: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            events = list(self._events)
+        for event in events:
+            item = totals.setdefault(event['cat'], {'count': 0, 'total_seconds': 0.0})
+            item['count'] += 1
+            item['total_seconds'] += event['dur'] / 1_000_000
+        for item in totals.values():
+            item['total_seconds'] = round(item['total_seconds'], 3)
+        return totals
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """转换为Chrome trace格式"""
+        pid = os.getpid()
+        with self._lock:
+            events = sorted(self._events, key=lambda e: (e['ts'], -e['dur']))
+            lanes = list(self._lanes.values())
+
+        metadata_events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': self.name}}]
+        for lane in lanes:
+            metadata_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': lane['tid'], 'args': {'name': lane['name']}})
+
+        return {
+            'traceEvents': metadata_events + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'name': self.name,
+                'started_at': self.started_at,
+                **{k: str(v) for k, v in self.metadata.items()}
+            }
+        }
+
+    def export(self, output_path: str) -> Optional[str]:
+        """导出Chrome trace JSON文件"""
+        try:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            tmp_path = f"{output_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_chrome_trace(), f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, output_path)
+            print(f"[耗时追踪] 时间线已导出: {output_path}")
+            return output_path
+        except Exception as e:
+            logger.warning(f"[耗时追踪] 导出时间线失败: {e}")
+            return None
+
+
+def _tracing_enabled() -> bool:
+    from app.config.video_reconstruction_config import get_config
+    return get_config().get("tracing.enabled", True)
+
+
+def start_trace(name: str, **metadata) -> Optional[Trace]:
+    """为当前上下文创建新的时间线，关闭追踪时返回None"""
+    trace = Trace(name, **metadata) if _tracing_enabled() else None
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def get_current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, category: str = 'pipeline', **args):
+    """记录一段耗时；没有时间线时不做任何事。yield出的args可在span内补充属性"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield args
+        return
+
+    parent_id = _current_span.get()
+    span_id = trace._new_span_id()
+    args = {'span_id': span_id, 'parent_id': parent_id, **args}
+    tid = trace._lane()
+    token = _current_span.set(span_id)
+    start_us = trace.now_us()
+    try:
+        yield args
+    except BaseException as e:
+        args['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        trace.add_span(name, category, start_us, trace.now_us(), tid, args)
+
+
+def traced(name: str = None, category: str = 'pipeline'):
+    """把函数调用记录为span，同时支持普通函数和协程函数"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def trace_methods(obj: Any, method_names: List[str], prefix: str, category: str):
+    """给外部组件实例（如一致性检查器）的方法套上span，不修改其源码"""
+    for method_name in method_names:
+        method = getattr(obj, method_name, None)
+        if method is None:
+            continue
+        setattr(obj, method_name, traced(f"{prefix}.{method_name}", category)(method))
@@ -0,0 +1,223 @@
+# 视频理解分层摘要
+# 切片分析结果先按时间窗口分组压缩成各时间段的摘要(map)，再逐层合并成全局摘要(reduce)；
+# 每次调用的输入和输出都受token预算约束，视频再长，单次调用和每个场景提示词的输入也不会随之增长
+
+import re
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字大约每字一个token，其余字符大约每4个一个token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数，只用于预算控制，不追求精确"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """按token预算截断文本，超出时在末尾加省略号"""
+    if not text or budget <= 0:
+        return ''
+    if estimate_tokens(text) <= budget:
+        return text
+    used = 0.0
+    for i, char in enumerate(text):
+        used += 1 if _CJK_PATTERN.match(char) else 0.25
+        if used > budget - 1:
+            return text[:i].rstrip() + '…'
+    return text
+
+
+def _format_range(start: float, end: float) -> str:
+    return f"{start:.1f}s - {end:.1f}s"
+
+
+class UnderstandingSummarizer:
+    """按token预算对切片分析结果做map-reduce摘要"""
+
+    def __init__(self, generate: Callable[[str, str], Awaitable[str]], config: Dict[str, Any] = None):
+        from app.config.video_reconstruction_config import get_config
+
+        # generate(system_prompt, user_prompt)返回模型输出文本，失败时抛出异常
+        self.generate = generate
+
+        # 获取配置
+        summary_config = dict(get_config().get_summarization_config())
+        if config:
+            summary_config.update(config)
+
+        self.slice_tokens = summary_config.get("slice_tokens", 600)
+        self.map_input_tokens = summary_config.get("map_input_tokens", 3000)
+        self.window_seconds = summary_config.get("window_seconds", 24)
+        self.digest_tokens = summary_config.get("digest_tokens", 300)
+        self.reduce_input_tokens = summary_config.get("reduce_input_tokens", 3000)
+        self.summary_tokens = summary_config.get("summary_tokens", 800)
+        self.max_concurrency = summary_config.get("max_concurrency", 4)
+
+        self.calls = 0
+        self.input_tokens = 0
+
+    def _group(self, items: List[Dict[str, Any]], budget: int, max_span: float = None) -> List[List[Dict[str, Any]]]:
+        # 按时间顺序把相邻条目装进输入预算(和时间跨度)内的分组，单个条目超预算时独占一组
+        groups: List[List[Dict[str, Any]]] = []
+        used = 0
+        for item in items:
+            if (groups and used + item['tokens'] <= budget
+                    and (not max_span or item['end_time'] - groups[-1][0]['start_time'] <= max_span)):
+                groups[-1].append(item)
+                used += item['tokens']
+            else:
+                groups.append([item])
+                used = item['tokens']
+        return groups
+
+    async def _call(self, system_prompt: str, user_prompt: str, budget: int, fallback: str) -> str:
+        # 模型输出同样按预算截断，调用失败时使用截断后的输入作为摘要
+        self.calls += 1
+        self.input_tokens += estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        try:
+            text = (await self.generate(system_prompt, user_prompt) or '').strip()
+        except Exception as e:
+            logger.warning(f"[分层摘要] 摘要调用失败，使用截断后的原文: {type(e).__name__}: {e}")
+            text = ''
+        return truncate_to_tokens(text or fallback, budget)
+
+    async def _digest(self, group: List[Dict[str, Any]], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        start, end = group[0]['start_time'], group[-1]['end_time']
+        text = '\n\n'.join(item['text'] for item in group)
+        if estimate_tokens(text) > self.digest_tokens:
+            async with semaphore:
+                text = await self._call(
+                    f"你是视频内容分析专家。请把以下同一时间段内的视频片段分析压缩成一段连贯的摘要，"
+                    f"保留人物、场景、动作、画面风格和关键台词，按时间顺序叙述，不超过{self.digest_tokens}字。",
+                    f"时间段 {_format_range(start, end)} 的片段分析：\n\n{text}",
+                    self.digest_tokens,
+                    text
+                )
+        return {
+            'start_time': start,
+            'end_time': end,
+            'slice_indexes': [index for item in group for index in item.get('slice_indexes', [])],
+            'text': text,
+            'tokens': estimate_tokens(text)
+        }
+
+    async def _reduce(self, digests: List[Dict[str, Any]], note: str, semaphore: asyncio.Semaphore) -> str:
+        # 摘要总量超过单次输入预算时先分组合并成更粗粒度的摘要，逐层向上直到一次调用能容纳
+        level = digests
+        while sum(item['tokens'] for item in level) > self.reduce_input_tokens and len(level) > 1:
+            groups = self._group(
+                [{**item, 'text': f"[{_format_range(item['start_time'], item['end_time'])}] {item['text']}"} for item in level],
+                self.reduce_input_tokens
+            )
+            if len(groups) == len(level):
+                # 每个摘要都独占一组时无法继续合并，直接截断
+                break
+            level = await asyncio.gather(*[self._digest(group, semaphore) for group in groups])
+
+        timeline = '\n\n'.join(f"[{_format_range(item['start_time'], item['end_time'])}] {item['text']}" for item in level)
+        timeline = truncate_to_tokens(timeline, self.reduce_input_tokens)
+        async with semaphore:
+            return await self._call(
+                f"你是专业的视频内容整合专家。请根据按时间排列的各时间段摘要，写出视频的整体分析："
+                f"整体内容和故事情节、主要人物及外观、场景环境、画面风格、音视频的对应关系。"
+                f"语言连贯，不要逐段复述，不超过{self.summary_tokens}字。",
+                f"{note}\n\n各时间段摘要：\n\n{timeline}" if note else f"各时间段摘要：\n\n{timeline}",
+                self.summary_tokens,
+                timeline
+            )
+
+    async def summarize(self, slices: List[Dict[str, Any]], note: str = '') -> Dict[str, Any]:
+        """
+        对切片分析结果做分层摘要
+
+        Args:
+            slices: 切片分析结果，包含slice_index、start_time、end_time、analysis、audio_content
+            note: 附加说明(如分析失败的切片)，只用于全局摘要
+
+        Returns:
+            包含全局摘要summary、各时间段摘要digests和token统计的字典
+        """
+        self.calls = 0
+        self.input_tokens = 0
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # 单个切片的分析先按预算截断，避免个别超长输出挤占整个分组；复用分析的近重复切片只记一句延续说明
+        items = []
+        for slice_data in sorted(slices, key=lambda s: s.get('start_time', 0)):
+            analysis = slice_data.get('analysis', '')
+            if slice_data.get('reused_from') is not None:
+                analysis = f"画面与切片 {slice_data['reused_from'] + 1} 基本相同，延续上一段画面。"
+            text = f"[{_format_range(slice_data['start_time'], slice_data['end_time'])}] {analysis}"
+            if slice_data.get('audio_content'):
+                text += f"\n音频内容: {slice_data['audio_content']}"
+            text = truncate_to_tokens(text, self.slice_tokens)
+            items.append({
+                'start_time': slice_data['start_time'],
+                'end_time': slice_data['end_time'],
+                'slice_indexes': [slice_data.get('slice_index')],
+                'text': text,
+                'tokens': estimate_tokens(text)
+            })
+        if not items:
+            return {'summary': '', 'digests': [], 'calls': 0, 'input_tokens': 0}
+
+        digests = list(await asyncio.gather(*[
+            self._digest(group, semaphore) for group in self._group(items, self.map_input_tokens, self.window_seconds)
+        ]))
+        summary = await self._reduce(digests, note, semaphore)
+
+        logger.info(f"[分层摘要] {len(items)} 个切片 -> {len(digests)} 个时间段摘要 -> 全局摘要 "
+                    f"{estimate_tokens(summary)} tokens，调用 {self.calls} 次，输入约 {self.input_tokens} tokens")
+        return {
+            'summary': summary,
+            'digests': digests,
+            'calls': self.calls,
+            'input_tokens': self.input_tokens
+        }
+
+
+def build_scene_context(video_understanding: Dict[str, Any], start_time: Optional[float] = None,
+                        end_time: Optional[float] = None, budget: int = None) -> str:
+    """
+    为场景提示词组装视频理解上下文：全局摘要 + 与场景时间段重叠的时间段摘要，总长度受预算约束；
+    不给时间段时附上全部时间段摘要(按预算截断)，旧的理解结果没有摘要时截断全文
+    """
+    if not video_understanding:
+        return ''
+    if budget is None:
+        from app.config.video_reconstruction_config import get_config
+        budget = get_config().get("summarization.scene_context_tokens", 1200)
+
+    content = video_understanding.get('content') or ''
+    digests = video_understanding.get('digests') or []
+    if not digests:
+        return truncate_to_tokens(content, budget)
+
+    if start_time is None or end_time is None:
+        selected = digests
+    else:
+        selected = [d for d in digests if d['start_time'] < end_time and d['end_time'] > start_time]
+        if not selected:
+            # 场景落在所有摘要之外时使用时间上最近的摘要
+            middle = (start_time + end_time) / 2
+            selected = [min(digests, key=lambda d: abs((d['start_time'] + d['end_time']) / 2 - middle))]
+
+    summary = truncate_to_tokens(content, budget // 2)
+    remaining = budget - estimate_tokens(summary)
+    blocks = []
+    for digest in selected:
+        if remaining <= 0:
+            break
+        block = truncate_to_tokens(f"[{_format_range(digest['start_time'], digest['end_time'])}] {digest['text']}", remaining)
+        remaining -= estimate_tokens(block)
+        blocks.append(block)
+    title = "分时间段内容" if start_time is None or end_time is None else "当前时间段内容"
+    return f"视频整体概要：\n{summary}\n\n{title}：\n" + '\n\n'.join(blocks)
@@ -1,24 +1,40 @@
 import os
 import sys
 import time
+import asyncio
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 from pydantic import Field
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessageChunk
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
-from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
 from dashscope import MultiModalConversation
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from config import config
+from app.services.provider_scheduler import ProviderScheduler, provider_limited, get_provider_scheduler
+from app.services.dashscope_client import get_dashscope_client, inline_local_media, DashScopeError
+from app.services.cassette import get_cassette
+from app.services.response_cache import get_response_cache
+from app.services.understanding_summarizer import UnderstandingSummarizer
+from app.services.slice_fingerprint import SliceFingerprinter
+from app.services.image_payload import get_image_payload_optimizer
 
 class DashScopeChatModel(BaseChatModel):
     """基于DashScope的LangChain聊天模型"""
     
     api_key: str = Field(default="")
     model_name: str = Field(default="qwen-omni-turbo")
+    # 调用失败时是否返回模拟结果；关闭后直接抛出异常，由调用方重试或记录失败
+    fallback_on_error: bool = Field(default=True)
+    # 单次调用截止时间(秒)，为空时使用dashscope_client.request_timeout
+    request_timeout: Optional[float] = Field(default=None)
+    # 生成温度，为空时使用服务端默认值
+    temperature: Optional[float] = Field(default=None)
+    # 是否缓存响应；为空时按温度判断(确定性调用才缓存)
+    cache_responses: Optional[bool] = Field(default=None)
     
     def __init__(self, api_key: str = None, model_name: str = "qwen-omni-turbo", **kwargs):
         # 设置默认值
@@ -34,6 +50,7 @@ class DashScopeChatModel(BaseChatModel):
     def _llm_type(self) -> str:
         return "dashscope"
     
+    @provider_limited(ProviderScheduler.DASHSCOPE_VL)
     def _generate(
         self,
         messages: list[BaseMessage],
@@ -41,99 +58,207 @@ class DashScopeChatModel(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        """调用DashScope API生成响应"""
+        """同步调用DashScope（供旧的同步代码使用），与异步调用共用进程内连接池"""
         try:
-            print(f"[DashScope] 开始API调用，模型: {self.model_name}")
-            
-            # 转换LangChain消息格式为DashScope格式
-            dashscope_messages = self._convert_messages(messages)
-            print(f"[DashScope] 消息转换完成，消息数量: {len(dashscope_messages)}")
-            
-            # 打印第一个消息的内容类型（用于调试）
-            if dashscope_messages:
-                first_msg = dashscope_messages[0]
-                print(f"[DashScope] 第一个消息角色: {first_msg.get('role')}")
-                if 'content' in first_msg and isinstance(first_msg['content'], list):
-                    content_types = [list(item.keys())[0] if item else 'empty' for item in first_msg['content']]
-                    print(f"[DashScope] 内容类型: {content_types}")
-            
-            print(f"[DashScope] 开始调用MultiModalConversation.call")
-            response = MultiModalConversation.call(
-                api_key=self.api_key,
-                model=self.model_name,
-                messages=dashscope_messages
-            )
-            
-            print(f"[DashScope] API调用完成")
-            
-            if response is None:
-                raise Exception("API响应为空")
-            
-            print(f"[DashScope] 响应对象类型: {type(response)}")
-            
-            # 检查响应状态
-            if hasattr(response, 'status_code'):
-                print(f"[DashScope] 响应状态码: {response.status_code}")
-                if response.status_code != 200:
-                    error_msg = f"API调用失败，状态码: {response.status_code}"
-                    if hasattr(response, 'message'):
-                        error_msg += f", 错误信息: {response.message}"
-                    raise Exception(error_msg)
-            
-            if not hasattr(response, 'output') or response.output is None:
-                print(f"[DashScope] 响应对象属性: {dir(response)}")
-                raise Exception("API响应格式错误：缺少output字段")
-            
-            print(f"[DashScope] output对象类型: {type(response.output)}")
-            
-            if not hasattr(response.output, 'choices') or not response.output.choices:
-                print(f"[DashScope] output对象属性: {dir(response.output)}")
-                raise Exception("API响应格式错误：缺少choices字段")
-            
-            print(f"[DashScope] choices数量: {len(response.output.choices)}")
-            
-            choice = response.output.choices[0]
-            print(f"[DashScope] 第一个choice类型: {type(choice)}")
-            
-            if not hasattr(choice, 'message'):
-                print(f"[DashScope] choice对象属性: {dir(choice)}")
-                raise Exception("API响应格式错误：choice缺少message字段")
-            
-            message = choice.message
-            print(f"[DashScope] message类型: {type(message)}")
-            
-            if not hasattr(message, 'content'):
-                print(f"[DashScope] message对象属性: {dir(message)}")
-                raise Exception("API响应格式错误：message缺少content字段")
-            
-            content_data = message.content
-            print(f"[DashScope] content类型: {type(content_data)}")
-            
-            if isinstance(content_data, list) and len(content_data) > 0:
-                if isinstance(content_data[0], dict) and "text" in content_data[0]:
-                    content = content_data[0]["text"]
-                else:
-                    content = str(content_data[0])
-            else:
-                content = str(content_data)
-            
+            cache_key, content = self._cache_lookup(messages)
+            if content is None:
+                content = self._call_sync(messages)
+                self._cache_store(cache_key, content)
             print(f"[DashScope] 提取的内容长度: {len(content)}")
             
             generation = ChatGeneration(message=HumanMessage(content=content))
             return ChatResult(generations=[generation])
         except Exception as e:
-            print(f"[DashScope] API调用异常: {str(e)}")
-            print(f"[DashScope] 异常类型: {type(e).__name__}")
-            import traceback
-            print(f"[DashScope] 异常堆栈: {traceback.format_exc()}")
-            
-            # Fallback机制：返回模拟结果
-            print(f"[DashScope] 使用模拟结果作为fallback")
+            return self._fallback_result(e)
+    
+    @provider_limited(ProviderScheduler.DASHSCOPE_VL)
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """异步调用DashScope，等待期间不阻塞事件循环，协程被取消时请求同时取消"""
+        try:
+            cache_key, content = await asyncio.to_thread(self._cache_lookup, messages)
+            if content is None:
+                if get_cassette().active:
+                    # 录制回放只覆盖SDK调用，走同步路径
+                    content = await asyncio.to_thread(self._call_sync, messages)
+                else:
+                    dashscope_messages = await asyncio.to_thread(self._prepare_http_messages, messages)
+                    print(f"[DashScope] 开始异步API调用，模型: {self.model_name}，消息数量: {len(dashscope_messages)}")
+                    result = await get_dashscope_client().call(
+                        self.model_name, dashscope_messages, self.api_key,
+                        parameters=self._parameters(), timeout=self.request_timeout
+                    )
+                    content = result['text']
+                    await asyncio.to_thread(self._cache_store, cache_key, content)
+            print(f"[DashScope] 提取的内容长度: {len(content)}")
             
-            # 生成模拟内容
-            simulated_content = "这是一个模拟的视频分析结果。视频中包含小动物和豌豆藤蔓的内容，场景生动有趣。"
-            generation = ChatGeneration(message=HumanMessage(content=simulated_content))
+            generation = ChatGeneration(message=HumanMessage(content=content))
             return ChatResult(generations=[generation])
+        except Exception as e:
+            return self._fallback_result(e)
+    
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """异步流式调用DashScope，逐块返回增量文本；失败时直接抛出DashScopeError"""
+        if get_cassette().active:
+            result = await self._agenerate(messages, stop=stop, **kwargs)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].message.content))
+            return
+        
+        cache_key, cached = await asyncio.to_thread(self._cache_lookup, messages)
+        if cached is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached))
+            return
+        
+        dashscope_messages = await asyncio.to_thread(self._prepare_http_messages, messages)
+        parts = []
+        async with get_provider_scheduler().limit_async(ProviderScheduler.DASHSCOPE_VL):
+            async for chunk in get_dashscope_client().stream(
+                self.model_name, dashscope_messages, self.api_key,
+                parameters=self._parameters(), timeout=self.request_timeout
+            ):
+                if not chunk['text']:
+                    continue
+                parts.append(chunk['text'])
+                generation_chunk = ChatGenerationChunk(message=AIMessageChunk(content=chunk['text']))
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk['text'], chunk=generation_chunk)
+                yield generation_chunk
+        # 只有完整读完的流才写缓存
+        await asyncio.to_thread(self._cache_store, cache_key, ''.join(parts))
+    
+    def _parameters(self) -> Dict[str, Any]:
+        return {'temperature': self.temperature} if self.temperature is not None else {}
+    
+    def _cache_lookup(self, messages: list[BaseMessage]):
+        # 键包含模型、规范化后的消息(本地图片按内容哈希)和生成参数
+        cache_key, cached = get_response_cache().lookup(
+            'dashscope_chat', self.model_name, self._convert_messages(messages), self._parameters(),
+            temperature=self.temperature, cacheable=self.cache_responses
+        )
+        if cached is not None:
+            print(f"[DashScope] 命中响应缓存，模型: {self.model_name}")
+        return cache_key, cached
+    
+    def _cache_store(self, cache_key: Optional[str], content: str):
+        if cache_key and content:
+            get_response_cache().put(cache_key, content, 'dashscope_chat', self.model_name)
+    
+    def _prepare_http_messages(self, messages: list[BaseMessage]) -> list[Dict[str, Any]]:
+        # REST接口不接受file://路径，本地图片内联为data URL
+        return inline_local_media(self._convert_messages(messages), self.model_name)
+    
+    def _call_sync(self, messages: list[BaseMessage]) -> str:
+        print(f"[DashScope] 开始API调用，模型: {self.model_name}")
+        if not get_cassette().active:
+            result = get_dashscope_client().call_sync(
+                self.model_name, self._prepare_http_messages(messages), self.api_key,
+                parameters=self._parameters(), timeout=self.request_timeout
+            )
+            return result['text']
+        
+        # 转换LangChain消息格式为DashScope格式
+        dashscope_messages = self._convert_messages(messages)
+        print(f"[DashScope] 消息转换完成，消息数量: {len(dashscope_messages)}")
+        
+        # 打印第一个消息的内容类型（用于调试）
+        if dashscope_messages:
+            first_msg = dashscope_messages[0]
+            print(f"[DashScope] 第一个消息角色: {first_msg.get('role')}")
+            if 'content' in first_msg and isinstance(first_msg['content'], list):
+                content_types = [list(item.keys())[0] if item else 'empty' for item in first_msg['content']]
+                print(f"[DashScope] 内容类型: {content_types}")
+        
+        print(f"[DashScope] 开始调用MultiModalConversation.call")
+        response = MultiModalConversation.call(
+            api_key=self.api_key,
+            model=self.model_name,
+            messages=dashscope_messages,
+            **self._parameters()
+        )
+        
+        print(f"[DashScope] API调用完成")
+        
+        if response is None:
+            raise Exception("API响应为空")
+        
+        print(f"[DashScope] 响应对象类型: {type(response)}")
+        
+        # 检查响应状态
+        if hasattr(response, 'status_code'):
+            print(f"[DashScope] 响应状态码: {response.status_code}")
+            if response.status_code != 200:
+                error_msg = f"API调用失败，状态码: {response.status_code}"
+                if hasattr(response, 'message'):
+                    error_msg += f", 错误信息: {response.message}"
+                raise Exception(error_msg)
+        
+        if not hasattr(response, 'output') or response.output is None:
+            print(f"[DashScope] 响应对象属性: {dir(response)}")
+            raise Exception("API响应格式错误：缺少output字段")
+        
+        print(f"[DashScope] output对象类型: {type(response.output)}")
+        
+        if not hasattr(response.output, 'choices') or not response.output.choices:
+            print(f"[DashScope] output对象属性: {dir(response.output)}")
+            raise Exception("API响应格式错误：缺少choices字段")
+        
+        print(f"[DashScope] choices数量: {len(response.output.choices)}")
+        
+        choice = response.output.choices[0]
+        print(f"[DashScope] 第一个choice类型: {type(choice)}")
+        
+        if not hasattr(choice, 'message'):
+            print(f"[DashScope] choice对象属性: {dir(choice)}")
+            raise Exception("API响应格式错误：choice缺少message字段")
+        
+        message = choice.message
+        print(f"[DashScope] message类型: {type(message)}")
+        
+        if not hasattr(message, 'content'):
+            print(f"[DashScope] message对象属性: {dir(message)}")
+            raise Exception("API响应格式错误：message缺少content字段")
+        
+        content_data = message.content
+        print(f"[DashScope] content类型: {type(content_data)}")
+        
+        if isinstance(content_data, list) and len(content_data) > 0:
+            if isinstance(content_data[0], dict) and "text" in content_data[0]:
+                content = content_data[0]["text"]
+            else:
+                content = str(content_data[0])
+        else:
+            content = str(content_data)
+        
+        return content
+    
+    def _fallback_result(self, e: Exception) -> ChatResult:
+        print(f"[DashScope] API调用异常: {str(e)}")
+        print(f"[DashScope] 异常类型: {type(e).__name__}")
+        import traceback
+        print(f"[DashScope] 异常堆栈: {traceback.format_exc()}")
+        
+        # 录制回放时不使用模拟结果，避免假数据进入磁带或基准测试结果
+        if get_cassette().active or not self.fallback_on_error:
+            raise e
+        
+        # Fallback机制：返回模拟结果
+        print(f"[DashScope] 使用模拟结果作为fallback")
+        
+        # 生成模拟内容
+        simulated_content = "这是一个模拟的视频分析结果。视频中包含小动物和豌豆藤蔓的内容，场景生动有趣。"
+        generation = ChatGeneration(message=HumanMessage(content=simulated_content))
+        return ChatResult(generations=[generation])
     
     def _convert_messages(self, messages: list[BaseMessage]) -> list[Dict[str, Any]]:
         """将LangChain消息格式转换为DashScope格式"""
@@ -156,7 +281,7 @@ class DashScopeChatModel(BaseChatModel):
                         content_list = []
                         # 只使用前3个关键帧以加快处理速度
                         for frame_path in keyframes[:3]:
-                            content_list.append({'image': f"file://{os.path.abspath(frame_path)}"})
+                            content_list.append({'image': get_image_payload_optimizer().file_url(frame_path, self.model_name)})
                         content_list.append({'text': message.content})
                         dashscope_messages.append({
                             'role': 'user',
@@ -182,9 +307,22 @@ class VideoAnalysisAgent:
     
     def __init__(self, api_key: str = None, model_name: str = "qwen-omni-turbo"):
 # 初始化视频分析智能体
+        # 切片并发分析配置
+        from app.config.video_reconstruction_config import get_config
+        analysis_config = get_config().get_video_analysis_config()
+        self.max_concurrency = max(1, int(analysis_config.get("max_concurrency", 4)))
+        self.slice_timeout = analysis_config.get("slice_timeout", 120)
+        self.slice_retries = max(0, int(analysis_config.get("slice_retries", 2)))
+        self.retry_delay = analysis_config.get("retry_delay", 2)
+        
         self.llm = DashScopeChatModel(
             api_key=api_key,
-            model_name=model_name
+            model_name=model_name,
+            fallback_on_error=False,
+            # 截止时间只约束HTTP请求本身，在全局调度器中排队等待名额的时间不计入
+            request_timeout=self.slice_timeout,
+            # 切片和关键帧不变时分析结果可以复用，重跑任务不再重复分析
+            cache_responses=True
         )
         
         # 定义系统提示词
@@ -270,87 +408,71 @@ class VideoAnalysisAgent:
                 print(f"[视频理解] 测试模式：只使用前10个切片")
             print(f"[视频理解] 视频切片完成，共 {len(slices)} 个切片，每个切片4秒")
             
-            # 逐个分析切片
-            all_analysis_results = []
-            
             # 提取对应切片的音频内容
             slice_audio_content = self._get_slice_audio_content(audio_transcription, slices)
             
-            for i, slice_info in enumerate(slices):
-                slice_path = slice_info['output_file']
-                slice_start = slice_info['start_time']
-                slice_duration = slice_info['duration']
-                slice_keyframes = slice_info.get('keyframes', [])  # 获取关键帧信息
-                slice_preview = slice_info.get('preview_file', '')  # 获取预览图
-                current_slice_audio = slice_audio_content.get(i, '')  # 获取当前切片对应的音频内容
-                
-                print(f"\n[视频理解] 开始分析切片 {i+1}/{len(slices)}: {slice_path}")
-                print(f"[视频理解] 切片时间范围: {slice_start:.1f}s - {slice_start+slice_duration:.1f}s")
-                print(f"[视频理解] 切片关键帧数量: {len(slice_keyframes)}")
-                print(f"[视频理解] 切片音频内容长度: {len(current_slice_audio)}")
-                
-                # 构建增强的系统提示词，包含音频内容的重要性
-                enhanced_system_prompt = self.system_prompt + "\n\n特别重要：请结合提供的音频转录内容，确保视觉分析与音频内容保持一致，提高内容理解的准确性。"
-                
-                # 构建消息链 - 分析单个切片，结合音频内容
-                messages = [
-                    SystemMessage(content=enhanced_system_prompt),
-                    HumanMessage(
-                        content=f"请深度分析这个视频切片，重点关注：1）切片的内容和情节；2）画面中的具体元素、人物、环境；3）色彩、光线、氛围等细节。\n\n切片信息：第{i+1}/{len(slices)}个切片，原视频时间范围 {slice_start:.1f}s - {slice_start+slice_duration:.1f}s\n\n切片对应的音频内容：{current_slice_audio}",
-                        additional_kwargs={
-                            'video_path': slice_path,
-                            'fps': fps,
-                            'keyframes': slice_keyframes  # 传递关键帧信息
-                        }
-                    )
-                ]
-                
-                # 调用LangChain模型分析切片
-                slice_result = self.llm.generate([messages])
-                slice_analysis = slice_result.generations[0][0].message.content
-                
-                all_analysis_results.append({
-                    'slice_index': i,
-                    'start_time': slice_start,
-                    'end_time': slice_start + slice_duration,
-                    'analysis': slice_analysis,
-                    'keyframes': slice_keyframes,  # 保存关键帧信息
-                    'preview_file': slice_preview,  # 保存预览图
-                    'slice_path': slice_path,  # 保存切片路径
-                    'audio_content': current_slice_audio  # 保存对应音频内容
-                })
-                
-                print(f"[视频理解] 切片 {i+1} 分析完成，结果长度: {len(slice_analysis)}")
-            
-            # 整合所有切片的分析结果
-            print(f"\n[视频理解] 开始整合 {len(all_analysis_results)} 个切片的分析结果")
-            
-            # 构建整合后的分析结果，包含音频转录信息
-            integrated_analysis = f"  # 视频整体分析结果\n\n"
-            integrated_analysis += f"  # # 基本信息\n"
-            integrated_analysis += f"- 视频路径: {video_path}\n"
-            integrated_analysis += f"- 分析模型: {self.llm.model_name}\n"
-            integrated_analysis += f"- 切片数量: {len(all_analysis_results)}\n"
-            integrated_analysis += f"- 分析时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            if audio_transcription:
-                integrated_analysis += f"- 音频转录内容长度: {len(audio_transcription)}\n"
-            integrated_analysis += "\n"
+            # 近重复切片复用相邻切片的分析结果，只有各连续段的代表切片调用模型
+            sources = await asyncio.to_thread(SliceFingerprinter().plan, slices)
+            
+            # 并发分析切片，结果按切片顺序返回；单个切片失败不影响其他切片
+            print(f"[视频理解] 并发分析切片，并发上限: {self.max_concurrency}")
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            all_analysis_results = [None] * len(slices)
+            pending = [i for i, source in enumerate(sources) if source is None]
+            while pending:
+                analyzed = await asyncio.gather(*[
+                    self._analyze_slice(i, len(slices), slices[i], slice_audio_content.get(i, ''), fps, semaphore)
+                    for i in pending
+                ])
+                for i, result in zip(pending, analyzed):
+                    all_analysis_results[i] = result
+                # 复用来源分析失败的切片改为自己分析
+                pending = [i for i, source in enumerate(sources)
+                           if source is not None and not all_analysis_results[source]['success']]
+                for i in pending:
+                    sources[i] = None
+            
+            reused_count = 0
+            for i, source in enumerate(sources):
+                if source is not None:
+                    result = self._slice_result(i, slices[i], slice_audio_content.get(i, ''))
+                    result.update({'analysis': all_analysis_results[source]['analysis'], 'success': True, 'reused_from': source})
+                    all_analysis_results[i] = result
+                    reused_count += 1
+            if reused_count:
+                print(f"[视频理解] {reused_count} 个切片与相邻切片画面近似，复用已有分析，节省 {reused_count} 次模型调用")
+            
+            succeeded = [r for r in all_analysis_results if r['success']]
+            failed = [r for r in all_analysis_results if not r['success']]
+            if not succeeded:
+                error_msg = f"所有切片分析都失败了: {failed[0]['error'] if failed else '无切片'}"
+                print(f"[视频理解] {error_msg}")
+                return {
+                    "success": False,
+                    "error": error_msg,
+                    "video_path": os.path.abspath(video_path),
+                    "timestamp": datetime.now().isoformat(),
+                    "content": None,
+                    "raw_slices": all_analysis_results
+                }
+            if failed:
+                print(f"[视频理解] {len(failed)} 个切片分析失败，使用其余 {len(succeeded)} 个切片的结果: "
+                      f"{[r['slice_index'] + 1 for r in failed]}")
             
-            integrated_analysis += "  # # 切片分析结果\n\n"
-            for i, slice_data in enumerate(all_analysis_results):
-                integrated_analysis += f"
-                integrated_analysis += f"**音频内容**: {slice_data['audio_content'][:100]}...\n\n" if slice_data['audio_content'] else "\n"
-                integrated_analysis += slice_data['analysis'] + "\n\n"
+            # 分层摘要：切片分析 -> 各时间段摘要 -> 全局摘要，每次调用的输入输出都受token预算约束
+            print(f"\n[视频理解] 开始分层摘要 {len(succeeded)} 个切片的分析结果")
+            note = ""
+            if failed:
+                note = f"注意：切片 {', '.join(str(r['slice_index'] + 1) for r in failed)} 分析失败，对应时间段内容缺失，不要推测。"
             
-            # 调用模型生成整体总结，强调音视频一致性
-            print(f"[视频理解] 生成整体视频总结，强调音视频一致性")
-            summary_messages = [
-                SystemMessage(content="你是一个专业的视频内容整合专家，请将多个视频切片的分析结果整合成一个连贯的、完整的视频分析报告。\n\n要求：\n1. 总结视频的整体内容和故事情节\n2. 保持内容的连贯性和逻辑性\n3. 突出视频的重点和亮点\n4. 确保视觉内容与音频内容的一致性\n5. 使用流畅自然的语言\n6. 不要重复切片间的过渡内容\n7. 整体结构清晰，易于理解"),
-                HumanMessage(content=f"请根据以下各个切片的分析结果，生成一个完整的视频分析报告：\n\n{integrated_analysis}")
-            ]
+            async def generate(system_prompt: str, user_prompt: str) -> str:
+                result = await self.llm.agenerate([[SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)]])
+                return result.generations[0][0].message.content
             
-            summary_result = self.llm.generate([summary_messages])
-            final_analysis = summary_result.generations[0][0].message.content
+            summary_result = await UnderstandingSummarizer(generate).summarize(succeeded, note)
+            final_analysis = summary_result['summary']
+            print(f"[视频理解] 生成 {len(summary_result['digests'])} 个时间段摘要，摘要调用 {summary_result['calls']} 次，"
+                  f"输入约 {summary_result['input_tokens']} tokens")
             
             time_cost = time.time() - start_time
             print(f"[视频理解] 视频分析完成，总耗时: {time_cost:.2f}秒")
@@ -364,10 +486,13 @@ class VideoAnalysisAgent:
                 "model_used": self.llm.model_name,
                 "fps": fps,
                 "time_cost": round(time_cost, 2),
-                "content": final_analysis,
+                "content": final_analysis,  # 全局摘要
+                "digests": summary_result['digests'],  # 各时间段摘要，场景提示词只使用对应时间段的摘要
                 "timestamp": datetime.now().isoformat(),
-                "slice_count": len(all_analysis_results),
-                "raw_slices": all_analysis_results,
+                "slice_count": len(succeeded),
+                "raw_slices": succeeded,
+                "failed_slices": failed,  # 分析失败的切片，不参与后续场景生成
+                "vlm_calls_saved": reused_count,  # 近重复切片复用分析结果节省的模型调用次数
                 "slices": slices,  # 保存完整的切片信息，包含关键帧
                 "audio_transcription": audio_transcription  # 保存音频转录结果
             }
@@ -387,6 +512,82 @@ class VideoAnalysisAgent:
                 "content": None
             }
     
+    def _slice_result(self, index: int, slice_info: Dict[str, Any], slice_audio: str) -> Dict[str, Any]:
+        # 单个切片的分析结果结构，reused_from不为None时表示复用了该索引切片的分析
+        return {
+            'slice_index': index,
+            'start_time': slice_info['start_time'],
+            'end_time': slice_info['start_time'] + slice_info['duration'],
+            'analysis': '',
+            'keyframes': slice_info.get('keyframes', []),  # 保存关键帧信息
+            'preview_file': slice_info.get('preview_file', ''),  # 保存预览图
+            'slice_path': slice_info['output_file'],  # 保存切片路径
+            'audio_content': slice_audio,  # 保存对应音频内容
+            'success': False,
+            'error': None,
+            'attempts': 0,
+            'reused_from': None
+        }
+    
+    async def _analyze_slice(self, index: int, total: int, slice_info: Dict[str, Any], slice_audio: str,
+                             fps: int, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """分析单个切片，超时或失败时按配置重试，最终失败时返回带错误信息的结果而不是抛出异常"""
+        slice_path = slice_info['output_file']
+        slice_start = slice_info['start_time']
+        slice_duration = slice_info['duration']
+        slice_keyframes = slice_info.get('keyframes', [])  # 获取关键帧信息
+        
+        result = self._slice_result(index, slice_info, slice_audio)
+        
+        # 构建增强的系统提示词，包含音频内容的重要性
+        enhanced_system_prompt = self.system_prompt + "\n\n特别重要：请结合提供的音频转录内容，确保视觉分析与音频内容保持一致，提高内容理解的准确性。"
+        
+        # 构建消息链 - 分析单个切片，结合音频内容
+        messages = [
+            SystemMessage(content=enhanced_system_prompt),
+            HumanMessage(
+                content=f"请深度分析这个视频切片，重点关注：1）切片的内容和情节；2）画面中的具体元素、人物、环境；3）色彩、光线、氛围等细节。\n\n切片信息：第{index+1}/{total}个切片，原视频时间范围 {slice_start:.1f}s - {slice_start+slice_duration:.1f}s\n\n切片对应的音频内容：{slice_audio}",
+                additional_kwargs={
+                    'video_path': slice_path,
+                    'fps': fps,
+                    'keyframes': slice_keyframes  # 传递关键帧信息
+                }
+            )
+        ]
+        
+        for attempt in range(self.slice_retries + 1):
+            result['attempts'] = attempt + 1
+            slice_start_time = time.time()
+            try:
+                # 只在调用期间占用并发名额，重试等待时释放给其他切片
+                async with semaphore:
+                    print(f"[视频理解] 开始分析切片 {index+1}/{total}: {slice_path}，"
+                          f"关键帧 {len(slice_keyframes)} 个，第 {attempt + 1} 次尝试")
+                    slice_result = await self.llm.agenerate([messages])
+                slice_analysis = slice_result.generations[0][0].message.content
+                if not slice_analysis or not slice_analysis.strip():
+                    raise ValueError("模型返回内容为空")
+                
+                result['analysis'] = slice_analysis
+                result['success'] = True
+                result['error'] = None
+                print(f"[视频理解] 切片 {index+1} 分析完成，耗时 {time.time() - slice_start_time:.1f}秒，结果长度: {len(slice_analysis)}")
+                return result
+            except DashScopeError as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                if not e.retryable:
+                    # 请求本身的错误(参数、鉴权、内容审核)重试也不会成功
+                    print(f"[视频理解] 切片 {index+1} 分析失败且不可重试: {result['error']}")
+                    break
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+            
+            print(f"[视频理解] 切片 {index+1} 第 {attempt + 1} 次分析失败: {result['error']}")
+            if attempt < self.slice_retries:
+                await asyncio.sleep(self.retry_delay * (attempt + 1))
+        
+        return result
+    
     def _get_slice_audio_content(self, full_transcription: str, slices: List[Dict]) -> Dict[int, str]:
         if not full_transcription:
             return {}
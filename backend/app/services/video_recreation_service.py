@@ -1,14 +1,18 @@
 import os
 import sys
 import json
+import asyncio
+import contextvars
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from config import Config
+from app.config.video_reconstruction_config import get_config
 from .video_analysis_agent import VideoAnalysisAgent
 from .speech_recognition_service import SimpleSpeechRecognizer
 from .scene_segmentation_service import SceneSegmentationService
@@ -18,6 +22,12 @@ from app.services.comfyui_service import ComfyUIService
 from app.services.comfyui_prompt_converter import ComfyUIPromptConverter
 from app.services.nano_banana_service import NanoBananaService
 from app.services.qwen_video_service import QwenVideoService
+from app.services.ffmpeg_service import FFmpegService
+from app.services.step_cache import get_step_cache
+from app.services.understanding_summarizer import build_scene_context
+from app.services.structured_output import get_structured_output_metrics
+from app.services.progress_events import bind_recreation, emit_progress
+from app.services.tracing import start_trace, span, traced, trace_methods
 
 # 添加视频一致性检查代理
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'video_consistency_agent'))
@@ -30,6 +40,8 @@ class VideoRecreationService:
         self.speech_recognizer = SimpleSpeechRecognizer()
         self.scene_segmenter = SceneSegmentationService()
         self.content_generator = ContentGenerationService()
+        self.ffmpeg_service = FFmpegService()
+        self.single_pass_render = get_config().get("render.single_pass", True)
         
         # ComfyUI集成服务
         self.comfyui_service = ComfyUIService()
@@ -57,6 +69,16 @@ class VideoRecreationService:
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
         config_path = os.path.join(project_root, 'video_consistency_agent', 'config', 'config.yaml')
         self.consistency_agent = ConsistencyAgent(config_path)
+        # 一致性检查器属于独立的agent包，在实例上套span，不让其依赖后端的追踪模块
+        trace_methods(self.consistency_agent, ['check_consistency'], 'consistency', 'consistency')
+        analysis = self.consistency_agent.analysis
+        trace_methods(analysis.visual_checker, ['check_visual_consistency'], 'consistency', 'consistency')
+        trace_methods(analysis.temporal_checker, ['check_temporal_consistency'], 'consistency', 'consistency')
+        trace_methods(analysis.semantic_checker, ['check_semantic_consistency'], 'consistency', 'consistency')
+        trace_methods(analysis.style_checker, ['check_style_consistency'], 'consistency', 'consistency')
+        
+        # 步骤缓存：按输入哈希复用各步骤结果，支持重跑和断点续跑
+        self.step_cache = get_step_cache()
         
         # 保留原有的DashScope配置（可选回退）
         self.api_key = os.getenv("DASHSCOPE_API_KEY")
@@ -151,7 +173,8 @@ class VideoRecreationService:
                         setattr(recreation, key, value)
             
             recreation.updated_at = datetime.now()
-            db.session.commit()
+            with span('db.update_recreation', 'db'):
+                db.session.commit()
             print(f"[数据库] 任务 {recreation_id} 数据更新完成")
             
         except Exception as e:
@@ -161,6 +184,7 @@ class VideoRecreationService:
             print(f"[数据库] 继续执行流程，跳过数据库更新")
     
     def log_step(self, recreation_id: int, step_name: str, status: str, message: str):
+        emit_progress('step', {'step': step_name, 'status': status, 'message': message}, recreation_id=recreation_id)
         try:
             log = RecreationLog(
                 recreation_id=recreation_id,
@@ -170,12 +194,14 @@ class VideoRecreationService:
                 created_at=datetime.now()
             )
             db.session.add(log)
-            db.session.commit()
+            with span('db.log_step', 'db', step=step_name):
+                db.session.commit()
             
         except Exception as e:
             db.session.rollback()
             print(f"[日志] 记录步骤日志失败: {e}")
     
+    @traced('step.audio_transcription')
     def extract_and_transcribe_audio(self, video_path: str, recreation_id: int = None, task_dir: str = None) -> Dict[str, Any]:
         try:
             print(f"[语音转录] 开始处理视频: {video_path}")
@@ -251,14 +277,15 @@ class VideoRecreationService:
                 'audio_path': audio_path if 'audio_path' in locals() else ''
             }
     
+    @traced('step.scene_analysis')
     def generate_scene_prompts(self, video_path: str, video_understanding: Dict[str, Any], audio_transcription: str, recreation_id: int = None, task_dir: str = None) -> Dict[str, Any]:
         try:
             print(f"[场景分割] 开始生成场景提示词: {video_path}")
             
-            # 提取视频理解内容和音频文本
+            # 提取视频理解内容和音频文本；每个场景只使用全局摘要和对应时间段的摘要
             video_content = video_understanding.get('content', '') if video_understanding.get('success') else ''
             audio_text = audio_transcription  # 直接使用字符串，不需要.get()方法
-            print(f"[场景分割] 视频理解内容长度: {len(video_content)}")
+            print(f"[场景分割] 视频理解全局摘要长度: {len(video_content)}, 时间段摘要: {len(video_understanding.get('digests', []))} 个")
             print(f"[场景分割] 音频文本长度: {len(audio_text)}")
             
             # 直接从视频理解结果中的切片创建场景，不进行智能场景分割
@@ -287,25 +314,34 @@ class VideoRecreationService:
                 }
                 scenes.append(scene)
             
-            # 为每个场景生成视频提示词
-            enhanced_scenes = []
-            for i, scene in enumerate(scenes):
+            prompt_config = get_config().get_scene_prompts_config()
+            parallel = prompt_config.get("mode", "parallel") == "parallel"
+            
+            # 并行模式：先一次性提取全片风格与人物设定，各场景据此保持一致，不再依赖上一场景的输出
+            style_sheet = {}
+            if parallel and video_content:
+                with span('scene_prompts.style_sheet', 'dashscope'):
+                    style_sheet = self.scene_segmenter.extract_style_sheet(
+                        build_scene_context(video_understanding), audio_text
+                    ).get('style_sheet', {})
+            
+            def generate_one(i: int, scene: Dict[str, Any]) -> Dict[str, Any]:
+                enhanced_scene = scene.copy()
+                enhanced_scene['keyframes'] = scene.get('slice_data', {}).get('keyframes', [])  # 保存关键帧信息
                 try:
                     print(f"为场景 {i+1} 生成视频提示词...")
                     
                     # 生成视频提示词
                     prompt_result = self.scene_segmenter.generate_video_prompt_for_scene(
                         scene=scene,
-                        video_understanding=video_content,
+                        video_understanding=build_scene_context(video_understanding, scene['start_time'], scene['end_time']) if video_content else '',
                         audio_text=audio_text,
-                        scene_index=i
+                        scene_index=i,
+                        style_sheet=style_sheet or None
                     )
                     
                     # 将提示词结果添加到场景中
-                    enhanced_scene = scene.copy()
                     enhanced_scene['video_prompt'] = prompt_result
-                    enhanced_scene['keyframes'] = scene.get('slice_data', {}).get('keyframes', [])  # 保存关键帧信息
-                    enhanced_scenes.append(enhanced_scene)
                     
                     if prompt_result.get('success'):
                         print(f"场景 {i+1} 提示词生成成功")
@@ -314,19 +350,32 @@ class VideoRecreationService:
                         
                 except Exception as e:
                     print(f"场景 {i+1} 提示词生成时发生错误: {e}")
-                    enhanced_scene = scene.copy()
                     enhanced_scene['video_prompt'] = {
                         'success': False,
                         'error': str(e),
                         'video_prompt': ''
                     }
-                    enhanced_scene['keyframes'] = scene.get('slice_data', {}).get('keyframes', [])  # 保存关键帧信息
-                    enhanced_scenes.append(enhanced_scene)
+                return enhanced_scene
+            
+            # 为每个场景生成视频提示词；并行模式下所有场景同时发出请求，结果按场景顺序返回
+            if parallel and len(scenes) > 1:
+                max_workers = max(1, min(int(prompt_config.get("max_concurrency", 6)), len(scenes)))
+                print(f"[场景分割] 并发生成 {len(scenes)} 个场景的提示词，并发上限: {max_workers}")
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scene-prompt') as executor:
+                    futures = [executor.submit(contextvars.copy_context().run, generate_one, i, scene) for i, scene in enumerate(scenes)]
+                    enhanced_scenes = [future.result() for future in futures]
+            else:
+                enhanced_scenes = [generate_one(i, scene) for i, scene in enumerate(scenes)]
+            
+            if parallel:
+                self._polish_and_link_scenes(enhanced_scenes, style_sheet, prompt_config.get("polish", False))
             
             return {
                 'success': True,
                 'scenes': enhanced_scenes,
                 'total_scenes': len(enhanced_scenes),
+                'prompt_mode': 'parallel' if parallel else 'sequential',
+                'style_sheet': style_sheet,
                 'timestamp': datetime.now().isoformat()
             }
             
@@ -339,545 +388,660 @@ class VideoRecreationService:
                 'timestamp': datetime.now().isoformat()
             }
     
-    async def process_video_for_recreation(self, video_path: str, recreation_id: int, use_nano_banana: bool = False, use_qwen: bool = False, slice_limit: int = 0, existing_prompt_data: Dict[str, Any] = None) -> Dict[str, Any]:
-        print(f"🔧 处理参数: slice_limit={slice_limit}")
-        try:
-            print(f"开始处理视频: {video_path}，任务ID: {recreation_id}")
-            
-            # 检查是否存在现有任务记录
-            existing_recreation = self.find_existing_recreation(video_path)
-            if existing_recreation and existing_recreation.status == 'completed':
-                print(f"[任务管理] 该视频已经完成二创，返回现有结果")
-                return {
-                    'processing_status': 'success',
-                    'recreation_id': existing_recreation.id,
-                    'task_dir': self.create_task_directory(existing_recreation.id, video_path),
-                    'final_video_path': existing_recreation.final_video_path,
-                    'final_video_with_audio_path': existing_recreation.final_video_with_audio_path,
-                    'new_script': existing_recreation.new_script_content,
-                    'tts_result': {
-                        'audio_path': existing_recreation.tts_audio_path,
-                        'duration': existing_recreation.tts_audio_duration
-                    },
-                    'message': '使用已完成的二创结果'
-                }
-            
-            # 创建任务目录
-            task_dir = self.create_task_directory(recreation_id, video_path)
-            
-            # 计算视频哈希并保存到数据库
-            video_hash = self.calculate_video_hash(video_path)
-            self.update_recreation_step(recreation_id, {
-                'original_video_path': video_path,
-                'original_video_hash': video_hash
-            })
-            
-            # 步骤1: 视频内容理解
-            print("步骤1: 视频内容理解...")
-            self.log_step(recreation_id, 'video_understanding', 'processing', '开始视频内容理解')
-            
-            # 强制重新生成视频理解结果，确保包含关键帧信息
-            print(f"[任务管理] 强制重新生成视频理解结果，确保包含关键帧信息")
-            start_time = time.time()
-            video_understanding = self.video_analyzer.understand_video_content_and_scenes(
-                video_path=video_path,
-                fps=5,  # 降低帧率，加快处理速度
-                slice_limit=slice_limit  # 传递切片限制参数
+    def _collect_understanding_artifacts(self, video_understanding: Dict[str, Any]) -> List[str]:
+        # 收集视频理解结果引用的本地文件（切片、预览图、关键帧），随缓存一起保存
+        artifacts = []
+        for slice_data in video_understanding.get('raw_slices', []):
+            for file_path in [slice_data.get('slice_path'), slice_data.get('preview_file')] + list(slice_data.get('keyframes', [])):
+                if file_path and isinstance(file_path, str) and os.path.isfile(file_path):
+                    artifacts.append(file_path)
+        return artifacts
+    
+    def _save_scenes_to_db(self, recreation_id: int, scenes: List[Dict[str, Any]]):
+        # 保存场景和prompt到数据库，已存在的场景记录不重复写入
+        if RecreationScene.query.filter_by(recreation_id=recreation_id).first():
+            return
+        for i, scene in enumerate(scenes):
+            video_prompt_data = scene.get('video_prompt', {})
+            scene_obj = RecreationScene(
+                recreation_id=recreation_id,
+                scene_index=i,
+                start_time=scene.get('start_time', 0),
+                end_time=scene.get('end_time', 0),
+                duration=scene.get('duration', 0),
+                description=scene.get('description', ''),
+                video_prompt=video_prompt_data.get('video_prompt', '') if isinstance(video_prompt_data, dict) else str(video_prompt_data),
+                technical_params=scene.get('technical_params', {}),
+                style_elements=scene.get('style_elements', {}),
+                prompt_generation_model='SceneSegmentationService'
             )
-            understanding_time = time.time() - start_time
-            
-            if video_understanding.get('success'):
-                # 保存视频理解结果到数据库，包括关键帧信息
-                self.update_recreation_step(recreation_id, {
-                    'video_understanding': video_understanding.get('content', ''),
-                    'understanding_model': 'VideoAnalysisAgent',
-                    'understanding_time_cost': understanding_time
-                })
-                self.log_step(recreation_id, 'video_understanding', 'success', f'视频理解完成，耗时: {understanding_time:.2f}秒')
-                # 打印关键帧信息，用于调试
-                if 'raw_slices' in video_understanding:
-                    total_keyframes = sum(len(slice_data.get('keyframes', [])) for slice_data in video_understanding['raw_slices'])
-                    print(f"[视频理解] 生成的切片数量: {len(video_understanding['raw_slices'])}")
-                    print(f"[视频理解] 提取的关键帧总数: {total_keyframes}")
-            else:
-                error_msg = video_understanding.get('error', '视频理解失败')
-                self.log_step(recreation_id, 'video_understanding', 'failed', error_msg)
-                raise Exception(error_msg)
-            
-            # 步骤2: 语音转文本
-            print("步骤2: 语音转文本...")
-            self.log_step(recreation_id, 'audio_transcription', 'processing', '开始语音转文本')
-            
-            # 检查是否已经有语音转录结果
-            audio_result = None
-            audio_transcription = ''
-            if existing_recreation and existing_recreation.transcription_text and existing_recreation.audio_file_path:
-                print(f"[任务管理] 发现已有语音转录结果，跳过语音转文本步骤")
-                audio_transcription = existing_recreation.transcription_text
-                audio_result = {
-                    'success': True,
-                    'text': audio_transcription,
-                    'audio_path': existing_recreation.audio_file_path
+            db.session.add(scene_obj)
+        with span('db.save_scenes', 'db', scene_count=len(scenes)):
+            db.session.commit()
+        print(f"[任务管理] 场景和prompt已保存到数据库")
+    
+    def _polish_and_link_scenes(self, scenes: List[Dict[str, Any]], style_sheet: Dict[str, Any], polish: bool):
+        # 并行模式的收尾：可选地一次调用统一润色所有提示词，再在本地为每个场景记录上一场景的信息供后续关键帧生成使用
+        succeeded = [scene for scene in scenes if isinstance(scene.get('video_prompt'), dict) and scene['video_prompt'].get('success')]
+        if polish and len(succeeded) > 1:
+            with span('scene_prompts.polish', 'dashscope', scene_count=len(succeeded)):
+                polished = self.scene_segmenter.polish_scene_prompts(
+                    [scene['video_prompt'].get('video_prompt', '') for scene in succeeded], style_sheet
+                )
+            if polished:
+                for scene, video_prompt in zip(succeeded, polished):
+                    scene['video_prompt']['video_prompt'] = video_prompt
+                print(f"[场景连贯性] 已统一润色 {len(succeeded)} 个场景的提示词")
+        
+        previous_scene_info = None
+        for scene in scenes:
+            if previous_scene_info:
+                scene['previous_scene_info'] = previous_scene_info
+            video_prompt_data = scene.get('video_prompt', {})
+            if isinstance(video_prompt_data, dict) and video_prompt_data.get('success'):
+                previous_scene_info = {
+                    'video_prompt': video_prompt_data.get('video_prompt', ''),
+                    'style_elements': video_prompt_data.get('style_elements', {}),
+                    'scene_info': video_prompt_data.get('scene_info', {}),
+                    'technical_params': video_prompt_data.get('technical_params', {})
                 }
-            else:
-                audio_result = self.extract_and_transcribe_audio(video_path, recreation_id, task_dir)
-                if not audio_result.get('success'):
-                    raise Exception(f"语音转录失败: {audio_result.get('error')}")
+    
+    def _add_scene_continuity(self, scenes: List[Dict[str, Any]], video_understanding: Dict[str, Any], audio_transcription: str):
+        # 添加上下文信息到场景中，确保场景间连贯性
+        previous_scene_info = None
+        for i, scene in enumerate(scenes):
+            # 如果是第一个场景，没有上一个场景信息
+            if i > 0 and previous_scene_info:
+                # 为当前场景添加上一个场景的信息
+                scene['previous_scene_info'] = previous_scene_info
                 
-                audio_transcription = audio_result.get('text', '')
-            
-            # 步骤3: 新文案创作
-            print("步骤3: 新文案创作...")
-            self.log_step(recreation_id, 'new_script_creation', 'processing', '开始新文案创作')
-            
-            # 检查是否已经有新文案结果
-            new_script = None
-            if existing_recreation and existing_recreation.new_script_content:
-                print(f"[任务管理] 发现已有新文案结果，跳过新文案创作步骤")
-                new_script = {
-                    'success': True,
-                    'new_script': existing_recreation.new_script_content
-                }
+                # 重新生成更连贯的提示词
+                print(f"[场景连贯性] 为场景 {i+1} 添加上下文信息并重新生成提示词")
+                updated_prompt = self.scene_segmenter.generate_video_prompt_for_scene(
+                    scene=scene,
+                    video_understanding=build_scene_context(video_understanding, scene.get('start_time'), scene.get('end_time')),
+                    audio_text=audio_transcription,
+                    scene_index=i,
+                    output_format="json",
+                    previous_scene_info=previous_scene_info
+                )
+                scene['video_prompt'] = updated_prompt
+            
+            # 保存当前场景信息，供下一个场景使用
+            video_prompt_data = scene.get('video_prompt', {})
+            if isinstance(video_prompt_data, dict):
+                if video_prompt_data.get('success'):
+                    previous_scene_info = {
+                        'video_prompt': video_prompt_data.get('video_prompt', ''),
+                        'style_elements': video_prompt_data.get('style_elements', {}),
+                        'scene_info': video_prompt_data.get('scene_info', {}),
+                        'technical_params': video_prompt_data.get('technical_params', {})
+                    }
             else:
-                new_script = self.content_generator.generate_new_script(
+                previous_scene_info = None
+        
+        print(f"[场景连贯性] 已处理 {len(scenes)} 个场景，添加了上下文信息确保连贯性")
+    
+    async def _join_branches(self, *coroutines):
+        # 并发执行多个分支并等待全部完成，任一分支失败时取消其余分支
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    
+    @traced('branch.understanding')
+    async def _understanding_branch(self, video_path: str, video_hash: str, recreation_id: int, slice_limit: int) -> Dict[str, Any]:
+        # 步骤1: 视频内容理解
+        print("步骤1: 视频内容理解...")
+        self.log_step(recreation_id, 'video_understanding', 'processing', '开始视频内容理解')
+        
+        understanding_key = self.step_cache.make_key('video_understanding', {
+            'video_hash': video_hash,
+            'fps': 5,
+            'slice_limit': slice_limit,
+            'model': self.video_analyzer.llm.model_name,
+            'summarization': get_config().get_summarization_config(),
+            'slice_dedup': get_config().get_slice_dedup_config(),
+            'slicing': self.ffmpeg_service.slicing_params()
+        })
+        # 切片目录位于原视频旁边，产物相对原视频所在目录保存，同一视频在其他位置上传时恢复到新位置旁边
+        slices_base_dir = os.path.dirname(video_path)
+        video_understanding = self.step_cache.get('video_understanding', understanding_key, base_dir=slices_base_dir)
+        understanding_cached = bool(video_understanding)
+        if understanding_cached:
+            print(f"[步骤缓存] 视频理解命中缓存，跳过视频理解步骤")
+            understanding_time = video_understanding.get('time_cost', 0)
+        else:
+            start_time = time.time()
+            with span('step.video_understanding', slice_limit=slice_limit):
+                video_understanding = await self.video_analyzer.understand_video_content_and_scenes(
+                    video_path=video_path,
+                    fps=5,  # 降低帧率，加快处理速度
+                    slice_limit=slice_limit  # 传递切片限制参数
+                )
+            understanding_time = time.time() - start_time
+            # 有切片分析失败的部分结果不写缓存，重跑时重新分析
+            if video_understanding.get('success') and not video_understanding.get('failed_slices'):
+                await asyncio.to_thread(self.step_cache.put, 'video_understanding', understanding_key, video_understanding,
+                                        self._collect_understanding_artifacts(video_understanding), slices_base_dir)
+        
+        if not video_understanding.get('success'):
+            error_msg = video_understanding.get('error', '视频理解失败')
+            self.log_step(recreation_id, 'video_understanding', 'failed', error_msg)
+            raise Exception(error_msg)
+        
+        # 保存视频理解结果到数据库，包括关键帧信息
+        self.update_recreation_step(recreation_id, {
+            'video_understanding': video_understanding.get('content', ''),
+            'understanding_model': 'VideoAnalysisAgent',
+            'understanding_time_cost': understanding_time
+        })
+        if understanding_cached:
+            # 命中缓存时本次没有调用模型，不重复上报原任务节省的调用次数
+            self.log_step(recreation_id, 'video_understanding', 'success', '视频理解完成，命中步骤缓存')
+        else:
+            self.log_step(recreation_id, 'video_understanding', 'success',
+                          f'视频理解完成，耗时: {understanding_time:.2f}秒，近重复切片节省模型调用 {video_understanding.get("vlm_calls_saved", 0)} 次')
+        # 打印关键帧信息，用于调试
+        if 'raw_slices' in video_understanding:
+            total_keyframes = sum(len(slice_data.get('keyframes', [])) for slice_data in video_understanding['raw_slices'])
+            print(f"[视频理解] 生成的切片数量: {len(video_understanding['raw_slices'])}")
+            print(f"[视频理解] 提取的关键帧总数: {total_keyframes}")
+        
+        return video_understanding
+    
+    @traced('branch.transcription')
+    async def _transcription_branch(self, video_path: str, video_hash: str, recreation_id: int, task_dir: str) -> Dict[str, Any]:
+        # 步骤2: 语音转文本，与视频理解并行执行
+        print("步骤2: 语音转文本...")
+        self.log_step(recreation_id, 'audio_transcription', 'processing', '开始语音转文本')
+        
+        transcription_key = self.step_cache.make_key('audio_transcription', {
+            'video_hash': video_hash,
+            'recognizer': type(self.speech_recognizer.recognizer).__name__ if self.speech_recognizer.recognizer else 'simulated'
+        })
+        audio_result = self.step_cache.get('audio_transcription', transcription_key, base_dir=task_dir)
+        if audio_result:
+            print(f"[步骤缓存] 语音转录命中缓存，跳过语音转文本步骤")
+        else:
+            # 在线程中执行提取和识别；数据库写入留在事件循环线程中完成
+            audio_result = await asyncio.to_thread(self.extract_and_transcribe_audio, video_path, None, task_dir)
+            if not audio_result.get('success'):
+                self.log_step(recreation_id, 'audio_transcription', 'failed', f"语音转录失败: {audio_result.get('error')}")
+                raise Exception(f"语音转录失败: {audio_result.get('error')}")
+            await asyncio.to_thread(self.step_cache.put, 'audio_transcription', transcription_key, audio_result, [audio_result.get('audio_path')], task_dir)
+        
+        self.update_recreation_step(recreation_id, {
+            'audio_file_path': audio_result.get('audio_path'),
+            'transcription_text': audio_result.get('text', ''),
+            'transcription_service': 'SimpleSpeechRecognizer'
+        })
+        self.log_step(recreation_id, 'audio_transcription', 'success', f"语音转录完成，文本长度: {len(audio_result.get('text', ''))}")
+        
+        return audio_result
+    
+    @traced('branch.script_and_tts')
+    async def _script_and_tts_branch(self, recreation_id: int, task_dir: str, video_understanding: Dict[str, Any], audio_transcription: str):
+        # 步骤3: 新文案创作
+        print("步骤3: 新文案创作...")
+        self.log_step(recreation_id, 'new_script_creation', 'processing', '开始新文案创作')
+        
+        script_key = self.step_cache.make_key('new_script_creation', {
+            'video_understanding': video_understanding.get('content', ''),
+            'original_script': audio_transcription,
+            'model': 'qwen-max'
+        })
+        new_script = self.step_cache.get('new_script_creation', script_key)
+        if new_script:
+            print(f"[步骤缓存] 新文案命中缓存，跳过新文案创作步骤")
+        else:
+            with span('step.new_script_creation'):
+                new_script = await asyncio.to_thread(
+                    self.content_generator.generate_new_script,
                     video_understanding=video_understanding.get('content', ''),
                     original_script=audio_transcription
                 )
-                
-                if new_script.get('success'):
-                    self.update_recreation_step(recreation_id, {
-                        'new_script_content': new_script.get('new_script', ''),
-                        'script_generation_model': 'qwen-max'
-                    })
-                    self.log_step(recreation_id, 'new_script_creation', 'success', '新文案创作完成')
-                else:
-                    error_msg = new_script.get('error', '新文案创作失败')
-                    self.log_step(recreation_id, 'new_script_creation', 'failed', error_msg)
-                    raise Exception(error_msg)
-            
-            # 步骤4: 智能场景分割和提示词生成
-            print("步骤4: 智能场景分割和提示词生成...")
-            self.log_step(recreation_id, 'scene_analysis', 'processing', '开始场景分析')
-            
-            # 检查是否已经有场景分析结果
-            scene_analysis = None
-            
-            # 1. 优先使用传入的已有prompt数据
-            if existing_prompt_data:
-                print(f"[任务管理] 使用传入的已有prompt数据，跳过场景分割步骤")
-                # 检查已有prompt数据的格式
-                if isinstance(existing_prompt_data, dict):
-                    # 从已有prompt数据中提取场景信息
-                    if 'scenes' in existing_prompt_data:
-                        scene_analysis = {
-                            'success': True,
-                            'scenes': existing_prompt_data['scenes']
-                        }
-                    elif 'scene_analysis' in existing_prompt_data and 'scenes' in existing_prompt_data['scene_analysis']:
-                        scene_analysis = existing_prompt_data['scene_analysis']
-                    elif 'video_generation' in existing_prompt_data and 'scenes' in existing_prompt_data['video_generation']:
-                        # 从video_generation中提取场景信息
-                        scene_analysis = {
-                            'success': True,
-                            'scenes': existing_prompt_data['video_generation']['scenes']
-                        }
-            # 2. 其次检查是否有现有任务记录
-            elif existing_recreation and existing_recreation.scenes:
-                print(f"[任务管理] 发现已有场景分析结果，跳过场景分割步骤")
-                # 从数据库中获取场景信息
-                scenes = []
-                for scene in existing_recreation.scenes:
-                    scenes.append({
-                        'scene_id': scene.scene_index,
-                        'start_time': scene.start_time,
-                        'end_time': scene.end_time,
-                        'duration': scene.duration,
-                        'description': scene.description,
-                        'video_prompt': {
-                            'success': True,
-                            'video_prompt': scene.video_prompt
-                        },
-                        'technical_params': scene.technical_params,
-                        'style_elements': scene.style_elements
-                    })
-                scene_analysis = {
-                    'success': True,
-                    'scenes': scenes
-                }
-            # 3. 最后生成新的场景提示词
-            else:
-                scene_analysis = self.generate_scene_prompts(
-                    video_path=video_path,
-                    video_understanding=video_understanding,
-                    audio_transcription=audio_transcription,
-                    recreation_id=recreation_id,
-                    task_dir=task_dir
+            if new_script.get('success'):
+                self.step_cache.put('new_script_creation', script_key, new_script)
+        
+        if new_script.get('success'):
+            self.update_recreation_step(recreation_id, {
+                'new_script_content': new_script.get('new_script', ''),
+                'script_generation_model': 'qwen-max'
+            })
+            self.log_step(recreation_id, 'new_script_creation', 'success', '新文案创作完成')
+        else:
+            error_msg = new_script.get('error', '新文案创作失败')
+            self.log_step(recreation_id, 'new_script_creation', 'failed', error_msg)
+            raise Exception(error_msg)
+        
+        # 步骤6: 文本转语音，只依赖新文案，与场景视频生成并行执行
+        print("步骤6: 文本转语音...")
+        self.log_step(recreation_id, 'text_to_speech', 'processing', '开始文本转语音')
+        
+        tts_key = self.step_cache.make_key('text_to_speech', {
+            'text': new_script.get('new_script', ''),
+            'service': 'edge-tts',
+            'voice': 'zh-CN-XiaoxiaoNeural'
+        })
+        tts_result = self.step_cache.get('text_to_speech', tts_key, base_dir=task_dir)
+        if tts_result:
+            print(f"[步骤缓存] TTS音频命中缓存，跳过文本转语音步骤")
+        else:
+            tts_audio_path = os.path.join(task_dir, 'tts', 'tts_audio.mp3')
+            os.makedirs(os.path.dirname(tts_audio_path), exist_ok=True)
+            
+            with span('step.text_to_speech'):
+                tts_result = await asyncio.to_thread(
+                    self.content_generator.text_to_speech,
+                    text=new_script.get('new_script', ''),
+                    output_path=tts_audio_path
                 )
-                
-                if scene_analysis.get('success'):
-                    self.log_step(recreation_id, 'scene_analysis', 'success', f'场景分析完成，共{len(scene_analysis.get("scenes", []))}个场景')
-                    
-                    # 保存场景和prompt到数据库
-                    scenes = scene_analysis.get('scenes', [])
-                    
-                    # 添加上下文信息到场景中，确保场景间连贯性
-                    previous_scene_info = None
-                    for i, scene in enumerate(scenes):
-                        # 如果是第一个场景，没有上一个场景信息
-                        if i > 0 and previous_scene_info:
-                            # 为当前场景添加上一个场景的信息
-                            scene['previous_scene_info'] = previous_scene_info
-                            
-                            # 重新生成更连贯的提示词
-                            print(f"[场景连贯性] 为场景 {i+1} 添加上下文信息并重新生成提示词")
-                            updated_prompt = self.scene_segmenter.generate_video_prompt_for_scene(
-                                scene=scene,
-                                video_understanding=video_understanding.get('content', ''),
-                                audio_text=audio_transcription,
-                                scene_index=i,
-                                output_format="json",
-                                previous_scene_info=previous_scene_info
-                            )
-                            scene['video_prompt'] = updated_prompt
-                        
-                        # 保存当前场景信息，供下一个场景使用
-                        video_prompt_data = scene.get('video_prompt', {})
-                        # 确保video_prompt_data是字典格式
-                        if isinstance(video_prompt_data, dict):
-                            # 如果是字典格式，检查success字段
-                            if video_prompt_data.get('success'):
-                                previous_scene_info = {
-                                    'video_prompt': video_prompt_data.get('video_prompt', ''),
-                                    'style_elements': video_prompt_data.get('style_elements', {}),
-                                    'scene_info': video_prompt_data.get('scene_info', {}),
-                                    'technical_params': video_prompt_data.get('technical_params', {})
-                                }
-                        else:
-                            # 如果不是字典格式，跳过保存
-                            previous_scene_info = None
-                        
-                        # 保存场景到数据库
-                        scene_obj = RecreationScene(
-                            recreation_id=recreation_id,
-                            scene_index=i,
-                            start_time=scene.get('start_time', 0),
-                            end_time=scene.get('end_time', 0),
-                            duration=scene.get('duration', 0),
-                            description=scene.get('description', ''),
-                            video_prompt=scene.get('video_prompt', {}).get('video_prompt', ''),
-                            technical_params=scene.get('technical_params', {}),
-                            style_elements=scene.get('style_elements', {}),
-                            prompt_generation_model='SceneSegmentationService'
-                        )
-                        db.session.add(scene_obj)
-                    db.session.commit()
-                    print(f"[任务管理] 场景和prompt已保存到数据库")
-                    print(f"[场景连贯性] 已处理 {len(scenes)} 个场景，添加了上下文信息确保连贯性")
-                else:
-                    error_msg = scene_analysis.get('error', '场景分析失败')
-                    self.log_step(recreation_id, 'scene_analysis', 'failed', error_msg)
-                    raise Exception(error_msg)
-            
-            # 步骤4.5: 增强场景提示词，整合音频内容
-            print("步骤4.5: 增强场景提示词，整合音频内容...")
-            scenes = scene_analysis.get('scenes', [])
-            enhanced_scenes = []
-            
-            for i, scene in enumerate(scenes):
-                # 设置总场景数，用于后续音频内容分配
-                scene['total_scenes'] = len(scenes)
-                
-                # 获取当前场景对应的音频内容
-                scene_audio_content = self._get_scene_audio_content(audio_transcription, scene)
-                
-                # 增强视频提示词，将音频内容整合进去
-                video_prompt_data = scene.get('video_prompt', {})
-                if isinstance(video_prompt_data, dict) and video_prompt_data.get('success'):
-                    original_prompt = video_prompt_data.get('video_prompt', '')
-                    
-                    # 增强提示词，整合音频内容
-                    enhanced_prompt = f"{original_prompt}\n\n特别重要：请结合以下音频内容，确保生成的视频与音频内容保持一致：\n{scene_audio_content}"
-                    
-                    # 更新场景提示词
-                    scene['video_prompt']['video_prompt'] = enhanced_prompt
-                    
-                enhanced_scenes.append(scene)
-            
-            # 更新场景分析结果
-            scene_analysis['scenes'] = enhanced_scenes
-            print(f"[提示词增强] 已增强 {len(enhanced_scenes)} 个场景的提示词，整合了音频内容")
-            
-            # 步骤5: 视频生成（根据参数选择服务）
-            # 检查是否所有场景都已经生成了视频
-            all_scenes_generated = False
-            if existing_recreation and existing_recreation.scenes:
-                # 检查每个场景是否都有生成的视频
-                all_scenes_generated = all(scene.generated_video_path for scene in existing_recreation.scenes)
-                
-                if all_scenes_generated:
-                    print(f"[任务管理] 发现所有场景都已生成视频，跳过视频生成步骤")
-                    # 从数据库中获取生成的视频信息
-                    generated_videos = []
-                    for scene in existing_recreation.scenes:
-                        generated_videos.append({
-                            'scene_index': scene.scene_index,
-                            'scene_id': scene.scene_index,
-                            'success': True,
-                            'local_path': scene.generated_video_path,
-                            'prompt': scene.video_prompt,
-                            'duration': scene.duration,
-                            'start_time': scene.start_time,
-                            'end_time': scene.end_time
-                        })
-                    
-                    video_generation_result = {
+            if tts_result.get('success'):
+                await asyncio.to_thread(self.step_cache.put, 'text_to_speech', tts_key, tts_result, [tts_result.get('audio_path')], task_dir)
+        
+        if tts_result.get('success'):
+            self.update_recreation_step(recreation_id, {
+                'tts_audio_path': tts_result.get('audio_path'),
+                'tts_service': 'edge-tts',
+                'tts_voice_model': 'zh-CN-XiaoxiaoNeural',
+                'tts_audio_duration': tts_result.get('duration', 0)
+            })
+            self.log_step(recreation_id, 'text_to_speech', 'success', '文本转语音完成')
+        else:
+            error_msg = tts_result.get('error', '文本转语音失败')
+            self.log_step(recreation_id, 'text_to_speech', 'failed', error_msg)
+            raise Exception(error_msg)
+        
+        return new_script, tts_result
+    
+    @traced('branch.scene_video')
+    async def _scene_video_branch(self, video_path: str, recreation_id: int, task_dir: str, video_understanding: Dict[str, Any],
+                                  audio_transcription: str, use_nano_banana: bool, use_qwen: bool, existing_prompt_data: Dict[str, Any] = None):
+        # 步骤4: 智能场景分割和提示词生成
+        print("步骤4: 智能场景分割和提示词生成...")
+        self.log_step(recreation_id, 'scene_analysis', 'processing', '开始场景分析')
+        
+        scene_analysis = None
+        
+        # 1. 优先使用传入的已有prompt数据
+        if existing_prompt_data:
+            print(f"[任务管理] 使用传入的已有prompt数据，跳过场景分割步骤")
+            # 检查已有prompt数据的格式
+            if isinstance(existing_prompt_data, dict):
+                # 从已有prompt数据中提取场景信息
+                if 'scenes' in existing_prompt_data:
+                    scene_analysis = {
                         'success': True,
-                        'total_scenes': len(existing_recreation.scenes),
-                        'successful_count': len(existing_recreation.scenes),
-                        'failed_count': 0,
-                        'output_directory': os.path.dirname(existing_recreation.scenes[0].generated_video_path) if existing_recreation.scenes else task_dir,
-                        'generated_videos': generated_videos
+                        'scenes': existing_prompt_data['scenes']
                     }
-                    
-                    self.log_step(recreation_id, 'video_generation', 'success', f'复用已有视频，成功: {len(generated_videos)}')
-            
-            if not all_scenes_generated:
-                if use_qwen:
-                    print("步骤5: Qwen模型视频生成...")
-                    self.log_step(recreation_id, 'video_generation', 'processing', '开始Qwen模型视频生成')
-                    
-                    video_generation_result = await self.generate_videos_with_qwen(
-                        scene_analysis=scene_analysis,
-                        video_path=video_path,
-                        recreation_id=recreation_id,
-                        task_dir=task_dir,
-                        video_understanding=video_understanding
-                    )
-                    
-                    if video_generation_result.get('success'):
-                        # 更新数据库中的场景视频路径
-                        for video_info in video_generation_result.get('generated_videos', []):
-                            if video_info.get('success'):
-                                scene = RecreationScene.query.filter_by(
-                                    recreation_id=recreation_id,
-                                    scene_index=video_info.get('scene_index')
-                                ).first()
-                                if scene:
-                                    scene.generated_video_path = video_info.get('local_path')
-                                    scene.generation_status = 'completed'
-                                    scene.generation_service = 'qwen'
-                                    scene.generation_completed_at = datetime.now()
-                        db.session.commit()
-                        
-                        self.log_step(recreation_id, 'video_generation', 'success', f'Qwen模型视频生成完成，成功: {video_generation_result.get("successful_count", 0)}')
-                    else:
-                        self.log_step(recreation_id, 'video_generation', 'failed', video_generation_result.get('error', 'Qwen模型视频生成失败'))
-                elif use_nano_banana:
-                    print("步骤5: Nano Banana视频生成...")
-                    self.log_step(recreation_id, 'video_generation', 'processing', '开始Nano Banana视频生成')
-                    
-                    video_generation_result = self.generate_videos_with_nano_banana(
-                        scene_analysis=scene_analysis,
-                        video_path=video_path,
-                        recreation_id=recreation_id,
-                        task_dir=task_dir
-                    )
-                    
-                    if video_generation_result.get('success'):
-                        # 更新数据库中的场景视频路径
-                        for video_info in video_generation_result.get('generated_videos', []):
-                            if video_info.get('success'):
-                                scene = RecreationScene.query.filter_by(
-                                    recreation_id=recreation_id,
-                                    scene_index=video_info.get('scene_index')
-                                ).first()
-                                if scene:
-                                    scene.generated_video_path = video_info.get('local_path')
-                                    scene.generation_status = 'completed'
-                                    scene.generation_service = 'nano_banana'
-                                    scene.generation_completed_at = datetime.now()
-                        db.session.commit()
-                        
-                        self.log_step(recreation_id, 'video_generation', 'success', f'Nano Banana视频生成完成，成功: {video_generation_result.get("successful_count", 0)}')
-                    else:
-                        self.log_step(recreation_id, 'video_generation', 'failed', video_generation_result.get('error', 'Nano Banana视频生成失败'))
+                elif 'scene_analysis' in existing_prompt_data and 'scenes' in existing_prompt_data['scene_analysis']:
+                    scene_analysis = existing_prompt_data['scene_analysis']
+                elif 'video_generation' in existing_prompt_data and 'scenes' in existing_prompt_data['video_generation']:
+                    # 从video_generation中提取场景信息
+                    scene_analysis = {
+                        'success': True,
+                        'scenes': existing_prompt_data['video_generation']['scenes']
+                    }
+        
+        # 2. 否则按输入查找缓存，未命中时生成新的场景提示词
+        if scene_analysis is None:
+            scene_key = self.step_cache.make_key('scene_analysis', {
+                'video_understanding': video_understanding.get('content', ''),
+                'digests': [[d.get('start_time'), d.get('end_time'), d.get('text')] for d in video_understanding.get('digests', [])],
+                'prompt_config': get_config().get_scene_prompts_config(),
+                'slices': [
+                    [s.get('start_time'), s.get('end_time'), s.get('keyframes', [])]
+                    for s in video_understanding.get('raw_slices', video_understanding.get('slices', []))
+                ],
+                'audio_transcription': audio_transcription
+            })
+            scene_analysis = self.step_cache.get('scene_analysis', scene_key)
+            # 只统计本任务的模型输出解析结果
+            with get_structured_output_metrics().track() as job_parse_metrics:
+                if scene_analysis:
+                    print(f"[步骤缓存] 场景分析命中缓存，跳过场景分割步骤")
                 else:
-                    print("步骤5: ComfyUI关键帧生成与视频生成...")
-                    self.log_step(recreation_id, 'video_generation', 'processing', '开始ComfyUI关键帧生成')
-                    
-                    video_generation_result = self.generate_videos_from_scenes(
-                        scene_analysis=scene_analysis,
+                    scene_analysis = await asyncio.to_thread(
+                        self.generate_scene_prompts,
                         video_path=video_path,
+                        video_understanding=video_understanding,
+                        audio_transcription=audio_transcription,
                         recreation_id=recreation_id,
                         task_dir=task_dir
                     )
-                    
-                    if video_generation_result.get('success'):
-                        # 更新数据库中的场景视频路径
-                        for video_info in video_generation_result.get('generated_videos', []):
-                            if video_info.get('success'):
-                                scene = RecreationScene.query.filter_by(
-                                    recreation_id=recreation_id,
-                                    scene_index=video_info.get('scene_index')
-                                ).first()
-                                if scene:
-                                    scene.generated_video_path = video_info.get('local_path')
-                                    scene.generation_status = 'completed'
-                                    scene.generation_service = 'comfyui'
-                                    scene.generation_completed_at = datetime.now()
-                        db.session.commit()
-                        
-                        self.log_step(recreation_id, 'video_generation', 'success', f'ComfyUI视频生成完成，成功: {video_generation_result.get("successful_count", 0)}')
-                    else:
-                        self.log_step(recreation_id, 'video_generation', 'failed', video_generation_result.get('error', 'ComfyUI视频生成失败'))
-            
-            # 步骤5.5: 视频一致性检查
-            print("步骤5.5: 视频一致性检查...")
-            self.log_step(recreation_id, 'video_consistency_check', 'processing', '开始视频一致性检查')
-            
-            # 准备一致性检查数据
-            consistency_check_data = {
-                'generated_images': video_generation_result.get('generated_videos', []),
-                'original_video_info': {
-                    'content': video_understanding.get('content', ''),
-                    'keyframes': [slice.get('keyframes', [])[0] if slice.get('keyframes', []) else '' for slice in video_understanding.get('slices', [])],
-                    'tags': [],  # 可以从视频理解结果中提取标签
-                    'audio_transcription': audio_transcription
-                },
-                'storyboard': storyboard
-            }
+                    if scene_analysis.get('success'):
+                        if scene_analysis.get('prompt_mode') != 'parallel':
+                            # 顺序模式：逐个场景参考上一场景的输出重新生成提示词
+                            await asyncio.to_thread(self._add_scene_continuity, scene_analysis.get('scenes', []), video_understanding, audio_transcription)
+                        self.step_cache.put('scene_analysis', scene_key, scene_analysis)
+            
+            if scene_analysis.get('success'):
+                parse_summary = job_parse_metrics.summary()
+                self.log_step(recreation_id, 'scene_analysis', 'success', f'场景分析完成，共{len(scene_analysis.get("scenes", []))}个场景'
+                              + (f'，模型输出解析: {parse_summary}' if parse_summary else ''))
+                self._save_scenes_to_db(recreation_id, scene_analysis.get('scenes', []))
+            else:
+                error_msg = scene_analysis.get('error', '场景分析失败')
+                self.log_step(recreation_id, 'scene_analysis', 'failed', error_msg)
+                raise Exception(error_msg)
+        
+        # 步骤4.5: 增强场景提示词，整合音频内容
+        print("步骤4.5: 增强场景提示词，整合音频内容...")
+        scenes = scene_analysis.get('scenes', [])
+        enhanced_scenes = []
+        
+        for i, scene in enumerate(scenes):
+            # 设置总场景数，用于后续音频内容分配
+            scene['total_scenes'] = len(scenes)
             
-            # 执行一致性检查
-            consistency_result = self.consistency_agent.execute(consistency_check_data)
+            # 获取当前场景对应的音频内容
+            scene_audio_content = self._get_scene_audio_content(audio_transcription, scene)
             
-            if consistency_result.get('success'):
-                print(f"[一致性检查] 成功通过 {consistency_result.get('passed_count', 0)} 个视频片段，失败 {consistency_result.get('failed_count', 0)} 个片段")
+            # 增强视频提示词，将音频内容整合进去
+            video_prompt_data = scene.get('video_prompt', {})
+            if isinstance(video_prompt_data, dict) and video_prompt_data.get('success'):
+                original_prompt = video_prompt_data.get('video_prompt', '')
                 
-                # 如果有失败的片段，进行重新生成
-                failed_images = consistency_result.get('failed_images', [])
-                if failed_images:
-                    print(f"[一致性检查] 重新生成 {len(failed_images)} 个失败的视频片段")
-                    
-                    # 这里可以添加重新生成逻辑
-                    # 简单实现：使用原始生成结果，后续可以优化为重新生成失败片段
+                # 增强提示词，整合音频内容
+                enhanced_prompt = f"{original_prompt}\n\n特别重要：请结合以下音频内容，确保生成的视频与音频内容保持一致：\n{scene_audio_content}"
+                
+                # 更新场景提示词
+                scene['video_prompt']['video_prompt'] = enhanced_prompt
+                
+            enhanced_scenes.append(scene)
+        
+        # 更新场景分析结果
+        scene_analysis['scenes'] = enhanced_scenes
+        print(f"[提示词增强] 已增强 {len(enhanced_scenes)} 个场景的提示词，整合了音频内容")
+        
+        # 步骤5: 视频生成（根据参数选择服务）
+        if use_qwen:
+            print("步骤5: Qwen模型视频生成...")
+            self.log_step(recreation_id, 'video_generation', 'processing', '开始Qwen模型视频生成')
+            
+            # Qwen工作流在场景粒度上缓存，只重新生成输入发生变化的场景
+            video_generation_result = await self.generate_videos_with_qwen(
+                scene_analysis=scene_analysis,
+                video_path=video_path,
+                recreation_id=recreation_id,
+                task_dir=task_dir,
+                video_understanding=video_understanding
+            )
+            generation_service = 'qwen'
+        else:
+            generation_service = 'nano_banana' if use_nano_banana else 'comfyui'
+            generation_key = self.step_cache.make_key('video_generation', {
+                'service': generation_service,
+                'scenes': scene_analysis.get('scenes', [])
+            })
+            video_generation_result = self.step_cache.get('video_generation', generation_key, base_dir=task_dir)
+            if video_generation_result:
+                print(f"[步骤缓存] 视频生成命中缓存，跳过视频生成步骤")
+            elif use_nano_banana:
+                print("步骤5: Nano Banana视频生成...")
+                self.log_step(recreation_id, 'video_generation', 'processing', '开始Nano Banana视频生成')
+                
+                video_generation_result = await asyncio.to_thread(
+                    self.generate_videos_with_nano_banana,
+                    scene_analysis=scene_analysis,
+                    video_path=video_path,
+                    recreation_id=recreation_id,
+                    task_dir=task_dir
+                )
             else:
-                print(f"[一致性检查] 检查失败: {consistency_result.get('error')}")
-            
-            self.log_step(recreation_id, 'video_consistency_check', 'success', '视频一致性检查完成')
+                print("步骤5: ComfyUI关键帧生成与视频生成...")
+                self.log_step(recreation_id, 'video_generation', 'processing', '开始ComfyUI关键帧生成')
+                
+                video_generation_result = await asyncio.to_thread(
+                    self.generate_videos_from_scenes,
+                    scene_analysis=scene_analysis,
+                    video_path=video_path,
+                    recreation_id=recreation_id,
+                    task_dir=task_dir
+                )
             
-            # 步骤6: 文本转语音
-            print("步骤6: 文本转语音...")
-            self.log_step(recreation_id, 'text_to_speech', 'processing', '开始文本转语音')
+            # 只缓存全部场景都成功的结果，失败的场景下次重新生成
+            if video_generation_result.get('success') and not video_generation_result.get('failed_count'):
+                await asyncio.to_thread(self.step_cache.put, 'video_generation', generation_key, video_generation_result, [
+                    v.get('local_path') for v in video_generation_result.get('generated_videos', []) if v.get('local_path')
+                ], task_dir)
+        
+        service_names = {'qwen': 'Qwen模型', 'nano_banana': 'Nano Banana', 'comfyui': 'ComfyUI'}
+        if video_generation_result.get('success'):
+            # 更新数据库中的场景视频路径
+            for video_info in video_generation_result.get('generated_videos', []):
+                if video_info.get('success'):
+                    scene = RecreationScene.query.filter_by(
+                        recreation_id=recreation_id,
+                        scene_index=video_info.get('scene_index')
+                    ).first()
+                    if scene:
+                        scene.generated_video_path = video_info.get('local_path')
+                        scene.generation_status = 'completed'
+                        scene.generation_service = generation_service
+                        scene.generation_completed_at = datetime.now()
+            with span('db.update_scenes', 'db'):
+                db.session.commit()
             
-            # 检查是否已经有TTS音频结果
-            tts_result = None
-            if existing_recreation and existing_recreation.tts_audio_path:
-                print(f"[任务管理] 发现已有TTS音频结果，跳过文本转语音步骤")
-                tts_result = {
-                    'success': True,
-                    'audio_path': existing_recreation.tts_audio_path,
-                    'duration': existing_recreation.tts_audio_duration
-                }
+            self.log_step(recreation_id, 'video_generation', 'success', f'{service_names[generation_service]}视频生成完成，成功: {video_generation_result.get("successful_count", 0)}')
+        else:
+            self.log_step(recreation_id, 'video_generation', 'failed', video_generation_result.get('error', f'{service_names[generation_service]}视频生成失败'))
+        
+        # 步骤5.5: 视频一致性检查
+        print("步骤5.5: 视频一致性检查...")
+        self.log_step(recreation_id, 'video_consistency_check', 'processing', '开始视频一致性检查')
+        
+        if use_qwen:
+            # Qwen工作流在生成每个场景后已与上一场景做过一致性检查并按结果重试
+            self.log_step(recreation_id, 'video_consistency_check', 'skipped', 'Qwen工作流已在场景生成时逐场景检查一致性')
+        else:
+            consistency_result = await self._check_adjacent_scene_consistency(
+                video_generation_result.get('generated_videos', []), scene_analysis.get('scenes', [])
+            )
+            summary = f"检查相邻场景 {consistency_result['checked']} 对，通过 {consistency_result['passed']} 对，未通过 {consistency_result['failed']} 对"
+            print(f"[一致性检查] {summary}")
+            if consistency_result['errors']:
+                self.log_step(recreation_id, 'video_consistency_check', 'failed',
+                              f"{summary}，检查出错 {len(consistency_result['errors'])} 对: {consistency_result['errors'][0]}")
+            elif not consistency_result['checked']:
+                self.log_step(recreation_id, 'video_consistency_check', 'skipped', '成功生成的场景少于2个，跳过一致性检查')
             else:
-                tts_audio_path = os.path.join(task_dir, 'tts', 'tts_audio.mp3')
-                os.makedirs(os.path.dirname(tts_audio_path), exist_ok=True)
-                
-                tts_result = self.content_generator.text_to_speech(
-                    text=new_script.get('new_script', ''),
-                    output_path=tts_audio_path
-                )
-                
-                if tts_result.get('success'):
-                    self.update_recreation_step(recreation_id, {
-                        'tts_audio_path': tts_result.get('audio_path'),
-                        'tts_service': 'edge-tts',
-                        'tts_voice_model': 'zh-CN-XiaoxiaoNeural',
-                        'tts_audio_duration': tts_result.get('duration', 0)
+                self.log_step(recreation_id, 'video_consistency_check', 'success', f'视频一致性检查完成，{summary}')
+        
+        return scene_analysis, video_generation_result
+    
+    async def _check_adjacent_scene_consistency(self, generated_videos: List[Dict[str, Any]], storyboard: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # 按分镜顺序检查每对相邻的已生成场景视频；结果只用于记录，不重新生成
+        videos = sorted(
+            (v for v in generated_videos if v.get('success') and v.get('local_path') and os.path.exists(v['local_path'])),
+            key=lambda v: v.get('scene_index', 0)
+        )
+        result = {'checked': 0, 'passed': 0, 'failed': 0, 'errors': []}
+        previous_scene = None
+        for video in videos:
+            scene_index = video.get('scene_index', 0)
+            scene_plan = storyboard[scene_index] if 0 <= scene_index < len(storyboard) else {}
+            prompt_data = scene_plan.get('video_prompt') if isinstance(scene_plan.get('video_prompt'), dict) else {}
+            current_scene = {
+                'video_path': video['local_path'],
+                'keyframes': video.get('keyframes', []),
+                'scene_index': scene_index,
+                'scene_id': scene_plan.get('scene_id', scene_index + 1),
+                'video_prompt': video.get('prompt') or prompt_data.get('video_prompt', '')
+            }
+            if previous_scene:
+                try:
+                    check = await self.consistency_agent.check_consistency(current_scene, previous_scene, {
+                        'description': scene_plan.get('description', ''),
+                        'original_prompt': current_scene['video_prompt'],
+                        'generation_params': prompt_data.get('technical_params', {})
                     })
-                    self.log_step(recreation_id, 'text_to_speech', 'success', '文本转语音完成')
+                except Exception as e:
+                    check = {'success': False, 'error': str(e)}
+                if check.get('success') is False:
+                    result['errors'].append(f"场景 {scene_index + 1}: {check.get('error')}")
                 else:
-                    error_msg = tts_result.get('error', '文本转语音失败')
-                    self.log_step(recreation_id, 'text_to_speech', 'failed', error_msg)
-                    raise Exception(error_msg)
+                    result['checked'] += 1
+                    result['passed' if check.get('passed') else 'failed'] += 1
+            previous_scene = current_scene
+        return result
+    
+    async def process_video_for_recreation(self, video_path: str, recreation_id: int, use_nano_banana: bool = False, use_qwen: bool = False, slice_limit: int = 0, existing_prompt_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        # 每个任务一条耗时时间线，与recreation_result.json一起保存在任务目录
+        trace = start_trace(f"recreation-{recreation_id}", recreation_id=recreation_id, video_path=video_path)
+        with span('recreation', recreation_id=recreation_id) as span_args:
+            result = await self._process_video_for_recreation(
+                video_path, recreation_id, use_nano_banana, use_qwen, slice_limit, existing_prompt_data
+            )
+            span_args['processing_status'] = result.get('processing_status')
+        
+        task_dir = result.get('task_dir')
+        if trace is not None:
+            result['timing'] = trace.summary()
+            if task_dir:
+                trace_file_name = get_config().get("tracing.trace_file_name", "trace.json")
+                result['trace_path'] = trace.export(os.path.join(task_dir, trace_file_name))
+        
+        # 保存结果到文件
+        if result.get('processing_status') == 'success':
+            self.save_recreation_result(result, task_dir)
+        
+        return result
+    
+    async def _process_video_for_recreation(self, video_path: str, recreation_id: int, use_nano_banana: bool, use_qwen: bool, slice_limit: int, existing_prompt_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        print(f"🔧 处理参数: slice_limit={slice_limit}")
+        task_dir = None
+        # 绑定任务ID，各分支和深层服务上报的进度事件都归属到该任务
+        bind_recreation(recreation_id)
+        try:
+            print(f"开始处理视频: {video_path}，任务ID: {recreation_id}")
+            
+            # 创建任务目录
+            task_dir = self.create_task_directory(recreation_id, video_path)
+            
+            # 计算视频哈希并保存到数据库，视频哈希是所有步骤缓存键的根
+            video_hash = self.calculate_video_hash(video_path)
+            if not video_hash:
+                raise Exception(f"无法读取视频文件: {video_path}")
+            self.update_recreation_step(recreation_id, {
+                'original_video_path': video_path,
+                'original_video_hash': video_hash
+            })
+            
+            # 分支一：视频理解 ∥ 语音转文本
+            video_understanding, audio_result = await self._join_branches(
+                self._understanding_branch(video_path, video_hash, recreation_id, slice_limit),
+                self._transcription_branch(video_path, video_hash, recreation_id, task_dir)
+            )
+            audio_transcription = audio_result.get('text', '')
+            
+            # 分支二：（新文案 → TTS） ∥ （场景分析 → 视频生成）
+            (new_script, tts_result), (scene_analysis, video_generation_result) = await self._join_branches(
+                self._script_and_tts_branch(recreation_id, task_dir, video_understanding, audio_transcription),
+                self._scene_video_branch(video_path, recreation_id, task_dir, video_understanding, audio_transcription,
+                                         use_nano_banana, use_qwen, existing_prompt_data)
+            )
             
             # 步骤7: 视频拼接
             print("步骤7: 视频拼接...")
             self.log_step(recreation_id, 'video_composition', 'processing', '开始视频拼接')
             
-            # 检查是否已经有拼接好的视频
-            composition_result = None
-            if existing_recreation and existing_recreation.final_video_path:
-                print(f"[任务管理] 发现已有拼接好的视频，跳过视频拼接步骤")
-                composition_result = {
-                    'success': True,
-                    'output_path': existing_recreation.final_video_path,
-                    'duration': existing_recreation.total_duration,
-                    'file_size': existing_recreation.final_file_size,
-                    'resolution': existing_recreation.video_resolution,
-                    'fps': existing_recreation.video_fps
-                }
+            # 获取所有成功生成的视频路径
+            successful_videos = [v for v in video_generation_result.get('generated_videos', []) if v.get('success')]
+            video_paths = [v.get('local_path') for v in successful_videos if v.get('local_path')]
+            
+            if not video_paths:
+                error_msg = '没有可用的视频进行拼接'
+                self.log_step(recreation_id, 'video_composition', 'failed', error_msg)
+                raise Exception(error_msg)
+            
+            # 以各场景视频的内容哈希作为键，任何场景重新生成都会使拼接结果失效
+            composition_inputs = {'videos': [self.step_cache.file_digest(p) or p for p in video_paths]}
+            if self.single_pass_render:
+                # 单次渲染的结果还包含配音，配音变化同样使其失效
+                composition_inputs['audio'] = self.step_cache.file_digest(tts_result.get('audio_path'))
+                composition_inputs['render'] = get_config().get_render_config()
+            composition_key = self.step_cache.make_key('video_composition', composition_inputs)
+            composition_result = self.step_cache.get('video_composition', composition_key, base_dir=task_dir)
+            if composition_result:
+                print(f"[步骤缓存] 拼接视频命中缓存，跳过视频拼接步骤")
             else:
-                # 获取所有成功生成的视频路径
-                successful_videos = [v for v in video_generation_result.get('generated_videos', []) if v.get('success')]
-                video_paths = [v.get('local_path') for v in successful_videos if v.get('local_path')]
+                final_video_path = os.path.join(task_dir, 'final', 'final_video.mp4')
+                os.makedirs(os.path.dirname(final_video_path), exist_ok=True)
                 
-                if video_paths:
-                    final_video_path = os.path.join(task_dir, 'final', 'final_video.mp4')
-                    os.makedirs(os.path.dirname(final_video_path), exist_ok=True)
-                    
-                    composition_result = self.content_generator.compose_videos(
-                        video_paths=video_paths,
-                        output_path=final_video_path
-                    )
-                    
-                    if composition_result.get('success'):
-                        self.update_recreation_step(recreation_id, {
-                            'final_video_path': composition_result.get('output_path'),
-                            'composition_status': 'completed',
-                            'total_duration': composition_result.get('duration', 0),
-                            'final_file_size': composition_result.get('file_size', 0),
-                            'video_resolution': composition_result.get('resolution', ''),
-                            'video_fps': composition_result.get('fps', 0)
-                        })
-                        self.log_step(recreation_id, 'video_composition', 'success', '视频拼接完成')
+                with span('step.video_composition', video_count=len(video_paths)):
+                    if self.single_pass_render:
+                        # 拼接、配音混流和时长适配在一次ffmpeg渲染中完成
+                        composition_result = await self.ffmpeg_service.render_final_video(
+                            video_paths,
+                            os.path.join(task_dir, 'final', 'final_video_with_audio.mp4'),
+                            audio_path=tts_result.get('audio_path')
+                        )
                     else:
-                        error_msg = composition_result.get('error', '视频拼接失败')
-                        self.log_step(recreation_id, 'video_composition', 'failed', error_msg)
-                        raise Exception(error_msg)
-                else:
-                    error_msg = '没有可用的视频进行拼接'
-                    self.log_step(recreation_id, 'video_composition', 'failed', error_msg)
-                    raise Exception(error_msg)
+                        composition_result = self.content_generator.compose_videos(
+                            video_paths=video_paths,
+                            output_path=final_video_path
+                        )
+                if composition_result.get('success'):
+                    self.step_cache.put('video_composition', composition_key, composition_result, [composition_result.get('output_path')], task_dir)
+            
+            if composition_result.get('success'):
+                self.update_recreation_step(recreation_id, {
+                    'final_video_path': composition_result.get('output_path'),
+                    'composition_status': 'completed',
+                    'total_duration': composition_result.get('duration', 0),
+                    'final_file_size': composition_result.get('file_size', 0),
+                    'video_resolution': composition_result.get('resolution', ''),
+                    'video_fps': composition_result.get('fps', 0)
+                })
+                self.log_step(recreation_id, 'video_composition', 'success', '视频拼接完成')
+            else:
+                error_msg = composition_result.get('error', '视频拼接失败')
+                self.log_step(recreation_id, 'video_composition', 'failed', error_msg)
+                raise Exception(error_msg)
             
             # 步骤8: 音画同步
             print("步骤8: 音画同步...")
             self.log_step(recreation_id, 'audio_video_sync', 'processing', '开始音画同步')
             
-            # 检查是否已经有音画同步的最终视频
-            sync_result = None
-            if existing_recreation and existing_recreation.final_video_with_audio_path:
-                print(f"[任务管理] 发现已有音画同步的最终视频，跳语音画同步步骤")
-                sync_result = {
-                    'success': True,
-                    'output_path': existing_recreation.final_video_with_audio_path
-                }
+            if composition_result.get('audio_muxed'):
+                # 配音已在单次渲染中混流
+                sync_result = composition_result
+                print(f"[最终渲染] 配音已在拼接时混流，跳过音画同步步骤")
             else:
-                final_video_with_audio_path = os.path.join(task_dir, 'final', 'final_video_with_audio.mp4')
-                sync_result = self.content_generator.sync_audio_video(
-                    video_path=composition_result.get('output_path'),
-                    audio_path=tts_result.get('audio_path'),
-                    output_path=final_video_with_audio_path
-                )
-                
-                if sync_result.get('success'):
-                    self.update_recreation_step(recreation_id, {
-                        'final_video_with_audio_path': sync_result.get('output_path')
-                    })
-                    self.log_step(recreation_id, 'audio_video_sync', 'success', '音画同步完成')
+                sync_key = self.step_cache.make_key('audio_video_sync', {
+                    'video': self.step_cache.file_digest(composition_result.get('output_path')),
+                    'audio': self.step_cache.file_digest(tts_result.get('audio_path'))
+                })
+                sync_result = self.step_cache.get('audio_video_sync', sync_key, base_dir=task_dir)
+                if sync_result:
+                    print(f"[步骤缓存] 音画同步命中缓存，跳过音画同步步骤")
                 else:
-                    error_msg = sync_result.get('error', '音画同步失败')
-                    self.log_step(recreation_id, 'audio_video_sync', 'failed', error_msg)
-                    raise Exception(error_msg)
+                    final_video_with_audio_path = os.path.join(task_dir, 'final', 'final_video_with_audio.mp4')
+                    with span('step.audio_video_sync'):
+                        sync_result = self.content_generator.sync_audio_video(
+                            video_path=composition_result.get('output_path'),
+                            audio_path=tts_result.get('audio_path'),
+                            output_path=final_video_with_audio_path
+                        )
+                    if sync_result.get('success'):
+                        self.step_cache.put('audio_video_sync', sync_key, sync_result, [sync_result.get('output_path')], task_dir)
+            
+            if sync_result.get('success'):
+                self.update_recreation_step(recreation_id, {
+                    'final_video_with_audio_path': sync_result.get('output_path')
+                })
+                self.log_step(recreation_id, 'audio_video_sync', 'success', '音画同步完成')
+            else:
+                error_msg = sync_result.get('error', '音画同步失败')
+                self.log_step(recreation_id, 'audio_video_sync', 'failed', error_msg)
+                raise Exception(error_msg)
             
             # 更新任务状态为完成
             self.update_recreation_step(recreation_id, {
@@ -903,9 +1067,6 @@ class VideoRecreationService:
                 'processing_status': 'success'
             }
             
-            # 保存结果到文件
-            self.save_recreation_result(result, task_dir)
-            
             print(f"视频二创处理完成! 任务ID: {recreation_id}")
             return result
             
@@ -924,6 +1085,7 @@ class VideoRecreationService:
             
             error_result = {
                 'recreation_id': recreation_id,
+                'task_dir': task_dir,
                 'video_path': video_path,
                 'timestamp': datetime.now().isoformat(),
                 'error': error_msg,
@@ -1103,6 +1265,7 @@ class VideoRecreationService:
                 'generated_videos': []
             }
     
+    @traced('dashscope.create_video_generation_task', 'dashscope')
     def create_video_generation_task(self, prompt: str) -> Dict[str, Any]:
         try:
             headers = {
@@ -1153,6 +1316,7 @@ class VideoRecreationService:
                 'error': str(e)
             }
     
+    @traced('dashscope.wait_for_video_generation', 'dashscope')
     def wait_for_video_generation(self, task_id: str, max_wait_time: int = 600) -> Dict[str, Any]:
         try:
             headers = {
@@ -1163,6 +1327,7 @@ class VideoRecreationService:
             check_interval = 30  # 每30秒检查一次
             
             print(f"[视频等待] 开始等待任务 {task_id} 完成，最大等待时间: {max_wait_time} 秒")
+            last_status = None
             
             while time.time() - start_time < max_wait_time:
                 print(f"[视频等待] 检查任务 {task_id} 状态")
@@ -1178,6 +1343,9 @@ class VideoRecreationService:
                     if 'output' in result:
                         task_status = result['output'].get('task_status')
                         print(f"[视频等待] 任务 {task_id} 状态: {task_status}")
+                        if task_status != last_status:
+                            emit_progress('remote_task', {'service': 'dashscope', 'task_id': task_id, 'status': task_status})
+                            last_status = task_status
                         
                         if task_status == 'SUCCEEDED':
                             video_url = result['output'].get('video_url')
@@ -1205,7 +1373,8 @@ class VideoRecreationService:
                         elif task_status in ['PENDING', 'RUNNING']:
                             elapsed_time = int(time.time() - start_time)
                             print(f"[视频等待] 任务 {task_id} 状态: {task_status}, 已等待: {elapsed_time}秒")
-                            time.sleep(check_interval)
+                            with span('poll.sleep', 'sleep'):
+                                time.sleep(check_interval)
                             continue
                         
                         else:
@@ -1220,7 +1389,8 @@ class VideoRecreationService:
                         }
                 else:
                     print(f"[视频等待] 查询任务状态失败: {response.status_code} - {response.text}")
-                    time.sleep(check_interval)
+                    with span('poll.sleep', 'sleep'):
+                        time.sleep(check_interval)
             
             print(f"[视频等待] 任务 {task_id} 超时")
             return {
@@ -1235,6 +1405,7 @@ class VideoRecreationService:
                 'error': str(e)
             }
     
+    @traced('download.video', 'download')
     def download_video(self, video_url: str, local_path: str) -> Dict[str, Any]:
         try:
             print(f"[视频下载] 开始下载视频: {video_url}")
@@ -1308,6 +1479,524 @@ class VideoRecreationService:
         except Exception as e:
             print(f"保存结果失败: {e}")
     
+    async def _run_blocking(self, semaphore: asyncio.Semaphore, func, *args, **kwargs):
+        # 在并发上限内把阻塞的远程调用放到线程池执行
+        async with semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+    
+    def _extract_qwen_video_prompt(self, scene: Dict[str, Any]) -> str:
+        # 从场景中提取视频提示词
+        video_prompt_data = scene.get('video_prompt', {})
+        if isinstance(video_prompt_data, dict):
+            return video_prompt_data.get('video_prompt', '')
+        elif isinstance(video_prompt_data, str):
+            return video_prompt_data
+        return str(video_prompt_data)
+    
+    def _build_qwen_scene_data(self, scene: Dict[str, Any], video_prompt: str) -> Dict[str, Any]:
+        # 构建场景数据，保留原始场景的所有信息
+        scene_data = scene.copy()
+        scene_data['video_prompt'] = video_prompt
+        
+        # 保留原始场景的技术参数，只在缺失时添加默认值
+        original_tech_params = scene.get('technical_params', {})
+        scene_data['technical_params'] = {
+            'width': original_tech_params.get('width', 1280),
+            'height': original_tech_params.get('height', 720),
+            'duration': scene.get('duration', 5),
+            'fps': original_tech_params.get('fps', 24),
+            **original_tech_params  # 保留所有原始技术参数
+        }
+        
+        # 保留原始场景的风格元素，只在缺失时添加默认值
+        original_style_elements = scene.get('style_elements', {})
+        scene_data['style_elements'] = {
+            'style': original_style_elements.get('style', 'cinematic'),
+            'quality': original_style_elements.get('quality', 'high'),
+            'motion': original_style_elements.get('motion', 'natural'),
+            **original_style_elements  # 保留所有原始风格元素
+        }
+        return scene_data
+    
+    def _get_qwen_reference_images(self, i: int, scene: Dict[str, Any], video_understanding: Dict[str, Any] = None, verbose: bool = True) -> List[str]:
+        # 获取原视频切片的关键帧作为参考，返回副本，避免修改视频理解结果
+        reference_images = []
+        
+        # 1. 首先从外部传入的video_understanding中获取（优先）
+        if video_understanding is not None:
+            # 1.1 从raw_slices中获取原视频切片的关键帧
+            if 'raw_slices' in video_understanding and i < len(video_understanding['raw_slices']):
+                slice_data = video_understanding['raw_slices'][i]
+                if 'keyframes' in slice_data:
+                    reference_images = list(slice_data['keyframes'])
+                    if verbose:
+                        print(f"[Qwen Video] 场景 {i+1}: 从raw_slices[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
+            # 1.2 从slices中获取
+            elif 'slices' in video_understanding and i < len(video_understanding['slices']):
+                slice_info = video_understanding['slices'][i]
+                if 'keyframes' in slice_info:
+                    reference_images = list(slice_info['keyframes'])
+                    if verbose:
+                        print(f"[Qwen Video] 场景 {i+1}: 从slices[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
+            # 1.3 从vl_analysis中获取
+            elif 'vl_analysis' in video_understanding and i < len(video_understanding['vl_analysis']):
+                vl_slice = video_understanding['vl_analysis'][i]
+                if 'keyframes' in vl_slice:
+                    reference_images = list(vl_slice['keyframes'])
+                    if verbose:
+                        print(f"[Qwen Video] 场景 {i+1}: 从vl_analysis[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
+        
+        # 2. 如果从video_understanding中未获取到，再从scene对象中获取
+        if not reference_images and 'keyframes' in scene:
+            reference_images = list(scene['keyframes'])
+            if verbose:
+                print(f"[Qwen Video] 场景 {i+1}: 从场景对象获取了 {len(reference_images)} 个参考关键帧")
+        
+        return reference_images
+    
+    def _merge_qwen3vl_prompt(self, i: int, optimized_scene_data: Dict[str, Any], qwen3vl_prompt: str):
+        # 智能融合qwen3-vl-plus生成的提示词与原提示词
+        try:
+            qwen3vl_data = json.loads(qwen3vl_prompt)
+            
+            original_prompt = optimized_scene_data.get('video_prompt', '')
+            
+            # 从qwen3-vl-plus结果中提取关键信息
+            qwen3vl_content = qwen3vl_data.get('video_content_description', '')
+            qwen3vl_style = qwen3vl_data.get('visual_style', {})
+            qwen3vl_tech_params = qwen3vl_data.get('technical_parameters', {})
+            qwen3vl_atmosphere = qwen3vl_data.get('scene_atmosphere', '')
+            
+            # 构建新的提示词，保留原提示词的核心内容，同时融合qwen3-vl-plus的分析结果
+            new_prompt = f"{original_prompt}"
+            
+            if qwen3vl_content:
+                new_prompt += f"\n\n内容描述: {qwen3vl_content}"
+            
+            # 更新风格信息，确保与原视频风格一致
+            if qwen3vl_style:
+                if isinstance(qwen3vl_style, dict):
+                    if 'style' in qwen3vl_style:
+                        optimized_scene_data['style_elements']['style'] = qwen3vl_style['style']
+                    if 'color_palette' in qwen3vl_style:
+                        optimized_scene_data['style_elements']['color_palette'] = qwen3vl_style['color_palette']
+                    if 'animation_style' in qwen3vl_style:
+                        optimized_scene_data['style_elements']['animation_style'] = qwen3vl_style['animation_style']
+                else:
+                    optimized_scene_data['style_elements']['style'] = qwen3vl_style
+            
+            # 更新技术参数
+            if qwen3vl_tech_params:
+                optimized_scene_data['technical_params'].update(qwen3vl_tech_params)
+            
+            if qwen3vl_atmosphere:
+                new_prompt += f"\n\n氛围: {qwen3vl_atmosphere}"
+            
+            # 只在新提示词有实质性改进时才更新
+            if len(new_prompt) > len(original_prompt):
+                optimized_scene_data['video_prompt'] = new_prompt
+                print(f"[Qwen Video] 场景 {i+1}: 智能融合qwen3-vl-plus提示词成功")
+        
+        except json.JSONDecodeError as e:
+            print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus返回的JSON格式错误: {e}")
+        except Exception as e:
+            print(f"[Qwen Video] 场景 {i+1}: 融合qwen3-vl-plus提示词失败: {e}")
+    
+    @traced('qwen_scene.prepare')
+    async def _prepare_qwen_scene(self, i: int, scene: Dict[str, Any], video_prompt: str, locked_style: Optional[Dict[str, Any]],
+                                  video_understanding: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        # 场景准备阶段：提示词优化和参考关键帧分析，不依赖其他场景，可并发执行
+        scene_data = self._build_qwen_scene_data(scene, video_prompt)
+        
+        # 风格锁定机制：第一个场景的风格在调度前已提取，后续场景严格遵循
+        if i > 0 and locked_style:
+            print(f"[Qwen Video] 场景 {i+1}: 应用锁定的风格信息")
+            scene_data['style_elements'].update(locked_style)
+            print(f"[Qwen Video] 场景 {i+1}: 更新后的风格信息: {scene_data['style_elements']}")
+        
+        # 添加上一个场景的信息，增强连贯性
+        if i > 0 and scene.get('previous_scene_info'):
+            scene_data['previous_scene_info'] = scene.get('previous_scene_info')
+        
+        # 1. 优化JSON提示词
+        print(f"[Qwen Video] 场景 {i+1}: 开始优化JSON提示词")
+        optimized_scene_data = await self._run_blocking(semaphore, self.scene_segmenter.optimize_json_prompt, scene_data)
+        
+        # 2. 将JSON转换为适合qwen-image的文本格式
+        print(f"[Qwen Video] 场景 {i+1}: 将JSON转换为文本提示词")
+        text_prompt = self.scene_segmenter.json_to_text_prompt(optimized_scene_data)
+        optimized_scene_data['video_prompt'] = text_prompt
+        
+        # 3. 获取原视频切片的关键帧作为参考
+        reference_images = self._get_qwen_reference_images(i, scene, video_understanding)
+        
+        if not reference_images:
+            print(f"[Qwen Video] 场景 {i+1}: 警告：未找到原视频切片关键帧，这可能导致生成视频与原视频差距较大")
+        else:
+            print(f"[Qwen Video] 场景 {i+1}: 成功获取到 {len(reference_images)} 个原视频切片关键帧")
+            
+            # 4. 使用qwen3-vl-plus分析关键帧，生成json格式的prompt
+            print(f"[Qwen Video] 场景 {i+1}: 开始使用qwen3-vl-plus分析关键帧")
+            qwen3vl_result = await self._run_blocking(
+                semaphore,
+                self.qwen_video_service.analyze_keyframes_with_qwen3vl_plus,
+                reference_images,
+                {
+                    "video_prompt": optimized_scene_data.get("video_prompt", "")
+                }
+            )
+            
+            if qwen3vl_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus分析成功，生成了优化的prompt")
+                qwen3vl_prompt = qwen3vl_result.get('prompt', '')
+                if qwen3vl_prompt:
+                    self._merge_qwen3vl_prompt(i, optimized_scene_data, qwen3vl_prompt)
+            else:
+                print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus分析失败: {qwen3vl_result.get('error')}")
+        
+        # 5. 准备关键帧生成参数
+        keyframe_prompt = {
+            "video_prompt": optimized_scene_data.get("video_prompt", ""),
+            "technical_params": optimized_scene_data.get("technical_params", {})
+        }
+        
+        return {
+            'scene_data': scene_data,
+            'optimized_scene_data': optimized_scene_data,
+            'keyframe_prompt': keyframe_prompt,
+            'reference_images': reference_images
+        }
+    
+    @traced('qwen_scene.consistency', 'consistency')
+    async def _check_qwen_scene_consistency(self, i: int, video_prompt: str, prepared: Dict[str, Any], current_scene_info: Dict[str, Any],
+                                            previous_scene_info: Optional[Dict[str, Any]], local_video_path: str,
+                                            semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        # 检查与前一个场景的一致性，未通过时优化提示词重新生成，最多重试3次
+        optimized_scene_data = prepared['optimized_scene_data']
+        keyframe_prompt = prepared['keyframe_prompt']
+        reference_images = prepared['reference_images']
+        
+        if i == 0 or not previous_scene_info:
+            # 第一个场景或没有上一个场景信息，直接通过
+            return {}
+        
+        max_retries = 3
+        retry_count = 0
+        consistency_result = {}
+        
+        while retry_count < max_retries:
+            print(f"[Qwen Video] 场景 {i+1}: 开始一致性检查，重试次数: {retry_count+1}")
+            
+            prompt_data = {
+                'original_prompt': video_prompt,
+                'optimized_prompt': optimized_scene_data.get('video_prompt', ''),
+                'generation_params': optimized_scene_data.get('technical_params', {})
+            }
+            
+            try:
+                consistency_result = await self.consistency_agent.check_consistency(
+                    current_scene_info,
+                    previous_scene_info,
+                    prompt_data
+                )
+            except Exception as e:
+                print(f"[Qwen Video] 场景 {i+1}: 一致性检查异常: {e}")
+                print(f"[Qwen Video] 场景 {i+1}: 跳过一致性检查，继续执行")
+                break
+            
+            print(f"[Qwen Video] 场景 {i+1}: 一致性检查结果: {'通过' if consistency_result.get('passed') else '未通过'}")
+            
+            if consistency_result.get('passed'):
+                print(f"[Qwen Video] 场景 {i+1}: 一致性检查通过")
+                break
+            
+            # 一致性检查未通过，重新生成视频
+            print(f"[Qwen Video] 场景 {i+1}: 一致性检查未通过，开始优化提示词和参数")
+            retry_count += 1
+            
+            optimized_prompt = consistency_result.get('optimization_feedback', {}).get('optimized_prompt', '')
+            adjusted_params = consistency_result.get('optimization_feedback', {}).get('adjusted_params', {})
+            
+            if not optimized_prompt:
+                print(f"[Qwen Video] 场景 {i+1}: 未获取到优化提示词")
+                continue
+            
+            # 智能融合提示词，保留原提示词的核心内容，只添加优化建议
+            original_prompt = optimized_scene_data.get('video_prompt', '')
+            optimized_scene_data['video_prompt'] = f"{original_prompt}\n\n优化建议: {optimized_prompt}"
+            if adjusted_params:
+                optimized_scene_data['technical_params'].update(adjusted_params)
+            
+            # 重新生成关键帧
+            print(f"[Qwen Video] 场景 {i+1}: 使用优化后的提示词重新生成关键帧")
+            keyframe_prompt['video_prompt'] = optimized_scene_data['video_prompt']
+            keyframe_prompt['technical_params'] = optimized_scene_data['technical_params']
+            
+            keyframe_result = await self._run_blocking(
+                semaphore,
+                self.qwen_video_service.generate_keyframes_with_qwen_image_edit,
+                keyframe_prompt,
+                reference_images=reference_images,
+                num_keyframes=3
+            )
+            if not keyframe_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1}: 重新生成关键帧失败")
+                continue
+            
+            keyframes = keyframe_result.get('keyframes', [])
+            print(f"[Qwen Video] 场景 {i+1}: 重新生成关键帧成功")
+            
+            # 重新生成视频
+            print(f"[Qwen Video] 场景 {i+1}: 使用重新生成的关键帧生成视频")
+            video_result = await self._run_blocking(
+                semaphore, self.qwen_video_service.generate_video_from_keyframes, keyframes, optimized_scene_data
+            )
+            if not video_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1}: 重新生成视频失败")
+                continue
+            
+            # 重新下载视频
+            video_url = video_result.get('video_url')
+            download_result = await self._run_blocking(
+                semaphore, self.qwen_video_service.download_video, video_url, local_video_path
+            )
+            if not download_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1}: 重新下载视频失败")
+                break
+            
+            print(f"[Qwen Video] 场景 {i+1}: 重新生成视频成功")
+            current_scene_info['keyframes'] = keyframes
+            current_scene_info['video_url'] = video_url
+            current_scene_info['video_prompt'] = optimized_scene_data['video_prompt']
+            current_scene_info['technical_params'] = optimized_scene_data['technical_params']
+        
+        return consistency_result
+    
+    @traced('qwen_scene')
+    async def _run_qwen_scene(self, i: int, total: int, scene: Dict[str, Any], locked_style: Optional[Dict[str, Any]],
+                              video_understanding: Dict[str, Any], produce_video_dir: str, semaphore: asyncio.Semaphore,
+                              keyframe_futures: List[asyncio.Future], scene_info_futures: List[asyncio.Future],
+                              scene_key: str = None) -> Optional[Dict[str, Any]]:
+        # 单个场景的完整流程。场景间唯一的依赖是：关键帧生成需要上一个场景的关键帧，
+        # 一致性检查需要上一个场景的最终信息；其余阶段与其他场景并发执行
+        scene_id = scene.get('scene_id', i+1)
+        video_prompt = ''
+        own_keyframes = None
+        own_scene_info = None
+        
+        try:
+            print(f"\n[Qwen Video] 开始处理场景 {i+1}/{total}")
+            
+            video_prompt = self._extract_qwen_video_prompt(scene)
+            if not video_prompt:
+                print(f"[Qwen Video] 场景 {i+1} 提示词为空，跳过")
+                return None
+            
+            print(f"[Qwen Video] 场景 {i+1} 提示词: {video_prompt[:100]}...")
+            
+            # 场景缓存命中时直接复用，并把缓存的关键帧和场景信息传给下一个场景。
+            # 上一个场景失败后重跑成功时，传入的关键帧会不同，此时缓存不可用
+            cached_scene = self.step_cache.get('qwen_scene', scene_key, base_dir=produce_video_dir) if scene_key else None
+            if cached_scene and i > 0:
+                if cached_scene.get('previous_keyframes') != await keyframe_futures[i-1]:
+                    cached_scene = None
+            if cached_scene:
+                print(f"[步骤缓存] 场景 {i+1} 命中缓存，跳过关键帧和视频生成")
+                emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'cached', 'status': 'success'})
+                own_keyframes = cached_scene.get('chain_keyframes', [])
+                own_scene_info = cached_scene.get('scene_info')
+                return cached_scene['result']
+            
+            # 阶段1：场景准备（并发）
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'preparing', 'status': 'processing'})
+            prepared = await self._prepare_qwen_scene(i, scene, video_prompt, locked_style, video_understanding, semaphore)
+            scene_data = prepared['scene_data']
+            optimized_scene_data = prepared['optimized_scene_data']
+            keyframe_prompt = prepared['keyframe_prompt']
+            reference_images = prepared['reference_images']
+            
+            # 阶段2：关键帧生成（依赖上一个场景的关键帧）
+            previous_scene_keyframes = await keyframe_futures[i-1] if i > 0 else []
+            if i > 0 and previous_scene_keyframes:
+                print(f"[Qwen Video] 场景 {i+1}: 使用上一个场景的关键帧作为参考")
+                keyframe_prompt['previous_keyframes'] = previous_scene_keyframes
+                reference_images.append(previous_scene_keyframes[-1])
+                print(f"[Qwen Video] 场景 {i+1}: 添加上一个场景的关键帧，参考图像总数: {len(reference_images)}")
+            
+            print(f"[Qwen Video] 场景 {i+1}: 开始使用qwen-image-edit-plus生成关键帧")
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'keyframes', 'status': 'processing'})
+            keyframe_result = await self._run_blocking(
+                semaphore,
+                self.qwen_video_service.generate_keyframes_with_qwen_image_edit,
+                keyframe_prompt,
+                reference_images=reference_images,
+                num_keyframes=3
+            )
+            
+            if not keyframe_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1} 关键帧生成失败: {keyframe_result.get('error')}")
+                return {
+                    'scene_index': i,
+                    'scene_id': scene_id,
+                    'success': False,
+                    'error': f"关键帧生成失败: {keyframe_result.get('error')}",
+                    'prompt': video_prompt
+                }
+            
+            keyframes = keyframe_result.get('keyframes', [])
+            print(f"[Qwen Video] 场景 {i+1} 关键帧生成成功，共生成 {len(keyframes)} 个关键帧")
+            
+            # 关键帧就绪后立即释放下一个场景
+            own_keyframes = keyframes
+            keyframe_futures[i].set_result(keyframes)
+            
+            # 阶段3：视频生成与下载（并发）
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'rendering', 'status': 'processing'})
+            print(f"[Qwen Video] 场景 {i+1}: 开始使用wan2.6-r2v从关键帧生成视频")
+            video_gen_params = scene_data.copy()
+            video_gen_params['keyframes'] = keyframes
+            
+            if i > 0 and previous_scene_keyframes:
+                print(f"[Qwen Video] 场景 {i+1}: 使用上一个场景的关键帧作为视频生成参考")
+                video_gen_params['previous_keyframe'] = previous_scene_keyframes[-1]
+                video_gen_params['previous_scene_info'] = {
+                    'video_prompt': scene_data.get('video_prompt', ''),
+                    'style_elements': scene_data.get('style_elements', {}),
+                    'scene_info': scene_data.get('scene_info', {})
+                }
+            
+            video_result = await self._run_blocking(
+                semaphore, self.qwen_video_service.generate_video_from_keyframes, keyframes, video_gen_params
+            )
+            
+            if not video_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1} 视频生成失败: {video_result.get('error')}")
+                return {
+                    'scene_index': i,
+                    'scene_id': scene_id,
+                    'success': False,
+                    'error': f"视频生成失败: {video_result.get('error')}",
+                    'prompt': video_prompt
+                }
+            
+            video_url = video_result.get('video_url')
+            if not video_url:
+                print(f"[Qwen Video] 场景 {i+1} 生成成功但未返回视频URL")
+                return {
+                    'scene_index': i,
+                    'scene_id': scene_id,
+                    'success': False,
+                    'error': "生成成功但未返回视频URL",
+                    'prompt': video_prompt
+                }
+            
+            local_video_path = os.path.join(produce_video_dir, f"scene_{i+1:02d}_{scene_id}.mp4")
+            print(f"[Qwen Video] 场景 {i+1}: 开始下载视频到本地")
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'downloading', 'status': 'processing'})
+            
+            download_result = await self._run_blocking(
+                semaphore, self.qwen_video_service.download_video, video_url, local_video_path
+            )
+            if not download_result.get('success'):
+                print(f"[Qwen Video] 场景 {i+1} 视频下载失败: {download_result.get('error')}")
+                return {
+                    'scene_index': i,
+                    'scene_id': scene_id,
+                    'success': False,
+                    'error': f"视频下载失败: {download_result.get('error')}",
+                    'prompt': video_prompt,
+                    'video_url': video_url
+                }
+            
+            print(f"[Qwen Video] 场景 {i+1} 视频下载成功: {local_video_path}")
+            
+            current_scene_info = {
+                'video_path': local_video_path,
+                'video_url': video_url,
+                'video_info': {
+                    'width': 1920,
+                    'height': 1080,
+                    'fps': 30
+                },
+                'keyframes': keyframes,
+                'scene_index': i,
+                'video_prompt': optimized_scene_data.get('video_prompt', ''),
+                'style_elements': optimized_scene_data.get('style_elements', {}),
+                'technical_params': optimized_scene_data.get('technical_params', {})
+            }
+            
+            # 阶段4：一致性检查（依赖上一个场景的最终信息）
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'consistency', 'status': 'processing'})
+            previous_scene_info = await scene_info_futures[i-1] if i > 0 else None
+            consistency_result = await self._check_qwen_scene_consistency(
+                i, video_prompt, prepared, current_scene_info, previous_scene_info, local_video_path, semaphore
+            )
+            
+            current_scene_info.update({
+                'original_keyframes': reference_images,
+                'scene_id': scene_id,
+                'scene_index': i
+            })
+            
+            # 保存当前场景信息，作为下一个场景的前一个场景信息
+            own_scene_info = current_scene_info.copy()
+            scene_info_futures[i].set_result(own_scene_info)
+            
+            current_scene_info['consistency_check_result'] = consistency_result
+            
+            scene_result = {
+                'scene_index': i,
+                'scene_id': scene_id,
+                'success': True,
+                'local_path': local_video_path,
+                'video_url': current_scene_info['video_url'],
+                'prompt': optimized_scene_data.get('video_prompt', ''),
+                'duration': scene.get('duration', 4),
+                'start_time': scene.get('start_time', i * 4),
+                'end_time': scene.get('end_time', (i + 1) * 4),
+                'keyframe_count': len(current_scene_info['keyframes']),
+                'keyframes': current_scene_info['keyframes'],
+                'original_keyframes': reference_images,
+                'consistency_check_result': consistency_result,
+                'video_info': current_scene_info.get('video_info', {})
+            }
+            
+            emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'completed', 'status': 'success'})
+            
+            if scene_key:
+                await asyncio.to_thread(self.step_cache.put, 'qwen_scene', scene_key, {
+                    'result': scene_result,
+                    'chain_keyframes': own_keyframes,
+                    'previous_keyframes': previous_scene_keyframes,
+                    'scene_info': own_scene_info
+                }, [local_video_path], produce_video_dir)
+            
+            return scene_result
+        
+        except Exception as e:
+            print(f"[Qwen Video] 场景 {i+1} 处理异常: {e}")
+            import traceback
+            traceback.print_exc()
+            return {
+                'scene_index': i,
+                'scene_id': scene_id,
+                'success': False,
+                'error': str(e),
+                'prompt': video_prompt or str(scene.get('video_prompt', {}))
+            }
+        
+        finally:
+            if video_prompt and own_scene_info is None:
+                emit_progress('scene', {'scene_index': i, 'scene_id': scene_id, 'total': total, 'stage': 'failed', 'status': 'failed'})
+            
+            # 当前场景没有产出时，沿用上一个场景的结果，保证后续场景不会一直等待
+            if not keyframe_futures[i].done():
+                inherited_keyframes = await keyframe_futures[i-1] if i > 0 else []
+                keyframe_futures[i].set_result(own_keyframes if own_keyframes is not None else inherited_keyframes)
+            if not scene_info_futures[i].done():
+                inherited_info = await scene_info_futures[i-1] if i > 0 else None
+                scene_info_futures[i].set_result(own_scene_info if own_scene_info is not None else inherited_info)
+    
     async def generate_videos_with_qwen(self, scene_analysis: Dict[str, Any], video_path: str, recreation_id: int = None, task_dir: str = None, video_understanding: Dict[str, Any] = None) -> Dict[str, Any]:
         try:
             if not scene_analysis.get('success') or not scene_analysis.get('scenes'):
@@ -1327,462 +2016,54 @@ class VideoRecreationService:
             os.makedirs(produce_video_dir, exist_ok=True)
             print(f"[Qwen Video] 创建视频输出目录: {produce_video_dir}")
             
-            generated_videos = []
             scenes = scene_analysis['scenes']
             
-            print(f"[Qwen Video] 开始生成视频，共 {len(scenes)} 个场景")
-            print(f"[Qwen Video] 使用Qwen工作流：qwen-image-edit-plus关键帧生成 → wan2.6-r2v视频生成")
+            # 并发上限：同时进行远程调用（分析、关键帧、渲染、下载）的数量
+            max_concurrency = max(1, int(get_config().get("scene_scheduler.max_concurrency", 3)))
+            semaphore = asyncio.Semaphore(max_concurrency)
             
-            # 初始化上一个场景的信息，用于保持场景连贯性
-            previous_scene_keyframes = []
+            print(f"[Qwen Video] 开始生成视频，共 {len(scenes)} 个场景，并发上限: {max_concurrency}")
+            print(f"[Qwen Video] 使用Qwen工作流：qwen-image-edit-plus关键帧生成 → wan2.6-r2v视频生成")
             
-            # 初始化风格锁定机制，从第一个场景提取风格信息，后续场景严格遵循
+            # 风格锁定机制：从第一个场景提取风格信息，后续场景严格遵循
             locked_style = None
-            
+            first_prompt = self._extract_qwen_video_prompt(scenes[0])
+            if first_prompt:
+                print(f"[Qwen Video] 场景 1: 提取并锁定风格信息")
+                locked_style = self._build_qwen_scene_data(scenes[0], first_prompt)['style_elements'].copy()
+                print(f"[Qwen Video] 场景 1: 锁定的风格信息: {locked_style}")
+            
+            # 场景缓存键链：每个场景的键包含自身输入和上一个场景的键，
+            # 上游场景变化时下游场景随之失效
+            scene_keys = []
+            previous_key = ''
             for i, scene in enumerate(scenes):
-                try:
-                    print(f"\n[Qwen Video] 开始处理场景 {i+1}/{len(scenes)}")
-                    
-                    # 获取视频提示词
-                    video_prompt_data = scene.get('video_prompt', {})
-                    if isinstance(video_prompt_data, dict):
-                        # 如果是字典格式，检查success字段
-                        if video_prompt_data.get('success'):
-                            # 成功情况下，提取video_prompt字段
-                            video_prompt = video_prompt_data.get('video_prompt', '')
-                        else:
-                            # 失败情况下，直接使用video_prompt字段
-                            video_prompt = video_prompt_data.get('video_prompt', '')
-                    elif isinstance(video_prompt_data, str):
-                        # 如果直接是字符串，直接使用
-                        video_prompt = video_prompt_data
-                    else:
-                        video_prompt = str(video_prompt_data)
-                    
-                    if not video_prompt:
-                        print(f"[Qwen Video] 场景 {i+1} 提示词为空，跳过")
-                        continue
-                    
-                    print(f"[Qwen Video] 场景 {i+1} 提示词: {video_prompt[:100]}...")
-                    
-                    # 构建场景数据，保留原始场景的所有信息
-                    scene_data = scene.copy()
-                    scene_data['video_prompt'] = video_prompt
-                    
-                    # 保留原始场景的技术参数，只在缺失时添加默认值
-                    original_tech_params = scene.get('technical_params', {})
-                    scene_data['technical_params'] = {
-                        'width': original_tech_params.get('width', 1280),
-                        'height': original_tech_params.get('height', 720),
-                        'duration': scene.get('duration', 5),
-                        'fps': original_tech_params.get('fps', 24),
-                        **original_tech_params  # 保留所有原始技术参数
-                    }
-                    
-                    # 保留原始场景的风格元素，只在缺失时添加默认值
-                    original_style_elements = scene.get('style_elements', {})
-                    scene_data['style_elements'] = {
-                        'style': original_style_elements.get('style', 'cinematic'),
-                        'quality': original_style_elements.get('quality', 'high'),
-                        'motion': original_style_elements.get('motion', 'natural'),
-                        **original_style_elements  # 保留所有原始风格元素
-                    }
-                    
-                    # 风格锁定机制
-                    if i == 0:
-                        # 第一个场景，提取并锁定风格信息
-                        print(f"[Qwen Video] 场景 {i+1}: 提取并锁定风格信息")
-                        locked_style = scene_data['style_elements'].copy()
-                        print(f"[Qwen Video] 场景 {i+1}: 锁定的风格信息: {locked_style}")
-                    else:
-                        # 非第一个场景，应用锁定的风格信息
-                        if locked_style:
-                            print(f"[Qwen Video] 场景 {i+1}: 应用锁定的风格信息")
-                            # 严格应用锁定的风格，确保场景间风格一致
-                            scene_data['style_elements'].update(locked_style)
-                            print(f"[Qwen Video] 场景 {i+1}: 更新后的风格信息: {scene_data['style_elements']}")
-                    
-                    # 添加上一个场景的信息，增强连贯性
-                    if i > 0 and scene.get('previous_scene_info'):
-                        scene_data['previous_scene_info'] = scene.get('previous_scene_info')
-                    
-                    # 1. 优化JSON提示词
-                    print(f"[Qwen Video] 场景 {i+1}: 开始优化JSON提示词")
-                    optimized_scene_data = self.scene_segmenter.optimize_json_prompt(scene_data)
-                    
-                    # 2. 将JSON转换为适合qwen-image的文本格式
-                    print(f"[Qwen Video] 场景 {i+1}: 将JSON转换为文本提示词")
-                    text_prompt = self.scene_segmenter.json_to_text_prompt(optimized_scene_data)
-                    
-                    # 更新scene_data的video_prompt为转换后的文本格式
-                    optimized_scene_data['video_prompt'] = text_prompt
-                    
-                    # 3. 准备关键帧生成参数
-                    keyframe_prompt = {
-                        "video_prompt": optimized_scene_data.get("video_prompt", ""),
-                        "technical_params": optimized_scene_data.get("technical_params", {})
-                    }
-                    
-                    # 4. 获取原视频切片的关键帧作为参考
-                    reference_images = []
-                    
-                    # 从多个来源获取关键帧，确保优先获取原视频切片的关键帧
-                    # 1. 首先从外部传入的video_understanding中获取（优先）
-                    if video_understanding is not None:
-                        # 1.1 从raw_slices中获取原视频切片的关键帧
-                        if 'raw_slices' in video_understanding and i < len(video_understanding['raw_slices']):
-                            slice_data = video_understanding['raw_slices'][i]
-                            if 'keyframes' in slice_data:
-                                reference_images = slice_data['keyframes']
-                                print(f"[Qwen Video] 场景 {i+1}: 从raw_slices[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
-                        # 1.2 从slices中获取
-                        elif 'slices' in video_understanding and i < len(video_understanding['slices']):
-                            slice_info = video_understanding['slices'][i]
-                            if 'keyframes' in slice_info:
-                                reference_images = slice_info['keyframes']
-                                print(f"[Qwen Video] 场景 {i+1}: 从slices[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
-                        # 1.3 从vl_analysis中获取
-                        elif 'vl_analysis' in video_understanding and i < len(video_understanding['vl_analysis']):
-                            vl_slice = video_understanding['vl_analysis'][i]
-                            if 'keyframes' in vl_slice:
-                                reference_images = vl_slice['keyframes']
-                                print(f"[Qwen Video] 场景 {i+1}: 从vl_analysis[{i}]获取了 {len(reference_images)} 个原视频切片关键帧")
-                    
-                    # 2. 如果从video_understanding中未获取到，再从scene对象中获取
-                    if not reference_images and 'keyframes' in scene:
-                        reference_images = scene['keyframes']
-                        print(f"[Qwen Video] 场景 {i+1}: 从场景对象获取了 {len(reference_images)} 个参考关键帧")
-                    
-                    # 3. 确保获取到足够的参考关键帧
-                    if not reference_images:
-                        print(f"[Qwen Video] 场景 {i+1}: 警告：未找到原视频切片关键帧，这可能导致生成视频与原视频差距较大")
-                    else:
-                        print(f"[Qwen Video] 场景 {i+1}: 成功获取到 {len(reference_images)} 个原视频切片关键帧")
-                        
-                        # 5. 使用qwen3-vl-plus分析关键帧，生成json格式的prompt
-                        print(f"[Qwen Video] 场景 {i+1}: 开始使用qwen3-vl-plus分析关键帧")
-                        qwen3vl_result = self.qwen_video_service.analyze_keyframes_with_qwen3vl_plus(
-                            reference_images,
-                            {
-                                "video_prompt": optimized_scene_data.get("video_prompt", "")
-                            }
-                        )
-                        
-                        if qwen3vl_result.get('success'):
-                            qwen3vl_prompt = qwen3vl_result.get('prompt', '')
-                            print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus分析成功，生成了优化的prompt")
-                            
-                            # 将qwen3-vl-plus生成的prompt与原prompt结合
-                            if qwen3vl_prompt:
-                                try:
-                                    import json
-                                    qwen3vl_data = json.loads(qwen3vl_prompt)
-                                    
-                                    # 智能融合qwen3-vl-plus生成的提示词与原提示词
-                                    original_prompt = optimized_scene_data.get('video_prompt', '')
-                                    
-                                    # 从qwen3-vl-plus结果中提取关键信息
-                                    qwen3vl_content = qwen3vl_data.get('video_content_description', '')
-                                    qwen3vl_style = qwen3vl_data.get('visual_style', {})
-                                    qwen3vl_tech_params = qwen3vl_data.get('technical_parameters', {})
-                                    qwen3vl_atmosphere = qwen3vl_data.get('scene_atmosphere', '')
-                                    
-                                    # 构建新的提示词，保留原提示词的核心内容，同时融合qwen3-vl-plus的分析结果
-                                    # 确保与原视频内容高度一致
-                                    new_prompt = f"{original_prompt}"
-                                    
-                                    if qwen3vl_content:
-                                        new_prompt += f"\n\n内容描述: {qwen3vl_content}"
-                                    
-                                    # 更新风格信息，确保与原视频风格一致
-                                    if qwen3vl_style:
-                                        # 严格遵循原视频风格
-                                        if isinstance(qwen3vl_style, dict):
-                                            if 'style' in qwen3vl_style:
-                                                optimized_scene_data['style_elements']['style'] = qwen3vl_style['style']
-                                            if 'color_palette' in qwen3vl_style:
-                                                optimized_scene_data['style_elements']['color_palette'] = qwen3vl_style['color_palette']
-                                            if 'animation_style' in qwen3vl_style:
-                                                optimized_scene_data['style_elements']['animation_style'] = qwen3vl_style['animation_style']
-                                        else:
-                                            optimized_scene_data['style_elements']['style'] = qwen3vl_style
-                                    
-                                    # 更新技术参数
-                                    if qwen3vl_tech_params:
-                                        optimized_scene_data['technical_params'].update(qwen3vl_tech_params)
-                                    
-                                    if qwen3vl_atmosphere:
-                                        new_prompt += f"\n\n氛围: {qwen3vl_atmosphere}"
-                                    
-                                    # 只在新提示词有实质性改进时才更新
-                                    if len(new_prompt) > len(original_prompt):
-                                        optimized_scene_data['video_prompt'] = new_prompt
-                                        print(f"[Qwen Video] 场景 {i+1}: 智能融合qwen3-vl-plus提示词成功")
-                                    
-                                except json.JSONDecodeError as e:
-                                    print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus返回的JSON格式错误: {e}")
-                                except Exception as e:
-                                    print(f"[Qwen Video] 场景 {i+1}: 融合qwen3-vl-plus提示词失败: {e}")
-                        else:
-                            print(f"[Qwen Video] 场景 {i+1}: qwen3-vl-plus分析失败: {qwen3vl_result.get('error')}")
-                    
-                    # 如果有上一个场景的关键帧，添加到参考图像中
-                    if i > 0 and previous_scene_keyframes:
-                        print(f"[Qwen Video] 场景 {i+1}: 使用上一个场景的关键帧作为参考")
-                        keyframe_prompt['previous_keyframes'] = previous_scene_keyframes
-                        # 将上一个场景的最后一个关键帧添加到参考图像中
-                        reference_images.append(previous_scene_keyframes[-1])
-                        print(f"[Qwen Video] 场景 {i+1}: 添加上一个场景的关键帧，参考图像总数: {len(reference_images)}")
-                    
-                    # 5. 使用qwen-image-edit-plus生成关键帧
-                    print(f"[Qwen Video] 场景 {i+1}: 开始使用qwen-image-edit-plus生成关键帧")
-                    keyframe_result = self.qwen_video_service.generate_keyframes_with_qwen_image_edit(
-                        keyframe_prompt, 
-                        reference_images=reference_images, 
-                        num_keyframes=3
-                    )
-                    
-                    if not keyframe_result.get('success'):
-                        print(f"[Qwen Video] 场景 {i+1} 关键帧生成失败: {keyframe_result.get('error')}")
-                        generated_videos.append({
-                            'scene_index': i,
-                            'scene_id': scene.get('scene_id', i+1),
-                            'success': False,
-                            'error': f"关键帧生成失败: {keyframe_result.get('error')}",
-                            'prompt': video_prompt
-                        })
-                        continue
-                    
-                    keyframes = keyframe_result.get('keyframes', [])
-                    print(f"[Qwen Video] 场景 {i+1} 关键帧生成成功，共生成 {len(keyframes)} 个关键帧")
-                    
-                    # 2. 使用wan2.6-r2v从关键帧生成视频
-                    print(f"[Qwen Video] 场景 {i+1}: 开始使用wan2.6-r2v从关键帧生成视频")
-                    
-                    # 准备视频生成参数，确保包含所有必要信息
-                    video_gen_params = scene_data.copy()
-                    video_gen_params['keyframes'] = keyframes
-                    
-                    # 添加上一个场景的关键帧作为参考
-                    if i > 0 and previous_scene_keyframes:
-                        print(f"[Qwen Video] 场景 {i+1}: 使用上一个场景的关键帧作为视频生成参考")
-                        # 将上一个场景的最后一个关键帧添加到当前场景数据中
-                        video_gen_params['previous_keyframe'] = previous_scene_keyframes[-1]  # 使用上一场景的最后一个关键帧
-                        # 添加场景间连贯信息
-                        video_gen_params['previous_scene_info'] = {
-                            'video_prompt': scene_data.get('video_prompt', ''),
-                            'style_elements': scene_data.get('style_elements', {}),
-                            'scene_info': scene_data.get('scene_info', {})
-                        }
-                    
-                    video_result = self.qwen_video_service.generate_video_from_keyframes(keyframes, video_gen_params)
-                    
-                    # 保存当前场景的关键帧，供下一个场景使用
-                    previous_scene_keyframes = keyframes
-                    
-                    if not video_result.get('success'):
-                        print(f"[Qwen Video] 场景 {i+1} 视频生成失败: {video_result.get('error')}")
-                        generated_videos.append({
-                            'scene_index': i,
-                            'scene_id': scene.get('scene_id', i+1),
-                            'success': False,
-                            'error': f"视频生成失败: {video_result.get('error')}",
-                            'prompt': video_prompt
-                        })
-                        continue
-                    
-                    # 3. 下载视频到本地
-                    video_url = video_result.get('video_url')
-                    if not video_url:
-                        print(f"[Qwen Video] 场景 {i+1} 生成成功但未返回视频URL")
-                        generated_videos.append({
-                            'scene_index': i,
-                            'scene_id': scene.get('scene_id', i+1),
-                            'success': False,
-                            'error': "生成成功但未返回视频URL",
-                            'prompt': video_prompt
-                        })
-                        continue
-                    
-                    local_video_path = os.path.join(produce_video_dir, f"scene_{i+1:02d}_{scene.get('scene_id', i+1)}.mp4")
-                    print(f"[Qwen Video] 场景 {i+1}: 开始下载视频到本地")
-                    
-                    download_result = self.qwen_video_service.download_video(video_url, local_video_path)
-                    if not download_result.get('success'):
-                        print(f"[Qwen Video] 场景 {i+1} 视频下载失败: {download_result.get('error')}")
-                        generated_videos.append({
-                            'scene_index': i,
-                            'scene_id': scene.get('scene_id', i+1),
-                            'success': False,
-                            'error': f"视频下载失败: {download_result.get('error')}",
-                            'prompt': video_prompt,
-                            'video_url': video_url
-                        })
-                        continue
-                    
-                    print(f"[Qwen Video] 场景 {i+1} 视频下载成功: {local_video_path}")
-                    
-                    # 创建当前场景信息，包含关键帧和原视频切片关键帧
-                    current_scene_info = {
-                        'video_path': local_video_path,
-                        'video_info': {
-                            'width': 1920,
-                            'height': 1080,
-                            'fps': 30
-                        },
-                        'keyframes': keyframes,
-                        'scene_index': i,
-                        'video_prompt': optimized_scene_data.get('video_prompt', ''),
-                        'style_elements': optimized_scene_data.get('style_elements', {}),
-                        'technical_params': optimized_scene_data.get('technical_params', {})
-                    }
-                    
-                    # 一致性检查：如果不是第一个场景，检查与前一个场景的一致性
-                    max_retries = 3
-                    retry_count = 0
-                    consistency_passed = False
-                    
-                    while retry_count < max_retries and not consistency_passed:
-                        if i > 0 and previous_scene_info:
-                            print(f"[Qwen Video] 场景 {i+1}: 开始一致性检查，重试次数: {retry_count+1}")
-                            
-                            # 准备一致性检查数据
-                            consistency_data = {
-                                'current_scene': current_scene_info,
-                                'previous_scene': previous_scene_info,
-                                'prompt_data': {
-                                    'original_prompt': video_prompt,
-                                    'optimized_prompt': optimized_scene_data.get('video_prompt', ''),
-                                    'generation_params': optimized_scene_data.get('technical_params', {})
-                                }
-                            }
-                            
-                            try:
-                                # 调用一致性检查代理
-                                consistency_result = await self.consistency_agent.check_consistency(
-                                    current_scene_info,
-                                    previous_scene_info,
-                                    consistency_data['prompt_data']
-                                )
-                                
-                                print(f"[Qwen Video] 场景 {i+1}: 一致性检查结果: {'通过' if consistency_result.get('passed') else '未通过'}")
-                                
-                                if consistency_result.get('passed'):
-                                    consistency_passed = True
-                                    print(f"[Qwen Video] 场景 {i+1}: 一致性检查通过")
-                                else:
-                                    # 一致性检查未通过，重新生成视频
-                                    print(f"[Qwen Video] 场景 {i+1}: 一致性检查未通过，开始优化提示词和参数")
-                                    
-                                    # 获取优化建议
-                                    optimized_prompt = consistency_result.get('optimization_feedback', {}).get('optimized_prompt', '')
-                                    adjusted_params = consistency_result.get('optimization_feedback', {}).get('adjusted_params', {})
-                                    
-                                    if optimized_prompt:
-                                        # 更新优化的场景数据
-                                        # 智能融合提示词，而不是直接替换
-                                        original_prompt = optimized_scene_data.get('video_prompt', '')
-                                        # 保留原提示词的核心内容，只添加优化建议
-                                        optimized_scene_data['video_prompt'] = f"{original_prompt}\n\n优化建议: {optimized_prompt}"
-                                        if adjusted_params:
-                                            optimized_scene_data['technical_params'].update(adjusted_params)
-                                        
-                                        # 重新生成关键帧
-                                        print(f"[Qwen Video] 场景 {i+1}: 使用优化后的提示词重新生成关键帧")
-                                        keyframe_prompt['video_prompt'] = optimized_scene_data['video_prompt']
-                                        keyframe_prompt['technical_params'] = optimized_scene_data['technical_params']
-                                        
-                                        keyframe_result = self.qwen_video_service.generate_keyframes_with_qwen_image_edit(
-                                            keyframe_prompt, 
-                                            reference_images=reference_images, 
-                                            num_keyframes=3
-                                        )
-                                        
-                                        if keyframe_result.get('success'):
-                                            keyframes = keyframe_result.get('keyframes', [])
-                                            print(f"[Qwen Video] 场景 {i+1}: 重新生成关键帧成功")
-                                            
-                                            # 重新生成视频
-                                            print(f"[Qwen Video] 场景 {i+1}: 使用重新生成的关键帧生成视频")
-                                            video_result = self.qwen_video_service.generate_video_from_keyframes(keyframes, optimized_scene_data)
-                                            
-                                            if video_result.get('success'):
-                                                # 重新下载视频
-                                                video_url = video_result.get('video_url')
-                                                download_result = self.qwen_video_service.download_video(video_url, local_video_path)
-                                                
-                                                if download_result.get('success'):
-                                                    print(f"[Qwen Video] 场景 {i+1}: 重新生成视频成功")
-                                                    # 更新当前场景信息
-                                                    current_scene_info['keyframes'] = keyframes
-                                                    current_scene_info['video_prompt'] = optimized_scene_data['video_prompt']
-                                                    current_scene_info['technical_params'] = optimized_scene_data['technical_params']
-                                                    retry_count += 1
-                                                else:
-                                                    print(f"[Qwen Video] 场景 {i+1}: 重新下载视频失败")
-                                                    retry_count += 1
-                                                    break
-                                            else:
-                                                print(f"[Qwen Video] 场景 {i+1}: 重新生成视频失败")
-                                                retry_count += 1
-                                        else:
-                                            print(f"[Qwen Video] 场景 {i+1}: 重新生成关键帧失败")
-                                            retry_count += 1
-                                    else:
-                                        print(f"[Qwen Video] 场景 {i+1}: 未获取到优化提示词")
-                                        retry_count += 1
-                            except Exception as e:
-                                print(f"[Qwen Video] 场景 {i+1}: 一致性检查异常: {e}")
-                                print(f"[Qwen Video] 场景 {i+1}: 跳过一致性检查，继续执行")
-                                # 跳过一致性检查，继续执行
-                                consistency_passed = True
-                                retry_count += 1
-                        else:
-                            # 第一个场景或没有上一个场景信息，直接通过
-                            consistency_passed = True
-                    
-                    # 更新当前场景信息，准备添加到生成视频列表
-                    current_scene_info.update({
-                        'original_keyframes': reference_images,
-                        'scene_id': scene.get('scene_id', i+1),
-                        'scene_index': i
-                    })
-                    
-                    # 保存当前场景信息，作为下一个场景的前一个场景信息
-                    previous_scene_info = current_scene_info.copy()
-                    
-                    # 5. 将一致性检查结果添加到当前场景信息
-                    current_scene_info['consistency_check_result'] = check_result if 'check_result' in locals() else {}
-                    
-                    # 6. 将生成的视频信息添加到结果列表
-                    generated_videos.append({
-                        'scene_index': i,
-                        'scene_id': scene.get('scene_id', i+1),
-                        'success': True,
-                        'local_path': local_video_path,
-                        'video_url': video_url,
-                        'prompt': optimized_scene_data.get('video_prompt', ''),
-                        'duration': scene.get('duration', 4),
-                        'start_time': scene.get('start_time', i * 4),
-                        'end_time': scene.get('end_time', (i + 1) * 4),
-                        'keyframe_count': len(keyframes),
-                        'keyframes': keyframes,
-                        'original_keyframes': reference_images,
-                        'consistency_check_result': current_scene_info.get('consistency_check_result', {}),
-                        'video_info': current_scene_info.get('video_info', {})
-                    })
-                    
-                except Exception as e:
-                    print(f"[Qwen Video] 场景 {i+1} 处理异常: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    generated_videos.append({
-                        'scene_index': i,
-                        'scene_id': scene.get('scene_id', i+1),
-                        'success': False,
-                        'error': str(e),
-                        'prompt': str(video_prompt_data)
-                    })
+                previous_key = self.step_cache.make_key('qwen_scene', {
+                    'scene': scene,
+                    'locked_style': locked_style,
+                    'references': [
+                        self.step_cache.file_digest(p) or p
+                        for p in self._get_qwen_reference_images(i, scene, video_understanding, verbose=False)
+                    ],
+                    'previous_scene': previous_key
+                })
+                scene_keys.append(previous_key)
+            
+            # 场景依赖链：第i个场景完成关键帧/最终信息后写入对应的future
+            loop = asyncio.get_running_loop()
+            keyframe_futures = [loop.create_future() for _ in scenes]
+            scene_info_futures = [loop.create_future() for _ in scenes]
+            
+            scene_results = await asyncio.gather(*[
+                self._run_qwen_scene(
+                    i, len(scenes), scene, locked_style, video_understanding, produce_video_dir,
+                    semaphore, keyframe_futures, scene_info_futures, scene_keys[i]
+                )
+                for i, scene in enumerate(scenes)
+            ])
+            
+            # 按场景顺序汇总结果
+            generated_videos = [r for r in scene_results if r is not None]
             
             # 统计结果
             successful_videos = [v for v in generated_videos if v['success']]
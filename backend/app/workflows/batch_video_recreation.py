@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.video_recreation_service import VideoRecreationService
+from app.services.provider_scheduler import get_provider_scheduler
+from app.config.video_reconstruction_config import get_config
+from app.models import db, VideoRecreation
+
+
+class BatchVideoRecreationWorkflow:
+    """批量视频二创：所有视频共用一个服务实例和全局服务调度器"""
+
+    def __init__(self, app, max_active_jobs: int = None):
+        batch_config = get_config().get_batch_config()
+        self.app = app
+        self.max_active_jobs = max(1, max_active_jobs or batch_config.get("max_active_jobs", 8))
+        self.skip_completed = batch_config.get("skip_completed", True)
+        self.workflow_name = "batch_video_recreation"
+
+        # 客户端只创建一次，各任务共享；并发和限流由全局调度器按服务统一控制
+        with app.app_context():
+            self.recreation_service = VideoRecreationService()
+        self.scheduler = get_provider_scheduler()
+        self._print_lock = threading.Lock()
+
+    def log_step(self, message: str, level: str = "INFO"):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._print_lock:
+            print(f"[{timestamp}] [{level}] [批量二创] {message}")
+
+    def load_manifest(self, manifest_path: str) -> List[Dict[str, Any]]:
+        """读取清单：JSON数组、{"videos": [...]} 或每行一个JSON/路径的JSONL文件"""
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+
+        try:
+            data = json.loads(content)
+            if isinstance(data, dict):
+                entries = data.get('videos', [data])
+            else:
+                entries = data if isinstance(data, list) else [data]
+        except json.JSONDecodeError:
+            entries = []
+            for line in content.splitlines():
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                entries.append(json.loads(line) if line.startswith('{') else line)
+
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        videos = []
+        for entry in entries:
+            item = {'video_path': entry} if isinstance(entry, str) else dict(entry)
+            video_path = item.get('video_path', '')
+            # 相对路径按清单文件所在目录解析
+            if video_path and not os.path.isabs(video_path):
+                item['video_path'] = os.path.join(manifest_dir, video_path)
+            videos.append(item)
+        return videos
+
+    def _run_one(self, index: int, total: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        # 每个视频在独立线程和事件循环中执行，某个任务里的阻塞调用不会拖住其他任务
+        video_path = item.get('video_path')
+        start_time = time.time()
+
+        with self.app.app_context():
+            try:
+                if not video_path or not os.path.exists(video_path):
+                    raise ValueError(f"视频文件不存在: {video_path}")
+
+                if self.skip_completed:
+                    existing = self.recreation_service.find_existing_recreation(video_path)
+                    if existing and existing.status == 'completed':
+                        self.log_step(f"[{index + 1}/{total}] 已有完成的二创记录，跳过: {video_path}")
+                        return {
+                            'video_path': video_path,
+                            'success': True,
+                            'skipped': True,
+                            'recreation_id': existing.id,
+                            'final_video_with_audio_path': existing.final_video_with_audio_path
+                        }
+
+                recreation = VideoRecreation(
+                    original_video_id=item.get('video_id') or os.path.splitext(os.path.basename(video_path))[0],
+                    original_video_path=video_path,
+                    status='processing',
+                    created_at=datetime.now()
+                )
+                db.session.add(recreation)
+                db.session.commit()
+                recreation_id = recreation.id
+
+                self.log_step(f"[{index + 1}/{total}] 开始处理: {video_path}，任务ID: {recreation_id}")
+                result = asyncio.run(self.recreation_service.process_video_for_recreation(
+                    video_path,
+                    recreation_id,
+                    use_nano_banana=bool(item.get('use_nano_banana', False)),
+                    use_qwen=bool(item.get('use_qwen', True)),
+                    slice_limit=int(item.get('slice_limit', 0))
+                ))
+
+                processing_time = time.time() - start_time
+                success = result.get('processing_status') == 'success'
+                self.log_step(
+                    f"[{index + 1}/{total}] {'完成' if success else '失败'}: {video_path}，耗时: {processing_time:.2f}秒"
+                    + ('' if success else f"，错误: {result.get('error', '未知错误')}"),
+                    "INFO" if success else "ERROR"
+                )
+                return {
+                    'video_path': video_path,
+                    'success': success,
+                    'recreation_id': recreation_id,
+                    'final_video_with_audio_path': result.get('final_video_with_audio_path'),
+                    'trace_path': result.get('trace_path'),
+                    'error': result.get('error'),
+                    'processing_time': processing_time
+                }
+
+            except Exception as e:
+                db.session.rollback()
+                self.log_step(f"[{index + 1}/{total}] 处理异常: {video_path}，错误: {e}", "ERROR")
+                return {
+                    'video_path': video_path,
+                    'success': False,
+                    'error': str(e),
+                    'processing_time': time.time() - start_time
+                }
+            finally:
+                db.session.remove()
+
+    def run(self, manifest_path: str, report_path: str = None) -> Dict[str, Any]:
+        """按清单批量二创，返回并保存批量报告"""
+        videos = self.load_manifest(manifest_path)
+        total = len(videos)
+        start_time = time.time()
+        self.log_step(f"清单共 {total} 个视频，同时处理 {self.max_active_jobs} 个")
+
+        results: List[Dict[str, Any]] = [None] * total
+        with ThreadPoolExecutor(max_workers=self.max_active_jobs, thread_name_prefix='batch-recreation') as executor:
+            futures = {executor.submit(self._run_one, i, total, item): i for i, item in enumerate(videos)}
+            for future, i in futures.items():
+                results[i] = future.result()
+
+        report = {
+            'manifest_path': os.path.abspath(manifest_path),
+            'started_at': datetime.fromtimestamp(start_time).isoformat(),
+            'total_time': time.time() - start_time,
+            'total': total,
+            'succeeded': sum(1 for r in results if r.get('success')),
+            'failed': sum(1 for r in results if not r.get('success')),
+            'skipped': sum(1 for r in results if r.get('skipped')),
+            'provider_stats': self.scheduler.stats(),
+            'results': results
+        }
+
+        report_path = report_path or os.path.join(
+            os.path.dirname(os.path.abspath(manifest_path)),
+            f"batch_report_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+        )
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            self.log_step(f"批量报告已保存到: {report_path}")
+        except Exception as e:
+            self.log_step(f"保存批量报告失败: {str(e)}", "WARNING")
+
+        self.log_step(f"批量处理结束，成功 {report['succeeded']}，失败 {report['failed']}，耗时 {report['total_time']:.2f}秒")
+        return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量视频二创工作流")
+    parser.add_argument("manifest", type=str, help="视频清单文件（JSON数组或JSONL，每项包含video_path和可选的use_qwen/slice_limit）")
+    parser.add_argument("--max-active-jobs", type=int, default=None, help="同时处理的视频数，默认使用配置中的batch.max_active_jobs")
+    parser.add_argument("--report", type=str, default=None, help="批量报告输出路径")
+
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+
+    workflow = BatchVideoRecreationWorkflow(app, args.max_active_jobs)
+    report = workflow.run(args.manifest, args.report)
+    print(json.dumps({k: v for k, v in report.items() if k != 'results'}, ensure_ascii=False, indent=2, default=str))
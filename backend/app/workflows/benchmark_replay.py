@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用录制的远程调用离线回放批量二创，用于基准测试调度和缓存改动")
+    parser.add_argument("manifest", type=str, help="视频清单文件，与录制时使用的清单相同")
+    parser.add_argument("--cassette", type=str, default=None, help="磁带目录，默认使用配置中的cassette.path")
+    parser.add_argument("--latency", choices=["none", "recorded"], default="recorded", help="回放时是否按录制耗时等待")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="回放耗时的缩放比例")
+    parser.add_argument("--max-active-jobs", type=int, default=None, help="同时处理的视频数")
+    parser.add_argument("--no-step-cache", action="store_true", help="关闭步骤缓存，测量完整流水线")
+    parser.add_argument("--report", type=str, default=None, help="批量报告输出路径")
+
+    args = parser.parse_args()
+
+    # 必须在创建应用和服务之前设置，磁带和步骤缓存在首次使用时读取配置
+    os.environ['CASSETTE_MODE'] = 'replay'
+    if args.cassette:
+        os.environ['CASSETTE_PATH'] = args.cassette
+
+    from app.config.video_reconstruction_config import get_config
+    config = get_config()
+    config.set("cassette.replay_latency", args.latency)
+    config.set("cassette.latency_scale", args.latency_scale)
+    if args.no_step_cache:
+        config.set("step_cache.enabled", False)
+
+    from app import create_app
+    from app.services.cassette import get_cassette
+    from app.workflows.batch_video_recreation import BatchVideoRecreationWorkflow
+
+    app = create_app()
+    workflow = BatchVideoRecreationWorkflow(app, args.max_active_jobs)
+    report = workflow.run(args.manifest, args.report)
+
+    summary = {k: v for k, v in report.items() if k != 'results'}
+    summary['recorded_latency'] = get_cassette().latency_stats()
+    print(json.dumps(summary, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+import traceback
+import multiprocessing
+from typing import Dict, List, Any
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def _run_job(service, queue, job: Dict[str, Any], heartbeat_interval: int):
+    from app.models import db, VideoRecreation
+    from app.services.progress_events import bind_recreation, emit_progress
+
+    job_id = job['id']
+    recreation_id = job['recreation_id']
+    print(f"[工作进程] 开始执行任务: job_id={job_id}, recreation_id={recreation_id}, 第{job['attempts']}次尝试")
+
+    # 任务执行期间定期刷新心跳，心跳中断说明进程已崩溃，任务会被重新领取
+    stop_heartbeat = threading.Event()
+
+    def heartbeat_loop():
+        while not stop_heartbeat.wait(heartbeat_interval):
+            try:
+                queue.heartbeat(job_id)
+            except Exception as e:
+                print(f"[工作进程] 刷新心跳失败: {e}")
+
+    heartbeat_thread = threading.Thread(target=heartbeat_loop, daemon=True)
+    heartbeat_thread.start()
+
+    bind_recreation(recreation_id)
+    emit_progress('job_started', {'job_id': job_id, 'attempts': job['attempts']})
+
+    try:
+        recreation = VideoRecreation.query.get(recreation_id)
+        if recreation:
+            recreation.status = 'processing'
+            db.session.commit()
+
+        result = asyncio.run(service.process_video_for_recreation(
+            job['video_path'],
+            recreation_id,
+            **job.get('options', {})
+        ))
+
+        if result.get('processing_status') == 'success':
+            queue.complete(job_id)
+            emit_progress('job_succeeded', {
+                'job_id': job_id,
+                'final_video_path': result.get('final_video_path'),
+                'final_video_with_audio_path': result.get('final_video_with_audio_path')
+            })
+            print(f"[工作进程] 任务完成: job_id={job_id}")
+        else:
+            queue.fail(job_id, result.get('error', '未知错误'))
+            emit_progress('job_failed', {'job_id': job_id, 'error': result.get('error', '未知错误')})
+            print(f"[工作进程] 任务失败: job_id={job_id}, 错误: {result.get('error', '未知错误')}")
+
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, str(e))
+        emit_progress('job_failed', {'job_id': job_id, 'error': str(e)})
+        try:
+            db.session.rollback()
+            recreation = VideoRecreation.query.get(recreation_id)
+            if recreation:
+                recreation.status = 'failed'
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+    finally:
+        stop_heartbeat.set()
+        bind_recreation(None)
+        db.session.remove()
+
+
+def run_worker(worker_index: int = 0):
+    """工作进程入口：循环领取并执行任务"""
+    from app import create_app
+    from app.services.job_queue import get_job_queue
+    from app.services.video_recreation_service import VideoRecreationService
+    from app.config.video_reconstruction_config import get_config
+
+    queue_config = get_config().get_job_queue_config()
+    poll_interval = queue_config.get("poll_interval", 2)
+    heartbeat_interval = queue_config.get("heartbeat_interval", 30)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{worker_index}"
+
+    app = create_app()
+    queue = get_job_queue()
+
+    with app.app_context():
+        service = VideoRecreationService()
+        print(f"[工作进程] {worker_id} 已启动，等待任务")
+
+        while True:
+            try:
+                job = queue.claim(worker_id)
+            except Exception as e:
+                print(f"[工作进程] 领取任务失败: {e}")
+                job = None
+
+            if not job:
+                time.sleep(poll_interval)
+                continue
+
+            _run_job(service, queue, job, heartbeat_interval)
+
+
+class RecreationWorkerPool:
+    """工作进程池，进程意外退出时自动拉起"""
+
+    def __init__(self, num_workers: int = None):
+        from app.config.video_reconstruction_config import get_config
+
+        queue_config = get_config().get_job_queue_config()
+        self.num_workers = num_workers or queue_config.get("workers", 2)
+        self.poll_interval = queue_config.get("poll_interval", 2)
+        self._ctx = multiprocessing.get_context('spawn')
+        self._processes: List[Any] = []
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def _spawn(self, worker_index: int):
+        process = self._ctx.Process(
+            target=run_worker,
+            args=(worker_index,),
+            name=f"recreation-worker-{worker_index}",
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def start(self):
+        """启动所有工作进程和监控线程"""
+        self._processes = [self._spawn(i) for i in range(self.num_workers)]
+        print(f"[工作进程池] 已启动 {self.num_workers} 个工作进程")
+
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+    def _monitor_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            for i, process in enumerate(self._processes):
+                if not process.is_alive():
+                    print(f"[工作进程池] 工作进程 {process.name} 已退出(exitcode={process.exitcode})，重新启动")
+                    self._processes[i] = self._spawn(i)
+
+    def stop(self):
+        """停止所有工作进程"""
+        self._stop.set()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            process.join(timeout=10)
+        print(f"[工作进程池] 已停止")
+
+    def join(self):
+        """阻塞直到进程池被停止"""
+        try:
+            while not self._stop.is_set():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+
+_worker_pool = None
+
+
+def start_worker_pool(num_workers: int = None) -> RecreationWorkerPool:
+    """启动全局工作进程池，重复调用不会重复启动"""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = RecreationWorkerPool(num_workers)
+        _worker_pool.start()
+    return _worker_pool
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="视频二创任务工作进程池")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数量，默认使用配置中的job_queue.workers")
+
+    args = parser.parse_args()
+
+    pool = RecreationWorkerPool(args.workers)
+    pool.start()
+    pool.join()
@@ -1,3 +1,4 @@
+import os
 from app import create_app
 from flask import render_template
 
@@ -8,4 +9,12 @@ def index():
     return render_template('index.html')
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    from app.config.video_reconstruction_config import get_config
+    
+    # 启动二创任务工作进程池；debug模式下只在重载器的子进程中启动，避免重复启动
+    debug = True
+    if get_config().get("job_queue.autostart_workers", True) and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        from app.workflows.recreation_worker import start_worker_pool
+        start_worker_pool()
+    
+    app.run(debug=debug, host='0.0.0.0', port=5000)
@@ -0,0 +1,51 @@
+# 模型输出JSON修复与增量解析的单元测试
+
+import json
+
+import pytest
+
+from app.services.streaming_json import IncrementalJSONArrayParser, load_json, repair_json_text
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[1 2 3]', [1, 2, 3]),
+    ('[-1 -2.5 1e-3]', [-1, -2.5, 0.001]),
+    ('[true false null]', [True, False, None]),
+    ('{"a": 1 "b": true}', {'a': 1, 'b': True}),
+    ('{"a": "x" "b": 2}', {'a': 'x', 'b': 2}),
+    ('{"a": null "b": [1 2]}', {'a': None, 'b': [1, 2]}),
+    ('[{"a": 1} {"a": 2}]', [{'a': 1}, {'a': 2}]),
+    ('["x" "y"]', ['x', 'y']),
+    ('{"a": 1, "b": 2,}', {'a': 1, 'b': 2}),
+])
+def test_repair_missing_and_trailing_commas(text, expected):
+    assert json.loads(repair_json_text(text)) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"scenes": [{"start_time": 0, "end_time": 5', {'scenes': [{'start_time': 0, 'end_time': 5}]}),
+    ('{"a": "trunc', {'a': 'trunc'}),
+    ('{"a": 1, "b":', {'a': 1, 'b': None}),
+    ('{"a": [1, 2,', {'a': [1, 2]}),
+])
+def test_repair_truncated_output(text, expected):
+    assert json.loads(repair_json_text(text)) == expected
+
+
+def test_repair_code_fenced_output():
+    text = '以下是结果：\n```json\n{"a": 1，"b": "中文"}\n```\n希望对你有帮助'
+    assert json.loads(repair_json_text(text)) == {'a': 1, 'b': '中文'}
+
+
+def test_load_json_reports_repair():
+    assert load_json('{"a": 1}') == ({'a': 1}, False)
+    assert load_json('```json\n{"a": 1 "b": 2}\n```') == ({'a': 1, 'b': 2}, True)
+
+
+def test_incremental_parser_yields_objects_as_they_close():
+    parser = IncrementalJSONArrayParser('scenes')
+    chunks = ['```json\n{"scenes": [{"id": 1', '}, {"id": 2 "x": true}', ', {"id": 3']
+    items = [item for chunk in chunks for item in parser.feed(chunk)]
+    assert items == [{'id': 1}, {'id': 2, 'x': True}]
+    assert parser.repaired == 1
+    assert parser.errors == 0
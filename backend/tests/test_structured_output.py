@@ -0,0 +1,51 @@
+# 结构化输出schema校验的单元测试
+
+import pytest
+
+from app.services.structured_output import SCENE_SCHEMA, SchemaError, validate
+
+
+@pytest.mark.parametrize('value, schema_type, expected', [
+    ('3.0', 'integer', 3),
+    ('12秒', 'number', 12.0),
+    ('12.5s', 'number', 12.5),
+    (7, 'number', 7.0),
+])
+def test_coerce_number_accepts(value, schema_type, expected):
+    data, _ = validate(value, {'type': schema_type})
+    assert data == expected
+    assert type(data) is type(expected)
+
+
+@pytest.mark.parametrize('value, schema_type', [
+    ('NaN', 'integer'),
+    ('inf', 'integer'),
+    ('-Infinity', 'number'),
+    (float('nan'), 'number'),
+    ('3.5', 'integer'),
+    ('abc', 'number'),
+    (True, 'integer'),
+])
+def test_coerce_number_rejects_with_schema_error(value, schema_type):
+    with pytest.raises(SchemaError):
+        validate(value, {'type': schema_type})
+
+
+@pytest.mark.parametrize('scene_id', ['NaN', 'inf', 'scene_1', 1.5])
+def test_bad_optional_field_falls_back_to_caller_default(scene_id):
+    data, fixes = validate({'scene_id': scene_id, 'start_time': 0, 'end_time': '2秒'}, SCENE_SCHEMA, {'scene_id': 4})
+    assert data['scene_id'] == 4
+    assert data['end_time'] == 2.0
+    assert any('scene_id' in fix for fix in fixes)
+
+
+def test_bad_optional_field_without_default_is_dropped():
+    data, fixes = validate({'scene_id': 'NaN', 'start_time': 0, 'end_time': 2}, SCENE_SCHEMA)
+    assert 'scene_id' not in data
+    assert any('已丢弃' in fix for fix in fixes)
+
+
+def test_bad_required_field_raises():
+    with pytest.raises(SchemaError) as excinfo:
+        validate({'start_time': 'NaN', 'end_time': 2}, SCENE_SCHEMA)
+    assert excinfo.value.path == 'start_time'
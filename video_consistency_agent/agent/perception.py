@@ -83,6 +83,8 @@ class PerceptionModule:
         return {
             'main_elements': main_elements,
             'style_info': style_info,
+            'original_prompt': prompt_data.get('original_prompt', prompt_data.get('description', '')),
+            'generation_params': prompt_data.get('generation_params', {}),
             'raw_prompt': prompt_data
         }
     
@@ -0,0 +1,8 @@
+def prepare_image(image: str, model: str = None) -> str:
+# 在后端进程中运行时按模型有效分辨率缩放、重编码并缓存图片，返回处理后的file://地址；单独使用本包时原样返回
+    try:
+        from app.services.image_payload import get_image_payload_optimizer
+    except ImportError:
+        return image
+    
+    return get_image_payload_optimizer().file_url(image, model)
@@ -3,6 +3,8 @@ import requests
 import os
 import dashscope
 
+from .response_cache import cached_call
+
 class LLMClient:
     def __init__(self, config: Dict[str, Any]):
 # 初始化大语言模型客户端
@@ -22,7 +24,8 @@ class LLMClient:
             print(f"[LLM Client] 分析内容连贯性: {scene1_desc[:50]}... vs {scene2_desc[:50]}...")
             
             # 使用通义千问API进行内容连贯性分析
-            response = dashscope.Generation.call(
+            response = cached_call(
+                'consistency_llm', dashscope.Generation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -87,7 +90,8 @@ class LLMClient:
             print(f"[LLM Client] 问题列表: {issues}")
             
             # 使用通义千问API生成优化提示词
-            response = dashscope.Generation.call(
+            response = cached_call(
+                'consistency_llm', dashscope.Generation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -162,7 +166,8 @@ class LLMClient:
             
             # 使用通义千问API评估场景逻辑一致性
             scene_text = '\n'.join([f"场景{i+1}: {desc}" for i, desc in enumerate(scene_sequence)])
-            response = dashscope.Generation.call(
+            response = cached_call(
+                'consistency_llm', dashscope.Generation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -0,0 +1,8 @@
+def cached_call(namespace: str, call, **kwargs):
+# 在后端进程中运行时经过共享的模型响应缓存(确定性调用才缓存，按模型、规范化提示词和图片内容哈希命中)，单独使用本包时直接调用
+    try:
+        from app.services.response_cache import get_response_cache
+    except ImportError:
+        return call(**kwargs)
+    
+    return get_response_cache().call_sdk(namespace, call, **kwargs)
@@ -3,6 +3,9 @@ import json
 from typing import Dict, Any, List
 import dashscope
 
+from .response_cache import cached_call
+from .image_payload import prepare_image
+
 class VLMClient:
     def __init__(self, config: Dict[str, Any]):
 # 初始化视觉语言模型客户端
@@ -55,7 +58,8 @@ class VLMClient:
             keyframe_path = keyframes[0]
             print(f"[VLM Client] 分析关键帧: {keyframe_path}")
             
-            response = dashscope.MultiModalConversation.call(
+            response = cached_call(
+                'consistency_vlm', dashscope.MultiModalConversation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -66,7 +70,7 @@ class VLMClient:
                         "role": "user",
                         "content": [
                             {
-                                "image": keyframe_path
+                                "image": prepare_image(keyframe_path, self.model_name)
                             },
                             {
                                 "text": prompt
@@ -172,7 +176,8 @@ class VLMClient:
                 }
             
             # 使用通义千问视觉API比较风格
-            response = dashscope.MultiModalConversation.call(
+            response = cached_call(
+                'consistency_vlm', dashscope.MultiModalConversation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -183,10 +188,10 @@ class VLMClient:
                         "role": "user",
                         "content": [
                             {
-                                "image": scene1_keyframes[0]
+                                "image": prepare_image(scene1_keyframes[0], self.model_name)
                             },
                             {
-                                "image": scene2_keyframes[0]
+                                "image": prepare_image(scene2_keyframes[0], self.model_name)
                             },
                             {
                                 "text": "请比较这两个图像的风格一致性，给出0-1的相似度分数，并说明理由。"
@@ -259,7 +264,8 @@ class VLMClient:
             print(f"[VLM Client] 场景2: {scene2_desc[:50]}...")
             
             # 使用通义千问API评估内容连贯性
-            response = dashscope.Generation.call(
+            response = cached_call(
+                'consistency_vlm', dashscope.Generation.call,
                 model='qwen-plus',
                 messages=[
                     {
@@ -322,7 +328,8 @@ class VLMClient:
             print(f"[VLM Client] 分析关键帧一致性: {keyframe1_path} vs {keyframe2_path}")
             
             # 使用通义千问视觉API分析关键帧一致性
-            response = dashscope.MultiModalConversation.call(
+            response = cached_call(
+                'consistency_vlm', dashscope.MultiModalConversation.call,
                 model=self.model_name,
                 messages=[
                     {
@@ -333,10 +340,10 @@ class VLMClient:
                         "role": "user",
                         "content": [
                             {
-                                "image": keyframe1_path
+                                "image": prepare_image(keyframe1_path, self.model_name)
                             },
                             {
-                                "image": keyframe2_path
+                                "image": prepare_image(keyframe2_path, self.model_name)
                             },
                             {
                                 "text": "请分析这两个关键帧的一致性，并给出详细的分析结果。"
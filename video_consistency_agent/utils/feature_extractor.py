@@ -3,18 +3,21 @@ import numpy as np
 import os
 from typing import Dict, Any
 
+from .video_utils import _probe_video_info
+from .frame_source import load_image
+
 class FeatureExtractor:
     def __init__(self):
         """初始化特征提取器"""
         pass
     
-    def extract_keyframe_features(self, keyframe_path: str) -> Dict[str, Any]:
-# 提取关键帧特征
-        if not os.path.exists(keyframe_path):
+    def extract_keyframe_features(self, keyframe_path) -> Dict[str, Any]:
+# 提取关键帧特征，支持图片路径或已解码的帧
+        if not isinstance(keyframe_path, np.ndarray) and not os.path.exists(keyframe_path):
             raise FileNotFoundError(f"关键帧文件不存在: {keyframe_path}")
         
-        # 读取图像
-        image = cv2.imread(keyframe_path)
+        # 读取图像（同一关键帧只解码一次）
+        image = load_image(keyframe_path)
         if image is None:
             raise ValueError(f"无法读取图像: {keyframe_path}")
         
@@ -60,6 +63,10 @@ class FeatureExtractor:
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"视频文件不存在: {video_path}")
         
+        video_info = _probe_video_info(video_path)
+        if video_info:
+            return video_info
+        
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"无法打开视频: {video_path}")
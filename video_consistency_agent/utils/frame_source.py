@@ -0,0 +1,227 @@
+import os
+import bisect
+import atexit
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import List, Optional, Iterator, Tuple
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    """通过ffmpeg rawvideo管道把解码后的帧直接读成NumPy数组，不写临时图片"""
+
+    def __init__(self, video_path: str, size: Optional[Tuple[int, int]] = None, ffmpeg_path: str = 'ffmpeg',
+                 timeout: float = 600):
+# size为(宽, 高)，只给宽度时按原视频比例计算高度；不给时使用原分辨率；timeout为单次解码的超时(秒)
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"视频文件不存在: {video_path}")
+
+        from .video_utils import VideoUtils
+
+        self.video_path = video_path
+        self.ffmpeg_path = ffmpeg_path
+        self.timeout = timeout
+        self.video_info = VideoUtils().get_video_info(video_path)
+
+        width, height = size if size else (None, None)
+        src_width, src_height = self.video_info['width'], self.video_info['height']
+        if not width:
+            width, height = src_width, src_height
+        elif not height:
+            height = max(2, int(round(src_height * width / max(src_width, 1) / 2)) * 2)
+        self.width, self.height = int(width), int(height)
+        self.frame_size = self.width * self.height * 3
+
+    def _command(self, video_filter: str, end: Optional[float] = None) -> List[str]:
+        cmd = [self.ffmpeg_path, '-v', 'error']
+        if end is not None:
+            cmd += ['-t', f"{end:.3f}"]
+        cmd += [
+            '-i', self.video_path,
+            '-an', '-sn',
+            '-vf', f"{video_filter},scale={self.width}:{self.height}",
+            '-vsync', '0',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            'pipe:1'
+        ]
+        return cmd
+
+    def _read_batches(self, cmd: List[str], batch_size: int) -> Iterator[np.ndarray]:
+# 在后端进程中运行时经过共享的FFmpeg执行器读取(并发上限、超时、返回码检查)，单独使用本包时直接启动子进程
+# 每批读入同一块预分配缓冲区，返回缓冲区视图；调用方需要保留帧时自行复制；解码失败或超时时抛出RuntimeError
+        try:
+            from app.services.ffmpeg_executor import read_rawvideo_batches, PRIORITY_INTERACTIVE
+        except ImportError:
+            yield from self._read_batches_standalone(cmd, batch_size)
+            return
+
+        yield from read_rawvideo_batches(
+            cmd, self.width, self.height, batch_size, priority=PRIORITY_INTERACTIVE, timeout=self.timeout,
+            label=f"frame_source:{os.path.basename(self.video_path)}"
+        )
+
+    def _read_batches_standalone(self, cmd: List[str], batch_size: int) -> Iterator[np.ndarray]:
+# 与后端read_rawvideo_batches相同的读取方式，超时结束进程，读到EOF后检查返回码
+        buffer = np.empty((batch_size, self.height, self.width, 3), dtype=np.uint8)
+        raw = memoryview(buffer.reshape(-1))
+        target = batch_size * self.frame_size
+
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, stdin=subprocess.DEVNULL)
+            timed_out = threading.Event()
+
+            def kill_on_timeout():
+                timed_out.set()
+                process.kill()
+
+            timer = threading.Timer(self.timeout, kill_on_timeout) if self.timeout else None
+            if timer:
+                timer.daemon = True
+                timer.start()
+            try:
+                while True:
+                    filled = 0
+                    while filled < target:
+                        count = process.stdout.readinto(raw[filled:target])
+                        if not count:
+                            break
+                        filled += count
+                    frames = filled // self.frame_size
+                    if frames:
+                        yield buffer[:frames]
+                    if filled < target:
+                        break
+            finally:
+                if timer:
+                    timer.cancel()
+                process.stdout.close()
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+
+            if timed_out.is_set():
+                raise RuntimeError(f"FFmpeg解码超时({self.timeout}秒): {self.video_path}")
+            if process.returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode('utf-8', errors='ignore')[-500:]
+                raise RuntimeError(f"FFmpeg解码失败(返回码 {process.returncode}): {self.video_path}: {message}")
+
+    def frames_at(self, timestamps: List[float]) -> List[Optional[np.ndarray]]:
+# 一次解码取出多个时间点的帧，按传入顺序返回；超出视频末尾的时间点返回最后解出的一帧
+        if not timestamps:
+            return []
+
+        # 同一帧间隔内的时间点只能选中一帧，先合并
+        frame_interval = 1.0 / self.video_info['fps'] if self.video_info.get('fps') else 0.04
+        groups: List[float] = []
+        for t in sorted(max(0.0, t) for t in timestamps):
+            if not groups or t - groups[-1] >= frame_interval:
+                groups.append(t)
+
+        # 选中时间戳首次越过每个时间点的那一帧；第一帧没有上一帧，单独判断
+        select_expr = '+'.join(f"gte(t,{t:.3f})*(isnan(prev_pts)+lt(prev_pts*TB,{t:.3f}))" for t in groups)
+        cmd = self._command(f"setpts=PTS-STARTPTS,select='{select_expr}'", end=groups[-1] + 1)
+
+        decoded: List[np.ndarray] = []
+        for batch in self._read_batches(cmd, len(groups)):
+            decoded.extend(frame.copy() for frame in batch)
+        if not decoded:
+            return [None] * len(timestamps)
+
+        # 每个时间点对应不晚于它的最后一个分组；末尾缺帧时用最后解出的一帧
+        return [decoded[min(bisect.bisect_right(groups, max(0.0, t)) - 1, len(decoded) - 1)] for t in timestamps]
+
+    def iter_frames(self, fps: float = None, every_n: int = None, start: float = 0.0, end: float = None,
+                    batch_size: int = 32) -> Iterator[Tuple[float, np.ndarray]]:
+# 按固定采样率或每隔N帧迭代，返回(时间, 帧)；帧是复用缓冲区的视图
+        if fps:
+            video_filter = f"fps={fps}"
+            step = 1.0 / fps
+        else:
+            every_n = max(1, every_n or 1)
+            video_filter = f"select='not(mod(n,{every_n}))'"
+            step = every_n / self.video_info['fps'] if self.video_info.get('fps') else every_n * 0.04
+        if start:
+            video_filter = f"trim=start={start:.3f},setpts=PTS-STARTPTS,{video_filter}"
+
+        index = 0
+        for batch in self._read_batches(self._command(video_filter, end), batch_size):
+            for frame in batch:
+                yield start + index * step, frame
+                index += 1
+
+
+_frame_dir = None
+_frame_dir_lock = threading.Lock()
+
+
+def _cleanup_frame_dir():
+    if _frame_dir:
+        shutil.rmtree(_frame_dir, ignore_errors=True)
+
+
+def frame_output_dir() -> str:
+# 需要交给外部接口的帧统一写到进程内唯一的临时目录，进程退出时删除
+    global _frame_dir
+    with _frame_dir_lock:
+        if _frame_dir is None:
+            _frame_dir = tempfile.mkdtemp(prefix='consistency_frames_')
+            atexit.register(_cleanup_frame_dir)
+        return _frame_dir
+
+
+_image_cache: "OrderedDict[Tuple[str, int], np.ndarray]" = OrderedDict()
+_image_cache_lock = threading.Lock()
+_IMAGE_CACHE_SIZE = 64
+
+
+def _image_key(image_path: str) -> Optional[Tuple[str, int]]:
+    try:
+        return (os.path.realpath(image_path), os.stat(image_path).st_mtime_ns)
+    except OSError:
+        return None
+
+
+def register_image(image_path: str, image: np.ndarray) -> None:
+# 把已经在内存中的帧登记到图片缓存，后续按路径读取时不再解码JPEG
+    key = _image_key(image_path)
+    if key is None:
+        return
+    with _image_cache_lock:
+        _image_cache[key] = image
+        _image_cache.move_to_end(key)
+        while len(_image_cache) > _IMAGE_CACHE_SIZE:
+            _image_cache.popitem(last=False)
+
+
+def load_image(image) -> Optional[np.ndarray]:
+# 读取图片：已是数组直接返回，路径先查内存缓存再用cv2读取
+    if isinstance(image, np.ndarray):
+        return image
+    key = _image_key(image)
+    if key is None:
+        return None
+    with _image_cache_lock:
+        cached = _image_cache.get(key)
+        if cached is not None:
+            _image_cache.move_to_end(key)
+            return cached
+    decoded = cv2.imread(image)
+    if decoded is not None:
+        register_image(image, decoded)
+    return decoded
+
+
+def write_frame(image: np.ndarray, name: str) -> str:
+# 只在外部接口需要文件时把帧写成JPEG，并登记到图片缓存
+    output_path = os.path.join(frame_output_dir(), name)
+    if not cv2.imwrite(output_path, image):
+        raise RuntimeError(f"写入帧失败: {output_path}")
+    register_image(output_path, image)
+    return output_path
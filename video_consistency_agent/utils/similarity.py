@@ -6,6 +6,8 @@ from typing import Dict, Any
 from alibabacloud_imagerecog20190930.client import Client as imagerecog20190930Client
 from alibabacloud_tea_openapi import models as open_api_models
 
+from .frame_source import load_image
+
 class SimilarityCalculator:
     def __init__(self, config: Dict[str, Any] = None):
 # 初始化相似度计算器
@@ -117,9 +119,9 @@ class SimilarityCalculator:
         
         print(f"[本地计算] 计算图像相似度: {image1_path} vs {image2_path}")
         
-        # 本地实现：读取图像
-        image1 = cv2.imread(image1_path)
-        image2 = cv2.imread(image2_path)
+        # 本地实现：读取图像（同一关键帧只解码一次）
+        image1 = load_image(image1_path)
+        image2 = load_image(image2_path)
         
         if image1 is None or image2 is None:
             raise ValueError("无法读取图像")
@@ -160,17 +162,18 @@ class SimilarityCalculator:
         
         return similarity
     
-    def calculate_structural_similarity(self, image1_path: str, image2_path: str) -> float:
-# 计算结构相似度
+    def calculate_structural_similarity(self, image1_path, image2_path) -> float:
+# 计算结构相似度，支持图片路径或已解码的帧
         from skimage.metrics import structural_similarity as ssim
         
         # 检查文件是否存在
-        if not os.path.exists(image1_path) or not os.path.exists(image2_path):
-            raise FileNotFoundError("图像文件不存在")
+        for image_path in (image1_path, image2_path):
+            if not isinstance(image_path, np.ndarray) and not os.path.exists(image_path):
+                raise FileNotFoundError("图像文件不存在")
         
-        # 读取图像
-        image1 = cv2.imread(image1_path)
-        image2 = cv2.imread(image2_path)
+        # 读取图像（同一关键帧只解码一次）
+        image1 = load_image(image1_path)
+        image2 = load_image(image2_path)
         
         if image1 is None or image2 is None:
             raise ValueError("无法读取图像")
@@ -207,8 +210,8 @@ class SimilarityCalculator:
         # 平均三个通道的相似度
         return (sim_b + sim_g + sim_r) / 3
     
-    def calculate_overall_visual_similarity(self, image1_path: str, image2_path: str) -> float:
-# 计算整体视觉相似度
+    def calculate_overall_visual_similarity(self, image1_path, image2_path) -> float:
+# 计算整体视觉相似度，支持图片路径或已解码的帧
         from .feature_extractor import FeatureExtractor
         
         extractor = FeatureExtractor()
@@ -1,62 +1,92 @@
 import os
+import uuid
 import subprocess
 import tempfile
 from typing import List, Dict, Any
 import cv2
 import numpy as np
 
+from .frame_source import FrameSource, write_frame
+
+
+def _run_ffmpeg(cmd: List[str]):
+# 在后端进程中运行时经过共享的FFmpeg执行器排队，单独使用本包时直接启动子进程
+    try:
+        from app.services.ffmpeg_executor import get_ffmpeg_executor, PRIORITY_INTERACTIVE
+    except ImportError:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        return result.returncode, result.stderr
+    
+    result = get_ffmpeg_executor().run(cmd, priority=PRIORITY_INTERACTIVE)
+    return result['returncode'], result['stderr']
+
+
+def _probe_video_info(video_path: str):
+# 在后端进程中运行时使用共享的ffprobe缓存，单独使用本包或探测失败时返回None
+    try:
+        from app.services.media_probe import get_media_probe, summarize_video_info
+    except ImportError:
+        return None
+    
+    info = get_media_probe().probe(video_path)
+    if not info:
+        return None
+    summary = summarize_video_info(info)
+    if not summary['width'] or not summary['height']:
+        return None
+    return {
+        'width': summary['width'],
+        'height': summary['height'],
+        'fps': summary['fps'],
+        'frame_count': summary['frame_count'],
+        'duration': summary['duration']
+    }
+
 class VideoUtils:
     def __init__(self):
         """初始化视频处理工具"""
         pass
     
-    def extract_keyframes(self, video_path: str, num_keyframes: int = 2) -> List[str]:
-# 提取视频关键帧
+    def extract_keyframe_arrays(self, video_path: str, num_keyframes: int = 2, size=None) -> List[np.ndarray]:
+# 提取视频关键帧为NumPy数组，一次解码完成，不写临时文件
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"视频文件不存在: {video_path}")
         
-        # 获取视频信息
-        video_info = self.get_video_info(video_path)
-        duration = video_info['duration']
+        source = FrameSource(video_path, size=size)
+        duration = source.video_info['duration']
         
-        keyframe_paths = []
-        temp_dir = tempfile.mkdtemp()
+        # 计算关键帧提取时间点
+        if num_keyframes == 1:
+            # 只提取中间帧
+            timestamps = [duration / 2]
+        elif num_keyframes == 2:
+            # 提取开始和结束帧
+            timestamps = [1, duration - 1]
+        else:
+            # 均匀分布提取
+            timestamps = [i * duration / (num_keyframes + 1) for i in range(1, num_keyframes + 1)]
         
-        try:
-            # 计算关键帧提取时间点
-            if num_keyframes == 1:
-                # 只提取中间帧
-                timestamps = [duration / 2]
-            elif num_keyframes == 2:
-                # 提取开始和结束帧
-                timestamps = [1, duration - 1]
-            else:
-                # 均匀分布提取
-                timestamps = [i * duration / (num_keyframes + 1) for i in range(1, num_keyframes + 1)]
-            
-            for i, timestamp in enumerate(timestamps):
-                # 生成关键帧路径
-                keyframe_path = os.path.join(temp_dir, f"keyframe_{i+1}.jpg")
-                
-                # 使用FFmpeg提取关键帧
-                self._extract_frame_at_timestamp(video_path, timestamp, keyframe_path)
-                
-                if os.path.exists(keyframe_path) and os.path.getsize(keyframe_path) > 0:
-                    keyframe_paths.append(keyframe_path)
-                else:
-                    raise RuntimeError(f"关键帧提取失败: {keyframe_path}")
-            
-            return keyframe_paths
-        except Exception as e:
-            # 清理临时文件
-            self._cleanup_temp_files(temp_dir)
-            raise e
+        frames = source.frames_at(timestamps)
+        if any(frame is None for frame in frames):
+            raise RuntimeError(f"关键帧提取失败: {video_path}")
+        return frames
+    
+    def extract_keyframes(self, video_path: str, num_keyframes: int = 2) -> List[str]:
+# 提取视频关键帧，返回图片路径供外部接口使用
+        frames = self.extract_keyframe_arrays(video_path, num_keyframes=num_keyframes)
+        prefix = f"{os.path.splitext(os.path.basename(video_path))[0]}_{uuid.uuid4().hex[:8]}"
+        return [write_frame(frame, f"{prefix}_keyframe_{i+1}.jpg") for i, frame in enumerate(frames)]
     
     def get_video_info(self, video_path: str) -> Dict[str, Any]:
 # 获取视频基本信息
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"视频文件不存在: {video_path}")
         
+        video_info = _probe_video_info(video_path)
+        if video_info:
+            video_info['path'] = video_path
+            return video_info
+        
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"无法打开视频: {video_path}")
@@ -81,25 +111,13 @@ class VideoUtils:
     
     def get_last_frame(self, video_path: str) -> str:
 # 获取视频最后一帧
-        video_info = self.get_video_info(video_path)
-        duration = video_info['duration']
+        source = FrameSource(video_path)
         
-        # 创建临时文件
-        temp_dir = tempfile.mkdtemp()
-        last_frame_path = os.path.join(temp_dir, "last_frame.jpg")
-        
-        try:
-            # 提取最后一帧（留出1秒的缓冲）
-            self._extract_frame_at_timestamp(video_path, duration - 1, last_frame_path)
-            
-            if os.path.exists(last_frame_path) and os.path.getsize(last_frame_path) > 0:
-                return last_frame_path
-            else:
-                raise RuntimeError(f"最后一帧提取失败: {last_frame_path}")
-        except Exception as e:
-            # 清理临时文件
-            self._cleanup_temp_files(temp_dir)
-            raise e
+        # 提取最后一帧（留出1秒的缓冲）
+        frame = source.frames_at([source.video_info['duration'] - 1])[0]
+        if frame is None:
+            raise RuntimeError(f"最后一帧提取失败: {video_path}")
+        return write_frame(frame, f"{os.path.splitext(os.path.basename(video_path))[0]}_{uuid.uuid4().hex[:8]}_last_frame.jpg")
     
     def _extract_frame_at_timestamp(self, video_path: str, timestamp: float, output_path: str) -> None:
 # 在指定时间戳提取视频帧
@@ -115,10 +133,10 @@ class VideoUtils:
         ]
         
         # 执行FFmpeg命令
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        returncode, stderr = _run_ffmpeg(cmd)
         
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg命令执行失败: {result.stderr}")
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg命令执行失败: {stderr}")
     
     def _cleanup_temp_files(self, temp_dir: str) -> None:
 # 清理临时文件
@@ -149,10 +167,10 @@ class VideoUtils:
             ]
             
             # 执行FFmpeg命令
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr = _run_ffmpeg(cmd)
             
-            if result.returncode != 0:
-                raise RuntimeError(f"FFmpeg命令执行失败: {result.stderr}")
+            if returncode != 0:
+                raise RuntimeError(f"FFmpeg命令执行失败: {stderr}")
             
             if os.path.exists(audio_path) and os.path.getsize(audio_path) > 0:
                 return audio_path
@@ -165,20 +183,9 @@ class VideoUtils:
     
     def get_first_frame(self, video_path: str) -> str:
 # 获取视频第一帧
-        # 创建临时文件
-        temp_dir = tempfile.mkdtemp()
-        first_frame_path = os.path.join(temp_dir, "first_frame.jpg")
-        
-        try:
-            # 提取第一帧（从1秒处提取，避免黑屏）
-            self._extract_frame_at_timestamp(video_path, 1, first_frame_path)
-            
-            if os.path.exists(first_frame_path) and os.path.getsize(first_frame_path) > 0:
-                return first_frame_path
-            else:
-                raise RuntimeError(f"第一帧提取失败: {first_frame_path}")
-        except Exception as e:
-            # 清理临时文件
-            self._cleanup_temp_files(temp_dir)
-            raise e
+        # 提取第一帧（从1秒处提取，避免黑屏）
+        frame = FrameSource(video_path).frames_at([1])[0]
+        if frame is None:
+            raise RuntimeError(f"第一帧提取失败: {video_path}")
+        return write_frame(frame, f"{os.path.splitext(os.path.basename(video_path))[0]}_{uuid.uuid4().hex[:8]}_first_frame.jpg")
 